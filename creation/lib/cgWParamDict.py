@@ -865,6 +865,7 @@ def populate_factory_descript(work_dir, glidein_dict,
         glidein_dict.add('PubKeyType', sec_el[u'pub_key'])
         glidein_dict.add('OldPubKeyGraceTime', sec_el[u'reuse_oldkey_onstartup_gracetime'])
         glidein_dict.add('MonitorUpdateThreadCount', conf.get_child(u'monitor')[u'update_thread_count'])
+        glidein_dict.add('MonitorRRDWriteBehind', conf.get_child(u'monitor')[u'rrd_write_behind'])
         glidein_dict.add('RemoveOldCredFreq', sec_el[u'remove_old_cred_freq'])
         glidein_dict.add('RemoveOldCredAge', sec_el[u'remove_old_cred_age'])
         del active_sub_list[:]  # clean
@@ -878,12 +879,17 @@ def populate_factory_descript(work_dir, glidein_dict,
         glidein_dict.add('Entries', string.join(active_sub_list,','))
         glidein_dict.add('AdvertiseWithTCP', conf[u'advertise_with_tcp'])
         glidein_dict.add('AdvertiseWithMultiple', conf[u'advertise_with_multiple'])
+        glidein_dict.add('AdvertiseBatchSize', conf[u'advertise_batch_size'])
+        glidein_dict.add('AdvertiseRefreshInterval', conf[u'advertise_refresh_interval'])
         glidein_dict.add('LoopDelay', conf[u'loop_delay'])
         glidein_dict.add('AdvertisePilotAccounting', conf[u'advertise_pilot_accounting'])
         glidein_dict.add('AdvertiseDelay', conf[u'advertise_delay'])
         glidein_dict.add('RestartAttempts', conf[u'restart_attempts'])
         glidein_dict.add('RestartInterval', conf[u'restart_interval'])
         glidein_dict.add('EntryParallelWorkers', conf[u'entry_parallel_workers'])
+        glidein_dict.add('EntryWorkerPool', conf[u'entry_worker_pool'])
+        glidein_dict.add('WorkQuerySnapshot', conf[u'work_query_snapshot'])
+        glidein_dict.add('SpanTrace', conf[u'span_trace'])
         glidein_dict.add('LogDir', conf.get_log_dir())
         glidein_dict.add('ClientLogBaseDir', sub_el[u'base_client_log_dir'])
         glidein_dict.add('ClientProxiesBaseDir', sub_el[u'base_client_proxies_dir'])
@@ -972,9 +978,11 @@ def populate_job_descript(work_dir, job_descript_dict, num_factories,
     remove = config.get_child(u'remove')
     job_descript_dict.add('MaxRemoveRate', remove[u'max_per_cycle'])
     job_descript_dict.add('RemoveSleep', remove[u'sleep'])
+    job_descript_dict.add('RemoveCluster', remove[u'cluster_size'])
     release = config.get_child(u'release')
     job_descript_dict.add('MaxReleaseRate', release[u'max_per_cycle'])
     job_descript_dict.add('ReleaseSleep', release[u'sleep'])
+    job_descript_dict.add('ReleaseCluster', release[u'cluster_size'])
     restrictions = config.get_child(u'restrictions')
     job_descript_dict.add('RequireVomsProxy', restrictions[u'require_voms_proxy'])
     job_descript_dict.add('RequireGlideinGlexecUse', restrictions[u'require_glidein_glexec_use'])
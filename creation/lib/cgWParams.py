@@ -102,8 +102,10 @@ class GlideinParams(cWParams.CommonParams):
 
         entry_config_defaults['remove'] = copy.deepcopy(entry_config_queue_defaults)
         entry_config_defaults['remove']['max_per_cycle'][0] = '5'
+        entry_config_defaults['remove']['cluster_size'] = ['100', "nr", "Max number of jobs removed by a single condor_rm.", None]
         entry_config_defaults['release'] = copy.deepcopy(entry_config_queue_defaults)
         entry_config_defaults['release']['max_per_cycle'][0] = '20'
+        entry_config_defaults['release']['cluster_size'] = ['100', "nr", "Max number of jobs released by a single condor_release.", None]
 
         # not exported and order does not matter, can stay a regular dictionary
         sub_defaults = {'attrs':(xmlParse.OrderedDict(), 'Dictionary of attributes', "Each attribute entry contains", self.attr_defaults),
@@ -170,6 +172,8 @@ class GlideinParams(cWParams.CommonParams):
         log_retention_defaults["job_logs"]["min_days"][0] = "2.0"
         self.defaults['advertise_with_tcp'] = ('True', 'Bool', 'Should condor_advertise use TCP connections?', None)
         self.defaults['advertise_with_multiple'] = ('True', 'Bool', 'Should condor_advertise use -multiple?', None)
+        self.defaults['advertise_batch_size'] = ('0', 'NR', 'Max number of classads sent in one update by the python bindings (0 means all)', None)
+        self.defaults['advertise_refresh_interval'] = ('0', 'seconds', 'Advertise the entry classads only if changed, or at least every NR seconds (0 means always)', None)
         log_retention_defaults["summary_logs"] = copy.deepcopy(one_log_retention_defaults)
         log_retention_defaults["summary_logs"]["max_days"][0] = "31.0"
         log_retention_defaults["condor_logs"] = copy.deepcopy(one_log_retention_defaults)
@@ -181,6 +185,9 @@ class GlideinParams(cWParams.CommonParams):
         self.defaults['restart_attempts'] = ('3', 'NR', 'Max allowed NR restarts every restart_interval before shutting down', None)
         self.defaults['restart_interval'] = ('1800', 'NR', 'Time interval NR sec which allow max restart attempts', None)
         self.defaults['entry_parallel_workers'] = ('0', 'NR', 'Number of entries that will perform the work in parallel', None)
+        self.defaults['entry_worker_pool'] = ('False', 'Bool', 'Should the entries work be done by a pool of pre-forked workers instead of one fork per entry?', None)
+        self.defaults['work_query_snapshot'] = ('False', 'Bool', 'Should the factory query the requests for all the entries once per iteration, instead of one query per entry group?', None)
+        self.defaults['span_trace'] = ('False', 'Bool', 'Should the factory and the entry groups write a trace file and publish the duration percentiles of their spans every iteration?', None)
 
         stage_defaults = cWParams.commentedOrderedDict()
         stage_defaults["base_dir"] = ("/var/www/html/glidefactory/stage", "base_dir", "Stage base dir", None)
@@ -191,6 +198,7 @@ class GlideinParams(cWParams.CommonParams):
         self.monitor_defaults["base_dir"] = ("/var/www/html/glidefactory/monitor", "base_dir", "Monitoring base dir", None)
         # Default for rrd update threads
         self.monitor_defaults["update_thread_count"]=(os.sysconf('SC_NPROCESSORS_ONLN'), "update_thread_count", "Number of rrd update threads. Defaults to cpu count.", None)
+        self.monitor_defaults["rrd_write_behind"]=("False", "Bool", "Should the rrd updates be queued and written in batches at the end of the stats writing?", None)
         self.defaults["monitor"] = self.monitor_defaults
 
         self.frontend_sec_class_defaults = cWParams.commentedOrderedDict()
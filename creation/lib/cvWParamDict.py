@@ -501,10 +501,18 @@ def populate_frontend_descript(work_dir,
         frontend_dict.add('LoopDelay', params.loop_delay)
         frontend_dict.add('AdvertiseDelay', params.advertise_delay)
         frontend_dict.add('GroupParallelWorkers', params.group_parallel_workers)
+        frontend_dict.add('GroupWorkerMode', params.group_worker_mode)
+        frontend_dict.add('QuerySnapshot', params.query_snapshot)
+        frontend_dict.add('RRDWriteBehind', params.rrd_write_behind)
+        frontend_dict.add('MatchMemoSize', params.match_memo_size)
+        frontend_dict.add('SpanTrace', params.span_trace)
+        frontend_dict.add('CompactQueryResults', params.compact_query_results)
         frontend_dict.add('RestartAttempts', params.restart_attempts)
         frontend_dict.add('RestartInterval', params.restart_interval)
         frontend_dict.add('AdvertiseWithTCP', params.advertise_with_tcp)
         frontend_dict.add('AdvertiseWithMultiple', params.advertise_with_multiple)
+        frontend_dict.add('AdvertiseBatchSize', params.advertise_batch_size)
+        frontend_dict.add('AdvertiseRefreshInterval', params.advertise_refresh_interval)
 
         frontend_dict.add('MonitorDisplayText', params.monitor_footer.display_txt)
         frontend_dict.add('MonitorLink', params.monitor_footer.href_link)
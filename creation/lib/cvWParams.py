@@ -205,8 +205,16 @@ class VOFrontendParams(cWParams.CommonParams):
         self.defaults['advertise_delay']=('5', 'NR', 'Advertize evert NR loops', None)
         self.defaults['advertise_with_tcp']=('True', 'Bool', 'Should condor_advertise use TCP connections?', None)
         self.defaults['advertise_with_multiple']=('True', 'Bool', 'Should condor_advertise use -multiple?', None)
+        self.defaults['advertise_batch_size']=('0', 'NR', 'Max number of classads sent in one update by the python bindings (0 means all)', None)
+        self.defaults['advertise_refresh_interval']=('0', 'seconds', 'Advertise the requests only if changed, or at least every NR seconds (0 means always)', None)
 
         self.defaults['group_parallel_workers']=('2', 'NR', 'Max number of parallel workers that process the group policies', None)
+        self.defaults['group_worker_mode']=('spawn', 'spawn|persistent', 'Start a new process for each group every iteration (spawn) or keep resident group processes (persistent)', None)
+        self.defaults['query_snapshot']=('False', 'Bool', 'Should the frontend query schedds and collector once per iteration for all the groups?', None)
+        self.defaults['rrd_write_behind']=('False', 'Bool', 'Should the groups queue the rrd updates and write them in batches at the end of the iteration?', None)
+        self.defaults['match_memo_size']=('0', 'NR', 'Max number of (job cluster, entry) match results each group remembers across iterations, 0 to disable', None)
+        self.defaults['span_trace']=('False', 'Bool', 'Should the groups write a trace file and the duration percentiles of their spans every iteration?', None)
+        self.defaults['compact_query_results']=('False', 'Bool', 'Should the group query processes return the classads stored by attribute, to reduce the data sent to the group?', None)
 
         self.defaults['restart_attempts']=('3', 'NR', 'Max allowed NR restarts every restart_interval before shutting down', None)
         self.defaults['restart_interval']=('1800', 'NR', 'Time interval NR sec which allow max restart attempts', None)
@@ -346,6 +354,9 @@ class VOFrontendParams(cWParams.CommonParams):
         if len(self.collectors)==0:
             raise RuntimeError("At least one pool collector is needed")
 
+        if self.group_worker_mode not in ('spawn', 'persistent'):
+            raise RuntimeError("Invalid group_worker_mode '%s', must be spawn or persistent" % self.group_worker_mode)
+
         ####################
         has_security_name=(self.security.security_name is not None)
         if not has_security_name:
@@ -36,6 +36,7 @@ sys.path.append(os.path.join(STARTUP_DIR, "../../"))
 from glideinwms.lib import logSupport
 from glideinwms.lib import cleanupSupport
 from glideinwms.lib import glideinWMSVersion
+from glideinwms.lib import servicePerformance
 from glideinwms.lib import util
 from glideinwms.lib.condorMonitor import CondorQEdit, QueryError
 from glideinwms.factory import glideFactoryPidLib
@@ -152,6 +153,45 @@ def write_descript(glideinDescript, frontendDescript, monitor_dir):
 
 ############################################################
 
+def get_perf_metrics(startup_dir, groups, span_durations, expiration=-1):
+    """
+    Write the spans of the iteration in the Factory trace file and return the
+    performance metrics of the Factory and of the entry groups (saved by them)
+
+    @type startup_dir: String
+    @param startup_dir: Path to glideinsubmit directory
+
+    @type groups: list
+    @param groups: ids of the entry groups
+
+    @type span_durations: dict
+    @param span_durations: rolling history of the Factory span durations, updated in place
+
+    @type expiration: int
+    @param expiration: metrics saved more than these seconds ago are ignored (e.g. of a dead entry group),
+        -1 to use them all
+
+    @rtype: list
+    @return: list of servicePerformance.PerfMetric
+    """
+    servicePerformance.summarizeTrace('factory', span_durations)
+    try:
+        servicePerformance.writeTraceFile(os.path.join(logSupport.log_dir, 'factory_trace.json'))
+    except:
+        logSupport.log.exception("Error writing the trace: ")
+    servicePerformance.resetTrace()
+    perf_metrics = [servicePerformance.getPerfMetric('factory')]
+    for group in groups:
+        fname = os.path.join(startup_dir,
+                             glideFactoryConfig.factoryConfig.group_perf_metrics_file % ('group_%s' % group))
+        try:
+            perf_metrics.append(util.file_pickle_load(fname, expiration=expiration))
+        except:
+            # the group may have not completed an iteration yet, or it stopped
+            logSupport.log.debug("No recent performance metrics for entry group %s" % group)
+    return perf_metrics
+
+
 def entry_grouper(size, entries):
     """
     Group the entries into n smaller groups
@@ -430,6 +470,9 @@ def spawn(sleep_time, advertize_rate, startup_dir, glideinDescript,
                     "(credential_*)", remove_old_cred_age)
                 cleanupSupport.cred_cleaners.add_cleaner(cred_cleaner)
 
+        # Rolling history of the span durations, used for the percentiles
+        span_durations = {}
+
         iteration_basetime = time.time()
         while True:
             # retrieves WebMonitoringURL from glideclient classAd
@@ -513,6 +556,24 @@ def spawn(sleep_time, advertize_rate, startup_dir, glideinDescript,
                     logSupport.log.exception("Error occurred processing the globals classads: ")
 
 
+            if glideinDescript.data.get('WorkQuerySnapshot', 'False') == 'True':
+                # One query for the requests of all the entries,
+                # the EntryGroups read them instead of querying the collector
+                try:
+                    pub_key_objs = [key_obj for key_obj in (glideinDescript.data['PubKeyObj'],
+                                                            glideinDescript.data['OldPubKeyObj'])
+                                    if key_obj is not None]
+                    with servicePerformance.TraceSpan('work_snapshot'):
+                        nr_requests = glideFactoryInterface.writeWorkSnapshot(
+                            glideinDescript.data['FactoryName'],
+                            glideinDescript.data['GlideinName'],
+                            entries,
+                            glideFactoryLib.factoryConfig.supported_signtypes,
+                            pub_key_objs)
+                    logSupport.log.info("Saved work snapshot with %i requests" % nr_requests)
+                except:
+                    logSupport.log.exception("Error creating the work snapshot, EntryGroups will query the collector: ")
+
             logSupport.log.info("Checking EntryGroups %s" % childs.keys())
             for group in childs:
                 entry_names = string.join(entry_groups[group], ':')
@@ -575,15 +636,23 @@ def spawn(sleep_time, advertize_rate, startup_dir, glideinDescript,
 
             # Aggregate Monitoring data periodically
             logSupport.log.info("Aggregate monitoring data")
-            stats = aggregate_stats(factory_downtimes.checkDowntime())
-            save_stats(stats, os.path.join(startup_dir, glideFactoryConfig.factoryConfig.aggregated_stats_file))
+            with servicePerformance.TraceSpan('aggregate_stats'):
+                stats = aggregate_stats(factory_downtimes.checkDowntime())
+                save_stats(stats, os.path.join(startup_dir, glideFactoryConfig.factoryConfig.aggregated_stats_file))
 
             # Aggregate job data periodically
             if glideinDescript.data.get('AdvertisePilotAccounting', False) in ['True', '1']:   # data attributes are strings
                 logSupport.log.info("Starting updating job classads")
-                update_classads()
+                with servicePerformance.TraceSpan('update_classads'):
+                    update_classads()
                 logSupport.log.info("Finishing updating job classads")
 
+            perf_metrics = ()
+            if servicePerformance.isTracingEnabled():
+                # the groups save their metrics at every iteration, drop the ones not updated for a few loops
+                perf_metrics = get_perf_metrics(startup_dir, childs.keys(), span_durations,
+                                                expiration=5 * sleep_time)
+
             # Advertise the global classad with the factory keys and Factory statistics
             try:
                 # KEL TODO need to add factory downtime?
@@ -591,7 +660,8 @@ def spawn(sleep_time, advertize_rate, startup_dir, glideinDescript,
                     glideinDescript.data['FactoryName'],
                     glideinDescript.data['GlideinName'],
                     glideFactoryLib.factoryConfig.supported_signtypes,
-                    glideinDescript.data['PubKeyObj']
+                    glideinDescript.data['PubKeyObj'],
+                    perf_metrics=perf_metrics
                     )
             except Exception as e:
                 logSupport.log.exception("Error advertising global classads: %s" % e)
@@ -687,6 +757,7 @@ def main(startup_dir):
 
     # Set the Log directory
     logSupport.log_dir = os.path.join(glideinDescript.data['LogDir'], "factory")
+    servicePerformance.enableTracing(glideinDescript.data.get('SpanTrace', 'False') == 'True')
 
     # Configure factory process logging
     process_logs = eval(glideinDescript.data['ProcessLogs'])
@@ -753,6 +824,7 @@ def main(startup_dir):
 
     glideFactoryInterface.factoryConfig.advertise_use_tcp = (glideinDescript.data['AdvertiseWithTCP'] in ('True', '1'))
     glideFactoryInterface.factoryConfig.advertise_use_multi = (glideinDescript.data['AdvertiseWithMultiple'] in ('True', '1'))
+    glideFactoryInterface.factoryConfig.advertise_batch_size = int(glideinDescript.data.get('AdvertiseBatchSize', '0'))
     sleep_time = int(glideinDescript.data['LoopDelay'])
     advertize_rate = int(glideinDescript.data['AdvertiseDelay'])
     restart_attempts = int(glideinDescript.data['RestartAttempts'])
@@ -768,7 +840,8 @@ def main(startup_dir):
 
     glideFactoryMonitorAggregator.monitorAggregatorConfig.config_factory(
         os.path.join(startup_dir, "monitor"), entries,
-        log=logSupport.log
+        log=logSupport.log,
+        parallel_workers=int(glideinDescript.data['MonitorUpdateThreadCount'])
     )
 
     # create lock file
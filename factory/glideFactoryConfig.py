@@ -30,6 +30,7 @@ class FactoryConfig:
         self.frontend_descript_file = "frontend.descript"
         self.signatures_file = "signatures.sha1"
         self.aggregated_stats_file = "aggregated_stats_dict.data"
+        self.group_perf_metrics_file = "%s_perf_metrics.data"
 
 # global configuration of the module
 factoryConfig=FactoryConfig()
@@ -82,6 +82,9 @@ class Entry:
 
         # Schedd where my glideins will be submitted
         self.scheddName = self.jobDescript.data['Schedd']
+        # condor_q of the schedd shared with the other entries of the group, set each iteration
+        # by the entry group (see setPrefetchedCondorQ)
+        self.prefetchedCondorQ = None
 
         # glideFactoryLib.log_files
         process_logs = eval(self.glideinDescript.data['ProcessLogs'])
@@ -107,6 +110,8 @@ class Entry:
         self.monitoringConfig = glideFactoryMonitoring.MonitoringConfig(log=self.log)
         self.monitoringConfig.monitor_dir = self.monitorDir
         self.monitoringConfig.my_name = "%s@%s" % (name, self.glideinDescript.data['GlideinName'])
+        if self.glideinDescript.data.get('MonitorRRDWriteBehind', 'False') == 'True':
+            self.monitoringConfig.use_rrd_write_behind()
 
         self.monitoringConfig.config_log(
             self.logDir,
@@ -155,6 +160,8 @@ class Entry:
         self.gflFactoryConfig.remove_sleep = float(self.jobDescript.data['RemoveSleep'])
         self.gflFactoryConfig.max_releases = int(self.jobDescript.data['MaxReleaseRate'])
         self.gflFactoryConfig.release_sleep = float(self.jobDescript.data['ReleaseSleep'])
+        self.gflFactoryConfig.max_remove_cluster_size = int(self.jobDescript.data.get('RemoveCluster', 100))
+        self.gflFactoryConfig.max_release_cluster_size = int(self.jobDescript.data.get('ReleaseCluster', 100))
         self.gflFactoryConfig.log_stats = glideFactoryMonitoring.condorLogSummary(log=self.log)
         self.gflFactoryConfig.rrd_stats = glideFactoryMonitoring.FactoryStatusData(log=self.log, base_dir=self.monitoringConfig.monitor_dir)
         self.gflFactoryConfig.rrd_stats.base_dir = self.monitorDir
@@ -379,17 +386,32 @@ class Entry:
         del self.jobAttributes.data['GLIDEIN_In_Downtime']
 
 
+    def setPrefetchedCondorQ(self, condorQ):
+        """
+        Set the glideins info already queried for this entry, returned by queryQueuedGlideins instead of querying
+        the schedd again. None to query the schedd.
+
+        @type condorQ: glideFactoryLib.EntryCondorQ
+        @param condorQ: Information about the jobs of this entry in condor_schedd (from getCondorQDataMulti)
+        """
+        self.prefetchedCondorQ = condorQ
+
     def queryQueuedGlideins(self):
         """
         Query WMS schedd (on Factory) and get glideins info. Re-raise in case of failures.
         Return a loaded condorMonitor.CondorQ object using the entry attributes (name, schedd, ...).
         Consists of a fetched dictionary w/ jobs (keyed by job cluster, ID) in .stored_data,
         some query attributes and the ability to reload (load/fetch)
+        If the entry group already queried the schedd for this entry (setPrefetchedCondorQ),
+        that data is returned instead
 
         @rtype: condorMonitor.CondorQ already loaded
         @return: Information about the jobs in condor_schedd
         """
 
+        if self.prefetchedCondorQ is not None:
+            return self.prefetchedCondorQ
+
         try:
             return glideFactoryLib.getCondorQData(
                        self.name, None, self.scheddName,
@@ -722,6 +744,9 @@ class Entry:
         self.gflFactoryConfig.qc_stats.write_file(monitoringConfig=self.monitoringConfig, alt_stats=self.gflFactoryConfig.client_stats)
         self.log.info("qc_stats written")
 
+        # rrd_stats reads back the RRDs updated above
+        self.monitoringConfig.flush_rrd()
+
         self.log.info("Writing rrd_stats for %s" % self.name)
         self.gflFactoryConfig.rrd_stats.writeFiles(monitoringConfig=self.monitoringConfig)
         self.log.info("rrd_stats written")
@@ -1128,6 +1153,8 @@ def check_and_perform_work(factory_in_downtime, entry, work):
         except:
             # Never fail for monitoring. Just log
             entry.log.exception("get_RRD_data failed with unknown error: ")
+    if all_security_names:
+        entry.gflFactoryConfig.rrd_stats.logFetchStats()
 
     return done_something
 
@@ -41,8 +41,10 @@ from glideinwms.lib import logSupport
 from glideinwms.lib import classadSupport
 from glideinwms.lib import cleanupSupport
 from glideinwms.lib import glideinWMSVersion
+from glideinwms.lib import servicePerformance
+from glideinwms.lib import util
 from glideinwms.lib.fork import fetch_fork_result_list
-from glideinwms.lib.fork import ForkManager
+from glideinwms.lib.fork import ForkManager, ForkPoolManager
 from glideinwms.lib.pidSupport import register_sighandler
 from glideinwms.lib.pidSupport import unregister_sighandler
 from glideinwms.factory import glideFactoryEntry
@@ -59,6 +61,10 @@ from glideinwms.factory import glideFactoryDowntimeLib
 #   plus a safety factor of 2
 
 ENTRY_MEM_REQ_BYTES = 500000000 * 2
+
+# The work snapshot (WorkQuerySnapshot) is used if younger than
+# this number of loop delays, otherwise the group queries the collector
+WORK_SNAPSHOT_MAX_AGE_LOOPS = 2
 ############################################################
 
 
@@ -144,12 +150,21 @@ def find_work(factory_in_downtime, glideinDescript,
     pub_key_obj = glideinDescript.data['PubKeyObj']
     old_pub_key_obj = glideinDescript.data['OldPubKeyObj']
 
+    work_snapshot = None
+    if glideinDescript.data.get('WorkQuerySnapshot', 'False') == 'True':
+        # refreshed by the factory every iteration, old if the factory is stuck
+        work_snapshot = gfi.loadWorkSnapshot(WORK_SNAPSHOT_MAX_AGE_LOOPS *
+                                             int(glideinDescript.data['LoopDelay']))
+        if work_snapshot is None:
+            logSupport.log.info("No valid work snapshot, querying the collector")
+
     logSupport.log.info("Finding work")
     work = gfi.findGroupWork(gfl.factoryConfig.factory_name,
                              gfl.factoryConfig.glidein_name,
                              my_entries.keys(),
                              gfl.factoryConfig.supported_signtypes,
-                             pub_key_obj)
+                             pub_key_obj,
+                             work_snapshot=work_snapshot)
     log_work_info(work, key='existing')
 
     # If old key is valid, find the work using old key as well and append it
@@ -162,7 +177,8 @@ def find_work(factory_in_downtime, glideinDescript,
                                         gfl.factoryConfig.glidein_name,
                                         my_entries.keys(),
                                         gfl.factoryConfig.supported_signtypes,
-                                        old_pub_key_obj)
+                                        old_pub_key_obj,
+                                        work_snapshot=work_snapshot)
         log_work_info(work, key='old')
 
         # Merge the work_oldkey with work
@@ -212,6 +228,7 @@ def get_work_count(work):
     return count
 
 
+@servicePerformance.TraceSpan('check_and_perform_work')
 def forked_check_and_perform_work(factory_in_downtime, entry, work):
     """
     Do the work assigned to an entry (glidein requests)
@@ -231,6 +248,7 @@ def forked_check_and_perform_work(factory_in_downtime, entry, work):
     return return_dict
 
 
+@servicePerformance.TraceSpan('update_entries_stats')
 def forked_update_entries_stats(factory_in_downtime, entries_list):
     """Update statistics for entries that have no work to do
 
@@ -252,6 +270,52 @@ def forked_update_entries_stats(factory_in_downtime, entries_list):
     return return_dict
 
 
+def query_entries_schedds(my_entries, entry_names):
+    """
+    Query the glideins of the entries with one condor_q per schedd, instead of one per entry.
+    The jobs of each entry are set in the entry (Entry.setPrefetchedCondorQ) and used by its queryQueuedGlideins
+    in the forked children. The other entries, and the ones whose schedd query failed, will query the schedd on their own
+
+    @type my_entries: dict
+    @param my_entries: Dictionary of entry objects (glideFactoryEntry.Entry) keyed on entry name
+
+    @type entry_names: list
+    @param entry_names: names of the entries that will query the glideins
+
+    @rtype: tuple
+    @return: number of schedd queries and time spent querying (seconds)
+    """
+    schedd_entries = {}
+    for ent in my_entries:
+        my_entries[ent].setPrefetchedCondorQ(None)
+    for ent in entry_names:
+        schedd_entries.setdefault(my_entries[ent].scheddName, []).append(my_entries[ent])
+
+    t_begin = time.time()
+    for schedd_name in schedd_entries:
+        entries = schedd_entries[schedd_name]
+        t_schedd = time.time()
+        try:
+            condorq_dict = gfl.getCondorQDataMulti([entry.name for entry in entries], schedd_name,
+                                                   factoryConfig=entries[0].gflFactoryConfig)
+        except Exception:
+            # Let the entries try again, like when not using the shared query
+            logSupport.log.warning("Failed condor_q of schedd %s for %i entries, the entries will query it separately" %
+                                   (schedd_name, len(entries)))
+            logSupport.log.exception("Failed condor_q of schedd %s: " % schedd_name)
+            continue
+        nr_glideins = 0
+        for entry in entries:
+            entry.setPrefetchedCondorQ(condorq_dict[entry.name])
+            nr_glideins += len(condorq_dict[entry.name].stored_data)
+        logSupport.log.debug("condor_q of schedd %s for %i entries: %i glideins in %.3f seconds" %
+                             (schedd_name, len(entries), nr_glideins, time.time() - t_schedd))
+    t_query = time.time() - t_begin
+    logSupport.log.info("Queried %i schedds for the glideins of %i entries in %.3f seconds" %
+                        (len(schedd_entries), len(entry_names), t_query))
+    return len(schedd_entries), t_query
+
+
 ##############################################
 # Functions managing the Entries life-cycle
 
@@ -291,8 +355,9 @@ def find_and_perform_work(do_advertize, factory_in_downtime, glideinDescript,
     # work includes all entries, empty value for entries w/ no work to do
     # to allow cleanup, ... (remove held glideins, ...)
 
-    work = find_work(factory_in_downtime, glideinDescript,
-                     frontendDescript, group_name, my_entries)
+    with servicePerformance.TraceSpan('find_work'):
+        work = find_work(factory_in_downtime, glideinDescript,
+                         frontendDescript, group_name, my_entries)
 
     # Request from a Frontend group to an entry
     work_count = get_work_count(work)
@@ -326,7 +391,11 @@ def find_and_perform_work(do_advertize, factory_in_downtime, glideinDescript,
 
     logSupport.log.debug("Setting parallel_workers limit of %s" % parallel_workers)
 
-    forkm_obj = ForkManager()
+    if glideinDescript.data.get('EntryWorkerPool', 'False') == 'True':
+        # parallel_workers pre-forked processes, each one doing the work of multiple entries
+        forkm_obj = ForkPoolManager()
+    else:
+        forkm_obj = ForkManager()
     # Only fork of child processes for entries that have corresponding
     # work to do, ie glideclient classads.
     # TODO: #22163, change in 3.5 coordinate w/ find_work():
@@ -334,6 +403,9 @@ def find_and_perform_work(do_advertize, factory_in_downtime, glideinDescript,
     #  currently work contains all entries
     #  cleanup is still done correctly, handled also in the entries w/o work function (forked as single function)
     entries_without_work = []
+    # One condor_q per schedd for all the entries that will need it, instead of one per entry in the children
+    with servicePerformance.TraceSpan('query_entries_schedds'):
+        query_entries_schedds(my_entries, [ent for ent in my_entries if do_advertize or work.get(ent)])
     for ent in my_entries:
         if work.get(ent):
             entry = my_entries[ent]  # ent is the entry.name
@@ -352,7 +424,8 @@ def find_and_perform_work(do_advertize, factory_in_downtime, glideinDescript,
                            factory_in_downtime, [my_entries[i] for i in entries_without_work])
     t_begin = time.time()
     try:
-        post_work_info = forkm_obj.bounded_fork_and_collect(parallel_workers)
+        with servicePerformance.TraceSpan('entries_work'):
+            post_work_info = forkm_obj.bounded_fork_and_collect(parallel_workers)
         t_end = time.time() - t_begin
     except RuntimeError:
         # Expect all errors logged already
@@ -450,14 +523,15 @@ def iterate_one(do_advertize, factory_in_downtime, glideinDescript,
 
     if ((do_advertize) or (done_something > 0)):
         logSupport.log.debug("Generated glidefactory and glidefactoryclient classads for entries: %s" % string.join(entries_to_advertise, ', '))
-        # ADVERTISE: glidefactory classads
-        gfi.advertizeGlideinFromFile(gf_filename,
-                                     remove_file=True,
-                                     is_multi=True)
-        # ADVERTISE: glidefactoryclient classads
-        gfi.advertizeGlideinClientMonitoringFromFile(gfc_filename,
-                                                     remove_file=True,
-                                                     is_multi=True)
+        with servicePerformance.TraceSpan('advertize_classads'):
+            # ADVERTISE: glidefactory classads
+            gfi.advertizeGlideinFromFile(gf_filename,
+                                         remove_file=True,
+                                         is_multi=True)
+            # ADVERTISE: glidefactoryclient classads
+            gfi.advertizeGlideinClientMonitoringFromFile(gfc_filename,
+                                                         remove_file=True,
+                                                         is_multi=True)
     else:
         logSupport.log.info("Not advertising glidefactory and glidefactoryclient classads this round")
 
@@ -507,6 +581,9 @@ def iterate(parent_pid, sleep_time, advertize_rate, glideinDescript,
 
     factory_downtimes = glideFactoryDowntimeLib.DowntimeFile(glideinDescript.data['DowntimesFile'])
 
+    # Rolling history of the span durations, used for the percentiles
+    span_durations = {}
+
     while True:
 
         # Check if parent is still active. If not cleanup and die.
@@ -540,9 +617,10 @@ def iterate(parent_pid, sleep_time, advertize_rate, glideinDescript,
         # Why do we want to execute this if we are in downtime?
         # Or do we want to execute only few steps here but code prevents us?
         try:
-            done_something = iterate_one(count==0, factory_in_downtime,
-                                         glideinDescript, frontendDescript,
-                                         group_name, my_entries)
+            with servicePerformance.TraceSpan('iteration'):
+                done_something = iterate_one(count==0, factory_in_downtime,
+                                             glideinDescript, frontendDescript,
+                                             group_name, my_entries)
 
             logSupport.log.info("Writing stats for all entries")
 
@@ -610,6 +688,9 @@ def iterate(parent_pid, sleep_time, advertize_rate, glideinDescript,
             except:
                 # never fail for stats reasons!
                 logSupport.log.exception("Error writing stats: ")
+
+            if servicePerformance.isTracingEnabled():
+                write_trace(group_name, span_durations)
         except KeyboardInterrupt:
             raise  # this is an exit signal, pass through
         except:
@@ -632,6 +713,28 @@ def iterate(parent_pid, sleep_time, advertize_rate, glideinDescript,
         is_first = False  # Entering following iterations
 
 
+def write_trace(group_name, span_durations):
+    """
+    Write the spans of the iteration in the group trace file and save the
+    performance metrics with their rolling percentiles, published by the Factory
+
+    @type group_name: string
+    @param group_name: Name of the group
+
+    @type span_durations: dict
+    @param span_durations: rolling history of the span durations, updated in place
+    """
+    try:
+        servicePerformance.summarizeTrace(group_name, span_durations)
+        servicePerformance.writeTraceFile(os.path.join(logSupport.log_dir, '%s_trace.json' % group_name))
+        util.file_pickle_dump(gfc.factoryConfig.group_perf_metrics_file % group_name,
+                              servicePerformance.getPerfMetric(group_name))
+    except:
+        # never fail for monitoring reasons
+        logSupport.log.exception("Error writing the trace: ")
+    servicePerformance.resetTrace()
+
+
 ############################################################
 # Initialize log_files for entries and groups
 
@@ -696,6 +799,10 @@ def main(parent_pid, sleep_time, advertize_rate,
 
     # set factory_collector at a global level, since we do not expect it to change
     gfi.factoryConfig.factory_collector = glideinDescript.data['FactoryCollector']
+    gfi.factoryConfig.advertise_batch_size = int(glideinDescript.data.get('AdvertiseBatchSize', '0'))
+    # glidefactory and glidefactoryclient classads are advertised only if changed
+    gfi.advertizeDeltaCache = classadSupport.ClassadDeltaCache(
+        int(glideinDescript.data.get('AdvertiseRefreshInterval', '0')))
 
     # Load factory keys
     glideinDescript.load_pub_key()
@@ -712,6 +819,7 @@ def main(parent_pid, sleep_time, advertize_rate,
 
     logSupport.log.info("Starting up")
     logSupport.log.info("Entries processed by %s: %s " % (group_name, entry_names))
+    servicePerformance.enableTracing(glideinDescript.data.get('SpanTrace', 'False') == 'True')
 
     # Check if all the entries in this group are valid
     for entry in string.split(entry_names, ':'):
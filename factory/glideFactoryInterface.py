@@ -21,6 +21,8 @@ from glideinwms.lib import condorMonitor
 from glideinwms.lib import condorManager
 from glideinwms.lib import logSupport
 from glideinwms.lib import classadSupport
+from glideinwms.lib import util
+from glideinwms.lib.util import LRUCache
 
 ############################################################
 #
@@ -36,6 +38,9 @@ advertizeGFCounter = {}
 advertizeGFCCounter = {}
 # Advertize counter for glidefactoryglobal classad
 advertizeGlobalCounter = 0
+# Fingerprints of the glidefactory and glidefactoryclient classads advertised by this process
+# Replaced with one having a refresh interval to enable the delta advertisement
+advertizeDeltaCache = classadSupport.ClassadDeltaCache()
 
 
 ############################################################
@@ -75,6 +80,9 @@ class FactoryConfig:
         # String to prefix for the configured limits
         self.glidein_config_prefix = "GlideinConfig"
 
+        # String to prefix for the performance metrics
+        self.glidein_perfmetric_prefix = "GlideinPerfMetric"
+
         # String to prefix for the requests
         self.client_req_prefix = "Req"
 
@@ -90,6 +98,8 @@ class FactoryConfig:
         self.advertise_use_tcp = False
         # Should we use the new -multiple for condor_advertise?
         self.advertise_use_multi = False
+        # Max number of classads per update when advertising with the python bindings (0 for all)
+        self.advertise_batch_size = 0
 
 
         # warning log files
@@ -105,10 +115,57 @@ class FactoryConfig:
         # i.e. the -pool argument coption to HTCondor cmdline tools
         self.factory_collector=None
 
+        # Max number of symmetric keys and of decrypted parameters
+        # remembered between findGroupWork calls
+        self.sym_key_cache_size = 1000
+        self.decrypted_param_cache_size = 10000
+
 
 # global configuration of the module
 factoryConfig = FactoryConfig()
 
+# The frontends reuse the same symmetric key and encrypted values for many cycles
+# The factory pub key id is part of the keys, so the entries of a rotated (or recreated)
+# key are never used with the new one and are evicted as they age
+# (pub key id, ReqEncKeyCode) -> symmetric key object
+symKeyCache = LRUCache(factoryConfig.sym_key_cache_size)
+# (pub key id, ReqEncKeyCode, encrypted value) -> decrypted value
+decryptedParamCache = LRUCache(factoryConfig.decrypted_param_cache_size)
+
+
+def clear_decryption_caches():
+    """
+    Forget the keys and values decrypted by findGroupWork
+    """
+    symKeyCache.clear()
+    decryptedParamCache.clear()
+
+
+def extract_sym_key_cached(pub_key_obj, enc_key_code):
+    """
+    Like pub_key_obj.extract_sym_key, using symKeyCache
+
+    @return: tuple (sym key id, sym key object)
+    """
+    sym_key_id = (pub_key_obj.get_pub_key_id(), enc_key_code)
+    sym_key_obj = symKeyCache.get(sym_key_id)
+    if sym_key_obj is None:
+        sym_key_obj = pub_key_obj.extract_sym_key(enc_key_code)
+        symKeyCache.put(sym_key_id, sym_key_obj)
+    return sym_key_id, sym_key_obj
+
+
+def decrypt_hex_cached(sym_key_id, sym_key_obj, enc_value):
+    """
+    Like sym_key_obj.decrypt_hex, using decryptedParamCache
+    """
+    cache_key = sym_key_id + (enc_value,)
+    value = decryptedParamCache.get(cache_key)
+    if value is None:
+        value = sym_key_obj.decrypt_hex(enc_value)
+        decryptedParamCache.put(cache_key, value)
+    return value
+
 #
 # When something is set to this,
 # use the value set in factoryConfig
@@ -122,6 +179,9 @@ factoryConfig = FactoryConfig()
 #
 DEFAULT_VAL = "default"
 
+# work snapshot file, in the lock dir
+WORK_SNAPSHOT_FNAME = "gfi_work_snapshot.pk"
+
 
 #####################################################
 # Exception thrown when multiple executions are used
@@ -151,7 +211,7 @@ class MultiExeError(condorExe.ExeError):
 
 def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
                   pub_key_obj=None, additional_constraints=None,
-                  factory_collector=DEFAULT_VAL):
+                  factory_collector=DEFAULT_VAL, work_snapshot=None):
     """
     Find request classAds that have my (factory, glidein name, entries) and
     create the dictionary of dictionary of work request information.
@@ -178,6 +238,10 @@ def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
     @type factory_collector: string or None
     @param factory_collector: the collector to query, special value 'default' will get it from the global config
 
+    @type work_snapshot: dict
+    @param work_snapshot: factory wide snapshot returned by loadWorkSnapshot, used instead of
+        querying the collector when it covers the request, default is None
+
     @rtype: dict
     @return: Dictionary of work to perform. Return format is work[entry_name][frontend] = {'params':'value', 'requests':'value}
     """
@@ -187,59 +251,40 @@ def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
     if factory_collector==DEFAULT_VAL:
         factory_collector=factoryConfig.factory_collector
 
-    req_glideins = ''
-    for entry in entry_names:
-        req_glideins = '%s@%s@%s,%s' % (entry, glidein_name,
-                                        factory_name, req_glideins)
-    # Strip off leading & trailing comma
-    req_glideins = req_glideins.strip(',')
-
-    status_constraint='(GlideinMyType=?="%s") && (stringListMember(ReqGlidein,"%s")=?=True)' % (factoryConfig.client_id, req_glideins)
-
-    if (supported_signtypes is not None):
-        status_constraint += ' && stringListMember(%s%s,"%s")' % \
-            (factoryConfig.client_web_prefix,
-             factoryConfig.client_web_signtype_suffix,
-             string.join(supported_signtypes, ","))
+    req_glideins = get_req_glideins(factory_name, glidein_name, entry_names)
+    if pub_key_obj is not None:
+        pub_key_ids = [pub_key_obj.get_pub_key_id()]
+    else:
+        pub_key_ids = None
 
-    if (pub_key_obj is not None):
-        # Get only classads that have my key or no key at all
-        # Any other key will not work
-        status_constraint += ' && (((ReqPubKeyID=?="%s") && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined)) || (ReqPubKeyID=?=Undefined))' % pub_key_obj.get_pub_key_id()
+    data = None
+    if work_snapshot is not None:
+        data = filterWorkSnapshot(work_snapshot, req_glideins, supported_signtypes,
+                                  pub_key_obj, additional_constraints, factory_collector)
+        if data is None:
+            logSupport.log.info("Work snapshot does not cover this request, querying the collector")
+    if data is None:
+        status_constraint = getWorkConstraint(req_glideins, supported_signtypes,
+                                              pub_key_ids, additional_constraints)
+        data = queryWorkClassads(status_constraint, glidein_name, factory_collector)
 
-    if (additional_constraints is not None):
-        status_constraint = "(%s)&&(%s)" % (status_constraint,
-                                            additional_constraints)
+    return processWorkClassads(data, pub_key_obj)
 
-    status = condorMonitor.CondorStatus(subsystem_name="any", pool_name=factory_collector)
-    # Important, this dictates what gets submitted
-    status.require_integrity(True)
-    status.glidein_name = glidein_name
 
-    # Serialize access to the Collector accross all the processes
-    # these is a single Collector anyhow
-    lock_fname = os.path.join(factoryConfig.lock_dir, "gfi_status.lock")
-    if not os.path.exists(lock_fname):
-        # Create a lock file if needed
-        try:
-            fd = open(lock_fname, "w")
-            fd.close()
-        except:
-            # could be a race condition
-            pass
+def processWorkClassads(data, pub_key_obj=None):
+    """
+    Decrypt and validate the request classAds found by findGroupWork
+    and group them by entry
 
-    fd = open(lock_fname, "r+")
+    @type data: dict
+    @param data: glideclient classAds keyed by name, as returned by CondorStatus.fetchStored
 
-    try:
-        fcntl.flock(fd, fcntl.LOCK_EX)
-        try:
-            status.load(status_constraint)
-        finally:
-            fcntl.flock(fd, fcntl.LOCK_UN)
-    finally:
-        fd.close()
+    @type pub_key_obj: string
+    @param pub_key_obj: factory key used to decrypt the requests, defaults to None
 
-    data = status.fetchStored()
+    @rtype: dict
+    @return: Dictionary of work to perform. Return format is work[entry_name][frontend] = {'params':'value', 'requests':'value}
+    """
 
     reserved_names = ("ReqName", "ReqGlidein", "ClientName", "FrontendName",
                       "GroupName", "ReqPubKeyID", "ReqEncKeyCode",
@@ -249,6 +294,11 @@ def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
     # out[entry_name][frontend]
     out = {}
 
+    symKeyCache.max_size = factoryConfig.sym_key_cache_size
+    decryptedParamCache.max_size = factoryConfig.decrypted_param_cache_size
+    sym_key_counts = (symKeyCache.hits, symKeyCache.misses)
+    param_counts = (decryptedParamCache.hits, decryptedParamCache.misses)
+
     # Copy over requests and parameters
 
     for k in data:
@@ -275,7 +325,7 @@ def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
         sym_key_obj = None
         if (pub_key_obj is not None) and ('ReqPubKeyID' in kel):
             try:
-                sym_key_obj = pub_key_obj.extract_sym_key(kel['ReqEncKeyCode'])
+                sym_key_id, sym_key_obj = extract_sym_key_cached(pub_key_obj, kel['ReqEncKeyCode'])
             except:
                 continue
 
@@ -283,7 +333,7 @@ def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
             # Verify that the identity the client claims to be is the
             # identity that Condor thinks it is
             try:
-                enc_identity = sym_key_obj.decrypt_hex(kel['ReqEncIdentity'])
+                enc_identity = decrypt_hex_cached(sym_key_id, sym_key_obj, kel['ReqEncIdentity'])
             except:
                 logSupport.log.warning("Client %s provided invalid ReqEncIdentity, could not decode. Skipping for security reasons." % k)
                 continue # Corrupted classad
@@ -306,7 +356,7 @@ def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
                     el[key][attr[plen:]] = None
                     if sym_key_obj is not None :
                         try:
-                            el[key][attr[plen:]] = sym_key_obj.decrypt_hex(kel[attr])
+                            el[key][attr[plen:]] = decrypt_hex_cached(sym_key_id, sym_key_obj, kel[attr])
                         except:
                             # I don't understand it -> invalid
                             invalid_classad = True
@@ -324,6 +374,11 @@ def findGroupWork(factory_name, glidein_name, entry_names, supported_signtypes,
 
         out[k] = el
 
+    if pub_key_obj is not None:
+        logSupport.log.info("Decryption caches: symmetric keys %i hits, %i misses; parameters %i hits, %i misses" %
+                            (symKeyCache.hits - sym_key_counts[0], symKeyCache.misses - sym_key_counts[1],
+                             decryptedParamCache.hits - param_counts[0], decryptedParamCache.misses - param_counts[1]))
+
     return workGroupByEntries(out)
 
 
@@ -348,6 +403,209 @@ def workGroupByEntries(work):
     return grouped_work
 
 
+def get_req_glideins(factory_name, glidein_name, entry_names):
+    """
+    Return the ReqGlidein values of the requests for the entries
+    """
+    return ['%s@%s@%s' % (entry, glidein_name, factory_name) for entry in entry_names]
+
+
+def getWorkConstraint(req_glideins, supported_signtypes, pub_key_ids=None,
+                      additional_constraints=None):
+    """
+    Build the constraint selecting the request classAds for req_glideins
+
+    @type req_glideins: list
+    @param req_glideins: ReqGlidein values, from get_req_glideins
+
+    @type supported_signtypes: list
+    @param supported_signtypes: signtypes supported by the factory, None to accept any
+
+    @type pub_key_ids: list
+    @param pub_key_ids: ids of the factory keys, None if the requests are not encrypted
+
+    @type additional_constraints: string
+    @param additional_constraints: any additional constraints to include, default is None
+
+    @rtype: string
+    @return: ClassAd constraint
+    """
+    status_constraint='(GlideinMyType=?="%s") && (stringListMember(ReqGlidein,"%s")=?=True)' % (factoryConfig.client_id, string.join(req_glideins, ","))
+
+    if (supported_signtypes is not None):
+        status_constraint += ' && stringListMember(%s%s,"%s")' % \
+            (factoryConfig.client_web_prefix,
+             factoryConfig.client_web_signtype_suffix,
+             string.join(supported_signtypes, ","))
+
+    if (pub_key_ids is not None):
+        # Get only classads that have my keys or no key at all
+        # Any other key will not work
+        key_constraint = string.join(['(ReqPubKeyID=?="%s")' % key_id for key_id in pub_key_ids], " || ")
+        if len(pub_key_ids) > 1:
+            key_constraint = '(%s)' % key_constraint
+        status_constraint += ' && ((%s && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined)) || (ReqPubKeyID=?=Undefined))' % key_constraint
+
+    if (additional_constraints is not None):
+        status_constraint = "(%s)&&(%s)" % (status_constraint,
+                                            additional_constraints)
+    return status_constraint
+
+
+def queryWorkClassads(status_constraint, glidein_name, factory_collector):
+    """
+    Query the collector for the request classAds matching status_constraint
+
+    The query is serialized with the ones of the other factory processes
+
+    @rtype: dict
+    @return: classAds keyed by name
+    """
+    status = condorMonitor.CondorStatus(subsystem_name="any", pool_name=factory_collector)
+    # Important, this dictates what gets submitted
+    status.require_integrity(True)
+    status.glidein_name = glidein_name
+
+    # Serialize access to the Collector accross all the processes
+    # these is a single Collector anyhow
+    lock_fname = os.path.join(factoryConfig.lock_dir, "gfi_status.lock")
+    if not os.path.exists(lock_fname):
+        # Create a lock file if needed
+        try:
+            fd = open(lock_fname, "w")
+            fd.close()
+        except:
+            # could be a race condition
+            pass
+
+    fd = open(lock_fname, "r+")
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            status.load(status_constraint)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        fd.close()
+
+    return status.fetchStored()
+
+
+############################################################
+#
+# Work snapshot (WorkQuerySnapshot factory option)
+#
+# The factory queries once per iteration the requests for all its entries
+# and saves them in the lock dir. The entry groups select their requests
+# from the snapshot instead of querying the collector one after the other
+#
+############################################################
+
+def get_work_snapshot_fname():
+    return os.path.join(factoryConfig.lock_dir, WORK_SNAPSHOT_FNAME)
+
+
+def writeWorkSnapshot(factory_name, glidein_name, entry_names, supported_signtypes,
+                      pub_key_objs, factory_collector=DEFAULT_VAL):
+    """
+    Query the requests for all the entries and save them in the work snapshot
+
+    @type pub_key_objs: list
+    @param pub_key_objs: valid factory keys (current and old), empty if the requests are not encrypted
+
+    @rtype: int
+    @return: number of request classAds saved
+    """
+    if factory_collector==DEFAULT_VAL:
+        factory_collector=factoryConfig.factory_collector
+
+    req_glideins = get_req_glideins(factory_name, glidein_name, entry_names)
+    pub_key_ids = [pub_key_obj.get_pub_key_id() for pub_key_obj in pub_key_objs]
+    status_constraint = getWorkConstraint(req_glideins, supported_signtypes, pub_key_ids or None)
+    data = queryWorkClassads(status_constraint, glidein_name, factory_collector)
+
+    util.file_pickle_dump(get_work_snapshot_fname(),
+                          {'time': time.time(),
+                           'factory_collector': factory_collector,
+                           'req_glideins': set(req_glideins),
+                           'supported_signtypes': supported_signtypes,
+                           'pub_key_ids': pub_key_ids,
+                           'data': data})
+    return len(data)
+
+
+def loadWorkSnapshot(max_age):
+    """
+    Load the work snapshot saved by the factory
+
+    @type max_age: int
+    @param max_age: max age in seconds of a usable snapshot
+
+    @return: the snapshot, None if missing, unreadable or older than max_age
+    """
+    try:
+        snapshot = util.file_pickle_load(get_work_snapshot_fname())
+    except:
+        # missing if the factory did not (or could not) query the collector
+        return None
+    age = time.time() - snapshot['time']
+    if age > max_age:
+        logSupport.log.info("Work snapshot is %i seconds old, ignoring it" % age)
+        return None
+    return snapshot
+
+
+def matchWorkClassad(kel, req_glideins, supported_signtypes, pub_key_id):
+    """
+    Local evaluation of the constraint built by getWorkConstraint
+
+    @type req_glideins: set
+    @param req_glideins: ReqGlidein values
+    """
+    if kel.get('GlideinMyType') != factoryConfig.client_id:
+        return False
+    if kel.get('ReqGlidein') not in req_glideins:
+        return False
+    if supported_signtypes is not None:
+        signtype_attr = factoryConfig.client_web_prefix + factoryConfig.client_web_signtype_suffix
+        if kel.get(signtype_attr) not in supported_signtypes:
+            return False
+    if (pub_key_id is not None) and ('ReqPubKeyID' in kel):
+        return ((kel['ReqPubKeyID'] == pub_key_id) and
+                ('ReqEncKeyCode' in kel) and ('ReqEncIdentity' in kel))
+    return True
+
+
+def filterWorkSnapshot(snapshot, req_glideins, supported_signtypes, pub_key_obj=None,
+                       additional_constraints=None, factory_collector=None):
+    """
+    Select from the work snapshot the request classAds that a findGroupWork query would return
+
+    @return: classAds keyed by name, None if the snapshot does not cover the query
+    """
+    if additional_constraints is not None:
+        # cannot be evaluated locally
+        return None
+    if ((snapshot['factory_collector'] != factory_collector) or
+            (snapshot['supported_signtypes'] != supported_signtypes)):
+        return None
+    if not snapshot['req_glideins'].issuperset(req_glideins):
+        return None
+    pub_key_id = None
+    if pub_key_obj is not None:
+        pub_key_id = pub_key_obj.get_pub_key_id()
+        if pub_key_id not in snapshot['pub_key_ids']:
+            return None
+
+    req_glideins = set(req_glideins)
+    data = {}
+    for k, kel in snapshot['data'].iteritems():
+        if matchWorkClassad(kel, req_glideins, supported_signtypes, pub_key_id):
+            data[k] = kel
+    return data
+
+
 # TODO: PM: findWork is still needed by tools/wmsXMLView. Modify wmsXMLView
 # its still being used before removing the function below
 
@@ -622,9 +880,27 @@ class FactoryGlobalClassad(classadSupport.Classad):
         self.adParams['PubKeyType'] = "%s" % pub_key_obj.get_pub_key_type()
         self.adParams['PubKeyValue'] = "%s" % string.replace(pub_key_obj.get_pub_key_value(), '\n', '\\n')
 
+    def setPerfMetrics(self, perf_metrics):
+        """
+        Set the performance metrics info for the factory or an entry group in the classad
+
+        @type perf_metrics: servicePerformance.PerfMetric
+        @param perf_metrics: PerfMetric object for the factory or an entry group
+        """
+        for event in perf_metrics.metric:
+            attr_name = '%s_%s_%s' % (factoryConfig.glidein_perfmetric_prefix,
+                                      perf_metrics.name, event)
+            self.adParams[attr_name] = perf_metrics.event_lifetime(event)
+        counters = perf_metrics.get_counters()
+        for counter in counters:
+            attr_name = '%s_%s_%s' % (factoryConfig.glidein_perfmetric_prefix,
+                                      perf_metrics.name, counter)
+            self.adParams[attr_name] = counters[counter]
+
 
 def advertizeGlobal(factory_name, glidein_name, supported_signtypes,
-                    pub_key_obj, stats_dict={}, factory_collector=DEFAULT_VAL):
+                    pub_key_obj, stats_dict={}, factory_collector=DEFAULT_VAL,
+                    perf_metrics=()):
 
     """
     Creates the glidefactoryglobal classad and advertises.
@@ -641,6 +917,8 @@ def advertizeGlobal(factory_name, glidein_name, supported_signtypes,
     @param stats_dict: completed jobs statistics
     @type factory_collector: string or None
     @param factory_collector: the collector to query, special value 'default' will get it from the global config
+    @type perf_metrics: list
+    @param perf_metrics: servicePerformance.PerfMetric objects of the factory and of the entry groups
 
     @todo add factory downtime?
     """
@@ -649,6 +927,8 @@ def advertizeGlobal(factory_name, glidein_name, supported_signtypes,
 
     gfg_classad = FactoryGlobalClassad(factory_name, glidein_name,
                                        supported_signtypes, pub_key_obj)
+    for perf_metric in perf_metrics:
+        gfg_classad.setPerfMetrics(perf_metric)
 
     try:
         gfg_classad.writeToFile(tmpnam, append=False)
@@ -907,8 +1187,13 @@ def advertizeGlideinClientMonitoringFromFile(fname, remove_file=True,
                                              is_multi=False, factory_collector=DEFAULT_VAL):
     if os.path.exists(fname):
         try:
-            logSupport.log.info("Advertising glidefactoryclient classads")
-            exe_condor_advertise(fname, "UPDATE_LICENSE_AD", is_multi=is_multi, factory_collector=factory_collector)
+            # only the classads changed since the last advertisement
+            fingerprints = advertizeDeltaCache.filter_file(fname)
+            advertizeDeltaCache.log_stats(factoryConfig.factoryclient_id)
+            if fingerprints:
+                logSupport.log.info("Advertising glidefactoryclient classads")
+                exe_condor_advertise(fname, "UPDATE_LICENSE_AD", is_multi=is_multi, factory_collector=factory_collector)
+                advertizeDeltaCache.mark_sent(fingerprints)
         except:
             logSupport.log.warning("Advertising glidefactoryclient classads failed")
             logSupport.log.exception("Advertising glidefactoryclient classads failed: ")
@@ -921,8 +1206,13 @@ def advertizeGlideinClientMonitoringFromFile(fname, remove_file=True,
 def advertizeGlideinFromFile(fname, remove_file=True, is_multi=False, factory_collector=DEFAULT_VAL):
     if os.path.exists(fname):
         try:
-            logSupport.log.info("Advertising glidefactory classads")
-            exe_condor_advertise(fname, "UPDATE_AD_GENERIC", is_multi=is_multi, factory_collector=factory_collector)
+            # only the classads changed since the last advertisement
+            fingerprints = advertizeDeltaCache.filter_file(fname)
+            advertizeDeltaCache.log_stats(factoryConfig.factory_id)
+            if fingerprints:
+                logSupport.log.info("Advertising glidefactory classads")
+                exe_condor_advertise(fname, "UPDATE_AD_GENERIC", is_multi=is_multi, factory_collector=factory_collector)
+                advertizeDeltaCache.mark_sent(fingerprints)
         except:
             logSupport.log.warning("Advertising glidefactory classads failed")
             logSupport.log.exception("Advertising glidefactory classads failed: ")
@@ -1003,7 +1293,8 @@ def exe_condor_advertise(fname, command,
         fcntl.flock(fd, fcntl.LOCK_EX)
         try:
             ret = condorManager.condorAdvertise(fname, command, factoryConfig.advertise_use_tcp,
-                                                is_multi, factory_collector)
+                                                is_multi, factory_collector,
+                                                factoryConfig.advertise_batch_size)
         finally:
             fcntl.flock(fd, fcntl.LOCK_UN)
     finally:
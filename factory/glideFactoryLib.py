@@ -88,6 +88,9 @@ class FactoryConfig:
         self.max_cluster_size = 10
         self.max_removes = 5
         self.max_releases = 20
+        # max glideins removed or released by a single command
+        self.max_remove_cluster_size = 100
+        self.max_release_cluster_size = 100
 
         # release related limits
         self.max_release_count = 10
@@ -201,6 +204,82 @@ def getCondorQData(entry_name, client_name, schedd_name, factoryConfig=None):
     return q
 
 
+class EntryCondorQ(condorMonitor.StoredQuery):
+    """
+    Jobs of one entry, from a condor_q shared by multiple entries (see getCondorQDataMulti)
+    Has the same attributes of the CondorQ returned by getCondorQData and can be used in its place
+    The data is already loaded: load() does not query the schedd again
+    """
+
+    def __init__(self, schedd_name, factory_name, glidein_name, entry_name, stored_data):
+        self.schedd_name = schedd_name
+        self.factory_name = factory_name
+        self.glidein_name = glidein_name
+        self.entry_name = entry_name
+        self.client_name = None
+        self.stored_data = stored_data
+
+    def load(self, constraint=None, format_list=None):
+        pass
+
+
+def getCondorQDataMulti(entry_names, schedd_name, factoryConfig=None):
+    """
+    Get Condor data for multiple entries using the same schedd, with a single condor_q
+    Same data of getCondorQData(entry_name, None, schedd_name) for each entry
+    Can throw condorMonitor.QueryError or condorExe.ExeError
+
+    @type entry_names: list
+    @param entry_names: names of the entries
+
+    @type schedd_name: string
+    @param schedd_name: schedd to query
+
+    @rtype: dict
+    @return: dictionary {entry_name: EntryCondorQ}, with an element (possibly empty) for each entry in entry_names
+    """
+
+    if factoryConfig is None:
+        factoryConfig = globals()['factoryConfig']
+
+    entry_attribute = factoryConfig.entry_schedd_attribute
+    entry_constraint = string.join(['(%s =?= "%s")' % (entry_attribute, entry_name) for entry_name in entry_names],
+                                   ' || ')
+    q_glidein_constraint = '(%s =?= "%s") && (%s =?= "%s") && (%s) && (%s =!= UNDEFINED)' % \
+        (factoryConfig.factory_schedd_attribute, factoryConfig.factory_name,
+         factoryConfig.glidein_schedd_attribute, factoryConfig.glidein_name,
+         entry_constraint, factoryConfig.credential_id_schedd_attribute)
+    q_glidein_format_list = [
+        ("JobStatus", "i"), ("GridJobStatus", "s"), ("ServerTime", "i"),
+        ("EnteredCurrentStatus", "i"), ("GlideinEntrySubmitFile", "s"),
+        (factoryConfig.credential_id_schedd_attribute, "s"),
+        ("HoldReasonCode", "i"), ("HoldReasonSubCode", "i"),
+        ("HoldReason", "s"), ("NumSystemHolds", "i"),
+        (factoryConfig.frontend_name_attribute, "s"),
+        (factoryConfig.client_schedd_attribute, "s"),
+        (factoryConfig.credential_secclass_schedd_attribute, "s"),
+        (entry_attribute, "s")
+    ]
+
+    q = condorMonitor.CondorQ(schedd_name)
+    q.load(q_glidein_constraint, q_glidein_format_list)
+
+    # split the jobs by entry, in one pass
+    entries_data = dict([(entry_name, {}) for entry_name in entry_names])
+    for jid, job in q.stored_data.iteritems():
+        try:
+            entries_data[job[entry_attribute]][jid] = job
+        except KeyError:
+            # not one of the requested entries, should not happen
+            pass
+
+    out = {}
+    for entry_name in entry_names:
+        out[entry_name] = EntryCondorQ(schedd_name, factoryConfig.factory_name, factoryConfig.glidein_name,
+                                       entry_name, entries_data[entry_name])
+    return out
+
+
 def getCondorQCredentialList(factoryConfig=None):
     """
     Returns a list of all currently used proxies based on the glideins in the queue.
@@ -1417,33 +1496,41 @@ def removeGlideins(schedd_name, jid_list, force=False, log=logSupport.log,
 
     removed_jids = []
 
-    is_not_first = 0
-    for jid in jid_list:
-
+    # one condor_rm for up to max_remove_cluster_size glideins,
+    # more commands only if some removals failed and max_removes is not reached
+    idx = 0
+    while idx < len(jid_list):
         # Respect the max_removes limit and exit right away if required
-        if len(removed_jids) >= factoryConfig.max_removes:
+        nr_jids = min(factoryConfig.max_removes - len(removed_jids), factoryConfig.max_remove_cluster_size)
+        if nr_jids <= 0:
             break  # limit reached, stop
 
-        if is_not_first:
-            is_not_first = 1
+        if idx > 0:
             time.sleep(factoryConfig.remove_sleep)
 
-        try:
-            # this will put a job in X state so that the next condor_rm --forcex below should work
-            condorManager.condorRemoveOne("%li.%li" % (jid[0], jid[1]), schedd_name)
-            removed_jids.append(jid)
-
-            # Force the removal if requested
-            if force == True:
-                try:
-                    log.info("Forcing the removal of glideins in X state")
-                    condorManager.condorRemoveOne("%li.%li" % (jid[0], jid[1]), schedd_name, do_forcex=True)
-                except condorExe.ExeError as e:
-                    log.warning("Forcing the removal of glideins in %s.%s state failed" % (jid[0], jid[1]))
-
-        except condorExe.ExeError as e:
-            # silently ignore errors, and try next one
-            log.warning("removeGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], e))
+        jids = jid_list[idx:idx + nr_jids]
+        idx += nr_jids
+        # this will put the jobs in X state so that the next condor_rm --forcex below should work
+        outcomes = condorManager.condorRemoveMany(jids, schedd_name)
+        ok_jids = []
+        for jid in jids:
+            ok, msg = outcomes[jid]
+            if ok:
+                ok_jids.append(jid)
+                log.debug("removeGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], msg))
+            else:
+                # silently ignore errors, and try next one
+                log.warning("removeGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], msg))
+        removed_jids += ok_jids
+
+        # Force the removal if requested
+        if force == True and ok_jids:
+            log.info("Forcing the removal of glideins in X state")
+            outcomes = condorManager.condorRemoveMany(ok_jids, schedd_name, do_forcex=True)
+            for jid in ok_jids:
+                ok, msg = outcomes[jid]
+                if not ok:
+                    log.warning("Forcing the removal of glideins in %s.%s state failed: %s" % (jid[0], jid[1], msg))
 
     log.info("Removed %i glideins on %s: %s" % (len(removed_jids), schedd_name, removed_jids))
 
@@ -1462,19 +1549,27 @@ def releaseGlideins(schedd_name, jid_list, log=logSupport.log,
 
     released_jids = []
 
-    is_not_first = 0
-    for jid in jid_list:
-        if len(released_jids) > factoryConfig.max_releases:
+    # one condor_release for up to max_release_cluster_size glideins,
+    # the limit is max_releases+1 like in the previous release loop that stopped only when above max_releases
+    idx = 0
+    while idx < len(jid_list):
+        nr_jids = min(factoryConfig.max_releases + 1 - len(released_jids), factoryConfig.max_release_cluster_size)
+        if nr_jids <= 0:
             break  # limit reached, stop
 
-        if is_not_first:
-            is_not_first = 1
+        if idx > 0:
             time.sleep(factoryConfig.release_sleep)
-        try:
-            condorManager.condorReleaseOne("%li.%li" % (jid[0], jid[1]), schedd_name)
-            released_jids.append(jid)
-        except condorExe.ExeError as e:
-            log.warning("releaseGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], e))
+
+        jids = jid_list[idx:idx + nr_jids]
+        idx += nr_jids
+        outcomes = condorManager.condorReleaseMany(jids, schedd_name)
+        for jid in jids:
+            ok, msg = outcomes[jid]
+            if ok:
+                released_jids.append(jid)
+                log.debug("releaseGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], msg))
+            else:
+                log.warning("releaseGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], msg))
 
     log.info("Released %i glideins on %s: %s" % (len(released_jids), schedd_name, released_jids))
 
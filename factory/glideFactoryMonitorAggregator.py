@@ -27,6 +27,7 @@ import time
 from glideinwms.lib import xmlParse, xmlFormat
 from glideinwms.lib import logSupport
 from glideinwms.lib import rrdSupport
+from glideinwms.lib.fork import ForkPoolManager
 from glideinwms.factory import glideFactoryMonitoring
 # from glideinwms.factory import glideFactoryLib
 
@@ -51,9 +52,13 @@ class MonitorAggregatorConfig:
         self.jobsummary_relname="job_summary.pkl"
         self.completed_data_relname="completed_data.json"
 
-    def config_factory(self, monitor_dir, entries, log):
+        # number of processes loading the entry files that changed
+        self.parallel_workers=1
+
+    def config_factory(self, monitor_dir, entries, log, parallel_workers=1):
         self.monitor_dir=monitor_dir
         self.entries=entries
+        self.parallel_workers=parallel_workers
         glideFactoryMonitoring.monitoringConfig.monitor_dir=monitor_dir
         glideFactoryMonitoring.monitoringConfig.log = log
         self.log = log
@@ -62,6 +67,76 @@ class MonitorAggregatorConfig:
 monitorAggregatorConfig = MonitorAggregatorConfig()
 
 
+############################################################
+#
+# Per-entry data, reused between aggregations
+#
+############################################################
+
+class EntryDataCache:
+    """
+    Keep what the aggregator loads from the files of each entry and reload
+    it only when the files change (different inode, mtime or size).
+    The files are always replaced by a rename, so a new inode means new content.
+    """
+
+    def __init__(self):
+        self.data = {}  # name -> {entry: (files_key, value)}
+
+    def load(self, name, entries, fnames_func, load_func, parallel_workers=1):
+        """
+        Return the values of the entries, loading only the ones whose files changed
+
+        @param name: name of the data set, e.g. the file name
+        @param entries: list of entry names
+        @param fnames_func: function(entry) returning the list of files the value depends on
+        @param load_func: function(entry) returning the value, or None if the entry has no data;
+          run in parallel_workers processes when many entries changed, so the value must be picklable
+        @param parallel_workers: maximum number of processes loading the entries
+        @return: (dictionary entry -> value for the entries with data, number of entries loaded)
+        """
+        old_data = self.data.get(name, {})
+        new_data = {}
+        to_load = []
+        for entry in entries:
+            files_key = []
+            for fname in fnames_func(entry):
+                try:
+                    st = os.stat(fname)
+                    files_key.append((st.st_ino, st.st_mtime, st.st_size))
+                except OSError:
+                    files_key.append(None)  # missing, load_func will decide
+            files_key = tuple(files_key)
+            if (entry in old_data) and (old_data[entry][0] == files_key):
+                new_data[entry] = old_data[entry]
+            else:
+                new_data[entry] = (files_key, None)
+                to_load.append(entry)
+
+        if (parallel_workers > 1) and (len(to_load) > 1):
+            forkm_obj = ForkPoolManager()
+            for entry in to_load:
+                forkm_obj.add_fork(entry, load_func, entry)
+            # failures are raised as ForkResultError, like the load errors when serial
+            values = forkm_obj.bounded_fork_and_collect(parallel_workers, log_progress=False)
+        else:
+            values = {}
+            for entry in to_load:
+                values[entry] = load_func(entry)
+        for entry in to_load:
+            new_data[entry] = (new_data[entry][0], values[entry])
+
+        self.data[name] = new_data
+        out = {}
+        for entry in entries:
+            if new_data[entry][1] is not None:
+                out[entry] = new_data[entry][1]
+        return out, len(to_load)
+
+# global cache of the module
+entryDataCache = EntryDataCache()
+
+
 def rrd_site(name):
     sname = name.split(".")[0]
     return "rrd_%s.xml" %sname
@@ -265,26 +340,44 @@ def aggregateStatus(in_downtime):
         for a in attributes_tp:
             val_dict["%s%s" % (tp_str, a)] = None
 
-    nr_entries = 0
-    nr_feentries = {}  # dictionary for nr entries per fe
-    for entry in monitorAggregatorConfig.entries:
-        # load entry status file
-        status_fname = os.path.join(os.path.join(monitorAggregatorConfig.monitor_dir, 'entry_'+entry),
-                                    monitorAggregatorConfig.status_relname)
-        # load entry completed data file
-        completed_data_fname = os.path.join(os.path.join(monitorAggregatorConfig.monitor_dir, 'entry_'+entry),
-                                            monitorAggregatorConfig.completed_data_relname)
+    def entry_fnames(entry):
+        entry_dir = os.path.join(monitorAggregatorConfig.monitor_dir, 'entry_'+entry)
+        status_fname = os.path.join(entry_dir, monitorAggregatorConfig.status_relname)
+        return (status_fname, status_fname + glideFactoryMonitoring.SIDECAR_EXT,
+                os.path.join(entry_dir, monitorAggregatorConfig.completed_data_relname))
+
+    def load_entry(entry):
+        # load entry status file and completed data file
+        status_fname, sidecar_fname, completed_data_fname = entry_fnames(entry)
         completed_data_fp = None
         try:
             # entry_data is a regular dictionary of nested dictionaries/lists returned form the XML parsed
-            entry_data = xmlParse.xmlfile2dict(status_fname)
+            # the JSON sidecar has the same content and is much faster to load
+            entry_data = glideFactoryMonitoring.load_sidecar(status_fname)
+            if entry_data is None:
+                entry_data = xmlParse.xmlfile2dict(status_fname)
             completed_data_fp = open(completed_data_fname)
             completed_data = json.load(completed_data_fp)
         except IOError:
-            continue  # file not found, ignore
+            return None  # file not found, ignore
         finally:
             if completed_data_fp:
                 completed_data_fp.close()
+        return entry_data, completed_data
+
+    start_time = time.time()
+    entries_data, nr_loaded = entryDataCache.load(monitorAggregatorConfig.status_relname,
+                                                  monitorAggregatorConfig.entries, entry_fnames, load_entry,
+                                                  monitorAggregatorConfig.parallel_workers)
+    load_time = time.time()
+
+    nr_entries = 0
+    nr_feentries = {}  # dictionary for nr entries per fe
+    for entry in monitorAggregatorConfig.entries:
+        if entry not in entries_data:
+            continue  # file not found, ignore
+        # the cached data is shared between iterations, it must not be modified
+        entry_data, completed_data = entries_data[entry]
 
         # update entry
         status['entries'][entry] = {'downtime': entry_data['downtime'], 'frontends': entry_data['frontends']}
@@ -399,6 +492,8 @@ def aggregateStatus(in_downtime):
                 if a in avgEntries and fe in nr_feentries:
                     tel[a] = tel[a]/nr_feentries[fe]  # divide per fe
 
+    sum_time = time.time()
+
     xml_downtime = xmlFormat.dict2string({}, dict_name='downtime', el_name='',
                                          params={'status': str(in_downtime)},
                                          leading_tab=xmlFormat.DEFAULT_TAB)
@@ -465,6 +560,9 @@ def aggregateStatus(in_downtime):
         glideFactoryMonitoring.monitoringConfig.write_rrd_multi("total/%s/Status_Attributes" % ("frontend_"+fe),
                                                                 "GAUGE", updated, val_dict)
 
+    logSupport.log.info("aggregateStatus: loaded %i/%i entries in %.3f s, summed in %.3f s, written in %.3f s" %
+                        (nr_loaded, len(monitorAggregatorConfig.entries), load_time - start_time,
+                         sum_time - load_time, time.time() - sum_time))
     return status
 
 
@@ -561,19 +659,23 @@ def aggregateLogSummary():
     status = {'entries': {}, 'total': global_total}
     status_fe = {'frontends': {}}  # analogous to above but for frontend totals
 
-    nr_entries = 0
-    nr_feentries = {}  # dictionary for nr entries per fe
-    for entry in monitorAggregatorConfig.entries:
-        # load entry log summary file
-        status_fname = os.path.join(os.path.join(monitorAggregatorConfig.monitor_dir, 'entry_'+entry),
-                                    monitorAggregatorConfig.logsummary_relname)
+    def entry_fnames(entry):
+        return (os.path.join(os.path.join(monitorAggregatorConfig.monitor_dir, 'entry_'+entry),
+                             monitorAggregatorConfig.logsummary_relname),)
+
+    def load_entry(entry):
+        """
+        Load the entry log summary file
+
+        @return: (per frontend data, entry total or None), None if the file is missing
+        """
+        status_fname, = entry_fnames(entry)
 
         try:
             entry_data = xmlParse.xmlfile2dict(status_fname, always_singular_list=['Fraction', 'TimeRange', 'Range'])
         except IOError:
-            continue  # file not found, ignore
+            return None  # file not found, ignore
 
-        # update entry
         out_data = {}
         for frontend in entry_data['frontends'].keys():
             fe_el = entry_data['frontends'][frontend]
@@ -600,41 +702,68 @@ def aggregateLogSummary():
                 out_fe_el['CompletedCounts']['JobsNr'][t] = int(fe_el['CompletedCounts']['JobsNr'][t]['val'])
             out_data[frontend] = out_fe_el
 
+        if 'total' not in entry_data:
+            return out_data, None
+
+        local_total = {}
+        for k in ['Current', 'Entered', 'Exited']:
+            local_total[k] = {}
+            for s in global_total[k].keys():
+                local_total[k][s] = int(entry_data['total'][k][s])
+        local_total['CompletedCounts'] = {'Sum': {}, 'Waste': {}, 'WasteTime': {},
+                                          'Lasted': {}, 'JobsNr': {}, 'JobsDuration': {}}
+        for tkey in entry_data['total']['CompletedCounts']['Sum'].keys():
+            local_total['CompletedCounts']['Sum'][tkey] = int(entry_data['total']['CompletedCounts']['Sum'][tkey])
+        for k in glideFactoryMonitoring.getAllJobTypes():
+            for w in ('Waste', 'WasteTime'):
+                local_total['CompletedCounts'][w][k] = {}
+                for t in glideFactoryMonitoring.getAllMillRanges():
+                    local_total['CompletedCounts'][w][k][t] = int(entry_data['total']['CompletedCounts'][w][k][t]['val'])
+        for t in glideFactoryMonitoring.getAllTimeRanges():
+            local_total['CompletedCounts']['Lasted'][t] = int(entry_data['total']['CompletedCounts']['Lasted'][t]['val'])
+        local_total['CompletedCounts']['JobsDuration'] = {}
+        for t in glideFactoryMonitoring.getAllTimeRanges():
+            local_total['CompletedCounts']['JobsDuration'][t] = int(entry_data['total']['CompletedCounts']['JobsDuration'][t]['val'])
+        for t in glideFactoryMonitoring.getAllJobRanges():
+            local_total['CompletedCounts']['JobsNr'][t] = int(entry_data['total']['CompletedCounts']['JobsNr'][t]['val'])
+        return out_data, local_total
+
+    start_time = time.time()
+    entries_data, nr_loaded = entryDataCache.load(monitorAggregatorConfig.logsummary_relname,
+                                                  monitorAggregatorConfig.entries, entry_fnames, load_entry,
+                                                  monitorAggregatorConfig.parallel_workers)
+    load_time = time.time()
+
+    nr_entries = 0
+    nr_feentries = {}  # dictionary for nr entries per fe
+    for entry in monitorAggregatorConfig.entries:
+        if entry not in entries_data:
+            continue  # file not found, ignore
+        # the cached data is shared between iterations, it must not be modified
+        out_data, local_total = entries_data[entry]
+
+        # update entry
         status['entries'][entry] = {'frontends': out_data}
 
         # update total
-        if 'total' in entry_data:
+        if local_total is not None:
             nr_entries += 1
-            local_total = {}
 
             for k in ['Current', 'Entered', 'Exited']:
-                local_total[k] = {}
                 for s in global_total[k].keys():
-                    local_total[k][s] = int(entry_data['total'][k][s])
-                    global_total[k][s] += int(entry_data['total'][k][s])
-            local_total['CompletedCounts'] = {'Sum': {}, 'Waste': {}, 'WasteTime': {},
-                                              'Lasted': {}, 'JobsNr': {}, 'JobsDuration': {}}
-            for tkey in entry_data['total']['CompletedCounts']['Sum'].keys():
-                local_total['CompletedCounts']['Sum'][tkey] = int(entry_data['total']['CompletedCounts']['Sum'][tkey])
-                global_total['CompletedCounts']['Sum'][tkey] += int(entry_data['total']['CompletedCounts']['Sum'][tkey])
+                    global_total[k][s] += local_total[k][s]
+            for tkey in local_total['CompletedCounts']['Sum'].keys():
+                global_total['CompletedCounts']['Sum'][tkey] += local_total['CompletedCounts']['Sum'][tkey]
             for k in glideFactoryMonitoring.getAllJobTypes():
                 for w in ('Waste', 'WasteTime'):
-                    local_total['CompletedCounts'][w][k] = {}
                     for t in glideFactoryMonitoring.getAllMillRanges():
-                        local_total['CompletedCounts'][w][k][t] = int(entry_data['total']['CompletedCounts'][w][k][t]['val'])
-                        global_total['CompletedCounts'][w][k][t] += int(entry_data['total']['CompletedCounts'][w][k][t]['val'])
-
+                        global_total['CompletedCounts'][w][k][t] += local_total['CompletedCounts'][w][k][t]
             for t in glideFactoryMonitoring.getAllTimeRanges():
-                local_total['CompletedCounts']['Lasted'][t] = int(entry_data['total']['CompletedCounts']['Lasted'][t]['val'])
-                global_total['CompletedCounts']['Lasted'][t] += int(entry_data['total']['CompletedCounts']['Lasted'][t]['val'])
-            local_total['CompletedCounts']['JobsDuration'] = {}
+                global_total['CompletedCounts']['Lasted'][t] += local_total['CompletedCounts']['Lasted'][t]
             for t in glideFactoryMonitoring.getAllTimeRanges():
-                local_total['CompletedCounts']['JobsDuration'][t] = int(entry_data['total']['CompletedCounts']['JobsDuration'][t]['val'])
-                global_total['CompletedCounts']['JobsDuration'][t] += int(entry_data['total']['CompletedCounts']['JobsDuration'][t]['val'])
-
+                global_total['CompletedCounts']['JobsDuration'][t] += local_total['CompletedCounts']['JobsDuration'][t]
             for t in glideFactoryMonitoring.getAllJobRanges():
-                local_total['CompletedCounts']['JobsNr'][t] = int(entry_data['total']['CompletedCounts']['JobsNr'][t]['val'])
-                global_total['CompletedCounts']['JobsNr'][t] += int(entry_data['total']['CompletedCounts']['JobsNr'][t]['val'])
+                global_total['CompletedCounts']['JobsNr'][t] += local_total['CompletedCounts']['JobsNr'][t]
 
             status['entries'][entry]['total'] = local_total
 
@@ -651,6 +780,8 @@ def aggregateLogSummary():
             # sum them up
             sumDictInt(out_data[fe], status_fe['frontends'][fe])
 
+    sum_time = time.time()
+
     # Write xml files
     # To do - Igor: Consider adding status_fe to the XML file
     updated = time.time()
@@ -682,6 +813,9 @@ def aggregateLogSummary():
     for fe in status_fe['frontends']:
         writeLogSummaryRRDs("total/%s" % ("frontend_"+fe), status_fe['frontends'][fe])
 
+    logSupport.log.info("aggregateLogSummary: loaded %i/%i entries in %.3f s, summed in %.3f s, written in %.3f s" %
+                        (nr_loaded, len(monitorAggregatorConfig.entries), load_time - start_time,
+                         sum_time - load_time, time.time() - sum_time))
     return status
 
 
@@ -782,19 +916,44 @@ def aggregateRRDStats(log=logSupport.log):
     rrdstats_relname = glideFactoryMonitoring.RRD_LIST
     tab = xmlFormat.DEFAULT_TAB
 
-    for rrd in rrdstats_relname:
+    def entry_fnames(entry):
+        fnames = []
+        for rrd in rrdstats_relname:
+            rrd_fname = os.path.join(os.path.join(monitorAggregatorConfig.monitor_dir, 'entry_' + entry), rrd_site(rrd))
+            fnames += [rrd_fname, rrd_fname + glideFactoryMonitoring.SIDECAR_EXT]
+        return fnames
 
-        # assigns the data from every site to 'stats'
-        stats = {}
-        for entry in monitorAggregatorConfig.entries:
+    def load_entry(entry):
+        # dictionary rrd -> data of the files found
+        entry_stats = {}
+        for rrd in rrdstats_relname:
             rrd_fname = os.path.join(os.path.join(monitorAggregatorConfig.monitor_dir, 'entry_' + entry), rrd_site(rrd))
             try:
-                stats[entry] = xmlParse.xmlfile2dict(rrd_fname, always_singular_list = {'timezone':{}})
+                rrd_stats = glideFactoryMonitoring.load_sidecar(rrd_fname)
+                if rrd_stats is None:
+                    rrd_stats = xmlParse.xmlfile2dict(rrd_fname, always_singular_list = {'timezone':{}})
+                entry_stats[rrd] = rrd_stats
             except IOError:
                 if os.path.exists(rrd_fname):
                     log.debug("aggregateRRDStats %s exception: parse_xml, IOError" % rrd_fname)
                 else:
                     log.debug("aggregateRRDStats %s exception: parse_xml, IOError, File not existing (OK if first time)" % rrd_fname)
+        return entry_stats
+
+    start_time = time.time()
+    entries_data, nr_loaded = entryDataCache.load('rrd_stats', monitorAggregatorConfig.entries,
+                                                  entry_fnames, load_entry,
+                                                  monitorAggregatorConfig.parallel_workers)
+    load_time = time.time()
+
+    for rrd in rrdstats_relname:
+
+        # assigns the data from every site to 'stats'
+        # the cached data is shared between iterations, it must not be modified
+        stats = {}
+        for entry in entries_data:
+            if rrd in entries_data[entry]:
+                stats[entry] = entries_data[entry][rrd]
 
         stats_entries=stats.keys()
         if len(stats_entries)==0:
@@ -930,6 +1089,8 @@ def aggregateRRDStats(log=logSupport.log):
         except IOError:
             log.debug("write_file %s, IOError"%rrd_site(rrd))
 
+    log.info("aggregateRRDStats: loaded %i/%i entries in %.3f s, summed and written in %.3f s" %
+             (nr_loaded, len(monitorAggregatorConfig.entries), load_time - start_time, time.time() - load_time))
     return
 
 
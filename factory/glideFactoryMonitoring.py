@@ -30,6 +30,9 @@ from glideinwms.lib import util
 # list of rrd files that each site has
 RRD_LIST = ('Status_Attributes.rrd', 'Log_Completed.rrd', 'Log_Completed_Stats.rrd', 'Log_Completed_WasteTime.rrd', 'Log_Counts.rrd')
 
+# extension of the JSON files written next to the XML status files read by the aggregator
+SIDECAR_EXT = '.json'
+
 ############################################################
 #
 # Configuration
@@ -158,6 +161,25 @@ class MonitoringConfig:
 
         return
 
+    def write_sidecar(self, relative_fname, data):
+        """
+        Write the data of an XML status file in a JSON file next to it,
+        so that the aggregator can load it without parsing the XML
+        Must be called after write_file, see load_sidecar
+        @param relative_fname: The relative path name of the XML file
+        @param data: dictionary as returned by xmlParse for the XML file (see sidecar_dict)
+        """
+        fname = os.path.join(self.monitor_dir, relative_fname + SIDECAR_EXT)
+        fd = open(fname + ".tmp", "w")
+        try:
+            json.dump(data, fd, separators=(',', ':'))
+        finally:
+            fd.close()
+
+        util.file_tmp2final(fname, do_backup=False,
+                            mask_exceptions=(self.log.error, "Failed rename/write into %s" % fname))
+        return
+
     def establish_dir(self, relative_dname):
         dname = os.path.join(self.monitor_dir, relative_dname)
         if not os.path.isdir(dname):
@@ -241,6 +263,22 @@ class MonitoringConfig:
                 self.log.exception("Failed to update %s: " % fname)
         return
 
+    def use_rrd_write_behind(self):
+        """
+        Queue the RRD updates and write them in batches when flush_rrd is called
+        """
+        self.rrd_obj = rrdSupport.write_behind(self.rrd_obj)
+
+    def flush_rrd(self):
+        """
+        Write the RRD updates queued in write-behind mode, logging the failed ones
+        """
+        nr_updates, nr_calls, errors = self.rrd_obj.flush()
+        for fname, msg in errors:
+            self.log.error("Failed to update %s: %s" % (fname, msg))
+        if nr_updates > 0:
+            self.log.debug("Wrote %i RRD updates using %i rrdtool calls" % (nr_updates, nr_calls))
+
 
 #######################################################################################################################
 #
@@ -490,6 +528,21 @@ class condorQStats:
                                      subtypes_params={"class": {'subclass_params': {'Requested': {'dicts_params': {'Parameters': {'el_name': 'Parameter'}}}}}},
                                      indent_tab=indent_tab, leading_tab=leading_tab)
 
+    @staticmethod
+    def get_sidecar_data(data):
+        """
+        Return the statistic data as xmlParse reads it from get_xml_data
+        @param data: self.get_data()
+        @return: dictionary of frontends
+        """
+        frontends = sidecar_dict(data)
+        for fe_el in frontends.values():
+            if 'Requested' in fe_el and 'Parameters' in fe_el['Requested']:
+                # Parameters is formatted as a dictionary of simple values
+                params = fe_el['Requested']['Parameters']
+                fe_el['Requested']['Parameters'] = dict([(k, {'val': params[k]}) for k in params])
+        return frontends
+
     def get_total(self, history={'set_to_zero': False}):
         total = {'Status': None, 'Requested': None, 'ClientMonitor': None}
         set_to_zero = False
@@ -603,6 +656,10 @@ class condorQStats:
                    self.get_xml_total(total_el, indent_tab=xmlFormat.DEFAULT_TAB, leading_tab=xmlFormat.DEFAULT_TAB) + "\n" +
                    "</glideFactoryEntryQStats>\n")
         monitoringConfig.write_file("schedd_status.xml", xml_str)
+        monitoringConfig.write_sidecar("schedd_status.xml",
+                                       {'downtime': {'status': sidecar_value(self.downtime)},
+                                        'frontends': self.get_sidecar_data(data),
+                                        'total': sidecar_dict(total_el)})
 
         # update RRDs
         type_strings = {'Status': 'Status', 'Requested': 'Req', 'ClientMonitor': 'Client'}
@@ -1334,7 +1391,15 @@ class FactoryStatusData:
         self.frontends = []
         if base_dir is None:
             self.base_dir = monitoringConfig.monitor_dir
+        else:
+            self.base_dir = base_dir
         self.log = log
+        # Cache of the fetched RRD data, {(file, resolution, start, end): data_sets}
+        # The times are aligned to the resolution, so each RRD file is fetched at most once per resolution per cycle
+        # Cleared by logFetchStats at the end of the cycle
+        self.fetch_cache = {}
+        self.nr_fetches = 0  # rrdtool fetch calls
+        self.nr_cached_fetches = 0
 
     def getUpdated(self):
         """returns the time of last update"""
@@ -1346,10 +1411,26 @@ class FactoryStatusData:
         rrdtool fetch returns 3 tuples: a[0], a[1], & a[2].
         [0] lists the resolution, start and end time, which can be specified as arugments of fetchData.
         [1] returns the names of the datasets.  These names are listed in the key.
-        [2] is a list of tuples. each tuple contains data from every dataset.  There is a tuple for each time data was collected."""
+        [2] is a list of tuples. each tuple contains data from every dataset.  There is a tuple for each time data was collected.
+
+        The result is cached, fetching again the same file and interval in the same cycle does not invoke rrdtool"""
+
+        cache_key = (pathway + rrd_file, res, start, end)
+        try:
+            data_sets = self.fetch_cache[cache_key]
+            self.nr_cached_fetches += 1
+            return data_sets
+        except KeyError:
+            pass
+        data_sets = self.fetch_cache[cache_key] = self.fetchRRD(rrd_file, pathway, res, start, end)
+        return data_sets
+
+    def fetchRRD(self, rrd_file, pathway, res, start, end):
+        """Fetch the data with rrdtool, without caching. Same output of fetchData"""
 
         # use rrdtool to fetch data
         baseRRDSupport = rrdSupport.rrdSupport()
+        self.nr_fetches += 1
         try:
             fetched = baseRRDSupport.fetch_rrd(pathway + rrd_file, 'AVERAGE', resolution=res, start=start, end=end)
         except:
@@ -1385,6 +1466,38 @@ class FactoryStatusData:
         else:
             return data_sets
 
+    def logFetchStats(self):
+        """Log the number of RRD fetches since the last call and clear the fetch cache (end of the cycle)"""
+        self.log.info("RRD stats: %i rrdtool fetch calls, %i fetches from cache" %
+                      (self.nr_fetches, self.nr_cached_fetches))
+        self.fetch_cache = {}
+        self.nr_fetches = 0
+        self.nr_cached_fetches = 0
+
+    def getPeriods(self, monitoringConfig):
+        """Return the periods to fetch, one per resolution in self.resolution
+
+        @return: list of tuples (period, rrd_res, start, end), with rrd_res the best RRD resolution for the period
+        """
+        periods = []
+        now = time.time()
+        for res_raw in self.resolution:
+            # calculate the best resolution
+            res_idx = 0
+            rrd_res = monitoringConfig.rrd_archives[res_idx][2] * monitoringConfig.rrd_step
+            period_mul = int(res_raw / rrd_res)
+            while (period_mul >= monitoringConfig.rrd_archives[res_idx][3]):
+                # not all elements in the higher bucket, get next lower resolution
+                res_idx += 1
+                rrd_res = monitoringConfig.rrd_archives[res_idx][2] * monitoringConfig.rrd_step
+                period_mul = int(res_raw / rrd_res)
+
+            period = period_mul * rrd_res
+            end = (int(now / rrd_res) - 1) * rrd_res  # round due to RRDTool requirements, -1 to avoid the last (partial) one
+            start = end - period
+            periods.append((period, rrd_res, start, end))
+        return periods
+
     def average(self, input_list):
         try:
             if len(input_list) > 0:
@@ -1419,24 +1532,11 @@ class FactoryStatusData:
             if client not in self.frontends:
                 self.frontends.append(client)
 
+        periods = self.getPeriods(monitoringConfig)
         for rrd in RRD_LIST:
             self.data[rrd][client] = {}
-            for res_raw in self.resolution:
-                # calculate the best resolution
-                res_idx = 0
-                rrd_res = monitoringConfig.rrd_archives[res_idx][2] * monitoringConfig.rrd_step
-                period_mul = int(res_raw / rrd_res)
-                while (period_mul >= monitoringConfig.rrd_archives[res_idx][3]):
-                    # not all elements in the higher bucket, get next lower resolution
-                    res_idx += 1
-                    rrd_res = monitoringConfig.rrd_archives[res_idx][2] * monitoringConfig.rrd_step
-                    period_mul = int(res_raw / rrd_res)
-
-                period = period_mul * rrd_res
-
+            for period, rrd_res, start, end in periods:
                 self.data[rrd][client][period] = {}
-                end = (int(time.time() / rrd_res) - 1) * rrd_res # round due to RRDTool requirements, -1 to avoid the last (partial) one
-                start = end - period
                 try:
                     fetched_data = self.fetchData(
                                        rrd_file=rrd,
@@ -1460,10 +1560,20 @@ class FactoryStatusData:
         @return: XML formatted string with stats data
         """
 
-        # create a string containing the total data
-        total_xml_str = self.tab + '<total>\n'
         # this is invoked to trigger the side effect but the data is retrieved directly from self.data dict below
         get_data_total = self.getData(self.total)
+        return self.formatXMLData(rrd)
+
+    def formatXMLData(self, rrd):
+        """Return a XML formatted string the specific RRD file using the data already in self.data
+        (fetched with getData for the total and the clients)
+
+        @param rrd:
+        @return: XML formatted string with stats data
+        """
+
+        # create a string containing the total data
+        total_xml_str = self.tab + '<total>\n'
         try:
             total_data = self.data[rrd][self.total]
             total_xml_str += (xmlFormat.dict2string(total_data, dict_name='periods', el_name='period', subtypes_params={"class":{}}, indent_tab=self.tab, leading_tab=2 * self.tab) + "\n")
@@ -1488,6 +1598,19 @@ class FactoryStatusData:
         data_str = total_xml_str + frontend_xml_str
         return data_str
 
+    def formatSidecarData(self, rrd):
+        """Return the data of formatXMLData as xmlParse reads it
+
+        @param rrd:
+        @return: dictionary with the total and frontends data
+        """
+        frontends = {}
+        for frontend in self.frontends:
+            fe_name = frontend.split("/")[0]
+            frontends[fe_name] = {'periods': sidecar_dict(self.data[rrd][frontend])}
+        return {'total': {'periods': sidecar_dict(self.data[rrd][self.total])},
+                'frontends': frontends}
+
     def writeFiles(self,  monitoringConfig=None):
         """Write an xml file for the data fetched from a given site.
         Write rrd files
@@ -1501,17 +1624,21 @@ class FactoryStatusData:
         if monitoringConfig is None:
             monitoringConfig = globals()['monitoringConfig']
 
+        # the totals of all the RRD files are fetched once, not for each XML file
+        self.getData(self.total, monitoringConfig=monitoringConfig)
         for rrd in RRD_LIST:
             file_name = 'rrd_' + rrd.split(".")[0] + '.xml'
             xml_str = ('<?xml version="1.0" encoding="ISO-8859-1"?>\n\n' +
                        '<glideFactoryEntryRRDStats>\n' +
                        self.getUpdated() + "\n" +
-                       self.getXMLData(rrd) +
+                       self.formatXMLData(rrd) +
                        '</glideFactoryEntryRRDStats>')
             try:
                 monitoringConfig.write_file(file_name, xml_str)
+                monitoringConfig.write_sidecar(file_name, self.formatSidecarData(rrd))
             except IOError:
                 self.log.exception("FactoryStatusData:write_file: ")
+        self.logFetchStats()
         return
 
 ##############################################################################
@@ -1697,6 +1824,53 @@ def get_completed_stats_xml_desc():
             }
 
 
+##################################################
+def sidecar_value(el):
+    """
+    Return a simple value as the aggregator reads it from the XML files:
+    integers are kept as numbers, everything else is the XML attribute string
+    """
+    if isinstance(el, bool) or (el is None):
+        return str(el)
+    if isinstance(el, (int, long)):
+        return el
+    if isinstance(el, float):
+        return "%.12g" % el  # like xmlFormat.xml_quoteattr
+    return el
+
+def sidecar_dict(data):
+    """
+    Return the nested dictionaries as xmlParse reads them once formatted as XML
+    classes: the keys become strings and the values go through sidecar_value
+    """
+    out = {}
+    for k in data:
+        el = data[k]
+        if isinstance(el, dict):
+            out[str(k)] = sidecar_dict(el)
+        else:
+            out[str(k)] = sidecar_value(el)
+    return out
+
+def load_sidecar(xml_fname):
+    """
+    Load the JSON sidecar of an XML status file (see MonitoringConfig.write_sidecar)
+    @param xml_fname: path of the XML file
+    @return: the data dictionary, None if the sidecar is missing, corrupted
+      or older than the XML file (the XML file must be parsed instead)
+    """
+    sidecar_fname = xml_fname + SIDECAR_EXT
+    try:
+        if os.path.getmtime(sidecar_fname) < os.path.getmtime(xml_fname):
+            return None  # the XML file was written without it
+        fd = open(sidecar_fname)
+        try:
+            return json.load(fd)
+        finally:
+            fd.close()
+    except (OSError, IOError, ValueError):
+        return None
+
 
 ##################################################
 # def tmp2final(fname):
@@ -18,6 +18,7 @@
 from __future__ import absolute_import
 import os
 import sys
+import errno
 import fcntl
 import subprocess
 import traceback
@@ -38,7 +39,9 @@ from glideinwms.frontend import glideinFrontendLib
 from glideinwms.frontend import glideinFrontendInterface
 from glideinwms.frontend import glideinFrontendMonitorAggregator
 from glideinwms.frontend import glideinFrontendMonitoring
+from glideinwms.frontend import glideinFrontendSnapshot
 from glideinwms.frontend.glideinFrontendElement import glideinFrontendElement
+from glideinwms.frontend.glideinFrontendElement import WORKER_RESULT_PREFIX, WORKER_EXIT
 FRONTEND_DIR = os.path.dirname(glideinFrontendLib.__file__)
 ############################################################
 # KEL remove this method and just call the monitor aggregator method directly below?  we don't use the results
@@ -88,7 +91,12 @@ def spawn_group(work_dir, group_name, action):
                     work_dir,
                     group_name,
                     action]
+    stdin = None
+    if action == "worker":
+        # resident group process, the operations are sent on stdin
+        stdin = subprocess.PIPE
     child = subprocess.Popen(command_list, shell=False,
+                             stdin=stdin,
                              stdout=subprocess.PIPE,
                              stderr=subprocess.PIPE)
 
@@ -98,15 +106,21 @@ def spawn_group(work_dir, group_name, action):
         fl = fcntl.fcntl(fd, fcntl.F_GETFL)
         fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
+    if child.stdin is not None:
+        # do not leak the pipe to the other groups or across exec (reconfig),
+        # the worker must see EOF when the frontend goes away
+        fd = child.stdin.fileno()
+        fl = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, fl | fcntl.FD_CLOEXEC)
+
     return child
 
 ############################################################
-def poll_group_process(group_name, child):
-    # empty stdout and stderr
+def read_group_output(group_name, child):
+    """Empty stderr and return what is available on stdout (non blocking)"""
+    tempOut = ''
     try:
         tempOut = child.stdout.read()
-        if len(tempOut) != 0:
-            logSupport.log.info("[%s]: %s" % (group_name, tempOut))
     except IOError:
         pass # ignore
     try:
@@ -115,14 +129,146 @@ def poll_group_process(group_name, child):
             logSupport.log.warning("[%s]: %s" % (group_name, tempErr))
     except IOError:
         pass # ignore
+    return tempOut
+
+def poll_group_process(group_name, child):
+    # empty stdout and stderr
+    tempOut = read_group_output(group_name, child)
+    if len(tempOut) != 0:
+        logSupport.log.info("[%s]: %s" % (group_name, tempOut))
 
     return child.poll()
 
+def wait_group_process(group_name, child):
+    """Same as poll_group_process, but reaps the child with wait4
+    to get the CPU time used by the group (including its children)
+
+    @return: tuple (exit code, CPU time), (None, None) if still alive
+    """
+    tempOut = read_group_output(group_name, child)
+    if len(tempOut) != 0:
+        logSupport.log.info("[%s]: %s" % (group_name, tempOut))
+
+    if child.returncode is not None:
+        return child.returncode, None
+    try:
+        pid, status, rusage = os.wait4(child.pid, os.WNOHANG)
+    except OSError as e:
+        if e.errno != errno.ECHILD:
+            raise
+        # already reaped, no usage information available
+        return child.poll(), None
+    if pid == 0:
+        return None, None
+    # keep Popen consistent, the process is gone
+    if os.WIFSIGNALED(status):
+        child.returncode = -os.WTERMSIG(status)
+    else:
+        child.returncode = os.WEXITSTATUS(status)
+    return child.returncode, rusage.ru_utime + rusage.ru_stime
+
+############################################################
+class GroupWorker:
+    """Resident process of a group (GroupWorkerMode persistent)
+
+    Runs glideinFrontendElement.py with the "worker" action, keeping
+    configuration and credentials between iterations.
+    See glideinFrontendElement.ElementWorker for the protocol.
+    """
+    def __init__(self, work_dir, group_name):
+        self.work_dir = work_dir
+        self.group_name = group_name
+        self.child = None
+        self.out_buffer = ''
+        self.result = None
+
+    def is_alive(self):
+        return (self.child is not None) and (self.child.poll() is None)
+
+    def start_action(self, action):
+        """Send the next operation, (re)starting the worker if needed"""
+        if not self.is_alive():
+            if self.child is not None:
+                logSupport.log.warning("Worker of group %s died (exit code %s), restarting it" % (self.group_name, self.child.returncode))
+            self.child = spawn_group(self.work_dir, self.group_name, "worker")
+            self.out_buffer = ''
+        self.result = None
+        try:
+            self.child.stdin.write("%s\n" % action)
+            self.child.stdin.flush()
+        except IOError:
+            # died in the meantime, poll() will report the failure
+            pass
+
+    def poll(self):
+        """Check the progress of the current operation
+
+        @return: None if still running, else tuple (exit code, CPU time)
+        """
+        self.out_buffer += read_group_output(self.group_name, self.child)
+        while '\n' in self.out_buffer:
+            line, self.out_buffer = self.out_buffer.split('\n', 1)
+            if line.startswith(WORKER_RESULT_PREFIX):
+                rc, wall_time, cpu_time = line.split()[1:4]
+                self.result = (int(rc), float(cpu_time))
+            elif line:
+                logSupport.log.info("[%s]: %s" % (self.group_name, line))
+        if (self.result is None) and (self.child.poll() is not None):
+            # the worker died before completing the operation
+            self.result = (self.child.returncode or 1, None)
+        return self.result
+
+    def stop(self, timeout=5):
+        """Ask the worker to exit, kill it if it does not in timeout seconds"""
+        if not self.is_alive():
+            return
+        try:
+            self.child.stdin.write("%s\n" % WORKER_EXIT)
+            self.child.stdin.close()
+        except IOError:
+            pass
+        end_time = time.time() + timeout
+        while (self.child.poll() is None) and (time.time() < end_time):
+            time.sleep(0.01)
+        if self.child.poll() is None:
+            self.kill()
+
+    def kill(self):
+        if self.is_alive():
+            try:
+                os.kill(self.child.pid, signal.SIGKILL)
+            except OSError:
+                pass # ignore failed kills of non-existent processes
+            self.child.wait()
+
+############################################################
+def spawn_snapshot(work_dir, frontendDescript, groups):
+    """Query schedds and user collector once for all groups (QuerySnapshot)
+
+    The number of queries, classads and bytes received are
+    added to the frontend performance metrics
+    """
+    servicePerformance.startPerfMetricEvent('frontend', 'snapshot')
+    try:
+        set_frontend_htcondor_env(work_dir, frontendDescript)
+        counters = glideinFrontendSnapshot.make_snapshot(
+            work_dir, frontendDescript.data['FrontendName'], groups)
+        for counter in counters:
+            servicePerformance.setPerfMetricCounter('frontend', counter, counters[counter])
+    except Exception:
+        # the groups will query HTCondor themselves
+        logSupport.log.exception("Failed to create the snapshot of schedds and collector: ")
+    finally:
+        clean_htcondor_env()
+        servicePerformance.endPerfMetricEvent('frontend', 'snapshot')
+
 ############################################################
 
 # return the list of (group,walltime) pairs
+# workers is a dictionary of GroupWorker (GroupWorkerMode persistent),
+# if None a new process is spawned for each group
 def spawn_iteration(work_dir, frontendDescript, groups, max_active,
-                    failure_dict, max_failures, action):
+                    failure_dict, max_failures, action, workers=None):
     childs = {}
   
     for group_name in groups:
@@ -134,14 +280,19 @@ def spawn_iteration(work_dir, frontendDescript, groups, max_active,
 
     max_num_failures = 0
     logSupport.log.info("Starting iteration")
+    if frontendDescript.data.get('QuerySnapshot', 'False') == 'True':
+        spawn_snapshot(work_dir, frontendDescript, groups)
     try:
         while groups_tofinish > 0:
             done_something = False
             # check if any group finished by now
             for group_name in groups:
                 if childs[group_name]['state'] == 'spawned':
-                    group_rc = poll_group_process(group_name,
-                                                  childs[group_name]['data'])
+                    if workers is None:
+                        group_rc, group_cpu = wait_group_process(group_name,
+                                                                 childs[group_name]['data'])
+                    else:
+                        group_rc, group_cpu = workers[group_name].poll() or (None, None)
                     if not (group_rc is None): # None means "still alive"
                         if group_rc == 0:
                             childs[group_name]['state'] = 'finished'
@@ -155,6 +306,14 @@ def spawn_iteration(work_dir, frontendDescript, groups, max_active,
                         childs[group_name]['end_time'] = time.time()
                         servicePerformance.endPerfMetricEvent(
                             'frontend', 'group_%s_iteration'%group_name)
+                        if group_cpu is None:
+                            cpu_str = "unknown"
+                        else:
+                            cpu_str = "%.1f sec" % group_cpu
+                        logSupport.log.info("Group %s %s: wall time %.1f sec, CPU time %s (%s mode)" % (
+                            group_name, action,
+                            childs[group_name]['end_time'] - childs[group_name]['start_time'],
+                            cpu_str, workers is None and 'spawn' or 'persistent'))
                         active_groups -= 1
                         groups_tofinish -= 1
                         done_something = True
@@ -163,7 +322,11 @@ def spawn_iteration(work_dir, frontendDescript, groups, max_active,
             for group_name in groups:
                 if active_groups < max_active: # can spawn more
                     if childs[group_name]['state'] == 'queued':
-                        childs[group_name]['data'] = spawn_group(work_dir, group_name, action)
+                        if workers is None:
+                            childs[group_name]['data'] = spawn_group(work_dir, group_name, action)
+                        else:
+                            workers[group_name].start_action(action)
+                            childs[group_name]['data'] = workers[group_name]
                         childs[group_name]['state'] = 'spawned'
                         childs[group_name]['start_time'] = time.time()
                         servicePerformance.startPerfMetricEvent(
@@ -214,6 +377,7 @@ def spawn_iteration(work_dir, frontendDescript, groups, max_active,
                     work_dir, group_name, True, dict)
                 pfm = servicePerformance.getPerfMetric(gname)
                 pfm.metric = history_obj['perf_metrics'].metric
+                pfm.counters = history_obj['perf_metrics'].get_counters()
 
                 fm_classad.setPerfMetrics(
                     servicePerformance.getPerfMetric(gname))
@@ -252,6 +416,10 @@ def spawn_iteration(work_dir, frontendDescript, groups, max_active,
                 logSupport.log.info("Hard killing group %s" % group_name)
                 servicePerformance.endPerfMetricEvent(
                     'frontend', 'group_%s_iteration'%group_name)
+                if workers is not None:
+                    # restarted at the next iteration
+                    workers[group_name].kill()
+                    continue
                 try:
                     os.kill(childs[group_name]['data'].pid, signal.SIGKILL)
                 except OSError:
@@ -307,10 +475,18 @@ def spawn_cleanup(work_dir, frontendDescript, groups, frontend_name, ha_mode):
 
 ############################################################
 def spawn(sleep_time, advertize_rate, work_dir, frontendDescript,
-          groups, max_parallel_workers, restart_interval, restart_attempts):
+          groups, max_parallel_workers, restart_interval, restart_attempts,
+          group_worker_mode='spawn'):
 
     num_groups = len(groups)
 
+    workers = None
+    if group_worker_mode == 'persistent':
+        # resident group processes, started at the first iteration
+        workers = {}
+        for group in groups:
+            workers[group] = GroupWorker(work_dir, group)
+
     # TODO: Get the ha_check_interval from the config
     ha = glideinFrontendLib.getHASettings(frontendDescript.data)
     ha_check_interval = glideinFrontendLib.getHACheckInterval(frontendDescript.data)
@@ -354,7 +530,7 @@ def spawn(sleep_time, advertize_rate, work_dir, frontendDescript,
                 start_time = time.time()
                 timings = spawn_iteration(work_dir, frontendDescript, groups,
                                           max_parallel_workers, failure_dict,
-                                          restart_attempts, "run")
+                                          restart_attempts, "run", workers)
                 servicePerformance.endPerfMetricEvent('frontend', 'iteration')
                 end_time = time.time()
                 elapsed_time = servicePerformance.getPerfMetricEventLifetime('frontend', 'iteration')
@@ -390,6 +566,11 @@ def spawn(sleep_time, advertize_rate, work_dir, frontendDescript,
 
 
     finally:
+        if workers:
+            logSupport.log.info("Stopping the group workers")
+            for group in workers:
+                workers[group].stop()
+
         # We have been asked to terminate
         logSupport.log.info("Deadvertize my ads")
         spawn_cleanup(work_dir, frontendDescript, groups,
@@ -534,7 +715,9 @@ def main(work_dir, action):
         max_parallel_workers = int(frontendDescript.data['GroupParallelWorkers'])
         restart_attempts = int(frontendDescript.data['RestartAttempts'])
         restart_interval = int(frontendDescript.data['RestartInterval'])
-
+        glideinFrontendInterface.frontendConfig.advertise_batch_size = int(frontendDescript.data.get('AdvertiseBatchSize', '0'))
+        # not in the descript files created by older versions
+        group_worker_mode = frontendDescript.data.get('GroupWorkerMode', 'spawn')
 
         groups = sorted(frontendDescript.data['Groups'].split(','))
 
@@ -547,6 +730,7 @@ def main(work_dir, action):
         frontendDescript, os.path.join(work_dir, 'monitor/'))
     
     logSupport.log.info("Enabled groups: %s" % groups)
+    logSupport.log.info("Group worker mode: %s" % group_worker_mode)
 
     # create lock file
     pid_obj = glideinFrontendPidLib.FrontendPidSupport(work_dir)
@@ -564,7 +748,7 @@ def main(work_dir, action):
             if action == "run":
                 spawn(sleep_time, advertize_rate, work_dir,
                       frontendDescript, groups, max_parallel_workers,
-                      restart_interval, restart_attempts)
+                      restart_interval, restart_attempts, group_worker_mode)
             elif action in ('removeWait', 'removeIdle', 'removeAll', 'removeWaitExcess', 'removeIdleExcess', 'removeAllExcess'):
                 spawn_removal(work_dir, frontendDescript, groups,
                               max_parallel_workers, action)
@@ -13,6 +13,8 @@
 #   $2 = work dir
 #   $3 = group_name
 #   $4 = operation type (optional, defaults to "run")
+#        "worker" starts a resident group process that reads
+#        the operations from stdin (GroupWorkerMode persistent)
 #
 # Author:
 #   Igor Sfiligoi (was glideinFrontend.py until Nov 21, 2008)
@@ -21,6 +23,8 @@
 import signal
 import sys
 import os
+import errno
+import select
 import copy
 import traceback
 import time
@@ -32,20 +36,24 @@ sys.path.append(os.path.join(sys.path[0], "../.."))
 
 from glideinwms.lib import symCrypto, pubCrypto
 from glideinwms.lib import logSupport
+from glideinwms.lib import classadSupport
 from glideinwms.lib import cleanupSupport
 from glideinwms.lib.util import safe_boolcomp
 from glideinwms.lib import servicePerformance
 from glideinwms.lib.fork import fork_in_bg, wait_for_pids
-from glideinwms.lib.fork import ForkManager
+from glideinwms.lib.fork import fetch_fork_result, FetchError
+from glideinwms.lib.fork import ForkManager, ForkPoolManager
 from glideinwms.lib.pidSupport import register_sighandler
 
 from glideinwms.frontend import glideinFrontendConfig
 from glideinwms.frontend import glideinFrontendInterface
 from glideinwms.frontend import glideinFrontendLib
+from glideinwms.frontend import glideinFrontendMatch
 from glideinwms.frontend import glideinFrontendPidLib
 from glideinwms.frontend import glideinFrontendMonitoring
 from glideinwms.frontend import glideinFrontendPlugins
 from glideinwms.frontend import glideinFrontendDowntimeLib
+from glideinwms.frontend import glideinFrontendSnapshot
 
 
 ###########################################################
@@ -171,6 +179,8 @@ class glideinFrontendElement:
         self.request_removal_wtype = None
         self.request_removal_excess_only = False
         self.ha_mode = glideinFrontendLib.getHAMode(self.elementDescript.frontend_data)
+        # Return the query results stored by attribute from the query processes
+        self.compact_query_results = self.elementDescript.frontend_data.get('CompactQueryResults', 'False') == 'True'
 
         # Initializing some monitoring variables
         self.count_real_jobs = {}
@@ -206,8 +216,12 @@ class glideinFrontendElement:
         # logSupport.log.info("Logging initialized")
 
         glideinFrontendMonitoring.monitoringConfig.monitor_dir = glideinFrontendConfig.get_group_dir(os.path.join(self.work_dir, "monitor"), self.group_name)
+        if self.elementDescript.frontend_data.get('RRDWriteBehind', 'False') == 'True':
+            glideinFrontendMonitoring.monitoringConfig.use_rrd_write_behind()
+        servicePerformance.enableTracing(self.elementDescript.frontend_data.get('SpanTrace', 'False') == 'True')
         glideinFrontendInterface.frontendConfig.advertise_use_tcp = (self.elementDescript.frontend_data['AdvertiseWithTCP'] in ('True', '1'))
         glideinFrontendInterface.frontendConfig.advertise_use_multi = (self.elementDescript.frontend_data['AdvertiseWithMultiple'] in ('True', '1'))
+        glideinFrontendInterface.frontendConfig.advertise_batch_size = int(self.elementDescript.frontend_data.get('AdvertiseBatchSize', '0'))
 
         if self.elementDescript.merged_data['Proxies']:
             proxy_plugins = glideinFrontendPlugins.proxy_plugins
@@ -278,6 +292,23 @@ class glideinFrontendElement:
         return rc
 
 
+    def reset_iteration(self, action):
+        """Prepare a resident element for a new iteration
+
+        In spawn mode each iteration starts with a new element,
+        this resets the state that iterate() expects to be fresh.
+
+        :param action: operation type of the next iteration
+        """
+        self.action = action
+        self.request_removal_wtype = None
+        self.request_removal_excess_only = False
+        self.count_real_jobs = {}
+        self.count_real_glideins = {}
+        self.history_obj['perf_metrics'] = {}
+        servicePerformance.resetPerfMetric(self.group_name)
+
+
     def iterate(self):
         self.stats = {'group': glideinFrontendMonitoring.groupStats()}
 
@@ -294,7 +325,8 @@ class glideinFrontendElement:
         if self.action == "run":
             logSupport.log.info("Iteration at %s" % time.ctime())
 
-            done_something = self.iterate_one()
+            with servicePerformance.TraceSpan('iteration'):
+                done_something = self.iterate_one()
             logSupport.log.info("iterate_one status: %s" % str(done_something))
 
             logSupport.log.info("Writing stats")
@@ -310,6 +342,8 @@ class glideinFrontendElement:
                 # never fail for stats reasons!
                 logSupport.log.exception("Exception occurred writing stats: " )
             finally:
+                if servicePerformance.isTracingEnabled():
+                    self.write_trace()
                 # Save the history_obj last even in case of exceptions
                 self.history_obj['perf_metrics'] = servicePerformance.getPerfMetric(self.group_name)
                 self.history_obj.save()
@@ -338,6 +372,17 @@ class glideinFrontendElement:
 
         return 0
 
+    def write_trace(self):
+        """Write the spans of the iteration in the trace file and add their rolling percentiles to the performance metrics"""
+        try:
+            self.history_obj['span_durations'] = servicePerformance.summarizeTrace(
+                self.group_name, self.history_obj.get('span_durations'))
+            servicePerformance.writeTraceFile(os.path.join(logSupport.log_dir, 'iteration_trace.json'))
+        except:
+            # never fail for monitoring reasons
+            logSupport.log.exception("Exception occurred writing the trace: ")
+        servicePerformance.resetTrace()
+
     def deadvertiseAllClassads(self):
         # Invalidate all glideclient glideclientglobal classads
         for factory_pool in self.factory_pools:
@@ -366,12 +411,30 @@ class glideinFrontendElement:
         except:
             logSupport.log.warning("Failed to deadvertise resources classads")
 
+        # The Factory has no requests from this group anymore,
+        # the next iteration must advertise all of them
+        self.clear_advertize_delta()
+
 
     def iterate_one(self):
         pipe_ids={}
 
         logSupport.log.info("Querying schedd, entry, and glidein status using child processes.")
 
+        # the frontend builds the snapshot of the next iteration using this
+        query_spec = self.get_query_spec()
+        self.history_obj['query_spec'] = query_spec
+        snapshot = None
+        if self.elementDescript.frontend_data.get('QuerySnapshot', 'False') == 'True':
+            try:
+                snapshot = glideinFrontendSnapshot.GroupSnapshot(self.work_dir, self.frontend_name,
+                                                                 self.group_name, query_spec)
+                logSupport.log.info("Using the frontend snapshot for %i schedds%s" % (
+                    len(snapshot.schedds), snapshot.has_status() and " and the user collector" or ""))
+            except:
+                logSupport.log.exception("Failed to load the frontend snapshot, querying HTCondor directly: ")
+                snapshot = None
+
         forkm_obj = ForkManager()
 
         # query globals and entries
@@ -382,18 +445,27 @@ class glideinFrontendElement:
 
         ## schedd
         idx=0
+        nr_schedd_queries = 0
         for schedd_name in self.elementDescript.merged_data['JobSchedds']:
             idx+=1
+            if snapshot and snapshot.has_schedd(schedd_name):
+                continue
             forkm_obj.add_fork(('schedd', idx), self.get_condor_q, schedd_name)
+            nr_schedd_queries += 1
 
         ## resource
-        forkm_obj.add_fork(('collector', 0), self.get_condor_status)
+        if not (snapshot and snapshot.has_status()):
+            forkm_obj.add_fork(('collector', 0), self.get_condor_status)
+        servicePerformance.setPerfMetricCounter(self.group_name, 'condor_q_queries', nr_schedd_queries)
+        servicePerformance.setPerfMetricCounter(self.group_name, 'condor_status_queries',
+                                                not (snapshot and snapshot.has_status()) and 1 or 0)
 
         logSupport.log.debug("%i child query processes started"%len(forkm_obj))
         try:
             servicePerformance.startPerfMetricEvent(
                 self.group_name, 'condor_queries')
-            pipe_out=forkm_obj.fork_and_collect()
+            with servicePerformance.TraceSpan('condor_queries'):
+                pipe_out=forkm_obj.fork_and_collect()
             servicePerformance.endPerfMetricEvent(
                 self.group_name, 'condor_queries')
         except RuntimeError as e:
@@ -428,7 +500,12 @@ class glideinFrontendElement:
             # collector dealt with outside the loop because there is only one
             # nothing else left
 
-        (self.status_dict, self.fe_counts, self.global_counts, self.status_schedd_dict) = pipe_out[('collector', 0)]
+        if snapshot:
+            self.condorq_dict.update(snapshot.condorq_dict)
+        if snapshot and snapshot.has_status():
+            (self.status_dict, self.fe_counts, self.global_counts, self.status_schedd_dict) = self.get_condor_status_snapshot(snapshot)
+        else:
+            (self.status_dict, self.fe_counts, self.global_counts, self.status_schedd_dict) = pipe_out[('collector', 0)]
 
         # M2Crypto objects are not picklable, so do the transforamtion here
         self.populate_pubkey()
@@ -535,7 +612,8 @@ class glideinFrontendElement:
         self.condorq_match_list = [f[0] for f in self.elementDescript.merged_data['JobMatchAttrs']]
 
         servicePerformance.startPerfMetricEvent(self.group_name, 'matchmaking')
-        self.do_match()
+        with servicePerformance.TraceSpan('matchmaking'):
+            self.do_match()
         servicePerformance.endPerfMetricEvent(self.group_name, 'matchmaking')
 
         logSupport.log.info("Total matching idle %i (old 10min %i 60min %i) running %i limit %i" % (
@@ -560,6 +638,9 @@ class glideinFrontendElement:
 
         # Add glidein config limits to the glideclient classads
         advertizer.set_glidein_config_limits(self.glidein_config_limits)
+        # Advertise only the requests that changed
+        delta_cache = self.load_advertize_delta()
+        advertizer.set_delta_cache(delta_cache)
 
         glideid_list = sorted(condorq_dict_types['Idle']['count'].keys())
         # TODO: PM Following shows up in branch_v2plus. Which is correct?
@@ -806,6 +887,7 @@ class glideinFrontendElement:
         self.log_and_print_unmatched(total_down_stats_arr)
 
         pids = []
+        ad_pids = []
         # Advertise glideclient and glideclient global classads
         ad_file_id_cache = glideinFrontendInterface.CredentialCache()
         advertizer.renew_and_load_credentials()
@@ -822,15 +904,26 @@ class glideinFrontendElement:
                                                            create_files_only=True, reset_unique_id=False)
                 s_ads = advertizer.do_advertize_one(ad_factname, ad_file_id_cache,
                                                     adname=adname, create_files_only=True, reset_unique_id=False)
-                pids.append(fork_in_bg(advertizer.do_advertize_batch_one, ad_factname, tuple(set(g_ads)|set(s_ads))))
+                ad_files = tuple(set(g_ads)|set(s_ads))
+                ad_pids.append((fork_in_bg(advertizer.do_advertize_batch_one, ad_factname, ad_files), ad_files))
 
         del ad_file_id_cache
+        delta_cache.log_stats(glideinFrontendInterface.frontendConfig.client_id)
 
         # Advertise glideresource classads
         logSupport.log.info("Advertising %i glideresource classads to the user pool" % len(resource_advertiser.classads))
         pids.append(fork_in_bg(resource_advertiser.advertiseAllClassads))
 
-        wait_for_pids(pids)
+        with servicePerformance.TraceSpan('advertize_wait'):
+            for ad_pid, ad_files in ad_pids:
+                try:
+                    failed_files = fetch_fork_result(ad_pid['r'], ad_pid['pid'])
+                except FetchError:
+                    failed_files = ad_files
+                advertizer.mark_advertized(ad_files, failed_files)
+            wait_for_pids(pids)
+        self.history_obj['advertize_delta'] = delta_cache.get_state()
+        self.history_obj['advertize_delta_parent_pid'] = self.parent_pid
         logSupport.log.info("Done advertising")
         servicePerformance.endPerfMetricEvent(self.group_name, 'advertize_classads')
 
@@ -913,54 +1006,11 @@ class glideinFrontendElement:
 
 
     def populate_condorq_dict_types(self):
-        # create a dictionary that does not contain the blacklisted schedds
-        good_condorq_dict=self.condorq_dict.copy() #simple copy enough, will only modify keys
-        for k in self.blacklist_schedds:
-            if k in good_condorq_dict: # some schedds may not have returned anything
-                del good_condorq_dict[k]
-        # use only the good schedds when considering idle
-        condorq_dict_idle = glideinFrontendLib.getIdleCondorQ(good_condorq_dict)
-        condorq_dict_idle_600 = glideinFrontendLib.getOldCondorQ(condorq_dict_idle, 600)
-        condorq_dict_idle_3600 = glideinFrontendLib.getOldCondorQ(condorq_dict_idle, 3600)
-        condorq_dict_proxy = glideinFrontendLib.getIdleProxyCondorQ(condorq_dict_idle)
-        condorq_dict_voms = glideinFrontendLib.getIdleVomsCondorQ(condorq_dict_idle)
-
-        # then report how many we really had
-        condorq_dict_idle_all = glideinFrontendLib.getIdleCondorQ(self.condorq_dict)
-
-        self.condorq_dict_running = glideinFrontendLib.getRunningCondorQ(self.condorq_dict)
-
-        self.condorq_dict_types = {
-            'IdleAll': {
-                'dict':condorq_dict_idle_all,
-                'abs':glideinFrontendLib.countCondorQ(condorq_dict_idle_all)
-            },
-            'Idle': {
-                'dict':condorq_dict_idle,
-                'abs':glideinFrontendLib.countCondorQ(condorq_dict_idle)
-            },
-            #idle 600s or more
-            'OldIdle': {
-                'dict':condorq_dict_idle_600,
-                'abs':glideinFrontendLib.countCondorQ(condorq_dict_idle_600)
-            },
-            #idle 3600s or more
-            'Idle_3600': {
-                'dict':condorq_dict_idle_3600,
-                'abs':glideinFrontendLib.countCondorQ(condorq_dict_idle_3600)
-            },
-            'VomsIdle': {
-                'dict':condorq_dict_voms,
-                'abs':glideinFrontendLib.countCondorQ(condorq_dict_voms)},
-            'ProxyIdle': {
-                'dict':condorq_dict_proxy,
-                'abs':glideinFrontendLib.countCondorQ(condorq_dict_proxy)
-            },
-            'Running': {
-                'dict':self.condorq_dict_running,
-                'abs':glideinFrontendLib.countCondorQ(self.condorq_dict_running)
-            }
-        }
+        # one pass over the jobs of each schedd for all the types
+        # the blacklisted schedds are used only in IdleAll and Running
+        self.condorq_dict_types = glideinFrontendLib.classifyCondorQ(self.condorq_dict,
+                                                                     self.blacklist_schedds)
+        self.condorq_dict_running = self.condorq_dict_types['Running']['dict']
 
     def populate_status_dict_types(self):
         # dict with static + pslot
@@ -1017,6 +1067,11 @@ class glideinFrontendElement:
             }
         }
 
+        # Counts of the slots above by request and credential, computed once here
+        # and used by subprocess_count_glidein (in the children) and count_factory_entries_without_classads
+        self.client_status_counts = glideinFrontendLib.countClientCondorStatus(
+            self.status_dict, self.frontend_name, self.group_name)
+
 
     def build_resource_classad(self, this_stats_arr, request_name,
                                glidein_el, glidein_in_downtime,
@@ -1432,23 +1487,8 @@ class glideinFrontendElement:
             if glideid_str in processed_glideid_str_set:
                 continue # already processed... ignore
 
-            self.count_status_multi[request_name]={}
-            for st in self.status_dict_types:
-                c = glideinFrontendLib.getClientCondorStatus(
-                        self.status_dict_types[st]['dict'],
-                        self.frontend_name, self.group_name, request_name)
-                if st in ('TotalCores', 'IdleCores', 'RunningCores'):
-                    self.count_status_multi[request_name][st] = \
-                        glideinFrontendLib.countCoresCondorStatus(c, st)
-                elif st == 'Running':
-                    # Running counts are computed differently because of
-                    # the dict composition. Dict also has p-slots
-                    # corresponding to the dynamic slots
-                    self.count_status_multi[request_name][st] = \
-                        glideinFrontendLib.countRunningCondorStatus(c)
-                else:
-                    self.count_status_multi[request_name][st] = \
-                        glideinFrontendLib.countCondorStatus(c)
+            self.count_status_multi[request_name] = glideinFrontendLib.sumClientCondorStatusCounts(
+                self.client_status_counts.get(request_name, {}))
 
             count_status = self.count_status_multi[request_name]
 
@@ -1618,6 +1658,7 @@ class glideinFrontendElement:
         return glidein_dict
 
 
+    @servicePerformance.TraceSpan('query_factory')
     def query_factory(self, factory_pool):
         """
         Serialize queries to the same factory.
@@ -1627,27 +1668,67 @@ class glideinFrontendElement:
                 self.query_factoryclients(factory_pool))
 
 
+    def get_condorq_format_list(self):
+        condorq_format_list = self.elementDescript.merged_data['JobMatchAttrs']
+        if self.x509_proxy_plugin:
+            condorq_format_list = list(condorq_format_list) + list(self.x509_proxy_plugin.get_required_job_attributes())
+
+        ### Add in elements to help in determining if jobs have voms creds
+        condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFirstFQAN', 's'),))
+        condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFQAN', 's'),))
+        condorq_format_list=list(condorq_format_list)+list((('x509userproxy', 's'),))
+        return condorq_format_list
+
+
+    @servicePerformance.TraceSpan('condor_q')
     def get_condor_q(self, schedd_name):
         condorq_dict = {}
         try:
-            condorq_format_list = self.elementDescript.merged_data['JobMatchAttrs']
-            if self.x509_proxy_plugin:
-                condorq_format_list = list(condorq_format_list) + list(self.x509_proxy_plugin.get_required_job_attributes())
-
-            ### Add in elements to help in determining if jobs have voms creds
-            condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFirstFQAN', 's'),))
-            condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFQAN', 's'),))
-            condorq_format_list=list(condorq_format_list)+list((('x509userproxy', 's'),))
+            condorq_format_list = self.get_condorq_format_list()
             condorq_dict = glideinFrontendLib.getCondorQ(
                                [schedd_name],
                                expand_DD(self.elementDescript.merged_data['JobQueryExpr'], self.attr_dict),
                                condorq_format_list)
+            if self.compact_query_results:
+                for condorq in condorq_dict.values():
+                    condorq.compact()
         except Exception:
             logSupport.log.exception("In query schedd child, exception:")
 
         return condorq_dict
 
 
+    def get_status_format_list(self):
+        # Always get the credential id used to submit the glideins
+        # This is essential for proper accounting info related to running
+        # glideins that have reported back to user pool
+        status_format_list = [
+            ('GLIDEIN_CredentialIdentifier', 's'),
+            ('TotalSlots', 'i'),
+            ('Cpus', 'i'),
+            ('Memory', 'i'),
+            ('PartitionableSlot', 's'),
+            ('SlotType', 's'),
+            ('TotalSlotCpus', 'i'),
+        ]
+
+        if self.x509_proxy_plugin:
+            status_format_list = list(status_format_list) + \
+                                 list(self.x509_proxy_plugin.get_required_classad_attributes())
+        return status_format_list
+
+
+    def get_query_spec(self):
+        """Queries needed by this group, used by the frontend to build
+        the snapshot of the next iteration (see glideinFrontendSnapshot)
+        """
+        return {'schedds': list(self.elementDescript.merged_data['JobSchedds']),
+                'condorq_constraint': expand_DD(self.elementDescript.merged_data['JobQueryExpr'], self.attr_dict),
+                'condorq_format_list': self.get_condorq_format_list(),
+                'status_format_list': self.get_status_format_list()}
+
+
+    @servicePerformance.TraceSpan('condor_status')
     def get_condor_status(self):
 
         # All slots for this group
@@ -1667,22 +1748,7 @@ class glideinFrontendElement:
         #mc_idle_constraint = '(PartitionableSlot=!=True) || (PartitionableSlot=?=True && cpus > 0 && memory > 2500)'
 
         try:
-            # Always get the credential id used to submit the glideins
-            # This is essential for proper accounting info related to running
-            # glideins that have reported back to user pool
-            status_format_list = [
-                ('GLIDEIN_CredentialIdentifier', 's'),
-                ('TotalSlots', 'i'),
-                ('Cpus', 'i'),
-                ('Memory', 'i'),
-                ('PartitionableSlot', 's'),
-                ('SlotType', 's'),
-                ('TotalSlotCpus', 'i'),
-            ]
-
-            if self.x509_proxy_plugin:
-                status_format_list = list(status_format_list) + \
-                                     list(self.x509_proxy_plugin.get_required_classad_attributes())
+            status_format_list = self.get_status_format_list()
 
             # Consider multicore slots with free cpus/memory only
             #constraint = '(GLIDECLIENT_Name=?="%s.%s") && (%s)' % (
@@ -1697,6 +1763,10 @@ class glideinFrontendElement:
                               [None],
                               constraint=constraint,
                               format_list=status_format_list)
+            if self.compact_query_results:
+                # status_schedd_dict is updated below, keep it as dictionaries
+                for status in status_dict.values():
+                    status.compact()
 
             # Also get all the classads for the whole FE for counting
             # do it in the same thread, as we are hitting the same collector
@@ -1792,6 +1862,28 @@ class glideinFrontendElement:
         return (status_dict, fe_counts, global_counts, status_schedd_dict)
 
 
+    def get_condor_status_snapshot(self, snapshot):
+        """Same as get_condor_status, using the classads in the frontend snapshot"""
+        (status_dict, fe_status_dict, global_status_dict,
+         status_schedd_dict, status_curb_schedd_dict) = snapshot.get_status_dicts()
+        fe_counts = {
+            'Idle': glideinFrontendLib.countCondorStatus(
+                glideinFrontendLib.getIdleCondorStatus(fe_status_dict)),
+            'Total': glideinFrontendLib.countCondorStatus(fe_status_dict)
+        }
+        global_counts = {
+            'Idle': glideinFrontendLib.countCondorStatus(
+                glideinFrontendLib.getIdleCondorStatus(global_status_dict)),
+            'Total': glideinFrontendLib.countCondorStatus(global_status_dict)
+        }
+        for c in status_curb_schedd_dict:
+            c_curb_schedd_dict = status_curb_schedd_dict[c].fetchStored()
+            for schedd in c_curb_schedd_dict:
+                if schedd in status_schedd_dict[c].fetchStored():
+                    status_schedd_dict[c].stored_data[schedd]['CurbMatchmaking'] = 'True'
+        return (status_dict, fe_counts, global_counts, status_schedd_dict)
+
+
     def do_match(self):
         """Do the actual matching.  This forks subprocess_count as children
         to do the work in parallel. """
@@ -1805,7 +1897,11 @@ class glideinFrontendElement:
         # the result is a list of lists
         split_glidein_list = [glidein_list[i:i+glideins_per_fork] for i in range(0, len(glidein_list), glideins_per_fork)]
 
-        forkm_obj = ForkManager()
+        # Results of the previous iterations, the subprocesses return the new ones
+        self.match_memo = self.load_match_memo()
+
+        # The counting functions have no side effects, a pool of max_matchmakers workers can run all of them
+        forkm_obj = ForkPoolManager()
 
         for i in range(len(split_glidein_list)):
             forkm_obj.add_fork(('Glidein', i), self.subprocess_count_glidein, split_glidein_list[i])
@@ -1826,8 +1922,12 @@ class glideinFrontendElement:
         logSupport.log.info("All children terminated - took %s seconds" % t_end)
 
         for dt, el in self.condorq_dict_types.iteritems():
-            # c, p, h, pmc, t returned by  subprocess_count_dt(self, dt)
-            (el['count'], el['prop'], el['hereonly'], el['prop_mc'], el['total']) = pipe_out[dt]
+            # c, p, h, pmc, t, memo update returned by  subprocess_count_dt(self, dt)
+            (el['count'], el['prop'], el['hereonly'], el['prop_mc'], el['total'], memo_update) = pipe_out[dt]
+            if memo_update is not None:
+                self.match_memo.merge_update(memo_update)
+        if self.match_memo is not None:
+            self.save_match_memo()
 
         (self.count_real_jobs, self.count_real_glideins) = pipe_out['Real']
         self.count_status_multi = {}
@@ -1845,11 +1945,83 @@ class glideinFrontendElement:
             self.glexec=self.elementDescript.merged_data['GLIDEIN_Glexec_Use']
 
 
+    def load_advertize_delta(self):
+        """Return the fingerprints of the requests advertised in the previous iterations, saved in the history file
+
+        @return: classadSupport.ClassadDeltaCache, always advertising if AdvertiseRefreshInterval is 0
+        """
+        refresh_interval = int(self.elementDescript.frontend_data.get('AdvertiseRefreshInterval', '0'))
+        state = None
+        # The state saved before the Frontend (re)started is not used:
+        # the Factory may have dropped the requests in the meantime (e.g. deadvertised at shutdown)
+        if self.history_obj.get('advertize_delta_parent_pid') == self.parent_pid:
+            state = self.history_obj.get('advertize_delta')
+        return classadSupport.ClassadDeltaCache.from_state(state, refresh_interval)
+
+    def clear_advertize_delta(self):
+        """Forget the requests advertised in the previous iterations, e.g. after invalidating them in the Factory collector
+        The history file is saved, so that also a new group process advertises all the requests
+        """
+        for key in ('advertize_delta', 'advertize_delta_parent_pid'):
+            if key in self.history_obj:
+                del self.history_obj[key]
+        self.history_obj.save()
+
+    def load_match_memo(self):
+        """Return the match memo (MatchMemoSize option) saved in the history file
+
+        @return: glideinFrontendMatch.MatchMemo, None if disabled
+        """
+        memo_size = int(self.elementDescript.frontend_data.get('MatchMemoSize', '0'))
+        if memo_size <= 0:
+            if 'match_memo' in self.history_obj:
+                del self.history_obj['match_memo']
+            return None
+        version = glideinFrontendMatch.get_match_version(
+            self.elementDescript.merged_data['MatchExpr'],
+            self.elementDescript.merged_data['MatchPolicyModules'],
+            self.attr_dict)
+        if version is None:
+            logSupport.log.warning("Cannot read the match policy files, not using the match memo")
+            return None
+        ignored_names = glideinFrontendMatch.get_memo_ignored_names(
+            self.elementDescript.merged_data['MatchExpr'],
+            self.elementDescript.merged_data['MatchPolicyModules'])
+        if ignored_names:
+            # the results would depend on values changing at every iteration
+            logSupport.log.warning("The match expression or the match policies use %s, not using the match memo" %
+                                   ", ".join(ignored_names))
+            if 'match_memo' in self.history_obj:
+                del self.history_obj['match_memo']
+            return None
+        return glideinFrontendMatch.MatchMemo.from_state(self.history_obj.get('match_memo'),
+                                                         memo_size, version)
+
+    def save_match_memo(self):
+        """Save the match memo in the history file and add the hit ratio to the performance metrics"""
+        memo = self.match_memo
+        # jobs no more in the queues
+        # nothing seen if nothing was matched (e.g. no entries), keep all the results
+        if memo.seen_clusters:
+            memo.prune(memo.seen_clusters)
+        self.history_obj['match_memo'] = memo.get_state()
+        nr_lookups = memo.hits + memo.misses
+        hit_ratio = 0.0
+        if nr_lookups > 0:
+            hit_ratio = float('%.3f' % (float(memo.hits) / nr_lookups))
+        logSupport.log.info("Match memo: %i hits, %i misses, %i results remembered" %
+                            (memo.hits, memo.misses, memo.size))
+        servicePerformance.setPerfMetricCounter(self.group_name, 'match_memo_hits', memo.hits)
+        servicePerformance.setPerfMetricCounter(self.group_name, 'match_memo_misses', memo.misses)
+        servicePerformance.setPerfMetricCounter(self.group_name, 'match_memo_hit_ratio', hit_ratio)
+
+    @servicePerformance.TraceSpan('count_match')
     def subprocess_count_dt(self, dt):
         """Make match calculations of glideins matching entries (invoked in parallel)
 
         @param dt: index within the data dictionary
-        @return: Tuple of 5 elements: count, prop, hereonly, prop_mc, total
+        @return: Tuple of 6 elements: count, prop, hereonly, prop_mc, total,
+            match memo update (None if the memo is not used)
         """
 
         out = ()
@@ -1862,6 +2034,8 @@ class glideinFrontendElement:
                         self.ignore_down_entries,
                         self.condorq_match_list,
                         match_policies=self.elementDescript.merged_data['MatchPolicyModules'],
+                        match_expr=self.elementDescript.merged_data['MatchExpr'],
+                        match_memo=self.match_memo,
 # This is the line to enable if you want the frontend to dump data structures during countMatch
 # You can then use the profile_frontend.py script to execute the countMatch function with real data
 # Data will be saved into /tmp/frontend_dump/ . Make sure to create the dir beforehand.
@@ -1869,10 +2043,15 @@ class glideinFrontendElement:
                         )
         t=glideinFrontendLib.countCondorQ(self.condorq_dict_types[dt]['dict'])
 
-        out = (c, p, h, pmc, t)
+        memo_update = None
+        if self.match_memo is not None:
+            memo_update = self.match_memo.get_update()
+
+        out = (c, p, h, pmc, t, memo_update)
 
         return out
 
+    @servicePerformance.TraceSpan('count_real_running')
     def subprocess_count_real(self):
         # will make calculations in parallel,using multiple processes
         out = glideinFrontendLib.countRealRunning(
@@ -1884,6 +2063,7 @@ class glideinFrontendElement:
                   match_policies=self.elementDescript.merged_data['MatchPolicyModules'])
         return out
 
+    @servicePerformance.TraceSpan('count_glideins')
     def subprocess_count_glidein(self, glidein_list):
         """
         Will make calculations in parallel, using multiple processes
@@ -1898,59 +2078,168 @@ class glideinFrontendElement:
         for glideid in glidein_list:
             request_name=glideid[1]
 
-            count_status_multi[request_name]={}
+            # Counts from the index built once in populate_status_dict_types,
+            # no scan of the status dictionaries for each request and credential
+            req_counts = self.client_status_counts.get(request_name, {})
+            count_status_multi[request_name] = glideinFrontendLib.sumClientCondorStatusCounts(req_counts)
             count_status_multi_per_cred[request_name] = {}
             for cred in self.x509_proxy_plugin.cred_list:
-                count_status_multi_per_cred[request_name][cred.getId()] = {}
-
-            # It is cheaper to get Idle and Running from request-only
-            # classads then filter out requests from Idle and Running
-            # glideins
-            total_req_dict = glideinFrontendLib.getClientCondorStatus(
-                        self.status_dict_types['Total']['dict'],
-                        self.frontend_name, self.group_name, request_name)
-
-            req_dict_types = {
-                'Total': total_req_dict,
-                'Idle': glideinFrontendLib.getIdleCondorStatus(total_req_dict),
-                'Running': glideinFrontendLib.getRunningCondorStatus(total_req_dict),
-                'Failed': glideinFrontendLib.getFailedCondorStatus(total_req_dict),
-                'TotalCores': glideinFrontendLib.getCondorStatusNonDynamic(total_req_dict),
-                'IdleCores': glideinFrontendLib.getIdleCoresCondorStatus(total_req_dict),
-                'RunningCores': glideinFrontendLib.getRunningCoresCondorStatus(total_req_dict),
-            }
-
-            for st in req_dict_types:
-                req_dict = req_dict_types[st]
-                if st in ('TotalCores', 'IdleCores', 'RunningCores'):
-                    count_status_multi[request_name][st]=glideinFrontendLib.countCoresCondorStatus(req_dict, st)
-                elif st == 'Running':
-                    # Running counts are computed differently because of
-                    # the dict composition. Dict also has p-slots
-                    # corresponding to the dynamic slots
-                    count_status_multi[request_name][st] = \
-                        glideinFrontendLib.countRunningCondorStatus(req_dict)
-                else:
-                    count_status_multi[request_name][st]=glideinFrontendLib.countCondorStatus(req_dict)
-
-                for cred in self.x509_proxy_plugin.cred_list:
-                    cred_id=cred.getId()
-                    cred_dict = glideinFrontendLib.getClientCondorStatusCredIdOnly(req_dict, cred_id)
-
-                    if st in ('TotalCores', 'IdleCores', 'RunningCores'):
-                        count_status_multi_per_cred[request_name][cred_id][st] = glideinFrontendLib.countCoresCondorStatus(cred_dict, st)
-                    elif st == 'Running':
-                        # Running counts are computed differently because of
-                        # the dict composition. Dict also has p-slots
-                        # corresponding to the dynamic slots
-                        count_status_multi_per_cred[request_name][cred_id][st] = glideinFrontendLib.countRunningCondorStatus(cred_dict)
-                    else:
-                        count_status_multi_per_cred[request_name][cred_id][st] = glideinFrontendLib.countCondorStatus(cred_dict)
+                cred_id = cred.getId()
+                count_status_multi_per_cred[request_name][cred_id] = \
+                    glideinFrontendLib.sumClientCondorStatusCounts(req_counts, [cred_id])
 
         out = (count_status_multi, count_status_multi_per_cred)
 
         return out
 
+############################################################
+#
+# Resident group process (GroupWorkerMode persistent)
+#
+# glideinFrontend sends one operation type per line on stdin,
+# the worker answers with one line on stdout at the end of each operation:
+#   WORKER_RESULT_PREFIX exit_code wall_time cpu_time
+# Closing stdin or sending WORKER_EXIT terminates the worker
+#
+############################################################
+
+WORKER_RESULT_PREFIX = "GWMS_WORKER_RESULT"
+WORKER_EXIT = "exit"
+# seconds between checks of the parent while waiting for an operation
+WORKER_PARENT_CHECK = 60
+
+
+class ElementWorker:
+    """Keeps a glideinFrontendElement between iterations
+
+    The configuration, logging and credentials are loaded once and reloaded
+    only on SIGHUP or when one of the configuration files changes.
+    """
+    def __init__(self, parent_pid, work_dir, group_name):
+        self.parent_pid = parent_pid
+        self.work_dir = work_dir
+        self.group_name = group_name
+
+        self.element = None
+        self.config_mtimes = {}
+        self.reload_requested = False
+        self.in_buffer = ''
+
+    def config_files(self):
+        """List of the files the element configuration is loaded from"""
+        cfg = glideinFrontendConfig.frontendConfig
+        group_dir = glideinFrontendConfig.get_group_dir(self.work_dir, self.group_name)
+        return [os.path.join(self.work_dir, cfg.frontend_descript_file),
+                os.path.join(self.work_dir, cfg.params_descript_file),
+                os.path.join(self.work_dir, cfg.attrs_descript_file),
+                os.path.join(self.work_dir, cfg.signature_descript_file),
+                os.path.join(group_dir, cfg.group_descript_file),
+                os.path.join(group_dir, cfg.params_descript_file),
+                os.path.join(group_dir, cfg.attrs_descript_file)]
+
+    def get_config_mtimes(self):
+        mtimes = {}
+        for fname in self.config_files():
+            try:
+                mtimes[fname] = os.stat(fname).st_mtime
+            except OSError:
+                mtimes[fname] = None
+        return mtimes
+
+    def config_changed(self):
+        return self.reload_requested or (self.get_config_mtimes() != self.config_mtimes)
+
+    def load(self):
+        """(Re)create and configure the element"""
+        if self.element is not None:
+            # configure() adds new log handlers, drop the old ones
+            group_log = logging.getLogger(self.group_name)
+            for handler in group_log.handlers[:]:
+                group_log.removeHandler(handler)
+                handler.close()
+                if handler in logSupport.handlers:
+                    logSupport.handlers.remove(handler)
+        self.reload_requested = False
+        self.config_mtimes = self.get_config_mtimes()
+        self.element = glideinFrontendElement(self.parent_pid, self.work_dir,
+                                              self.group_name, "run")
+        self.element.configure()
+        logSupport.log.info("Group worker configuration loaded")
+
+    def hupsignal(self, signr, frame):
+        self.reload_requested = True
+
+    def read_action(self):
+        """Wait for the next operation from the parent
+
+        :return: the operation type, None if the parent closed the pipe
+        """
+        fd = sys.stdin.fileno()
+        while '\n' not in self.in_buffer:
+            try:
+                ready = select.select([fd], [], [], WORKER_PARENT_CHECK)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue  # e.g. SIGHUP
+                raise
+            if not ready:
+                check_parent(self.parent_pid)
+                continue
+            data = os.read(fd, 4096)
+            if not data:
+                return None
+            self.in_buffer += data
+        line, self.in_buffer = self.in_buffer.split('\n', 1)
+        return line.strip()
+
+    def run_action(self, action):
+        """Run one iteration of the element
+
+        :return: tuple (exit code, wall time, CPU time including the query children)
+        """
+        if self.config_changed():
+            logSupport.log.info("Group configuration changed, reloading")
+            self.load()
+        start_time = time.time()
+        start_cpu = sum(os.times()[:4])
+        self.element.reset_iteration(action)
+        try:
+            rc = self.element.iterate()
+        except KeyboardInterrupt:
+            raise
+        except:
+            logSupport.log.exception("Unhandled exception in %s iteration: " % action)
+            rc = 2
+        return rc, time.time() - start_time, sum(os.times()[:4]) - start_cpu
+
+    def main(self):
+        signal.signal(signal.SIGHUP, self.hupsignal)
+        pid_obj = glideinFrontendPidLib.ElementPidSupport(self.work_dir,
+                                                          self.group_name)
+        rc = 0
+        pid_obj.register(self.parent_pid)
+        try:
+            self.load()
+            while True:
+                action = self.read_action()
+                if (action is None) or (action == WORKER_EXIT):
+                    break
+                rc, wall_time, cpu_time = self.run_action(action)
+                sys.stdout.write("%s %i %.3f %.3f\n" % (WORKER_RESULT_PREFIX, rc, wall_time, cpu_time))
+                sys.stdout.flush()
+            rc = 0
+        except KeyboardInterrupt:
+            logSupport.log.info("Received signal...exit")
+            rc = 1
+        except:
+            logSupport.log.exception("Unhandled exception, dying: ")
+            rc = 2
+        finally:
+            pid_obj.relinquish()
+
+        return rc
+
+
 ############################################################
 def check_parent(parent_pid):
     if os.path.exists('/proc/%s' % parent_pid):
@@ -1963,6 +2252,8 @@ def check_parent(parent_pid):
 def write_stats(stats):
     for k in stats.keys():
         stats[k].write_file();
+    # no-op unless the RRD updates are written behind
+    glideinFrontendMonitoring.monitoringConfig.flush_rrd()
 
 ############################################################
 # Will log the factory_stat_arr (tuple composed of 17 numbers)
@@ -2028,9 +2319,13 @@ if __name__ == '__main__':
         action = "run"
     else:
         action = sys.argv[4]
-    gfe = glideinFrontendElement(int(sys.argv[1]), sys.argv[2],
-                                 sys.argv[3], action)
-    rcm = gfe.main()
+    if action == "worker":
+        rcm = ElementWorker(int(sys.argv[1]), sys.argv[2],
+                            sys.argv[3]).main()
+    else:
+        gfe = glideinFrontendElement(int(sys.argv[1]), sys.argv[2],
+                                     sys.argv[3], action)
+        rcm = gfe.main()
 
     # explicitly exit with 0
     # this allows for reliable checking
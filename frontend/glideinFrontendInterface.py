@@ -19,6 +19,7 @@ import calendar
 import time
 import string
 import re
+import cStringIO
 
 STARTUP_DIR = sys.path[0]
 sys.path.append(os.path.join(STARTUP_DIR, "../lib"))
@@ -86,6 +87,8 @@ class FrontendConfig:
         self.advertise_use_tcp = False
         # Should we use the new -multiple for condor_advertise?
         self.advertise_use_multi = False
+        # Max number of classads per update when advertising with the python bindings (0 for all)
+        self.advertise_batch_size = 0
 
         self.condor_reserved_names = ("MyType", "TargetType", "GlideinMyType", "MyAddress", 'UpdatesHistory', 'UpdatesTotal', 'UpdatesLost', 'UpdatesSequenced', 'UpdateSequenceNumber', 'DaemonStartTime')
 
@@ -721,6 +724,9 @@ class MultiAdvertizeWork:
         self.x509_proxies_data = []
         self.ha_mode = 'master'
         self.glidein_config_limits = {}
+        # delta advertisement, see set_delta_cache
+        self.delta_cache = None
+        self.delta_fingerprints = {}     # file name -> fingerprints of the classads in the file
 
     # add a request to the list
     def add(self,
@@ -823,13 +829,52 @@ class MultiAdvertizeWork:
         """
         Advertize to a factory the clasad files provided
         Safe to run in parallel, guaranteed to not modify the self object state.
+        Returns the list of files that failed to be advertised (see mark_advertized).
         """
+        failed_files = []
         # Advertize all the files 
         for filename in filename_arr:
+            if not os.path.exists(filename):
+                # all the classads were unchanged (delta advertisement) or skipped
+                continue
             try:
                 advertizeWorkFromFile(factory_pool, filename, remove_file=remove_files, is_multi=frontendConfig.advertise_use_multi)
             except condorExe.ExeError:
                 logSupport.log.exception("Advertising failed for factory pool %s: " % factory_pool)
+                failed_files.append(filename)
+        return failed_files
+
+    def set_delta_cache(self, delta_cache):
+        """
+        Advertise only the requests changed since the last advertisement
+        (classadSupport.ClassadDeltaCache, None to advertise all of them).
+        The fingerprints are computed before encryption, since the symmetric key changes between iterations.
+        """
+        self.delta_cache = delta_cache
+
+    def is_changed(self, ad_type, classad_name, fname, *content):
+        """
+        Check if the classad must be advertised and, if so, remember its fingerprint
+        until the file is advertised (see mark_advertized)
+        """
+        if self.delta_cache is None:
+            return True
+        key = (ad_type, classad_name)
+        fingerprint = self.delta_cache.fingerprint(*content)
+        if not self.delta_cache.is_changed(key, fingerprint):
+            return False
+        self.delta_fingerprints.setdefault(fname, {})[key] = fingerprint
+        return True
+
+    def mark_advertized(self, filename_arr, failed_files=()):
+        """
+        Remember the classads in the files advertised successfully, so that they are
+        not advertised again until they change
+        """
+        for filename in filename_arr:
+            fingerprints = self.delta_fingerprints.pop(filename, {})
+            if (self.delta_cache is not None) and (filename not in failed_files):
+                self.delta_cache.mark_sent(fingerprints)
 
     def get_advertize_factory_list(self):
         return tuple(set(self.global_pool).union(set(self.factory_queue.keys())))
@@ -875,8 +920,10 @@ class MultiAdvertizeWork:
         for filename in filename_arr:
             try:
                 advertizeWorkFromFile(factory_pool, filename, remove_file=True, is_multi=frontendConfig.advertise_use_multi)
+                self.mark_advertized([filename])
             except condorExe.ExeError:
                 logSupport.log.exception("Advertising globals failed for factory pool %s: " % factory_pool)
+                self.mark_advertized([filename], [filename])
         return [] # no files left to be advertised
     
     def createGlobalAdvertizeWorkFile(self, factory_pool):
@@ -892,7 +939,7 @@ class MultiAdvertizeWork:
 
             tmpname=self.adname
             glidein_params_to_encrypt={}
-            fd=file(tmpname, "a")
+            fd=cStringIO.StringIO()
             nr_credentials=len(self.x509_proxies_data)
             if nr_credentials>0:
                 glidein_params_to_encrypt['NumberOfCredentials']="%s"%nr_credentials
@@ -923,6 +970,11 @@ class MultiAdvertizeWork:
 
             if (factory_pool in self.global_key):
                 key_obj=self.global_key[factory_pool]
+            # the encrypted values change with the key, use the clear ones for the delta advertisement
+            if not self.is_changed(frontendConfig.client_global, classad_name, tmpname,
+                                   fd.getvalue(), glidein_params_to_encrypt,
+                                   key_obj is not None and key_obj.factory_pub_key_id):
+                return []
             if key_obj is not None:
                 fd.write(string.join(key_obj.get_key_attrs(), '\n')+"\n")
                 for attr in glidein_params_to_encrypt.keys():
@@ -939,7 +991,11 @@ class MultiAdvertizeWork:
  
             # add a final empty line... useful when appending
             fd.write('\n')
-            fd.close()
+            ad_fd=file(tmpname, "a")
+            try:
+                ad_fd.write(fd.getvalue())
+            finally:
+                ad_fd.close()
 
             return [tmpname]
 
@@ -1012,10 +1068,15 @@ class MultiAdvertizeWork:
 
             # Else, advertize all the files (if multi, should only be one) 
             for filename in filename_arr:
+                if not os.path.exists(filename):
+                    # all the classads were unchanged (delta advertisement) or skipped
+                    continue
                 try:
                     advertizeWorkFromFile(factory_pool, filename, remove_file=True, is_multi=frontendConfig.advertise_use_multi)
+                    self.mark_advertized([filename])
                 except condorExe.ExeError:
                     logSupport.log.exception("Advertising request failed for factory pool %s: " % factory_pool)
+                    self.mark_advertized([filename], [filename])
 
             return [] # No files left to be advertized
 
@@ -1092,7 +1153,7 @@ class MultiAdvertizeWork:
             file_id_cache=CredentialCache()
 
         for i in range(nr_credentials):
-            fd=None
+            ad_fd=None
             glidein_monitors_this_cred = {}
             try:
                 encrypted_params={} # none by default
@@ -1165,15 +1226,8 @@ class MultiAdvertizeWork:
 
                     glidein_monitors_this_cred = params_obj.glidein_monitors_per_cred.get(credential_el.getId(), {})
 
-                if frontendConfig.advertise_use_multi is True:
-                    fname = self.adname
-                    cred_filename_arr.append(fname)
-                else:
-                    fname = self.adname + "_" + str(self.unique_id)
-                    self.unique_id += 1
-                    cred_filename_arr.append(fname)
-                logSupport.log.debug("Writing %s" % fname)
-                fd = file(fname, "a")
+                # the classad is written to the file once complete
+                fd = cStringIO.StringIO()
             
                 fd.write('MyType = "%s"\n'%frontendConfig.client_id)
                 fd.write('GlideinMyType = "%s"\n'%frontendConfig.client_id)
@@ -1189,7 +1243,6 @@ class MultiAdvertizeWork:
                     glidein_params_to_encrypt['SecurityName']=params_obj.security_name
                                   
                 if key_obj is not None:
-                    fd.write(string.join(key_obj.get_key_attrs(), '\n')+"\n")
                     for attr in glidein_params_to_encrypt.keys():
                         encrypted_params[attr]=key_obj.encrypt_hex(glidein_params_to_encrypt[attr])
                    
@@ -1201,9 +1254,9 @@ class MultiAdvertizeWork:
                 fd.write('WebMonitoringURL = "%s"\n'%descript_obj.monitoring_web_url)
                          
                 # write out both the params 
+                # (the encrypted ones are written after the delta advertisement check)
                 classad_info_tuples = (
                     (frontendConfig.glidein_param_prefix, params_obj.glidein_params),
-                    (frontendConfig.encrypted_param_prefix, encrypted_params),
                     (frontendConfig.glidein_config_prefix, self.glidein_config_limits)
                 )
                 for (prefix, data) in classad_info_tuples:
@@ -1231,6 +1284,26 @@ class MultiAdvertizeWork:
                                                 '%s%s' % (prefix, attr_name),
                                                 attr_value)
 
+                if frontendConfig.advertise_use_multi is True:
+                    fname = self.adname
+                else:
+                    fname = self.adname + "_" + str(self.unique_id)
+                # the encrypted values change with the key, use the clear ones for the delta advertisement
+                if not self.is_changed(frontendConfig.client_id, classad_name, fname,
+                                       fd.getvalue(), glidein_params_to_encrypt,
+                                       key_obj is not None and key_obj.factory_pub_key_id):
+                    continue
+                if frontendConfig.advertise_use_multi is not True:
+                    self.unique_id += 1
+                cred_filename_arr.append(fname)
+
+                if key_obj is not None:
+                    fd.write(string.join(key_obj.get_key_attrs(), '\n')+"\n")
+                    for attr in encrypted_params.keys():
+                        writeTypedClassadAttrToFile(fd,
+                                                    '%s%s' % (frontendConfig.encrypted_param_prefix, attr),
+                                                    encrypted_params[attr])
+
                 # Update Sequence number information
                 if classad_name in advertizeGCCounter:
                     advertizeGCCounter[classad_name] += 1
@@ -1240,12 +1313,15 @@ class MultiAdvertizeWork:
                             
                 # add a final empty line... useful when appending
                 fd.write('\n')
-                fd.close()
+                logSupport.log.debug("Writing %s" % fname)
+                ad_fd = file(fname, "a")
+                ad_fd.write(fd.getvalue())
+                ad_fd.close()
             except:
                 logSupport.log.exception("Exception writing advertisement file: ")
                 # remove file in case of problems
-                if (fd is not None):
-                    fd.close()
+                if (ad_fd is not None):
+                    ad_fd.close()
                     os.remove(fname)
                 raise
         return cred_filename_arr
@@ -1533,7 +1609,8 @@ class ResourceClassadAdvertiser(classadSupport.ClassadAdvertiser):
 
         classadSupport.ClassadAdvertiser.__init__(self, pool=pool, 
                                                   multi_support=multi_support,
-                                                  tcp_support=frontendConfig.advertise_use_tcp)
+                                                  tcp_support=frontendConfig.advertise_use_tcp,
+                                                  batch_size=frontendConfig.advertise_batch_size)
         
         self.adType = 'glideresource'
         self.adAdvertiseCmd = 'UPDATE_AD_GENERIC'
@@ -1612,6 +1689,11 @@ class FrontendMonitorClassad(classadSupport.Classad):
             attr_name = '%s_%s_%s' % (frontendConfig.glidein_perfmetric_prefix,
                                       perf_metrics.name, event)
             self.adParams[attr_name] = perf_metrics.event_lifetime(event)
+        counters = perf_metrics.get_counters()
+        for counter in counters:
+            attr_name = '%s_%s_%s' % (frontendConfig.glidein_perfmetric_prefix,
+                                      perf_metrics.name, counter)
+            self.adParams[attr_name] = counters[counter]
 
 
 class FrontendMonitorClassadAdvertiser(classadSupport.ClassadAdvertiser):
@@ -1632,7 +1714,8 @@ class FrontendMonitorClassadAdvertiser(classadSupport.ClassadAdvertiser):
 
         classadSupport.ClassadAdvertiser.__init__(self, pool=pool, 
                                                   multi_support=multi_support,
-                                                  tcp_support=frontendConfig.advertise_use_tcp)
+                                                  tcp_support=frontendConfig.advertise_use_tcp,
+                                                  batch_size=frontendConfig.advertise_batch_size)
         
         self.adType = 'glidefrontendmonitor'
         self.adAdvertiseCmd = 'UPDATE_AD_GENERIC'
@@ -1651,7 +1734,8 @@ def exe_condor_advertise(fname,command, pool, is_multi=False):
                                                            pool, is_multi))
     return condorManager.condorAdvertise(fname, command, 
                                          frontendConfig.advertise_use_tcp,
-                                         is_multi, pool)
+                                         is_multi, pool,
+                                         frontendConfig.advertise_batch_size)
 
 
 class NoCredentialException(Exception):
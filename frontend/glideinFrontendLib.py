@@ -23,6 +23,7 @@ import traceback
 
 from glideinwms.lib.util import safe_boolcomp
 from glideinwms.lib import condorMonitor, logSupport
+from glideinwms.frontend import glideinFrontendMatch
 
 #############################################################################################
 
@@ -37,11 +38,20 @@ def getCondorQ(schedd_names, constraint=None, format_list=None,
                want_format_completion=True, job_status_filter=(1, 2)):
     if format_list is not None:
         if want_format_completion:
-            format_list = condorMonitor.complete_format_list(
-                format_list,
-                [('JobStatus', 'i'), ('EnteredCurrentStatus', 'i'),
-                 ('ServerTime', 'i'), ('RemoteHost', 's')])
+            format_list = completeCondorQFormatList(format_list)
 
+    js_constraint = getCondorQJobStatusConstraint(job_status_filter)
+
+    return getCondorQConstrained(schedd_names, js_constraint, constraint, format_list)
+
+def completeCondorQFormatList(format_list):
+    """Add the attributes always needed by the frontend to a condor_q format_list"""
+    return condorMonitor.complete_format_list(
+        format_list,
+        [('JobStatus', 'i'), ('EnteredCurrentStatus', 'i'),
+         ('ServerTime', 'i'), ('RemoteHost', 's')])
+
+def getCondorQJobStatusConstraint(job_status_filter=(1, 2)):
     if not job_status_filter:
         # if nothing specified, assume it wants all of them
         js_constraint="True"
@@ -50,8 +60,7 @@ def getCondorQ(schedd_names, constraint=None, format_list=None,
         for n in job_status_filter:
             js_arr.append('(JobStatus=?=%i)'%n)
         js_constraint=string.join(js_arr, '||')
-
-    return getCondorQConstrained(schedd_names, js_constraint, constraint, format_list)
+    return js_constraint
 
 def getIdleVomsCondorQ(condorq_dict):
     out={}
@@ -100,45 +109,62 @@ def getRunningCondorQ(condorq_dict):
         out[schedd_name] = sq
     return out
 
-def appendRealRunning(condorq_dict, status_dict):
+def getRunningOnIndex(status_dict):
+    """Map the slot names in condor_status to the provenance of the glidein,
+    in the format used for RunningOn: entry@glidein@factory@factory_pool
+    If a slot is in more collectors, the first one is used
+
+    :param status_dict: running slots from condor_status, keyed by collector name
+    :return: dictionary {slot name: RunningOn value}
+    """
+    index = {}
+    for collector_name in status_dict:
+        condor_status = status_dict[collector_name].fetchStored()
+        for slot_name, slot in condor_status.iteritems():
+            if slot_name in index:
+                continue
+            try:
+                # there is currently no way to get the factory
+                # collector from condor status so this hack grabs
+                # the hostname of the schedd
+                schedd = slot['GLIDEIN_Schedd'].split('@')
+
+                # split by : to remove port number if there
+                fact_pool = schedd[-1].split(':')[0]
+
+                index[slot_name] = "%s@%s@%s@%s" % (slot['GLIDEIN_Entry_Name'],
+                                                    slot['GLIDEIN_Name'],
+                                                    slot['GLIDEIN_Factory'],
+                                                    fact_pool)
+            except (KeyError, AttributeError):
+                # not a glidein, jobs running there are UNKNOWN
+                pass
+    return index
+
+
+def appendRealRunning(condorq_dict, status_dict, running_on_index=None):
     """Adds provenance information from condor_status to the condor_q dictionary
     The name of static or pslots is the value of RemoteHost
     NOTE: HTC 8.5 may change RemoteHost to be the DynamicSlot name
 
     :param condorq_dict: adding 'RunningOn' to each job
     :param status_dict: running jobs from condor_status
+    :param running_on_index: result of getRunningOnIndex(status_dict), built if None
     :return:
     """
+    if running_on_index is None:
+        running_on_index = getRunningOnIndex(status_dict)
+
     for schedd_name in condorq_dict:
         condorq = condorq_dict[schedd_name].fetchStored()
 
-        for jid in condorq:
-            found = False
-
-            if 'RemoteHost' in condorq[jid]:
-                remote_host = condorq[jid]['RemoteHost']
-
-                for collector_name in status_dict:
-                    condor_status = status_dict[collector_name].fetchStored()
-                    if remote_host in condor_status:
-                        # there is currently no way to get the factory
-                        # collector from condor status so this hack grabs
-                        # the hostname of the schedd
-                        schedd = condor_status[remote_host]['GLIDEIN_Schedd'].split('@')
-
-                        # split by : to remove port number if there
-                        fact_pool = schedd[-1].split(':')[0]
-
-                        condorq[jid]['RunningOn'] = "%s@%s@%s@%s" % (
-                            condor_status[remote_host]['GLIDEIN_Entry_Name'],
-                            condor_status[remote_host]['GLIDEIN_Name'],
-                            condor_status[remote_host]['GLIDEIN_Factory'],
-                            fact_pool)
-                        found = True
-                        break
-
-            if not found:
-                condorq[jid]['RunningOn'] = 'UNKNOWN'
+        if isinstance(condorq, condorMonitor.ColumnarStoredData):
+            # the job dictionaries are read-only copies, add a column
+            condorq.set_column('RunningOn', [running_on_index.get(remote_host, 'UNKNOWN')
+                                             for remote_host in condorq.column('RemoteHost')])
+            continue
+        for job in condorq.itervalues():
+            job['RunningOn'] = running_on_index.get(job.get('RemoteHost'), 'UNKNOWN')
 
 #
 # Return a dictionary of schedds containing old jobs
@@ -154,6 +180,86 @@ def getOldCondorQ(condorq_dict, min_age):
         out[schedd_name] = sq
     return out
 
+class CondorQView(condorMonitor.StoredQuery):
+    """
+    Subset of the jobs of a schedd, sharing the job dictionaries with the original query
+    Can be used like the SubQuery returned by getIdleCondorQ and the similar functions
+    """
+    def __init__(self, stored_data):
+        self.stored_data = stored_data
+
+
+#
+# Split the jobs by type walking each schedd only once
+# Same selection as:
+#   IdleAll: getIdleCondorQ
+#   Idle: getIdleCondorQ, excluding blacklist_schedds
+#   OldIdle, Idle_3600: getOldCondorQ(Idle, 600) and getOldCondorQ(Idle, 3600)
+#   VomsIdle, ProxyIdle: getIdleVomsCondorQ(Idle) and getIdleProxyCondorQ(Idle)
+#   Running: getRunningCondorQ
+#
+# Use the output of getCondorQ
+# Returns a dictionary {type: {'dict': condorq_dict, 'abs': number of jobs}}
+# The types of compacted queries (see condorMonitor.StoredQuery.compact)
+# are views sharing the columns with the query
+#
+CLASSIFY_ATTRS = ('JobStatus', 'ServerTime', 'EnteredCurrentStatus', 'x509UserProxyFirstFQAN', 'x509userproxy')
+
+def classifyCondorQ(condorq_dict, blacklist_schedds=()):
+    types = {}
+    for dt in ('IdleAll', 'Idle', 'OldIdle', 'Idle_3600', 'VomsIdle', 'ProxyIdle', 'Running'):
+        types[dt] = {'dict': {}, 'abs': 0}
+
+    for schedd_name in condorq_dict.keys():
+        idle_all = {}
+        idle = {}
+        idle_600 = {}
+        idle_3600 = {}
+        voms = {}
+        proxy = {}
+        running = {}
+        # blacklisted schedds count only in IdleAll and Running
+        is_good = schedd_name not in blacklist_schedds
+
+        schedd_jobs = condorq_dict[schedd_name].fetchStored()
+        is_columnar = isinstance(schedd_jobs, condorMonitor.ColumnarStoredData)
+        if is_columnar:
+            # keyed by position, reading only the attributes needed here
+            jobs_iter = enumerate(schedd_jobs.iterclassads(CLASSIFY_ATTRS))
+        else:
+            jobs_iter = schedd_jobs.iteritems()
+
+        for jid, el in jobs_iter:
+            job_status = el.get('JobStatus')
+            if job_status == 2:
+                running[jid] = el
+            elif job_status == 1:
+                idle_all[jid] = el
+                if not is_good:
+                    continue
+                idle[jid] = el
+                if 'ServerTime' in el and 'EnteredCurrentStatus' in el:
+                    age = el['ServerTime'] - el['EnteredCurrentStatus']
+                    if age >= 600:
+                        idle_600[jid] = el
+                        if age >= 3600:
+                            idle_3600[jid] = el
+                if 'x509UserProxyFirstFQAN' in el:
+                    voms[jid] = el
+                if 'x509userproxy' in el:
+                    proxy[jid] = el
+
+        schedd_types = [('IdleAll', idle_all), ('Running', running)]
+        if is_good:
+            schedd_types += [('Idle', idle), ('OldIdle', idle_600), ('Idle_3600', idle_3600),
+                             ('VomsIdle', voms), ('ProxyIdle', proxy)]
+        for dt, jobs in schedd_types:
+            if is_columnar:
+                jobs = schedd_jobs.select(positions=sorted(jobs.keys()))
+            types[dt]['dict'][schedd_name] = CondorQView(jobs)
+            types[dt]['abs'] += len(jobs)
+    return types
+
 #
 # Return the number of jobs in the dictionary
 # Use the output of getCondorQ
@@ -198,7 +304,8 @@ def getCondorQUsers(condorq_dict):
 #    return schedd_count, cpu_schedd_count, first_t
 
 def countMatch(match_obj, condorq_dict, glidein_dict, attr_dict, ignore_down_entries,
-               condorq_match_list=None, match_policies=[], group_name=None):
+               condorq_match_list=None, match_policies=[], group_name=None, match_expr=None,
+               match_memo=None):
     """
     Get the number of jobs that match each glidein
     
@@ -209,6 +316,13 @@ def countMatch(match_obj, condorq_dict, glidein_dict, attr_dict, ignore_down_ent
     @param glidein_dict: output of interface.findGlideins
     @param attr_dict:  dictionary of constant attributes
     @param condorq_match_list: list of job attributes from the XML file
+    @param match_expr: match string used to compile match_obj. If provided, the
+        indexed engine in glideinFrontendMatch is used instead of evaluating match_obj
+        for each glidein and job cluster (falling back to match_obj if the
+        expression is not supported by the engine)
+    @type match_memo: glideinFrontendMatch.MatchMemo
+    @param match_memo: results of the previous iterations, used with the indexed engine
+        to evaluate only the new (job cluster, glidein) pairs. New results are added to it
 
     @return: tuple of 4 elements, where first 3 are a dictionary of
         glidein name where elements are number of jobs matching
@@ -318,9 +432,35 @@ def countMatch(match_obj, condorq_dict, glidein_dict, attr_dict, ignore_down_ent
     #                   indexes representing a job cluster each
     #  all_jobs_clusters: dictionary of cluster index -> list of jobs in
     #                     the cluster (represented each by its own index)
+    #  cq_cluster_info: for each schedd, dictionary of the matched clusters
+    #                   (hash) -> (cluster index, list of jobs, cpus)
     list_of_all_jobs = []
     all_jobs_clusters = {}
-    
+    cq_cluster_info = dict([(scheddIdx, {}) for scheddIdx in range(nr_schedds)])
+
+    # If possible use the indexed engine to find the matching clusters
+    # cluster_keys: list of (scheddIdx, jh), the position in the list is the
+    #               cluster index used by the engine
+    cluster_matcher = None
+    if match_expr is not None:
+        try:
+            engine = glideinFrontendMatch.get_match_engine(match_expr, globals(),
+                                                           countMatch.func_code.co_varnames)
+        except glideinFrontendMatch.MatchEngineError as e:
+            logSupport.log.debug("Using eval in countMatch, match expression not supported by the match engine: %s" % e)
+        else:
+            cluster_keys = []
+            cluster_jobs = []
+            # cluster indexes of each hash, used by match_memo
+            jh_idxs = {}
+            for scheddIdx in range(nr_schedds):
+                condorq_data = condorq_dict[schedds[scheddIdx]].fetchStored()
+                for jh, cluster in cq_dict_clusters[scheddIdx].iteritems():
+                    jh_idxs.setdefault(jh, []).append(len(cluster_keys))
+                    cluster_keys.append((scheddIdx, jh))
+                    cluster_jobs.append(condorq_data[(cluster[0][0], cluster[0][1])])
+            cluster_matcher = engine.bind(cluster_jobs, attr_dict)
+
     for glidename in glidein_dict:
         glidein = glidein_dict[glidename]
         # Number of glideins to request
@@ -329,6 +469,21 @@ def countMatch(match_obj, condorq_dict, glidein_dict, attr_dict, ignore_down_ent
         cpu_count = 0
         jobs_arr = []
 
+        if cluster_matcher is not None:
+            # matched clusters and evaluation errors, split by schedd
+            engine_matches = [[] for scheddIdx in range(nr_schedds)]
+            engine_errors = [[] for scheddIdx in range(nr_schedds)]
+            # Do not match downtime entries
+            if not (ignore_down_entries and safe_boolcomp(glidein['attrs'].get('GLIDEIN_In_Downtime', False), True)):
+                if match_memo is not None:
+                    matched, errors = match_memo.match(cluster_matcher, jh_idxs, glidein, match_policies)
+                else:
+                    matched, errors = cluster_matcher.match(glidein, match_policies)
+                for idx in matched:
+                    engine_matches[cluster_keys[idx][0]].append(cluster_keys[idx][1])
+                for idx in errors:
+                    engine_errors[cluster_keys[idx][0]].append(errors[idx])
+
         # Clusters are organized by schedd,
         #  so loop through each schedd
         for scheddIdx in range(nr_schedds):
@@ -349,60 +504,76 @@ def countMatch(match_obj, condorq_dict, glidein_dict, attr_dict, ignore_down_ent
             tb_count = 0
             recent_tb = None
 
-            for jh in cq_dict_clusters_el.keys():
-                # get the first job... they are all the same
-                first_jid=cq_dict_clusters_el[jh][0]
-                job=condorq_data[(first_jid[0], first_jid[1])]
-
-                try:
-                    # Do not match downtime entries
-                    if ignore_down_entries and safe_boolcomp(glidein_dict[glidename]['attrs'].get('GLIDEIN_In_Downtime', False), True):
-                        match = False
+            # List of the clusters (hash) matching the glidein
+            matched_jhs = []
+            if cluster_matcher is not None:
+                matched_jhs = engine_matches[scheddIdx]
+                for is_key_error, info in engine_errors[scheddIdx]:
+                    if is_key_error:
+                        missing_keys.add(info)
                     else:
-                        # Evaluate the Compiled object first.
-                        # Evaluation order does not really matter.
-                        match = eval(match_obj)
-                        for policy in match_policies:
-                            if match == True:
-                                # Policies are supposed to be ANDed
-                                match = (match and policy.pyObject.match(job, glidein))
-                            else:
-                                if match != False:
-                                    # Non boolean results should be discarded
-                                    # and logged
-                                    logSupport.log.warning("Match expression from policy file '%s' evaluated to non boolean result; assuming False" % policy.file)
-                                break
-
-                    if match == True:
-                        # The lines inside this if can be replaced with those three for profiling
-#                        sc, csc, first_t = do_match(cq_dict_clusters_el, procid_mul, nr_schedds, scheddIdx, first_jid, sjobs_arr, all_jobs_clusters, jh, job)
-#                        schedd_count += sc
-#                        cpu_schedd_count += csc
-
-                        # the first matched... add all jobs in the cluster
-                        cluster_arr = []
-                        for jid in cq_dict_clusters_el[jh]:
-                            cluster_arr.append(jid[2])
-                            schedd_count += 1
-
-                        # Since all jobs are same figure out how many cpus
-                        # are required for this cluster based on one job
-                        cpu_schedd_count += job.get('RequestCpus', 1) * len(cq_dict_clusters_el[jh])
-                        first_t = (first_jid[0]*procid_mul+first_jid[1])*nr_schedds+scheddIdx
-                        all_jobs_clusters[first_t] = cluster_arr
-                        sjobs_arr += [first_t]
-                except KeyError as e:
-                    tb = traceback.format_exception(sys.exc_info()[0],
-                                                    sys.exc_info()[1],
-                                                    sys.exc_info()[2])
-                    key = ((tb[-1].split(':'))[1]).strip()
-                    missing_keys.add(key)
+                        tb_count = tb_count + 1
+                        recent_tb = info
+            else:
+                for jh in cq_dict_clusters_el.keys():
+                    # get the first job... they are all the same
+                    first_jid=cq_dict_clusters_el[jh][0]
+                    job=condorq_data[(first_jid[0], first_jid[1])]
+
+                    try:
+                        # Do not match downtime entries
+                        if ignore_down_entries and safe_boolcomp(glidein_dict[glidename]['attrs'].get('GLIDEIN_In_Downtime', False), True):
+                            match = False
+                        else:
+                            # Evaluate the Compiled object first.
+                            # Evaluation order does not really matter.
+                            match = eval(match_obj)
+                            for policy in match_policies:
+                                if match == True:
+                                    # Policies are supposed to be ANDed
+                                    match = (match and policy.pyObject.match(job, glidein))
+                                else:
+                                    if match != False:
+                                        # Non boolean results should be discarded
+                                        # and logged
+                                        logSupport.log.warning("Match expression from policy file '%s' evaluated to non boolean result; assuming False" % policy.file)
+                                    break
 
-                except Exception as e:
-                    tb_count = tb_count + 1
-                    recent_tb = traceback.format_exception(sys.exc_info()[0],
-                                                           sys.exc_info()[1],
-                                                           sys.exc_info()[2])
+                        if match == True:
+                            matched_jhs.append(jh)
+                    except KeyError as e:
+                        tb = traceback.format_exception(sys.exc_info()[0],
+                                                        sys.exc_info()[1],
+                                                        sys.exc_info()[2])
+                        key = ((tb[-1].split(':'))[1]).strip()
+                        missing_keys.add(key)
+
+                    except Exception as e:
+                        tb_count = tb_count + 1
+                        recent_tb = traceback.format_exception(sys.exc_info()[0],
+                                                               sys.exc_info()[1],
+                                                               sys.exc_info()[2])
+
+            cq_cluster_info_el = cq_cluster_info[scheddIdx]
+            for jh in matched_jhs:
+                try:
+                    first_t, cluster_arr, cluster_cpus = cq_cluster_info_el[jh]
+                except KeyError:
+                    first_jid = cq_dict_clusters_el[jh][0]
+                    job = condorq_data[(first_jid[0], first_jid[1])]
+                    # the first matched... add all jobs in the cluster
+                    # The list is the same for all glideins, so it is computed only once
+                    cluster_arr = [jid[2] for jid in cq_dict_clusters_el[jh]]
+                    # Since all jobs are same figure out how many cpus
+                    # are required for this cluster based on one job
+                    cluster_cpus = job.get('RequestCpus', 1) * len(cluster_arr)
+                    first_t = (first_jid[0]*procid_mul+first_jid[1])*nr_schedds+scheddIdx
+                    cq_cluster_info_el[jh] = (first_t, cluster_arr, cluster_cpus)
+
+                schedd_count += len(cluster_arr)
+                cpu_schedd_count += cluster_cpus
+                all_jobs_clusters[first_t] = cluster_arr
+                sjobs_arr.append(first_t)
 
             if missing_keys:
                 logSupport.log.debug("Failed to evaluate resource match in countMatch. Possibly match_expr has errors and trying to reference job or site attribute(s) '%s' in an inappropriate way." % (','.join(missing_keys)))
@@ -542,20 +713,29 @@ def countRealRunning(match_obj, condorq_dict, glidein_dict,
     schedds = condorq_dict.keys()
     nr_schedds = len(schedds)
 
-    # dict of job clusters
+    # dict of job clusters, grouped by RunningOn
     # group together those that have the same attributes
+    # RunningOn is part of the cluster attributes, so each entry evaluates only
+    # the clusters running on it
     cq_dict_clusters = {}
+    nr_not_running_on = 0
     for scheddIdx in range(nr_schedds):
         schedd = schedds[scheddIdx]
         cq_dict_clusters[scheddIdx] = {}
         cq_dict_clusters_el = cq_dict_clusters[scheddIdx]
         condorq = condorq_dict[schedd]
         condorq_data = condorq.fetchStored()
-        for jid in condorq_data.keys():
-            jh = hashJob(condorq_data[jid], condorq_match_list)
-            if jh not in cq_dict_clusters_el:
-                cq_dict_clusters_el[jh] = []
-            cq_dict_clusters_el[jh].append(jid)
+        for jid, job in condorq_data.iteritems():
+            if 'RunningOn' not in job:
+                nr_not_running_on += 1
+                continue
+            jh = hashJob(job, condorq_match_list)
+            running_on_clusters = cq_dict_clusters_el.setdefault(job['RunningOn'], {})
+            if jh not in running_on_clusters:
+                running_on_clusters[jh] = []
+            running_on_clusters[jh].append(jid)
+    if nr_not_running_on > 0:
+        logSupport.log.debug("%i jobs without RunningOn ignored in countRealRunning" % nr_not_running_on)
 
     for glidename in glidein_dict:
         # split by : to remove port number if there
@@ -575,7 +755,8 @@ def countRealRunning(match_obj, condorq_dict, glidein_dict,
         glidein_ids = set()
         for scheddIdx in range(nr_schedds):
             schedd = schedds[scheddIdx]
-            cq_dict_clusters_el = cq_dict_clusters[scheddIdx]
+            # only the clusters running on this entry
+            cq_dict_clusters_el = cq_dict_clusters[scheddIdx].get(glide_str, {})
             condorq = condorq_dict[schedd]
             condorq_data = condorq.fetchStored()
             schedd_count = 0
@@ -591,7 +772,7 @@ def countRealRunning(match_obj, condorq_dict, glidein_dict,
                 try:
                     # Evaluate the Compiled object first.
                     # Evaluation order does not really matter.
-                    match = ((job['RunningOn']==glide_str) and eval(match_obj))
+                    match = eval(match_obj)
                     for policy in match_policies:
                         if match == True:
                             # Policies are supposed to be ANDed
@@ -676,17 +857,9 @@ def getCondorStatus(collector_names, constraint=None, format_list=None,
     @param want_glideins_only:
     @return:
     """
-    type_constraint = '(True)'
     if format_list is not None:
         if want_format_completion:
-            format_list = condorMonitor.complete_format_list(
-                format_list,
-                [('State', 's'), ('Activity', 's'),
-                 ('EnteredCurrentState', 'i'), ('EnteredCurrentActivity', 'i'),
-                 ('LastHeardFrom', 'i'), ('GLIDEIN_Factory', 's'),
-                 ('GLIDEIN_Name', 's'), ('GLIDEIN_Entry_Name', 's'),
-                 ('GLIDECLIENT_Name', 's'), ('GLIDECLIENT_ReqNode', 's'),
-                 ('GLIDEIN_Schedd', 's')])
+            format_list = completeCondorStatusFormatList(format_list)
 
     ###########################################################################
     # Parag: Nov 24, 2014
@@ -700,10 +873,75 @@ def getCondorStatus(collector_names, constraint=None, format_list=None,
     # type_constraint = '(PartitionableSlot =!= True || TotalSlots =?= 1)'
     ###########################################################################
 
+    type_constraint = getCondorStatusTypeConstraint(want_glideins_only)
+
+    return getCondorStatusConstrained(collector_names, type_constraint, constraint, format_list)
+
+
+def completeCondorStatusFormatList(format_list):
+    """Add the attributes always needed by the frontend to a condor_status format_list"""
+    return condorMonitor.complete_format_list(
+        format_list,
+        [('State', 's'), ('Activity', 's'),
+         ('EnteredCurrentState', 'i'), ('EnteredCurrentActivity', 'i'),
+         ('LastHeardFrom', 'i'), ('GLIDEIN_Factory', 's'),
+         ('GLIDEIN_Name', 's'), ('GLIDEIN_Entry_Name', 's'),
+         ('GLIDECLIENT_Name', 's'), ('GLIDECLIENT_ReqNode', 's'),
+         ('GLIDEIN_Schedd', 's')])
+
+
+def getCondorStatusTypeConstraint(want_glideins_only=True):
+    type_constraint = '(True)'
     if want_glideins_only:
         type_constraint += '&&(IS_MONITOR_VM=!=True)&&(GLIDEIN_Factory=!=UNDEFINED)&&(GLIDEIN_Name=!=UNDEFINED)&&(GLIDEIN_Entry_Name=!=UNDEFINED)'
+    return type_constraint
+
+
+#
+# Slot classification, used by the get*CondorStatus filters and by countClientCondorStatus
+#
+def isNonDynamicSlot(el):
+    """Static or partitionable slot"""
+    return el.get('SlotType') != 'Dynamic'
+
+
+def isIdleSlot(el):
+    """Idle (unclaimed) slot
+
+    Partitionable slots with no free memory/cpus are excluded
+    Minimum memory required by CMS is 2500 MB
+
+    1. (el.get('PartitionableSlot') != True)
+    Includes static slots irrespective of the free cpu/mem
+
+    2. (el.get('TotalSlots') == 1)
+    p-slots not yet partitioned
+
+    3. (el.get('Cpus', 0) > 0 and el.get('Memory', 2501) > 2500)
+    p-slots that have enough idle resources.
+    """
+    return ((el.get('State') == 'Unclaimed') and
+            (el.get('Activity') == 'Idle') and
+            ((el.get('PartitionableSlot') != True) or
+             (el.get('TotalSlots') == 1) or
+             (el.get('Cpus', 0) > 0 and el.get('Memory', 2501) > 2500)))
 
-    return getCondorStatusConstrained(collector_names, type_constraint, constraint, format_list)
+
+def isRunningSlot(el):
+    """Running (claimed) slot
+
+    1. Static - running slots
+    2. Dynamic slots (They are always running)
+    3. p-slot with one or more dynamic slots
+    """
+    return (((el.get('State') == 'Claimed') and
+             (el.get('Activity') in ('Busy', 'Retiring'))) or
+            ((el.get('PartitionableSlot') == True) and
+             (el.get('TotalSlots', 1) > 1)))
+
+
+def isFailedSlot(el):
+    return (el.get('State') == "Drained") and (el.get('Activity') == "Retiring")
 
 
 def getCondorStatusNonDynamic(status_dict):
@@ -717,12 +955,7 @@ def getCondorStatusNonDynamic(status_dict):
     out = {}
     for collector_name in status_dict.keys():
         # Exclude partitionable slots with no free memory/cpus
-        sq = condorMonitor.SubQuery(
-            status_dict[collector_name],
-            lambda el: (
-                (el.get('SlotType') != 'Dynamic')
-            )
-        )
+        sq = condorMonitor.SubQuery(status_dict[collector_name], isNonDynamicSlot)
         sq.load()
         out[collector_name] = sq
     return out
@@ -737,31 +970,8 @@ def getCondorStatusNonDynamic(status_dict):
 def getIdleCondorStatus(status_dict):
     out = {}
     for collector_name in status_dict.keys():
-
-        # Exclude partitionable slots with no free memory/cpus
-        # Minimum memory required by CMS is 2500 MB
-        #
-        # 1. (el.get('PartitionableSlot') != True)
-        # Includes static slots irrespective of the free cpu/mem
-        #
-        # 2. (el.get('TotalSlots') == 1)
-        # p-slots not yet partitioned
-        #
-        # 3. (el.get('Cpus', 0) > 0 and el.get('Memory', 2501) > 2500)
-        # p-slots that have enough idle resources.
-
-        sq = condorMonitor.SubQuery(
-            status_dict[collector_name],
-            lambda el: (
-                (el.get('State') == 'Unclaimed') and
-                (el.get('Activity') == 'Idle') and
-                (
-                    (el.get('PartitionableSlot') != True) or
-                    (el.get('TotalSlots') == 1) or
-                    (el.get('Cpus', 0) > 0 and el.get('Memory', 2501) > 2500)
-                )
-            )
-        )
+        # Exclude partitionable slots with no free memory/cpus, see isIdleSlot
+        sq = condorMonitor.SubQuery(status_dict[collector_name], isIdleSlot)
         sq.load()
         out[collector_name] = sq
     return out
@@ -781,18 +991,7 @@ def getRunningCondorStatus(status_dict):
         # 2. Dynamic slots (They are always running)
         # 3. p-slot with one or more dynamic slots
         #    We get them here so we can use them easily in appendRealRunning()
-
-        sq = condorMonitor.SubQuery(
-                status_dict[collector_name],
-                lambda el: (
-                    ((el.get('State') == 'Claimed') and
-                     (el.get('Activity') in ('Busy', 'Retiring'))
-                    ) or
-                    ((el.get('PartitionableSlot') == True) and
-                     (el.get('TotalSlots', 1) > 1)
-                    )
-                )
-        )
+        sq = condorMonitor.SubQuery(status_dict[collector_name], isRunningSlot)
         sq.load()
         out[collector_name] = sq
     return out
@@ -852,13 +1051,7 @@ def getRunningJobsCondorStatus(status_dict):
 def getFailedCondorStatus(status_dict):
     out = {}
     for collector_name in status_dict.keys():
-        sq = condorMonitor.SubQuery(
-            status_dict[collector_name],
-            lambda el: (
-                (el.get('State') == "Drained") and
-                (el.get('Activity') == "Retiring")
-            )
-        )
+        sq = condorMonitor.SubQuery(status_dict[collector_name], isFailedSlot)
         sq.load()
         out[collector_name] = sq
     return out
@@ -939,6 +1132,85 @@ def getClientCondorStatusPerCredId(status_dict, frontend_name, group_name,
     return out
 
 
+# States counted for each request by countClientCondorStatus, same as the status_dict_types of the frontend element
+CLIENT_STATUS_STATES = ('Total', 'Idle', 'Running', 'Failed', 'TotalCores', 'IdleCores', 'RunningCores')
+
+
+def countClientCondorStatus(status_dict, frontend_name, group_name):
+    """Count the slots of all the requests of a group in one pass
+
+    Same counts of getClientCondorStatus and getClientCondorStatusCredIdOnly followed by the
+    get*CondorStatus filters and count*CondorStatus functions, without scanning status_dict
+    once per request, state and credential
+
+    @param status_dict: output of getCondorStatus
+    @param frontend_name: name of the frontend
+    @param group_name: name of the group
+    @return: dictionary {request_name: {cred_id: {state: count}}}, with state in CLIENT_STATUS_STATES
+        and cred_id the GLIDEIN_CredentialIdentifier of the slots (None if not defined)
+        Use sumClientCondorStatusCounts to get the counts of a request for all the credentials
+    """
+    client_name_new = "%s.%s" % (frontend_name, group_name)
+    client_name_old_suffix = "@" + client_name_new
+    out = {}
+    for collector_name in status_dict:
+        for el in status_dict[collector_name].fetchStored().itervalues():
+            client_name = el.get('GLIDECLIENT_Name')
+            if client_name is None:
+                continue
+            if client_name == client_name_new:
+                try:
+                    request_name = "%s@%s@%s" % (el['GLIDEIN_Entry_Name'], el['GLIDEIN_Name'], el['GLIDEIN_Factory'])
+                except KeyError:
+                    continue
+            elif client_name.endswith(client_name_old_suffix):
+                request_name = client_name[:-len(client_name_old_suffix)]
+            else:
+                continue
+
+            cred_counts = out.setdefault(request_name, {})
+            cred_id = el.get('GLIDEIN_CredentialIdentifier')
+            try:
+                counts = cred_counts[cred_id]
+            except KeyError:
+                counts = cred_counts[cred_id] = dict.fromkeys(CLIENT_STATUS_STATES, 0)
+
+            counts['Total'] += 1
+            if isNonDynamicSlot(el):
+                if el.get('PartitionableSlot', False):
+                    counts['TotalCores'] += el.get('TotalSlotCpus', 0)
+                else:
+                    counts['TotalCores'] += el.get('Cpus', 0)
+            if isIdleSlot(el):
+                counts['Idle'] += 1
+                counts['IdleCores'] += el.get('Cpus', 0)
+            # Running p-slots are there only for appendRealRunning, not counted
+            if isRunningSlot(el) and not el.get('PartitionableSlot', False):
+                counts['Running'] += 1
+                counts['RunningCores'] += el.get('Cpus', 0)
+            if isFailedSlot(el):
+                counts['Failed'] += 1
+    return out
+
+
+def sumClientCondorStatusCounts(cred_counts, cred_ids=None):
+    """Sum the counts of a request from countClientCondorStatus
+
+    @param cred_counts: dictionary {cred_id: {state: count}} of a request
+    @param cred_ids: credentials to sum, all if None
+    @return: dictionary {state: count}
+    """
+    out = dict.fromkeys(CLIENT_STATUS_STATES, 0)
+    if cred_ids is None:
+        cred_ids = cred_counts.keys()
+    for cred_id in cred_ids:
+        counts = cred_counts.get(cred_id)
+        if counts is not None:
+            for st in CLIENT_STATUS_STATES:
+                out[st] += counts[st]
+    return out
+
+
 #
 # Return the number of vms in the dictionary
 # Use the output of getCondorStatus
@@ -1093,20 +1365,23 @@ def getCondorStatusSchedds(collector_names, constraint=None, format_list=None,
                            want_format_completion=True):
     if format_list is not None:
         if want_format_completion:
-            format_list = condorMonitor.complete_format_list(
-                              format_list,
-                              [('TotalRunningJobs', 'i'),
-                               ('TotalSchedulerJobsRunning', 'i'),
-                               ('TransferQueueNumUploading', 'i'),
-                               ('MaxJobsRunning', 'i'),
-                               ('TransferQueueMaxUploading', 'i'),
-                               ('CurbMatchmaking', 'i')])
+            format_list = completeCondorStatusScheddsFormatList(format_list)
 
     type_constraint = 'True'
     return getCondorStatusConstrained(collector_names, type_constraint,
                                       constraint, format_list,
                                       subsystem_name="schedd")
 
+def completeCondorStatusScheddsFormatList(format_list):
+    return condorMonitor.complete_format_list(
+               format_list,
+               [('TotalRunningJobs', 'i'),
+                ('TotalSchedulerJobsRunning', 'i'),
+                ('TransferQueueNumUploading', 'i'),
+                ('MaxJobsRunning', 'i'),
+                ('TransferQueueMaxUploading', 'i'),
+                ('CurbMatchmaking', 'i')])
+
 ############################################################
 #
 # I N T E R N A L - Do not use
@@ -1191,11 +1466,16 @@ def getCondorStatusConstrained(collector_names, type_constraint, constraint=None
 #############################################
 #
 # Extract unique subsets from a list of sets
-# by Benjamin Hass @ UCSD (working under Igor Sfiligoi)
 #
 # Input: list of sets
 # Output: list of (index set, value subset) pairs + a set that is the union of all input sets
 #
+# Each element is assigned a signature, the list of indexes of the input sets
+# containing it, in a single pass over the input. Elements are then grouped
+# by signature, each group is one of the unique subsets.
+# The cost is linear in the total size of the input sets
+# (plus sorting the subsets by size).
+#
 # Example in:
 #   [set([1, 2, 3, 4, 5, 6, 7, 8, 9, 10]), set([1, 2, 3, 4, 5, 6, 7, 8, 9, 10]),
 #    set([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20,
@@ -1210,72 +1490,29 @@ def getCondorStatusConstrained(collector_names, type_constraint, constraint=None
 #         21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35]))
 #
 def uniqueSets(in_sets):
-    # sets is a list of sets
-    sorted_sets = []
-    for i in in_sets:
-        common_list = []
-        common = set()
-        new_unique = set()
-        old_unique_list = []
-        old_unique = set()
-        new = []
-        # make a list of the elements common to i
-        # (current iteration of sets) and the existing
-        # sorted sets
-        for k in sorted_sets:
-            # for now, old unique is a set with all elements of
-            # sorted_sets
-            old_unique = old_unique | k
-            common = k & i
-            if common:
-                common_list.append(common)
-            else:
-                pass
-        # figure out which elements in i
-        # and which elements in old_uniques are unique
-        for j in common_list:
-            i = i - j
-            old_unique = old_unique - j
-        # make a list of all the unique elements in sorted_sets
-        for k in sorted_sets:
-            old_unique_list.append(k & old_unique)
-        new_unique = i
-        if new_unique:
-            new.append(new_unique)
-        for o in old_unique_list:
-            if o:
-                new.append(o)
-        for c in common_list:
-            if c:
-                new.append(c)
-        sorted_sets = new
-
-    # set with all unique elements
-    sum_set = set()
-    for s in sorted_sets:
-        sum_set = sum_set | s
-
-
-    sorted_sets.append(sum_set)
-
-    # index_list is a list of lists. Each list corresponds to 
-    # an element in sorted_sets, and contains the indexes of 
-    # that elements shared elements in the initial list of sets
-    index_list = []
-    for s in sorted_sets:
-        indexes = []
-        temp_sets = in_sets[:]
-        for t in temp_sets:
-            if s & t:
-                indexes.append(temp_sets.index(t))
-                temp_sets[temp_sets.index(t)] = set()
-        index_list.append(indexes)
-
-    # create output
+    # element -> list of the indexes of the sets containing it
+    signatures = {}
+    for idx in range(len(in_sets)):
+        for el in in_sets[idx]:
+            try:
+                signatures[el].append(idx)
+            except KeyError:
+                signatures[el] = [idx]
+
+    # signature -> set of elements with that signature
+    partitions = {}
+    for el, signature in signatures.iteritems():
+        signature = tuple(signature)
+        try:
+            partitions[signature].add(el)
+        except KeyError:
+            partitions[signature] = set([el])
+
+    # create output, sorted by size to have a deterministic order
     outvals = []
-    for i in range(len(index_list) - 1): # last one contains all the values
-        outvals.append((set(index_list[i]), sorted_sets[i]))
-    return (outvals, sorted_sets[-1])
+    for signature in sorted(partitions, key=lambda sig: (len(partitions[sig]), sig)):
+        outvals.append((set(signature), partitions[signature]))
+    return (outvals, set(signatures))
 
 def hashJob(condorq_el, condorq_match_list=None):
     out=[]
@@ -0,0 +1,779 @@
+#
+# Project:
+#   glideinWMS
+#
+# File Version:
+#
+# Description:
+#   Indexed matching engine used by glideinFrontendLib.countMatch
+#
+#   Instead of evaluating the match expression once per
+#   (entry, job cluster) pair, the expression is split in its
+#   job-only, entry-only and job-vs-entry parts:
+#    - job-only parts are evaluated once per job cluster
+#    - entry-only parts are evaluated once per entry
+#    - comparisons between a job-only and an entry-only operand
+#      (equality, set membership, numeric ranges) are resolved
+#      using per-attribute indexes built over the job clusters
+#   Everything else is evaluated with eval, one pair at the time,
+#   and only for the pairs that are still candidates.
+#   The results (including short-circuit and exception semantics)
+#   are the same as evaluating the whole expression with eval.
+#
+#   MatchMemo remembers the results across iterations (MatchMemoSize
+#   frontend option), so that only the new (job cluster, entry) pairs
+#   are evaluated.
+#
+
+import ast
+import sys
+import types
+import bisect
+import hashlib
+import operator
+import traceback
+from collections import OrderedDict
+
+from glideinwms.lib import logSupport
+
+# Outcome classes of an evaluation. They mirror the checks that
+# countMatch does on the value returned by eval
+TRUE = 0    # value == True
+TRUTHY = 1  # true, but != True
+FALSE = 2   # value == False
+FALSY = 3   # false, but != False
+
+# Names that can be used freely in a match expression
+JOB_NAME = 'job'
+GLIDEIN_NAME = 'glidein'
+ATTR_DICT_NAME = 'attr_dict'
+
+PRIMITIVE_TYPES = (str, unicode, int, long, float, bool, types.NoneType)
+NUMERIC_TYPES = (int, long, float, bool)
+CONTAINER_TYPES = (list, tuple, set, frozenset, dict)
+
+COMPARE_OPS = {ast.Eq: operator.eq,
+               ast.NotEq: operator.ne,
+               ast.Lt: operator.lt,
+               ast.LtE: operator.le,
+               ast.Gt: operator.gt,
+               ast.GtE: operator.ge,
+               ast.In: lambda a, b: a in b,
+               ast.NotIn: lambda a, b: a not in b}
+
+# Operator to use when the operands of a comparison are swapped
+MIRROR_OPS = {ast.Eq: ast.Eq, ast.NotEq: ast.NotEq,
+              ast.Lt: ast.Gt, ast.LtE: ast.GtE,
+              ast.Gt: ast.Lt, ast.GtE: ast.LtE}
+
+# Constructs that would bind names in the evaluation namespace
+BINDING_NODES = (ast.Lambda, ast.ListComp, ast.GeneratorExp, ast.DictComp, ast.SetComp)
+
+
+class MatchEngineError(Exception):
+    """Raised when a match expression cannot be handled by the engine"""
+    pass
+
+
+def classify(value):
+    """Return the outcome class of an evaluated value"""
+    if value:
+        if value == True:
+            return TRUE
+        return TRUTHY
+    if value == False:
+        return FALSE
+    return FALSY
+
+
+def error_record():
+    """Summarize the exception being handled the same way countMatch does
+
+    @return: tuple (is_key_error, info) where info is the missing key for
+        KeyError and the formatted traceback for all the other exceptions
+    """
+    exc_info = sys.exc_info()
+    tb = traceback.format_exception(exc_info[0], exc_info[1], exc_info[2])
+    if issubclass(exc_info[0], KeyError):
+        return (True, ((tb[-1].split(':'))[1]).strip())
+    return (False, tb)
+
+
+def is_nan(value):
+    return isinstance(value, float) and value != value
+
+
+class Outcome(object):
+    """Result of the evaluation of a node over a set of clusters
+
+    sets is a list indexed by the outcome class (TRUE, TRUTHY, FALSE, FALSY),
+    each element is the set of cluster indexes evaluating to that class
+    errors is a dictionary cluster index -> output of error_record()
+    """
+    __slots__ = ('sets', 'errors')
+
+    def __init__(self):
+        self.sets = [set(), set(), set(), set()]
+        self.errors = {}
+
+    def restrict(self, clusters):
+        """Return a new Outcome containing only the clusters in the set"""
+        out = Outcome()
+        for cls in (TRUE, TRUTHY, FALSE, FALSY):
+            out.sets[cls] = self.sets[cls] & clusters
+        if len(self.errors) < len(clusters):
+            out.errors = dict([(i, e) for i, e in self.errors.iteritems() if i in clusters])
+        else:
+            out.errors = dict([(i, self.errors[i]) for i in clusters if i in self.errors])
+        return out
+
+
+############################################################
+#
+# Evaluation plan nodes
+#
+
+class EntryNode(object):
+    """Sub-expression not depending on the job, evaluated once per entry"""
+
+    def __init__(self, code):
+        self.code = code
+
+    def evaluate(self, matcher, clusters):
+        out = Outcome()
+        try:
+            cls = classify(eval(self.code, matcher.eval_globals, matcher.entry_ns))
+        except Exception:
+            out.errors = dict.fromkeys(clusters, error_record())
+        else:
+            out.sets[cls] = set(clusters)
+        return out
+
+
+class JobNode(object):
+    """Sub-expression not depending on the entry, evaluated once per job cluster"""
+
+    def __init__(self, code):
+        self.code = code
+
+    def build(self, matcher):
+        out = Outcome()
+        ns = dict(matcher.job_ns)
+        for i, job in enumerate(matcher.jobs):
+            ns[JOB_NAME] = job
+            try:
+                out.sets[classify(eval(self.code, matcher.eval_globals, ns))].add(i)
+            except Exception:
+                out.errors[i] = error_record()
+        return out
+
+    def evaluate(self, matcher, clusters):
+        return matcher.get_index(self).restrict(clusters)
+
+
+class PairNode(object):
+    """Sub-expression that has to be evaluated for each (entry, cluster) pair"""
+
+    def __init__(self, code):
+        self.code = code
+
+    def evaluate(self, matcher, clusters):
+        out = Outcome()
+        ns = dict(matcher.entry_ns)
+        jobs = matcher.jobs
+        for i in clusters:
+            ns[JOB_NAME] = jobs[i]
+            try:
+                out.sets[classify(eval(self.code, matcher.eval_globals, ns))].add(i)
+            except Exception:
+                out.errors[i] = error_record()
+        return out
+
+
+class AndNode(object):
+    def __init__(self, children):
+        self.children = children
+
+    def evaluate(self, matcher, clusters):
+        out = Outcome()
+        remaining = clusters
+        last = len(self.children) - 1
+        for idx, child in enumerate(self.children):
+            if not remaining:
+                break
+            res = child.evaluate(matcher, remaining)
+            out.errors.update(res.errors)
+            out.sets[FALSE] |= res.sets[FALSE]
+            out.sets[FALSY] |= res.sets[FALSY]
+            if idx == last:
+                out.sets[TRUE] = res.sets[TRUE]
+                out.sets[TRUTHY] = res.sets[TRUTHY]
+            else:
+                remaining = res.sets[TRUE] | res.sets[TRUTHY]
+        return out
+
+
+class OrNode(object):
+    def __init__(self, children):
+        self.children = children
+
+    def evaluate(self, matcher, clusters):
+        out = Outcome()
+        remaining = clusters
+        last = len(self.children) - 1
+        for idx, child in enumerate(self.children):
+            if not remaining:
+                break
+            res = child.evaluate(matcher, remaining)
+            out.errors.update(res.errors)
+            out.sets[TRUE] |= res.sets[TRUE]
+            out.sets[TRUTHY] |= res.sets[TRUTHY]
+            if idx == last:
+                out.sets[FALSE] = res.sets[FALSE]
+                out.sets[FALSY] = res.sets[FALSY]
+            else:
+                remaining = res.sets[FALSE] | res.sets[FALSY]
+        return out
+
+
+class NotNode(object):
+    def __init__(self, child):
+        self.child = child
+
+    def evaluate(self, matcher, clusters):
+        res = self.child.evaluate(matcher, clusters)
+        out = Outcome()
+        out.errors = res.errors
+        out.sets[FALSE] = res.sets[TRUE] | res.sets[TRUTHY]
+        out.sets[TRUE] = res.sets[FALSE] | res.sets[FALSY]
+        return out
+
+
+class CompareIndex(object):
+    """Indexes over the values of the job side of a comparison
+
+    values: list of the job side value for each cluster (None for errors)
+    errors: dictionary cluster index -> error_record()
+    by_value: dictionary value -> set of clusters, for primitive values (equality lookups)
+    by_type_value: dictionary (type, value) -> set of clusters, for primitive values
+        (one evaluation per distinct value)
+    primitive: set of clusters with a primitive value
+    odd: set of clusters with a value that is not primitive (evaluated one by one)
+    numeric_vals, numeric_idx: sorted numeric values and corresponding clusters (ranges)
+    non_numeric_groups: list of the by_type_value groups with a non numeric value
+    """
+
+    def __init__(self, node, matcher):
+        self.values = [None] * len(matcher.jobs)
+        self.errors = {}
+        self.by_value = {}
+        self.by_type_value = {}
+        self.primitive = set()
+        self.odd = set()
+        numeric = []
+        ns = dict(matcher.job_ns)
+        for i, job in enumerate(matcher.jobs):
+            ns[JOB_NAME] = job
+            try:
+                val = eval(node.job_code, matcher.eval_globals, ns)
+            except Exception:
+                self.errors[i] = error_record()
+                continue
+            self.values[i] = val
+            if type(val) in PRIMITIVE_TYPES and not is_nan(val):
+                self.primitive.add(i)
+                self.by_value.setdefault(val, set()).add(i)
+                self.by_type_value.setdefault((type(val), val), set()).add(i)
+                if type(val) in NUMERIC_TYPES:
+                    numeric.append((val, i))
+            else:
+                self.odd.add(i)
+        numeric.sort()
+        self.numeric_vals = [el[0] for el in numeric]
+        self.numeric_idx = [el[1] for el in numeric]
+        self.non_numeric_groups = [group for key, group in self.by_type_value.iteritems()
+                                   if key[0] not in NUMERIC_TYPES]
+
+
+class CompareNode(object):
+    """Comparison between a job-only and an entry-only operand"""
+
+    def __init__(self, op_type, job_code, entry_code, job_left):
+        self.op_type = op_type
+        self.op = COMPARE_OPS[op_type]
+        self.job_code = job_code
+        self.entry_code = entry_code
+        self.job_left = job_left
+
+    def build(self, matcher):
+        return CompareIndex(self, matcher)
+
+    def apply(self, job_val, entry_val):
+        if self.job_left:
+            return self.op(job_val, entry_val)
+        return self.op(entry_val, job_val)
+
+    def evaluate(self, matcher, clusters):
+        out = Outcome()
+        try:
+            entry_val = eval(self.entry_code, matcher.eval_globals, matcher.entry_ns)
+        except Exception:
+            entry_err = error_record()
+        else:
+            entry_err = None
+
+        index = matcher.get_index(self)
+        if entry_err is not None and not self.job_left:
+            # the entry side is evaluated first
+            out.errors = dict.fromkeys(clusters, entry_err)
+            return out
+        for i in clusters:
+            if i in index.errors:
+                out.errors[i] = index.errors[i]
+        if entry_err is not None:
+            for i in clusters:
+                if i not in out.errors:
+                    out.errors[i] = entry_err
+            return out
+
+        matched = self.indexed_match(index, entry_val)
+        if matched is None:
+            # no index can be used with this entry value, one evaluation per distinct value
+            self.generic_match(index, entry_val, index.by_type_value.itervalues(), out)
+        else:
+            primitive = index.primitive & clusters
+            out.sets[TRUE] = matched & primitive
+            out.sets[FALSE] = primitive - out.sets[TRUE]
+        self.odd_match(index, entry_val, index.odd & clusters, out)
+        return out.restrict(clusters)
+
+    def indexed_match(self, index, entry_val):
+        """Return the set of primitive clusters matching the entry value using the indexes
+
+        @return: set of clusters, None if the indexes cannot be used for this value
+        """
+        if type(entry_val) in PRIMITIVE_TYPES and is_nan(entry_val):
+            return None
+        op_type = self.op_type
+        if op_type in (ast.In, ast.NotIn):
+            if not self.job_left or type(entry_val) not in CONTAINER_TYPES:
+                return None
+            # job value in a container of the entry: lookup each element
+            matched = set()
+            for el in entry_val:
+                if type(el) not in PRIMITIVE_TYPES or is_nan(el):
+                    return None
+                matched |= index.by_value.get(el, set())
+            if op_type == ast.NotIn:
+                return index.primitive - matched
+            return matched
+        if type(entry_val) not in PRIMITIVE_TYPES:
+            return None
+        if op_type in (ast.Eq, ast.NotEq):
+            matched = index.by_value.get(entry_val, set())
+            if op_type == ast.NotEq:
+                return index.primitive - matched
+            return set(matched)
+        if type(entry_val) not in NUMERIC_TYPES:
+            return None
+        # numeric range
+        if not self.job_left:
+            op_type = MIRROR_OPS[op_type]
+        vals = index.numeric_vals
+        if op_type == ast.Lt:
+            matched = set(index.numeric_idx[:bisect.bisect_left(vals, entry_val)])
+        elif op_type == ast.LtE:
+            matched = set(index.numeric_idx[:bisect.bisect_right(vals, entry_val)])
+        elif op_type == ast.Gt:
+            matched = set(index.numeric_idx[bisect.bisect_right(vals, entry_val):])
+        else:
+            matched = set(index.numeric_idx[bisect.bisect_left(vals, entry_val):])
+        if index.non_numeric_groups:
+            out = Outcome()
+            self.generic_match(index, entry_val, index.non_numeric_groups, out)
+            matched |= out.sets[TRUE]
+        return matched
+
+    def generic_match(self, index, entry_val, groups, out):
+        """Evaluate the comparison once for each group of clusters with the same value"""
+        for group in groups:
+            job_val = index.values[iter(group).next()]
+            try:
+                out.sets[classify(self.apply(job_val, entry_val))] |= group
+            except Exception:
+                err = error_record()
+                for i in group:
+                    out.errors[i] = err
+
+    def odd_match(self, index, entry_val, clusters, out):
+        """Evaluate the comparison for each of the clusters"""
+        for i in clusters:
+            try:
+                out.sets[classify(self.apply(index.values[i], entry_val))].add(i)
+            except Exception:
+                out.errors[i] = error_record()
+
+
+############################################################
+#
+# Engine
+#
+
+def get_deps(node):
+    """Return the set of the special names (job, glidein) used in the node"""
+    deps = set()
+    for el in ast.walk(node):
+        if isinstance(el, ast.Name) and el.id in (JOB_NAME, GLIDEIN_NAME):
+            deps.add(el.id)
+    return deps
+
+
+def compile_node(node):
+    return compile(ast.Expression(body=node), '<string>', 'eval')
+
+
+class MatchEngine(object):
+    """Evaluation plan of a match expression
+
+    The engine is immutable and can be reused across countMatch invocations
+    """
+
+    def __init__(self, match_expr, eval_globals, reserved_names=()):
+        """
+        @param match_expr: match expression (string)
+        @param eval_globals: globals used when evaluating the expression
+        @param reserved_names: names that would resolve to something different
+            than eval_globals when evaluated in the original context (e.g. the
+            local variables of countMatch). If used the expression is not supported
+        @raise MatchEngineError: if the expression cannot be handled by the engine
+        """
+        try:
+            tree = ast.parse(match_expr.strip(), '<string>', 'eval')
+        except SyntaxError as e:
+            raise MatchEngineError("Invalid match expression: %s" % e)
+        self.eval_globals = eval_globals
+        builtins = eval_globals.get('__builtins__', __builtins__)
+        if isinstance(builtins, types.ModuleType):
+            builtins = builtins.__dict__
+        for node in ast.walk(tree.body):
+            if isinstance(node, BINDING_NODES):
+                raise MatchEngineError("Unsupported construct in match expression: %s" % type(node).__name__)
+            if isinstance(node, ast.Name):
+                if node.id in (JOB_NAME, GLIDEIN_NAME, ATTR_DICT_NAME):
+                    continue
+                if node.id in reserved_names or not (node.id in eval_globals or node.id in builtins):
+                    raise MatchEngineError("Unsupported name in match expression: %s" % node.id)
+        self.root = self.build_node(tree.body)
+
+    def build_node(self, node):
+        deps = get_deps(node)
+        if JOB_NAME not in deps:
+            return EntryNode(compile_node(node))
+        if GLIDEIN_NAME not in deps:
+            return JobNode(compile_node(node))
+        if isinstance(node, ast.BoolOp):
+            children = [self.build_node(el) for el in node.values]
+            if isinstance(node.op, ast.And):
+                return AndNode(children)
+            return OrNode(children)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return NotNode(self.build_node(node.operand))
+        if (isinstance(node, ast.Compare) and len(node.ops) == 1 and
+                type(node.ops[0]) in COMPARE_OPS):
+            left_deps = get_deps(node.left)
+            right_deps = get_deps(node.comparators[0])
+            if GLIDEIN_NAME not in left_deps and JOB_NAME not in right_deps:
+                return CompareNode(type(node.ops[0]), compile_node(node.left),
+                                   compile_node(node.comparators[0]), True)
+            if JOB_NAME not in left_deps and GLIDEIN_NAME not in right_deps:
+                return CompareNode(type(node.ops[0]), compile_node(node.comparators[0]),
+                                   compile_node(node.left), False)
+        return PairNode(compile_node(node))
+
+    def bind(self, jobs, attr_dict):
+        """Return a ClusterMatcher for the list of job clusters
+
+        @param jobs: list of jobs, one representative job per cluster
+        @param attr_dict: dictionary of constant attributes
+        """
+        return ClusterMatcher(self, jobs, attr_dict)
+
+
+class ClusterMatcher(object):
+    """Match entries against a fixed list of job clusters
+
+    Job side values and indexes are computed lazily and reused for all the entries
+    """
+
+    def __init__(self, engine, jobs, attr_dict):
+        self.engine = engine
+        self.eval_globals = engine.eval_globals
+        self.jobs = jobs
+        self.all_clusters = frozenset(range(len(jobs)))
+        self.job_ns = {ATTR_DICT_NAME: attr_dict}
+        self.entry_ns = {ATTR_DICT_NAME: attr_dict}
+        self.indexes = {}
+
+    def get_index(self, node):
+        try:
+            return self.indexes[id(node)]
+        except KeyError:
+            index = node.build(self)
+            self.indexes[id(node)] = index
+            return index
+
+    def match(self, glidein, match_policies=[], clusters=None):
+        """Find the job clusters matching the entry
+
+        Policies are applied to the clusters matching the expression,
+        with the same semantics used by countMatch
+
+        @param glidein: the entry (element of glidein_dict)
+        @param match_policies: list of MatchPolicy objects
+        @param clusters: set of the cluster indexes to evaluate, None for all
+        @return: tuple (set of matching cluster indexes, dictionary cluster index -> error_record())
+        """
+        if clusters is None:
+            clusters = self.all_clusters
+        self.entry_ns[GLIDEIN_NAME] = glidein
+        res = self.engine.root.evaluate(self, clusters)
+        errors = res.errors
+        if not match_policies:
+            return res.sets[TRUE], errors
+
+        matched = set()
+        for i in res.sets[TRUTHY] | res.sets[FALSY]:
+            # Non boolean results should be discarded and logged
+            logSupport.log.warning("Match expression from policy file '%s' evaluated to non boolean result; assuming False" % match_policies[0].file)
+        for i in res.sets[TRUE]:
+            job = self.jobs[i]
+            try:
+                match = True
+                for policy in match_policies:
+                    if match == True:
+                        # Policies are supposed to be ANDed
+                        match = (match and policy.pyObject.match(job, glidein))
+                    else:
+                        if match != False:
+                            logSupport.log.warning("Match expression from policy file '%s' evaluated to non boolean result; assuming False" % policy.file)
+                        break
+                if match == True:
+                    matched.add(i)
+            except Exception:
+                errors[i] = error_record()
+        return matched, errors
+
+
+# Engines are immutable, cache them by expression
+_engine_cache = {}
+
+
+def get_match_engine(match_expr, eval_globals, reserved_names=()):
+    """Return the MatchEngine for the expression, creating it if needed
+
+    @raise MatchEngineError: if the expression cannot be handled by the engine
+    """
+    key = (match_expr, id(eval_globals))
+    try:
+        engine = _engine_cache[key]
+    except KeyError:
+        try:
+            engine = MatchEngine(match_expr, eval_globals, reserved_names)
+        except MatchEngineError as e:
+            engine = e
+        _engine_cache[key] = engine
+    if isinstance(engine, MatchEngineError):
+        raise engine
+    return engine
+
+
+############################################################
+#
+# Match memo
+#
+
+# Entry attributes changing at every advertisement of the factory,
+# not included in the entry fingerprint.
+# The memo is not used if the match expression or the policies use them,
+# or the factory monitoring values (glidein['monitor'])
+MEMO_IGNORED_ATTRS = ('LastHeardFrom',)
+MEMO_IGNORED_NAMES = ('monitor',) + MEMO_IGNORED_ATTRS
+
+# Change it if the content of the memo changes
+MEMO_FORMAT = 1
+
+
+def get_match_version(match_expr, match_policies, attr_dict):
+    """Return a string identifying the match configuration
+
+    Memo results are valid only for the same match expression,
+    policies (content of the files) and constant attributes
+    """
+    policies = []
+    for policy in match_policies:
+        try:
+            with open(policy.file) as fd:
+                policies.append((policy.file, hashlib.md5(fd.read()).hexdigest()))
+        except (IOError, TypeError):
+            # without the content any change may be missed
+            return None
+    return hashlib.md5(repr((MEMO_FORMAT, match_expr, policies,
+                             sorted(attr_dict.items())))).hexdigest()
+
+
+def get_memo_ignored_names(match_expr, match_policies):
+    """Return the values not in the entry fingerprint (MEMO_IGNORED_NAMES)
+    mentioned in the match expression or in the policy files
+
+    @return: list of names, empty if the memo can be used
+    """
+    sources = [match_expr]
+    for policy in match_policies:
+        try:
+            with open(policy.file) as fd:
+                sources.append(fd.read())
+        except (IOError, TypeError):
+            # get_match_version disables the memo
+            pass
+    return [name for name in MEMO_IGNORED_NAMES if [src for src in sources if name in src]]
+
+
+def get_entry_fingerprint(glidein):
+    """Return a string identifying the attributes and parameters of the entry
+
+    @param glidein: the entry (element of glidein_dict)
+    """
+    attrs = sorted([el for el in glidein['attrs'].iteritems() if el[0] not in MEMO_IGNORED_ATTRS])
+    params = sorted(glidein.get('params', {}).items())
+    return hashlib.md5(repr((attrs, params))).hexdigest()
+
+
+class MatchMemo(object):
+    """Results of the match of the job clusters with the entries, kept across iterations
+
+    For each entry fingerprint there are the sets of the job cluster hashes (hashJob)
+    matching and not matching it. The least recently used entries are dropped
+    when there are more than max_size (job cluster, entry) pairs.
+
+    countMatch runs in subprocesses: the new results and the clusters seen
+    are returned with get_update() and merged in the parent with merge_update().
+    Evaluation errors are not remembered.
+    """
+
+    def __init__(self, max_size, version):
+        self.max_size = max_size
+        self.version = version
+        self.entries = OrderedDict()   # fingerprint -> (matching set, not matching set)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.new_results = {}          # results added since the last get_update
+        self.seen_clusters = set()
+
+    @classmethod
+    def from_state(cls, state, max_size, version):
+        """Create the memo from the output of get_state, discarding it if the version is different"""
+        memo = cls(max_size, version)
+        if state and state.get('version') == version and version is not None:
+            for fingerprint, (matching, not_matching) in state['entries']:
+                memo.add_results(fingerprint, matching, not_matching)
+        return memo
+
+    def get_state(self):
+        """Return the content of the memo, to be saved in the history file"""
+        return {'version': self.version, 'entries': self.entries.items()}
+
+    def add_results(self, fingerprint, matching, not_matching):
+        try:
+            old_matching, old_not_matching = self.entries.pop(fingerprint)
+        except KeyError:
+            old_matching, old_not_matching = set(), set()
+        else:
+            self.size -= len(old_matching) + len(old_not_matching)
+        old_matching |= matching
+        old_not_matching |= not_matching
+        old_matching -= not_matching
+        old_not_matching -= matching
+        self.entries[fingerprint] = (old_matching, old_not_matching)
+        self.size += len(old_matching) + len(old_not_matching)
+        while self.size > self.max_size and self.entries:
+            # drop the least recently used entry
+            fingerprint, (dropped_matching, dropped_not_matching) = self.entries.popitem(last=False)
+            self.size -= len(dropped_matching) + len(dropped_not_matching)
+
+    def match(self, cluster_matcher, jh_idxs, glidein, match_policies=[]):
+        """Like cluster_matcher.match, evaluating only the clusters not in the memo
+
+        @param cluster_matcher: ClusterMatcher of the job clusters
+        @param jh_idxs: dictionary job cluster hash -> list of the cluster indexes
+            of cluster_matcher with that hash (the same hash can be in more schedds)
+        @return: tuple (set of matching cluster indexes, dictionary cluster index -> error_record())
+        """
+        current = jh_idxs.viewkeys()
+        self.seen_clusters.update(jh_idxs)
+
+        fingerprint = get_entry_fingerprint(glidein)
+        try:
+            matching, not_matching = self.entries.pop(fingerprint)
+        except KeyError:
+            matching = set()
+            todo = set(current)
+        else:
+            # now the most recently used
+            self.entries[fingerprint] = (matching, not_matching)
+            todo = current - matching - not_matching
+        self.hits += len(current) - len(todo)
+        self.misses += len(todo)
+
+        matched = set()
+        for jh in matching.intersection(current):
+            matched.update(jh_idxs[jh])
+        errors = {}
+        if todo:
+            todo_idxs = set()
+            for jh in todo:
+                todo_idxs.update(jh_idxs[jh])
+            new_matched, errors = cluster_matcher.match(glidein, match_policies, todo_idxs)
+            matched |= new_matched
+            new_matching = set()
+            new_not_matching = set()
+            for jh in todo:
+                idxs = jh_idxs[jh]
+                if [idx for idx in idxs if idx in errors]:
+                    continue
+                if idxs[0] in new_matched:
+                    new_matching.add(jh)
+                else:
+                    new_not_matching.add(jh)
+            self.add_results(fingerprint, new_matching, new_not_matching)
+            if fingerprint not in self.new_results:
+                self.new_results[fingerprint] = (set(), set())
+            self.new_results[fingerprint][0].update(new_matching)
+            self.new_results[fingerprint][1].update(new_not_matching)
+        return matched, errors
+
+    def get_update(self):
+        """Return the results added and the clusters seen since the last call, and reset them"""
+        update = (self.new_results, self.seen_clusters, self.hits, self.misses)
+        self.new_results = {}
+        self.seen_clusters = set()
+        self.hits = 0
+        self.misses = 0
+        return update
+
+    def merge_update(self, update):
+        """Add the results and the counts of get_update (e.g. from a subprocess)"""
+        new_results, seen_clusters, hits, misses = update
+        for fingerprint, (matching, not_matching) in new_results.iteritems():
+            self.add_results(fingerprint, matching, not_matching)
+        self.seen_clusters |= seen_clusters
+        self.hits += hits
+        self.misses += misses
+
+    def prune(self, clusters):
+        """Forget the job clusters not in the set, e.g. the ones no more in the queues"""
+        self.size = 0
+        for fingerprint, (matching, not_matching) in self.entries.iteritems():
+            matching &= clusters
+            not_matching &= clusters
+            self.size += len(matching) + len(not_matching)
@@ -97,7 +97,23 @@ class MonitoringConfig:
                 logSupport.log.error("Failed to update %s" % fname)
                 #logSupport.log.exception(traceback.format_exc())
         return
-    
+
+    def use_rrd_write_behind(self):
+        """
+        Queue the RRD updates and write them in batches when flush_rrd is called
+        """
+        self.rrd_obj=rrdSupport.write_behind(self.rrd_obj)
+
+    def flush_rrd(self):
+        """
+        Write the RRD updates queued in write-behind mode, logging the failed ones
+        """
+        nr_updates, nr_calls, errors=self.rrd_obj.flush()
+        for fname, msg in errors:
+            logSupport.log.error("Failed to update %s: %s" % (fname, msg))
+        if nr_updates > 0:
+            logSupport.log.debug("Wrote %i RRD updates using %i rrdtool calls" % (nr_updates, nr_calls))
+
 
 #########################################################################################################################################
 #
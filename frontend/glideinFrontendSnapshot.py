@@ -0,0 +1,370 @@
+#
+# Project:
+#   glideinWMS
+#
+# File Version:
+#
+# Description:
+#   Frontend level snapshot of the schedd queues and of the user pool
+#   (QuerySnapshot frontend option)
+#
+#   At the beginning of each iteration the frontend queries each schedd
+#   and the user collector once, with the union of the queries of all
+#   the groups, and saves the results in the snapshot directory of the
+#   work dir. The groups take the jobs and slots from the snapshot instead
+#   of querying HTCondor themselves.
+#
+#   Each group saves the queries it needs (query_spec) in its history file,
+#   the snapshot is built using the ones saved in the previous iteration.
+#   A group falls back to its own queries for anything the snapshot
+#   does not cover (e.g. first iteration, failed query, changed configuration).
+#
+#   There is no ClassAd evaluator in the frontend, so the jobs of a group
+#   cannot be selected locally using its JobQueryExpr. When groups with
+#   different JobQueryExpr share a schedd, the full classads are fetched
+#   once, using the OR of all the expressions, and each expression is
+#   evaluated by the schedd with a query returning only the job ids.
+#
+
+import os
+import re
+
+from glideinwms.lib import condorMonitor
+from glideinwms.lib import logSupport
+from glideinwms.lib import util
+from glideinwms.lib.fork import ForkManager, ForkResultError
+from glideinwms.frontend import glideinFrontendConfig
+from glideinwms.frontend import glideinFrontendLib
+
+SNAPSHOT_DIR = "snapshot"
+STATUS_FNAME = "condor_status.pk"
+# attributes identifying a job, the keys of the CondorQ data
+JOB_ID_FORMAT_LIST = [('ClusterId', 'i'), ('ProcId', 'i')]
+# attributes used to count all the slots (same as glideinFrontendElement.get_condor_status)
+COUNT_FORMAT_LIST = [('State', 's'), ('Activity', 's'), ('PartitionableSlot', 's'),
+                     ('TotalSlots', 'i'), ('Cpus', 'i'), ('Memory', 'i')]
+
+
+class SnapshotQuery(condorMonitor.StoredQuery):
+    """
+    Query result taken from the snapshot,
+    can be used like a loaded CondorQ or CondorStatus
+    """
+    def __init__(self, stored_data):
+        self.stored_data = stored_data
+
+
+############################################################
+#
+# Snapshot files
+#
+############################################################
+
+def get_snapshot_dir(work_dir):
+    return os.path.join(work_dir, SNAPSHOT_DIR)
+
+
+def get_condorq_fname(work_dir, schedd_name):
+    return os.path.join(get_snapshot_dir(work_dir),
+                        "condor_q_%s.pk" % re.sub(r'[^A-Za-z0-9_.@-]', '_', schedd_name))
+
+
+def get_status_fname(work_dir):
+    return os.path.join(get_snapshot_dir(work_dir), STATUS_FNAME)
+
+
+def format_names(format_list):
+    return set([el[0] for el in format_list])
+
+
+def clean_snapshot(work_dir):
+    """Remove the snapshot of the previous iteration, create the directory if needed"""
+    snapshot_dir = get_snapshot_dir(work_dir)
+    if not os.path.isdir(snapshot_dir):
+        os.mkdir(snapshot_dir)
+        return
+    for fname in os.listdir(snapshot_dir):
+        try:
+            os.unlink(os.path.join(snapshot_dir, fname))
+        except OSError:
+            logSupport.log.warning("Could not remove old snapshot file %s" % fname)
+
+
+def load_file(fname):
+    try:
+        return util.file_pickle_load(fname)
+    except:
+        # missing if the frontend did not (or could not) query this
+        return None
+
+
+############################################################
+#
+# Frontend side
+#
+############################################################
+
+def get_query_specs(work_dir, groups):
+    """Return the queries saved by the groups in their last iteration
+
+    @return: dictionary {group_name: query_spec}, groups without spec are missing
+    """
+    specs = {}
+    for group_name in groups:
+        history_obj = glideinFrontendConfig.HistoryFile(work_dir, group_name, True, dict)
+        if 'query_spec' in history_obj:
+            specs[group_name] = history_obj['query_spec']
+    return specs
+
+
+def merge_format_lists(format_lists):
+    """Union of format lists, keeping the order and the first type found for each attribute"""
+    out_format_list = []
+    for format_list in format_lists:
+        out_format_list = condorMonitor.complete_format_list(out_format_list, format_list)
+    return out_format_list
+
+
+def snapshot_schedd(work_dir, schedd_name, constraints, format_list):
+    """Query the jobs of schedd_name for all the groups and save them
+
+    @param constraints: list of the expanded JobQueryExpr of the groups
+    @param format_list: union of the format lists of the groups
+    @return: tuple (nr queries, nr classads, bytes received or None if unknown)
+    """
+    js_constraint = glideinFrontendLib.getCondorQJobStatusConstraint()
+    full_format_list = glideinFrontendLib.completeCondorQFormatList(format_list)
+    nr_queries = 0
+    nr_ads = 0
+    nr_bytes = 0
+
+    condorq = condorMonitor.CondorQ(schedd_name)
+    if len(constraints) == 1:
+        full_constraint = "(%s) && (%s)" % (js_constraint, constraints[0])
+    else:
+        full_constraint = "(%s) && (%s)" % (js_constraint,
+                                            " || ".join(["(%s)" % el for el in constraints]))
+    condorq.load(full_constraint, full_format_list)
+    data = condorq.fetchStored()
+    nr_queries += 1
+    nr_ads += len(data)
+    if condorq.fetched_bytes is None:
+        nr_bytes = None
+    else:
+        nr_bytes += condorq.fetched_bytes
+
+    members = {}
+    if len(constraints) == 1:
+        # all the jobs
+        members[constraints[0]] = None
+    else:
+        for constraint in constraints:
+            if not data:
+                members[constraint] = set()
+                continue
+            id_query = condorMonitor.CondorQ(schedd_name)
+            id_query.load("(%s) && (%s)" % (js_constraint, constraint), JOB_ID_FORMAT_LIST)
+            members[constraint] = set(id_query.fetchStored().keys())
+            nr_queries += 1
+            nr_ads += len(members[constraint])
+            if (nr_bytes is not None) and (id_query.fetched_bytes is not None):
+                nr_bytes += id_query.fetched_bytes
+            else:
+                nr_bytes = None
+
+    util.file_pickle_dump(get_condorq_fname(work_dir, schedd_name),
+                          {'schedd_name': schedd_name,
+                           'format_names': format_names(full_format_list),
+                           'constraints': members,
+                           'data': data})
+    return nr_queries, nr_ads, nr_bytes
+
+
+def snapshot_collector(work_dir, frontend_name, format_list):
+    """Query the slots and schedds in the user pool for all the groups and save them
+
+    @param format_list: union of the status format lists of the groups
+    @return: tuple (nr queries, nr classads, bytes received or None if unknown)
+    """
+    nr_ads = 0
+    nr_bytes = 0
+    out = {'frontend_name': frontend_name}
+    full_format_list = merge_format_lists(
+        [glideinFrontendLib.completeCondorStatusFormatList(format_list), COUNT_FORMAT_LIST])
+    out['format_names'] = format_names(full_format_list)
+
+    queries = (
+        # all the slots of this frontend, the groups select their own ones
+        ('frontend', None, glideinFrontendLib.getCondorStatusTypeConstraint(True),
+         '(substr(GLIDECLIENT_Name,0,%i)=?="%s.")' % (len(frontend_name)+1, frontend_name),
+         full_format_list),
+        ('global', None, glideinFrontendLib.getCondorStatusTypeConstraint(False),
+         'True', COUNT_FORMAT_LIST),
+        ('schedds', 'schedd', 'True', None,
+         glideinFrontendLib.completeCondorStatusScheddsFormatList([])),
+        ('curb_schedds', 'schedd', 'True', 'CurbMatchmaking=?=True',
+         glideinFrontendLib.completeCondorStatusScheddsFormatList([])),
+    )
+    for key, subsystem_name, type_constraint, constraint, query_format_list in queries:
+        full_constraint = type_constraint
+        if constraint is not None:
+            full_constraint = "(%s) && (%s)" % (type_constraint, constraint)
+        # use the main collector, same as the groups
+        status = condorMonitor.CondorStatus(subsystem_name=subsystem_name)
+        status.load(full_constraint, query_format_list)
+        out[key] = status.fetchStored()
+        nr_ads += len(out[key])
+        if (nr_bytes is not None) and (status.fetched_bytes is not None):
+            nr_bytes += status.fetched_bytes
+        else:
+            nr_bytes = None
+
+    util.file_pickle_dump(get_status_fname(work_dir), out)
+    return len(queries), nr_ads, nr_bytes
+
+
+def make_snapshot(work_dir, frontend_name, groups):
+    """Query the schedds and the user collector once for all the groups
+
+    To be called before starting the groups.
+    Queries that fail are not saved, the groups will do them.
+
+    @return: dictionary of counters with the number of queries, classads and bytes
+      received from the schedds (condor_q) and the collector (condor_status).
+      Bytes are available only when using the HTCondor commands
+    """
+    clean_snapshot(work_dir)
+    counters = {}
+    specs = get_query_specs(work_dir, groups)
+    if not specs:
+        logSupport.log.info("No group query information available yet, skipping the snapshot")
+        return counters
+
+    # schedd_name -> (list of constraints, list of format lists)
+    schedd_queries = {}
+    status_format_lists = []
+    for group_name in sorted(specs.keys()):
+        spec = specs[group_name]
+        for schedd_name in spec['schedds']:
+            if schedd_name == '':
+                continue
+            constraints, schedd_format_lists = schedd_queries.setdefault(schedd_name, ([], []))
+            if spec['condorq_constraint'] not in constraints:
+                constraints.append(spec['condorq_constraint'])
+            schedd_format_lists.append(spec['condorq_format_list'])
+        status_format_lists.append(spec['status_format_list'])
+
+    forkm_obj = ForkManager()
+    for schedd_name in schedd_queries:
+        constraints, schedd_format_lists = schedd_queries[schedd_name]
+        forkm_obj.add_fork(('schedd', schedd_name), snapshot_schedd, work_dir, schedd_name,
+                           constraints, merge_format_lists(schedd_format_lists))
+    forkm_obj.add_fork(('collector', None), snapshot_collector, work_dir, frontend_name,
+                       merge_format_lists(status_format_lists))
+    try:
+        results = forkm_obj.fork_and_collect()
+    except ForkResultError as e:
+        logSupport.log.warning("%i snapshot queries failed, the groups will query themselves" % e.nr_errors)
+        results = e.good_results
+
+    for query_type, exe_name in (('schedd', 'condor_q'), ('collector', 'condor_status')):
+        nr_queries = 0
+        nr_ads = 0
+        nr_bytes = 0
+        for key in results:
+            if key[0] == query_type:
+                nr_queries += results[key][0]
+                nr_ads += results[key][1]
+                if (nr_bytes is not None) and (results[key][2] is not None):
+                    nr_bytes += results[key][2]
+                else:
+                    nr_bytes = None
+        counters['snapshot_%s_queries' % exe_name] = nr_queries
+        counters['snapshot_%s_classads' % exe_name] = nr_ads
+        if nr_bytes is not None:
+            counters['snapshot_%s_bytes' % exe_name] = nr_bytes
+
+    logSupport.log.info("Snapshot of %i schedds and the user collector done: %s" % (len(schedd_queries), counters))
+    return counters
+
+
+############################################################
+#
+# Group side
+#
+############################################################
+
+class GroupSnapshot:
+    """Part of the frontend snapshot used by a group"""
+
+    def __init__(self, work_dir, frontend_name, group_name, query_spec):
+        """Load the snapshot data matching the queries of the group
+
+        @param query_spec: queries of the group, see glideinFrontendElement.get_query_spec
+        """
+        self.work_dir = work_dir
+        self.frontend_name = frontend_name
+        self.group_name = group_name
+        self.query_spec = query_spec
+
+        # schedd_name -> SnapshotQuery, only for schedds with jobs
+        self.condorq_dict = {}
+        # all the schedds found in the snapshot
+        self.schedds = set()
+        self.status = None
+
+        self.load_condorq()
+        self.load_status()
+
+    def load_condorq(self):
+        constraint = self.query_spec['condorq_constraint']
+        needed_names = format_names(glideinFrontendLib.completeCondorQFormatList(
+            self.query_spec['condorq_format_list']))
+        for schedd_name in self.query_spec['schedds']:
+            snap = load_file(get_condorq_fname(self.work_dir, schedd_name))
+            if ((snap is None) or (snap['schedd_name'] != schedd_name) or
+                    (constraint not in snap['constraints']) or
+                    (not needed_names.issubset(snap['format_names']))):
+                continue
+            self.schedds.add(schedd_name)
+            members = snap['constraints'][constraint]
+            data = snap['data']
+            if members is not None:
+                data = dict([(jid, data[jid]) for jid in members if jid in data])
+            # same as glideinFrontendLib.getCondorQConstrained, only schedds with jobs
+            if len(data) > 0:
+                self.condorq_dict[schedd_name] = SnapshotQuery(data)
+
+    def load_status(self):
+        needed_names = format_names(glideinFrontendLib.completeCondorStatusFormatList(
+            self.query_spec['status_format_list']))
+        snap = load_file(get_status_fname(self.work_dir))
+        if ((snap is None) or (snap['frontend_name'] != self.frontend_name) or
+                (not needed_names.issubset(snap['format_names']))):
+            return
+        self.status = snap
+
+    def has_schedd(self, schedd_name):
+        return schedd_name in self.schedds
+
+    def has_status(self):
+        return self.status is not None
+
+    def get_status_dicts(self):
+        """Return the condor_status results in the form returned by glideinFrontendLib
+
+        @return: tuple of dictionaries {collector: query} with the slots of the group,
+          of the frontend, all the slots, the schedds, the schedds with CurbMatchmaking
+        """
+        client_name = "%s.%s" % (self.frontend_name, self.group_name)
+        fe_data = self.status['frontend']
+        group_data = dict([(k, fe_data[k]) for k in fe_data if fe_data[k].get('GLIDECLIENT_Name') == client_name])
+        out = []
+        for data in (group_data, fe_data, self.status['global'],
+                     self.status['schedds'], self.status['curb_schedds']):
+            # same as glideinFrontendLib.getCondorStatusConstrained, only collectors with classads
+            if len(data) > 0:
+                out.append({None: SnapshotQuery(data)})
+            else:
+                out.append({})
+        return tuple(out)
@@ -10,8 +10,10 @@ from __future__ import absolute_import
 # 
 
 import os
+import re
 import time
 import string
+import hashlib
 from . import logSupport
 from . import condorManager
 
@@ -126,7 +128,7 @@ class ClassadAdvertiser:
     """
 
 
-    def __init__(self, pool=None, multi_support=False, tcp_support=False):
+    def __init__(self, pool=None, multi_support=False, tcp_support=False, batch_size=0):
         """
         Constructor
 
@@ -134,6 +136,8 @@ class ClassadAdvertiser:
         @param pool: Collector address
         @type multi_support: bool 
         @param multi_support: True if the installation support advertising multiple classads with one condor_advertise command. Defaults to False.
+        @type batch_size: int
+        @param batch_size: Max number of classads per update when using the python bindings, 0 for all. Defaults to 0.
         """
 
         # Dictionary of classad objects
@@ -142,6 +146,7 @@ class ClassadAdvertiser:
         self.multiAdvertiseSupport = multi_support
         self.multiClassadDelimiter = '\n'
         self.tcpAdvertiseSupport = tcp_support
+        self.advertiseBatchSize = batch_size
 
         # Following data members should be overridden.
         # Use generic defaults here.
@@ -243,6 +248,20 @@ class ClassadAdvertiser:
             raise RuntimeError('Failed advertising %s classads' % self.adType)
 
 
+    def doAdvertiseString(self, ads_str):
+        """
+        Advertise the classad(s) in the string, in memory when the python bindings are available
+
+        @type ads_str: string
+        @param ads_str: Classad(s), separated by empty lines
+        """
+
+        condorManager.condorAdvertiseString(ads_str, self.adAdvertiseCmd,
+                                            self.tcpAdvertiseSupport, self.multiAdvertiseSupport,
+                                            self.pool, self.advertiseBatchSize,
+                                            fname_prefix=self.advertiseFilePrefix)
+
+
     def advertiseClassads(self, ads=None):
         """
         Advertise multiple classads to the pool
@@ -258,8 +277,9 @@ class ClassadAdvertiser:
         logSupport.log.info("There are %i classads to advertise" % len(ads))
 
         if self.multiAdvertiseSupport:
-            fname = self.classadsToFile(ads)
-            self.doAdvertise(fname)
+            # Condor uses an empty line as classad delimiter
+            self.doAdvertiseString(string.join(['%s%s' % (self.classads[ad], self.multiClassadDelimiter)
+                                                for ad in ads], ''))
         else:
             # There is no multi advertise support.
             # Advertise one classad at a time.
@@ -275,8 +295,7 @@ class ClassadAdvertiser:
         @param ad: Name of the classad
         """
 
-        fname = self.classadToFile(ad)
-        self.doAdvertise(fname)
+        self.doAdvertiseString('%s' % self.classads[ad])
 
 
     def advertiseAllClassads(self):
@@ -315,24 +334,10 @@ class ClassadAdvertiser:
         @param type: Condor constraints for filtering the classads
         """
 
-        try:
-            fname = self.getUniqClassadFilename()
-            fd = file(fname, "w")
-            try:
-                fd.write('MyType = "Query"\n')
-                fd.write('TargetType = "%s"\n' % self.adType)
-                fd.write('Requirements = %s' % constraint)
-            finally:
-                fd.close()
-
-            exe_condor_advertise(fname, self.adInvalidateCmd, self.pool,
-                                 is_multi=self.multiAdvertiseSupport,
-                                 use_tcp=self.tcpAdvertiseSupport)
-        finally:
-            if fd:
-                os.remove(fname)
-            else:
-                logSupport.log.error("Error creating a classad file %s" % fname)
+        query_ad = 'MyType = "Query"\nTargetType = "%s"\nRequirements = %s\n' % (self.adType, constraint)
+        condorManager.condorAdvertiseString(query_ad, self.adInvalidateCmd,
+                                            self.tcpAdvertiseSupport, self.multiAdvertiseSupport,
+                                            self.pool, fname_prefix=self.advertiseFilePrefix)
 
 
     def getAllClassads(self):
@@ -361,6 +366,226 @@ class ClassadAdvertiser:
         return generate_classad_filename(prefix=self.advertiseFilePrefix)
 
 
+###############################################################################
+# Delta advertisement
+###############################################################################
+
+# Attributes changing at every advertisement, not part of the classad content
+DELTA_VOLATILE_ATTRS = ('UpdateSequenceNumber', 'DaemonStartTime')
+
+# Empty lines separate the classads in a file
+CLASSAD_SEPARATOR_RE = re.compile(r'\n[ \t]*\n')
+
+
+class ClassadDeltaCache:
+    """
+    Fingerprints of the classads advertised by a process, used to advertise
+    again only the classads whose content changed.
+    Each classad is advertised anyhow at least every refresh_interval seconds,
+    that must be shorter than the classad lifetime in the collector (CLASSAD_LIFETIME).
+    The classads are identified by (MyType, Name).
+    """
+
+    def __init__(self, refresh_interval=0, volatile_attrs=DELTA_VOLATILE_ATTRS):
+        """
+        Constructor
+
+        @type refresh_interval: int
+        @param refresh_interval: Max seconds between two advertisements of the same classad, 0 to advertise always
+        @type volatile_attrs: tuple
+        @param volatile_attrs: Attributes not included in the fingerprint
+        """
+
+        self.refresh_interval = refresh_interval
+        self.volatile_attrs = volatile_attrs
+        # (MyType, Name) -> (fingerprint, time of the last advertisement)
+        self.sent = {}
+        self.nr_sent = 0
+        self.nr_suppressed = 0
+
+
+    @classmethod
+    def from_state(cls, state, refresh_interval):
+        """
+        Create the cache from the state saved by get_state (e.g. in a history file)
+
+        @type state: dict
+        @param state: Result of get_state, can be None
+        @type refresh_interval: int
+        @param refresh_interval: Max seconds between two advertisements of the same classad
+
+        @rtype: ClassadDeltaCache
+        """
+
+        delta_cache = cls(refresh_interval)
+        if state and delta_cache.enabled():
+            delta_cache.sent = dict(state)
+        return delta_cache
+
+
+    def get_state(self):
+        """
+        Return the fingerprints still valid, to be restored with from_state
+        """
+
+        self.prune()
+        return self.sent.copy()
+
+
+    def enabled(self):
+        return self.refresh_interval > 0
+
+
+    def prune(self, now=None):
+        """
+        Forget the classads that are due for a refresh anyway
+        """
+
+        if now is None:
+            now = time.time()
+        for key in self.sent.keys():
+            if now - self.sent[key][1] >= self.refresh_interval:
+                del self.sent[key]
+
+
+    def fingerprint(self, *parts):
+        """
+        Return the fingerprint of the content of a classad, given as strings and dictionaries
+        """
+
+        content = []
+        for part in parts:
+            if isinstance(part, dict):
+                part = sorted(part.items())
+            content.append(part)
+        return hashlib.md5(repr(content)).hexdigest()
+
+
+    def classad_fingerprint(self, ad_str):
+        """
+        Return the classad key and the fingerprint of a classad in old syntax, without the volatile attributes
+
+        @type ad_str: string
+        @param ad_str: Classad, one "attr = value" per line
+
+        @rtype: tuple
+        @return: ((MyType, Name), fingerprint)
+        """
+
+        attrs = {}
+        for line in ad_str.split('\n'):
+            arr = line.split('=', 1)
+            if len(arr) == 2:
+                attrs[arr[0].strip()] = arr[1].strip()
+        key = (attrs.get('MyType', '').strip('"'), attrs.get('Name', '').strip('"'))
+        for attr in self.volatile_attrs:
+            attrs.pop(attr, None)
+        return key, self.fingerprint(attrs)
+
+
+    def is_changed(self, key, fingerprint, now=None):
+        """
+        Check if a classad must be advertised, and count it as sent or suppressed
+
+        @type key: tuple
+        @param key: (MyType, Name) of the classad
+        @type fingerprint: string
+        @param fingerprint: Fingerprint of the content of the classad
+
+        @rtype: bool
+        @return: True if the classad changed, is new or is due for a refresh
+        """
+
+        if self.enabled():
+            if now is None:
+                now = time.time()
+            if key in self.sent:
+                last_fingerprint, last_time = self.sent[key]
+                if (last_fingerprint == fingerprint) and (now - last_time < self.refresh_interval):
+                    self.nr_suppressed += 1
+                    return False
+        self.nr_sent += 1
+        return True
+
+
+    def mark_sent(self, fingerprints, now=None):
+        """
+        Remember the classads advertised successfully
+
+        @type fingerprints: dict
+        @param fingerprints: (MyType, Name) -> fingerprint
+        """
+
+        if not self.enabled():
+            return
+        if now is None:
+            now = time.time()
+        for key in fingerprints:
+            self.sent[key] = (fingerprints[key], now)
+
+
+    def filter_classads(self, ads_str, now=None):
+        """
+        Remove the unchanged classads from a string of classads separated by empty lines
+
+        @type ads_str: string
+        @param ads_str: Classads in old syntax
+
+        @rtype: tuple
+        @return: (classads to advertise as a string, fingerprints of those classads to pass to mark_sent)
+        """
+
+        fingerprints = {}
+        changed_ads = []
+        for ad_str in CLASSAD_SEPARATOR_RE.split(ads_str):
+            if ad_str.strip() == '':
+                continue
+            key, fingerprint = self.classad_fingerprint(ad_str)
+            if self.is_changed(key, fingerprint, now):
+                fingerprints[key] = fingerprint
+                changed_ads.append(ad_str.strip('\n') + '\n')
+        return string.join(changed_ads, '\n'), fingerprints
+
+
+    def filter_file(self, fname, now=None):
+        """
+        Remove the unchanged classads from a classad file (rewritten only if needed)
+
+        @type fname: string
+        @param fname: Name of the file with the classads separated by empty lines
+
+        @rtype: dict
+        @return: Fingerprints of the classads left in the file, empty if there is nothing to advertise
+        """
+
+        fd = open(fname)
+        try:
+            ads_str = fd.read()
+        finally:
+            fd.close()
+        nr_suppressed = self.nr_suppressed
+        changed_str, fingerprints = self.filter_classads(ads_str, now)
+        if fingerprints and (self.nr_suppressed > nr_suppressed):
+            fd = open(fname, 'w')
+            try:
+                fd.write(changed_str)
+            finally:
+                fd.close()
+        return fingerprints
+
+
+    def log_stats(self, ad_type):
+        """
+        Log and reset the number of classads sent and suppressed
+        """
+
+        if self.enabled():
+            logSupport.log.info("Delta advertisement of %s classads: %i sent, %i unchanged not sent" %
+                                (ad_type, self.nr_sent, self.nr_suppressed))
+        self.nr_sent = 0
+        self.nr_suppressed = 0
+
+
 ###############################################################################
 # Generic Utility Functions used with classads
 ###############################################################################
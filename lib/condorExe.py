@@ -61,6 +61,25 @@ def exe_cmd(condor_exe, args, stdin_data=None, env={}):
     return iexe_cmd(cmd, stdin_data, env)
 
 
+#
+# Same as exe_cmd but return a generator yielding the output in chunks as it arrives
+#  (the chunks are not aligned to lines)
+# Errors are raised when iterating, UnconfigError immediately
+#
+
+# can throw UnconfigError or ExeError
+def exe_cmd_stream(condor_exe, args, stdin_data=None, env={}):
+    global condor_bin_path
+
+    if condor_bin_path is None:
+        raise UnconfigError("condor_bin_path is undefined!")
+    condor_exe_path = os.path.join(condor_bin_path, condor_exe)
+
+    cmd = "%s %s" % (condor_exe_path, args)
+
+    return iexe_cmd_stream(cmd, stdin_data, env)
+
+
 def exe_cmd_sbin(condor_exe, args, stdin_data=None, env={}):
     global condor_sbin_path
 
@@ -139,6 +158,37 @@ def iexe_cmd(cmd, stdin_data=None, child_env=None):
     return stdoutdata.splitlines()
 
 
+# can throw ExeError
+def iexe_cmd_stream(cmd, stdin_data=None, child_env=None):
+    """
+    Fork a process and execute cmd, like iexe_cmd, but yield the stdout data
+    in chunks as it arrives instead of returning all the lines at the end.
+    The errors are raised at the end of the iteration, so all the output
+    must be consumed before using it.
+
+    @type cmd: string
+    @param cmd: Sting containing the entire command including all arguments
+    @type stdin_data: string
+    @param stdin_data: Data that will be fed to the command via stdin
+    @type child_env: dict
+    @param child_env: Environment to be set before execution
+    """
+    stdout_bytes = 0
+    try:
+        for data in subprocessSupport.iexe_cmd_stream(cmd, stdin_data=stdin_data,
+                                                      child_env=child_env):
+            stdout_bytes += len(data)
+            yield data
+    except Exception as ex:
+        msg = "Unexpected Error running '%s'. Details: %s. Stdout: %i bytes already processed" % (cmd, ex, stdout_bytes)
+        try:
+            logSupport.log.debug(msg)
+            logSupport.log.debug(generate_bash_script(cmd, os.environ))
+        except:
+            pass
+        raise ExeError(msg)
+
+
 #
 # Set condor_bin_path
 #
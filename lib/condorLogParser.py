@@ -39,13 +39,21 @@ class cachedLogClass:
     (possibly by using clInit) as well as the methods
      loadFromLog, merge and isActive.
     init method to be used by real constructors
+
+    Classes using parseLog or parseLogTimings in loadFromLog can set incremental to True:
+    the parsing state is saved in the cache together with the data and,
+    if the log has only been appended to, only the new events are parsed
     """
+    incremental = False
+
     def clInit(self, logname, cache_dir, cache_ext):
         self.logname = logname
         if cache_dir is None:
             self.cachename = logname + cache_ext
         else:
             self.cachename = os.path.join(cache_dir, os.path.basename(logname)+cache_ext)
+        # logCacheData with the state of the incremental parsing
+        self.log_state = None
 
     def has_changed(self):
         """
@@ -79,6 +87,9 @@ class cachedLogClass:
             # cache is newer, just load the cache
             return self.loadCache()
 
+        if self.incremental and (self.log_state is None):
+            self.loadLogState()
+
         while True:  # could need more than one loop if the log file is changing
             fstat = os.lstat(self.logname)
             start_logtime = fstat[stat.ST_MTIME]
@@ -99,17 +110,105 @@ class cachedLogClass:
         return  # should never reach this point
         
     def loadCache(self):
-        self.data = loadCache(self.cachename)
+        data = loadCache(self.cachename)
+        if isinstance(data, logCacheData):
+            self.log_state = data
+            data = data.data
+        self.data = data
         return
 
     def loadFromLog(self):
         raise RuntimeError('loadFromLog not implemented!')
-    
+
+    def parseLog(self):
+        """
+        Parse the log with parseSubmitLogFastRaw
+        or, in incremental mode, parse only the new events
+
+        @return: a dictionary of jobStrings each having the last statusString
+        """
+        if not self.incremental:
+            return parseSubmitLogFastRaw(self.logname)
+        return self.parseLogIncremental(parseSubmitLogFastRawFrom, {})
+
+    def parseLogTimings(self):
+        """
+        Parse the log with parseSubmitLogFastRawTimings
+        or, in incremental mode, parse only the new events
+
+        @return: tuple (dictionary of jobStrings, first time, last time)
+        """
+        if not self.incremental:
+            return parseSubmitLogFastRawTimings(self.logname)
+        return self.parseLogIncremental(parseSubmitLogFastRawTimingsFrom, ({}, None, None))
+
     ####### PRIVATE ###########
     def saveCache(self):
-        saveCache(self.cachename, self.data)
+        if self.incremental and (self.log_state is not None):
+            self.log_state.data = self.data
+            saveCache(self.cachename, self.log_state)
+        else:
+            saveCache(self.cachename, self.data)
         return
 
+    def loadLogState(self):
+        """
+        Load the parsing state from the cache, if there
+        """
+        if not os.path.isfile(self.cachename):
+            return
+        try:
+            data = loadCache(self.cachename)
+        except RuntimeError:
+            return  # corrupted cache, will parse the whole log
+        if isinstance(data, logCacheData):
+            self.log_state = data
+
+    def parseLogIncremental(self, parse_function, empty_state):
+        """
+        Continue the parsing from the state in the cache.
+        The whole log is parsed if there is no state or if the log
+        has been rotated or truncated since the last time
+
+        @param parse_function: function(fname, raw_state, offset) returning (raw_state, offset)
+        @param empty_state: raw state before parsing any event
+        @return: raw state
+        """
+        fstat = os.stat(self.logname)
+        state = self.log_state
+        if ((state is not None) and (state.inode == fstat[stat.ST_INO]) and
+                (state.offset <= fstat[stat.ST_SIZE]) and
+                (state.tail == readLogTail(self.logname, state.offset))):
+            raw_state = state.raw_state
+            offset = state.offset
+        else:
+            raw_state = empty_state
+            offset = 0
+        raw_state, offset = parse_function(self.logname, raw_state, offset)
+        self.log_state = logCacheData(None, fstat[stat.ST_INO], offset,
+                                      readLogTail(self.logname, offset), raw_state)
+        return raw_state
+
+
+class logCacheData:
+    """
+    Cache content of the incremental log parsing:
+    the data plus the state needed to continue parsing the log
+    """
+    def __init__(self, data, inode, offset, tail, raw_state):
+        """
+        @param data: data of the cachedLogClass
+        @param inode: inode of the log file
+        @param offset: offset of the first event not parsed yet
+        @param tail: log content right before offset, used to detect a log rewritten with the same inode
+        @param raw_state: the state returned by the parsing function (e.g. the raw jobs dictionary)
+        """
+        self.data = data
+        self.inode = inode
+        self.offset = offset
+        self.tail = tail
+        self.raw_state = raw_state
+
         
 class logSummary(cachedLogClass):
     """
@@ -120,6 +219,8 @@ class logSummary(cachedLogClass):
     self.data={'Idle':['123.003','123.004'],'Running':['123.001','123.002']}
     """
 
+    incremental = True
+
     def __init__(self, logname, cache_dir):
         self.clInit(logname, cache_dir, ".cstpk")
 
@@ -128,7 +229,7 @@ class logSummary(cachedLogClass):
         Parse the condor activity log and interpret the globus status code.
         Stores in self.data
         """
-        jobs = parseSubmitLogFastRaw(self.logname)
+        jobs = self.parseLog()
         self.data = listAndInterpretRawStatuses(jobs, listStatuses)
         return
 
@@ -219,6 +320,8 @@ class logCompleted(cachedLogClass):
     {'completed_jobs':['123.002','555.001'],
     'counts':{'Idle': 1145, 'Completed': 2}}
     """
+    incremental = True
+
     def __init__(self, logname, cache_dir):
         self.clInit(logname, cache_dir, ".clspk")
 
@@ -229,7 +332,7 @@ class logCompleted(cachedLogClass):
         Finally, parse and add counts.
         """
         tmpdata={}
-        jobs = parseSubmitLogFastRaw(self.logname)
+        jobs = self.parseLog()
         status  = listAndInterpretRawStatuses(jobs, listStatuses)
         counts = {}
         for s in status.keys():
@@ -335,11 +438,13 @@ class logCounts(cachedLogClass):
     For example self.data={'Idle': 1145, 'Completed': 2}
     """
 
+    incremental = True
+
     def __init__(self, logname, cache_dir):
         self.clInit(logname, cache_dir, ".clcpk")
 
     def loadFromLog(self):
-        jobs = parseSubmitLogFastRaw(self.logname)
+        jobs = self.parseLog()
         self.data = countAndInterpretRawStatuses(jobs)
         return
 
@@ -416,11 +521,13 @@ class logSummaryTimings(cachedLogClass):
     self.data={'Idle':['123.003','123.004'],'Running':['123.001','123.002']}
     """
 
+    incremental = True
+
     def __init__(self, logname, cache_dir):
         self.clInit(logname, cache_dir, ".ctstpk")
 
     def loadFromLog(self):
-        jobs, self.startTime, self.endTime = parseSubmitLogFastRawTimings(self.logname)
+        jobs, self.startTime, self.endTime = self.parseLogTimings()
         self.data = listAndInterpretRawStatuses(jobs, listStatusesTimings)
         return
 
@@ -968,6 +1075,130 @@ def parseSubmitLogFastRawTimings(fname):
     fd.close()
     return jobs, first_time, last_time
 
+def parseSubmitLogFastRawFrom(fname, jobs, offset):
+    """
+    Continue reading a condor submit log from offset, as parseSubmitLogFastRaw.
+    Only complete events (ending with ...) are used,
+    so that the parsing can be continued later from the returned offset
+
+    @param fname: Condor submit log to parse
+    @param jobs: dictionary of jobStrings each having the last statusString, updated in place
+    @param offset: offset of the first event to parse
+    @return: tuple (jobs, offset of the first event not parsed)
+    """
+    size = os.path.getsize(fname)
+    if size <= offset:
+        # nothing new to read
+        return jobs, offset
+
+    fd = open(fname, "r")
+    buf = mmap.mmap(fd.fileno(), size, access=mmap.ACCESS_READ)
+
+    idx = offset
+
+    while (idx+5) < size: # else we are at the end of the file
+        # format
+        # 023 (123.2332.000) Bla
+
+        # first 3 chars are status
+        status = buf[idx:idx+3]
+        # extract job id
+        i1 = buf.find(")", idx+5)
+        if i1 < 0:
+            break
+        i2 = buf.find("...", i1)
+        if i2 < 0:
+            break  # event not complete yet
+        jobid = buf[idx+5:i1-4]
+
+        if jobid in jobs:
+            jobs[jobid] = get_new_status(jobs[jobid], status)
+        else:
+            jobs[jobid] = status
+
+        idx = i2 + 4 #the 3 dots plus newline
+        offset = min(idx, size)
+
+    buf.close()
+    fd.close()
+    return jobs, offset
+
+def parseSubmitLogFastRawTimingsFrom(fname, raw_state, offset):
+    """
+    Continue reading a condor submit log from offset, as parseSubmitLogFastRawTimings.
+    Only complete events (ending with ...) are used,
+    so that the parsing can be continued later from the returned offset
+
+    @param fname: Condor submit log to parse
+    @param raw_state: tuple (jobs, first_time, last_time) as returned by parseSubmitLogFastRawTimings,
+        jobs is updated in place
+    @param offset: offset of the first event to parse
+    @return: tuple (raw_state, offset of the first event not parsed)
+    """
+    jobs, first_time, last_time = raw_state
+
+    size = os.path.getsize(fname)
+    if size <= offset:
+        # nothing new to read
+        return (jobs, first_time, last_time), offset
+
+    fd = open(fname, "r")
+    buf = mmap.mmap(fd.fileno(), size, access=mmap.ACCESS_READ)
+
+    idx = offset
+
+    while (idx + 5) < size: # else we are at the end of the file
+        # format
+        # 023 (123.2332.000) MM/DD HH:MM:SS
+
+        # first 3 chars are status
+        status = buf[idx:idx+3]
+        # extract job id
+        i1 = buf.find(")", idx+5)
+        if i1 < 0:
+            break
+        i2 = buf.find("...", i1)
+        if i2 < 0:
+            break  # event not complete yet
+        jobid = buf[idx+5:i1-4]
+        #extract time
+        line_time = buf[i1+2:i1+16]
+
+        if first_time is None:
+            first_time = line_time
+        last_time = line_time
+
+        if jobid in jobs:
+            if status == '001':
+                running_time = line_time
+            else:
+                running_time = jobs[jobid][2]
+            jobs[jobid] = (get_new_status(jobs[jobid][0], status), jobs[jobid][1], running_time, line_time) #start time never changes
+        else:
+            jobs[jobid] = (status, line_time, '', line_time)
+
+        idx = i2 + 4 #the 3 dots plus newline
+        offset = min(idx, size)
+
+    buf.close()
+    fd.close()
+    return (jobs, first_time, last_time), offset
+
+# Bytes before the parsing offset saved to detect logs rewritten in place
+LOG_TAIL_SIZE = 256
+
+def readLogTail(fname, offset):
+    """
+    @return: the LOG_TAIL_SIZE bytes of fname before offset
+    """
+    fd = open(fname, "r")
+    try:
+        start = max(offset - LOG_TAIL_SIZE, 0)
+        fd.seek(start)
+        return fd.read(offset - start)
+    finally:
+        fd.close()
+
 def parseSubmitLogFastRawCallback(fname, callback):
     """
     Read a condor submit log
@@ -12,10 +12,13 @@ from __future__ import absolute_import
 #   Igor Sfiligoi (May 17th 2007)
 #
 
+import os
 import re
 import string
+import tempfile
 from . import condorMonitor
 from . import condorExe
+from . import logSupport
 
 ##############################################
 # Helper functions
@@ -41,6 +44,27 @@ def cached_exe_cmd(cmd, arg_str,
     opts="%s%s%s"%(pool2str(pool_name), schedd_str, arg_str)
     return condorExe.exe_cmd(cmd, opts, env=env)
 
+def cached_exe_cmd_output(cmd, arg_str,
+                          schedd_name, pool_name, schedd_lookup_cache):
+    """Like cached_exe_cmd, but return the output also if the command fails
+
+    @return: tuple (list of output lines, condorExe.ExeError or None if successful)
+    """
+    if schedd_lookup_cache is None:
+        schedd_lookup_cache=condorMonitor.NoneScheddCache()
+
+    schedd_str, env=schedd_lookup_cache.getScheddId(schedd_name, pool_name)
+
+    opts="%s%s%s"%(pool2str(pool_name), schedd_str, arg_str)
+    out_list=[]
+    err=None
+    try:
+        for data in condorExe.exe_cmd_stream(cmd, opts, env=env):
+            out_list.append(data)
+    except condorExe.ExeError as e:
+        err=e
+    return string.join(out_list, "").splitlines(), err
+
 ##############################################
 #
 # Submit a new job, given a submit file
@@ -87,6 +111,156 @@ def condorRemoveOne(cluster_or_uname,schedd_name=None,pool_name=None,
     return cached_exe_cmd("condor_rm", opts,
                           schedd_name, pool_name, schedd_lookup_cache)
 
+##############################################
+#
+# Act on many jobs with a single command
+#
+
+# Per job outcome of condor_rm/condor_release: Job <cluster>.<proc> <outcome>
+JOB_OUTCOME_RE=re.compile(r'Job ([0-9]+)\.([0-9]+) ([^\n]*)')
+
+# command, python bindings action name and outcome prefixes meaning success
+JOB_ACTIONS={'remove': ("condor_rm", "", 'Remove', ("marked for", "removed")),
+             'removex': ("condor_rm", "-forcex ", 'RemoveX', ("marked for", "removed")),
+             'release': ("condor_release", "", 'Release', ("released",))}
+
+# action results (per job attributes in the ad returned by Schedd.act)
+AR_SUCCESS=1
+AR_MESSAGES={0: "error", 1: "success", 2: "not found", 3: "bad status",
+             4: "already done", 5: "permission denied"}
+
+def parse_job_outcomes(jid_list, out_lines, err, success_prefixes):
+    """
+    Parse the output of condor_rm or condor_release invoked with a list of job ids
+
+    @param jid_list: list of (cluster, proc) passed to the command
+    @param out_lines: stdout lines
+    @param err: ExeError if the command failed, None otherwise
+    @param success_prefixes: outcome prefixes meaning success
+    @return: dictionary jid -> (success, message)
+    """
+    outcomes={}
+    texts=list(out_lines)
+    if err is not None:
+        # the error contains stderr
+        texts.append(str(err))
+    for text in texts:
+        for m in JOB_OUTCOME_RE.finditer(text):
+            jid=(long(m.group(1)), long(m.group(2)))
+            msg=m.group(3).strip()
+            ok=False
+            for prefix in success_prefixes:
+                if msg.startswith(prefix):
+                    ok=True
+                    break
+            outcomes[jid]=(ok, msg)
+
+    out={}
+    for jid in jid_list:
+        key=(long(jid[0]), long(jid[1]))
+        if key in outcomes:
+            out[jid]=outcomes[key]
+        elif err is None:
+            # no per job message, the command was successful
+            out[jid]=(True, "success")
+        else:
+            out[jid]=(False, str(err))
+    return out
+
+def condorActMany(action, jid_list, schedd_name=None, pool_name=None,
+                  schedd_lookup_cache=condorMonitor.local_schedd_cache):
+    """
+    Run action on all the jobs in jid_list with a single condor command
+    or, if available, a single Schedd.act call of the python bindings
+
+    @param action: 'remove', 'removex' (remove with -forcex) or 'release'
+    @param jid_list: list of (cluster, proc)
+    @return: dictionary jid -> (success, message)
+    """
+    cmd, opts, pb_action, success_prefixes=JOB_ACTIONS[action]
+    if not jid_list:
+        return {}
+    if condorMonitor.USE_HTCONDOR_PYTHON_BINDINGS:
+        return pb_act_many(pb_action, jid_list, schedd_name, pool_name, schedd_lookup_cache)
+
+    opts+=string.join(["%li.%li"%(jid[0], jid[1]) for jid in jid_list], " ")
+    out_lines, err=cached_exe_cmd_output(cmd, opts,
+                                         schedd_name, pool_name, schedd_lookup_cache)
+    return parse_job_outcomes(jid_list, out_lines, err, success_prefixes)
+
+def pb_act_many(pb_action, jid_list, schedd_name, pool_name, schedd_lookup_cache):
+    """condorActMany using the htcondor python bindings
+
+    The schedd is looked up like for the condor commands: if the lookup cache returns an environment
+    (e.g. _CONDOR_SPOOL of a local schedd) it is set while using the local schedd.
+    The Schedd objects and the configuration reloads go through condorMonitor.bindings_handle_pool,
+    so the configuration is reloaded only when it or the environment changes.
+    """
+    htcondor=condorMonitor.htcondor
+    handle_pool=condorMonitor.bindings_handle_pool
+    if schedd_lookup_cache is None:
+        schedd_lookup_cache=condorMonitor.NoneScheddCache()
+
+    handle_schedd_name=schedd_name
+    old_env={}
+    try:
+        try:
+            schedd_str, env=schedd_lookup_cache.getScheddId(schedd_name, pool_name)
+            if env:
+                # the schedd is local, found through its environment as the condor commands do
+                handle_schedd_name=None
+                for k in env.keys():
+                    old_env[k]=os.environ.get(k)
+                    os.environ[k]=env[k]
+            handle_pool.reload_config()
+            schedd=handle_pool.get_schedd(pool_name, handle_schedd_name)
+            result=schedd.act(getattr(htcondor.JobAction, pb_action),
+                              ["%li.%li"%(jid[0], jid[1]) for jid in jid_list])
+        finally:
+            for k in old_env.keys():
+                if old_env[k] is None:
+                    del os.environ[k]
+                else:
+                    os.environ[k]=old_env[k]
+    except Exception as e:
+        handle_pool.invalidate(pool_name, handle_schedd_name)
+        msg="%s failed using python bindings: %s"%(pb_action, e)
+        return dict([(jid, (False, msg)) for jid in jid_list])
+
+    out={}
+    for jid in jid_list:
+        ar=result.get("job_%li_%li"%(jid[0], jid[1]))
+        if ar is None:
+            out[jid]=(False, "no result")
+        else:
+            out[jid]=(ar==AR_SUCCESS, AR_MESSAGES.get(ar, str(ar)))
+    return out
+
+##############################################
+#
+# Remove a list of jobs from the queue, with a single command
+#
+# returns a dictionary jid -> (success, message)
+#
+def condorRemoveMany(jid_list,schedd_name=None,pool_name=None,
+                     do_forcex=False,
+                     schedd_lookup_cache=condorMonitor.local_schedd_cache):
+    if do_forcex:
+        action='removex'
+    else:
+        action='remove'
+    return condorActMany(action, jid_list, schedd_name, pool_name, schedd_lookup_cache)
+
+##############################################
+#
+# Release a list of jobs from the queue, with a single command
+#
+# returns a dictionary jid -> (success, message)
+#
+def condorReleaseMany(jid_list,schedd_name=None,pool_name=None,
+                      schedd_lookup_cache=condorMonitor.local_schedd_cache):
+    return condorActMany('release', jid_list, schedd_name, pool_name, schedd_lookup_cache)
+
 ##############################################
 #
 # Hold a set of jobs from the queue
@@ -154,9 +328,75 @@ def ismulti2str(is_multi):
 
 ##############################################
 #
-# Remove a job from the queue
+# Advertise classads to a collector
 #
 def condorAdvertise(classad_fname,command,
-                    use_tcp=False,is_multi=False,pool_name=None):
+                    use_tcp=False,is_multi=False,pool_name=None,batch_size=0):
+    """
+    Advertise the classads in the file using the python bindings if available,
+    condor_advertise otherwise (or if the bindings fail)
+
+    @param batch_size: max number of classads sent in one update by the bindings, 0 for all
+    """
+    if condorMonitor.USE_HTCONDOR_PYTHON_BINDINGS:
+        fd=open(classad_fname)
+        try:
+            classads_str=fd.read()
+        finally:
+            fd.close()
+        if pb_advertise(classads_str, command, use_tcp, pool_name, batch_size):
+            return []
+    return exe_advertise(classad_fname, command, use_tcp, is_multi, pool_name)
+
+def condorAdvertiseString(classads_str,command,
+                          use_tcp=False,is_multi=False,pool_name=None,batch_size=0,
+                          fname_prefix='gwms_classad'):
+    """
+    Advertise the classads in the string (separated by empty lines) without writing them to disk
+    when the python bindings are available. Otherwise (or if the bindings fail)
+    write them to a temporary file for condor_advertise
+    """
+    if condorMonitor.USE_HTCONDOR_PYTHON_BINDINGS:
+        if pb_advertise(classads_str, command, use_tcp, pool_name, batch_size):
+            return []
+    fd, classad_fname=tempfile.mkstemp(prefix='%s_'%fname_prefix)
+    try:
+        try:
+            os.write(fd, classads_str)
+        finally:
+            os.close(fd)
+        return exe_advertise(classad_fname, command, use_tcp, is_multi, pool_name)
+    finally:
+        os.remove(classad_fname)
+
+def exe_advertise(classad_fname, command, use_tcp, is_multi, pool_name):
     cmd_opts="%s%s%s%s %s"%(pool2str(pool_name), usetcp2str(use_tcp), ismulti2str(is_multi), command, classad_fname)
     return condorExe.exe_cmd_sbin("condor_advertise", cmd_opts)
+
+def pb_parse_classads(classads_str):
+    """Parse old syntax classads separated by empty lines, as in the condor_advertise files"""
+    classad=condorMonitor.classad
+    if hasattr(classad, 'parseAds'):
+        return list(classad.parseAds(classads_str, classad.Parser.Old))
+    return list(classad.parseOldAds(classads_str))
+
+def pb_advertise(classads_str, command, use_tcp, pool_name, batch_size=0):
+    """
+    condorAdvertise using the htcondor python bindings, in batches of batch_size classads
+
+    @return: True if all the classads were advertised, False if the bindings failed
+    """
+    handle_pool=condorMonitor.bindings_handle_pool
+    try:
+        ads=pb_parse_classads(classads_str)
+        if batch_size<=0:
+            batch_size=max(len(ads), 1)
+        handle_pool.reload_config()
+        collector=handle_pool.get_collector(pool_name)
+        for i in range(0, len(ads), batch_size):
+            collector.advertise(ads[i:i+batch_size], command, use_tcp)
+    except Exception as e:
+        handle_pool.invalidate(pool_name)
+        logSupport.log.warning("%s failed using python bindings, using condor_advertise: %s"%(command, e))
+        return False
+    return True
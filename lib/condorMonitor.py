@@ -16,13 +16,17 @@ from __future__ import absolute_import
 
 import os
 import sys
+import time
 import string
 import copy
+import array
+import cPickle
 import socket
 import xml.parsers.expat
 from itertools import groupby
 from . import condorExe
 from . import condorSecurity
+from . import logSupport
 
 USE_HTCONDOR_PYTHON_BINDINGS = False
 try:
@@ -49,6 +53,10 @@ except:
 # Configuration
 #
 
+# HTCondor configuration file used when CONDOR_CONFIG is not set
+DEFAULT_CONDOR_CONFIG = '/etc/condor/condor_config'
+
+
 # Set path to condor binaries
 def set_path(new_condor_bin_path):
     global condor_bin_path
@@ -205,6 +213,179 @@ class LocalScheddCache(NoneScheddCache):
 local_schedd_cache = LocalScheddCache()
 
 
+class BindingsHandlePool:
+    """
+    Cache of the HTCondor python bindings objects (Collector, Schedd built from the located schedd ad)
+    Handles are kept per (pool, schedd, HTCondor configuration and security environment) for ttl seconds
+    and dropped when a query using them fails.
+    The HTCondor configuration is reloaded when the configuration files or the
+    _CONDOR_ environment (e.g. the security settings) change, and anyhow every reload_interval seconds
+    """
+
+    def __init__(self, ttl=300, reload_interval=300):
+        self.enabled = True
+        self.ttl = ttl
+        self.reload_interval = reload_interval
+        # key of the configuration loaded last and time of the reload
+        self.config_key = None
+        self.reload_time = 0
+        # LOCAL_CONFIG_FILE and LOCAL_CONFIG_DIR of the configuration loaded last
+        self.local_config_sources = []
+        # dict of (handle type, pool_name, schedd_name, config key)=>(creation time, handle)
+        self.handles = {}
+        self.nr_hits = 0
+        self.nr_misses = 0
+        self.nr_reloads = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.handles = {}
+
+    def get_config_sources(self):
+        """
+        Return the files and directories the HTCondor configuration is read from:
+        CONDOR_CONFIG (or the default condor_config), the config.d directory next to it
+        and the LOCAL_CONFIG_FILE and LOCAL_CONFIG_DIR of the last loaded configuration
+        """
+        condor_config = os.environ.get('CONDOR_CONFIG') or DEFAULT_CONDOR_CONFIG
+        sources = [condor_config, os.path.join(os.path.dirname(condor_config), 'config.d')]
+        for source in self.local_config_sources:
+            if source not in sources:
+                sources.append(source)
+        return sources
+
+    def get_config_key(self):
+        """
+        Return what the HTCondor configuration depends on: CONDOR_CONFIG, the modification time
+        and size of the configuration files (also of each file in the configuration directories),
+        X509_USER_PROXY and the _CONDOR_ environment
+        """
+        stats = []
+        for source in self.get_config_sources():
+            stats.append(file_stat(source))
+            if os.path.isdir(source):
+                try:
+                    fnames = sorted(os.listdir(source))
+                except OSError:
+                    fnames = []
+                for fname in fnames:
+                    stats.append(file_stat(os.path.join(source, fname)))
+        env = [(k, v) for k, v in os.environ.items() if k.startswith('_CONDOR_') or k == 'X509_USER_PROXY']
+        env.sort()
+        return (os.environ.get('CONDOR_CONFIG'), tuple(stats), tuple(env))
+
+    def reload_config(self):
+        """
+        Reload the HTCondor configuration if it changed since the last reload,
+        if the last reload is older than reload_interval (or if the pool is disabled)
+        """
+        config_key = self.get_config_key()
+        now = time.time()
+        if (not self.enabled) or (config_key != self.config_key) or (now - self.reload_time >= self.reload_interval):
+            htcondor.reload_config()
+            self.nr_reloads += 1
+            self.reload_time = now
+            local_config_sources = get_local_config_sources()
+            if local_config_sources != self.local_config_sources:
+                # watch also the local configuration files of the new configuration
+                self.local_config_sources = local_config_sources
+                config_key = self.get_config_key()
+            self.config_key = config_key
+
+    def log_query(self, query_name, setup_time, query_time):
+        """
+        Log the duration of a query using the bindings, with the setup time (reload and handle lookup)
+        and the counters of the pool
+        """
+        if logSupport.log is not None:
+            logSupport.log.debug("%s done in %.3f s (setup %.3f s, handles: %i hits, %i misses, %i config reloads)" %
+                                 (query_name, query_time, setup_time, self.nr_hits, self.nr_misses, self.nr_reloads))
+
+    def get_handle(self, handle_type, pool_name, schedd_name, create_function):
+        """
+        Return the cached handle or a new one from create_function
+
+        @param handle_type: 'collector' or 'schedd'
+        @param pool_name: name of the pool, None for the default one
+        @param schedd_name: name of the schedd, None for the local one or for a collector
+        @param create_function: function creating the handle, no arguments
+        @return: handle
+        """
+        now = time.time()
+        key = (handle_type, pool_name, schedd_name, self.config_key)
+        if self.enabled and key in self.handles:
+            creation_time, handle = self.handles[key]
+            if now - creation_time < self.ttl:
+                self.nr_hits += 1
+                return handle
+        self.nr_misses += 1
+        handle = create_function()
+        if self.enabled:
+            # forget the expired handles (also of old configurations)
+            for old_key in self.handles.keys():
+                if now - self.handles[old_key][0] >= self.ttl:
+                    del self.handles[old_key]
+            self.handles[key] = (now, handle)
+        return handle
+
+    def get_collector(self, pool_name=None):
+        def create_collector():
+            if pool_name:
+                return htcondor.Collector(str(pool_name))
+            return htcondor.Collector()
+        return self.get_handle('collector', pool_name, None, create_collector)
+
+    def get_schedd(self, pool_name=None, schedd_name=None):
+        def create_schedd():
+            if schedd_name is None:
+                return htcondor.Schedd()
+            schedd_ad = self.get_collector(pool_name).locate(htcondor.DaemonTypes.Schedd, schedd_name)
+            return htcondor.Schedd(schedd_ad)
+        return self.get_handle('schedd', pool_name, schedd_name, create_schedd)
+
+    def invalidate(self, pool_name=None, schedd_name=None):
+        """
+        Forget the handles of the schedd (or of all the pool if schedd_name is None), e.g. after an error
+        """
+        for key in self.handles.keys():
+            if key[1] == pool_name and (schedd_name is None or key[2] == schedd_name):
+                del self.handles[key]
+
+
+def file_stat(fname):
+    """
+    Return (fname, modification time, size), with None values if the file does not exist
+    """
+    try:
+        st = os.stat(fname)
+        return (fname, st.st_mtime, st.st_size)
+    except OSError:
+        return (fname, None, None)
+
+
+def get_local_config_sources():
+    """
+    Return the files and directories in LOCAL_CONFIG_FILE and LOCAL_CONFIG_DIR of the loaded HTCondor configuration
+    """
+    sources = []
+    for param_name in ('LOCAL_CONFIG_FILE', 'LOCAL_CONFIG_DIR'):
+        try:
+            value = htcondor.param.get(param_name)
+        except Exception:
+            value = None
+        if isinstance(value, basestring):
+            # comma or space separated lists, a trailing | marks a command, not a file
+            sources.extend([el for el in value.replace(',', ' ').split() if not el.endswith('|')])
+    return sources
+
+
+# default global object
+bindings_handle_pool = BindingsHandlePool()
+
+
 def condorq_attrs(q_constraint, attribute_list):
     """
     Retrieves a list of a single item from the all the factory queues.
@@ -287,6 +468,353 @@ class StoredQuery(AbstractQuery):
         """
         return applyConstraint(self.stored_data, constraint_func)
 
+    def compact(self):
+        """
+        Keep the stored data in a ColumnarStoredData, smaller in memory and when pickled
+        (e.g. to return the query from a forked process).
+        The classads returned by fetchStored become read-only copies
+        """
+        if not isinstance(self.stored_data, ColumnarStoredData):
+            self.stored_data = ColumnarStoredData(self.stored_data)
+
+
+#
+# Compact storage of the query results
+#
+
+# Marks the attributes not defined in a classad
+_MISSING = object()
+
+
+def intArray(values):
+    """
+    Return an array with the smallest item size able to hold all the int values
+    """
+    low = min(values or [0])
+    high = max(values or [0])
+    for typecode in ('b', 'h', 'i'):
+        limit = 1 << (8 * array.array(typecode).itemsize - 1)
+        if (-limit <= low) and (high < limit):
+            return array.array(typecode, values)
+    return array.array('l', values)
+
+
+def arrayState(arr):
+    """Return the typecode and the binary content of the array (native byte order)"""
+    return (arr.typecode, arr.tostring())
+
+
+def arrayFromState(state):
+    typecode, content = state
+    arr = array.array(typecode)
+    arr.fromstring(content)
+    return arr
+
+
+STRING_TYPES = set([str, unicode])
+
+
+class ColumnarColumn:
+    """
+    Values of one attribute (or of the keys) for all the classads of a ColumnarStoredData
+    kind is one of:
+      i - ints in an array
+      d - floats in an array
+      s - strings (str or unicode), as indexes in an array of the table of the distinct values
+      t - tuples of 2 ints (e.g. condor_q job ids), in 2 arrays
+      o - any other value, in a list
+    mask is an array with 0 for the missing values, None if there are none
+    """
+
+    def __init__(self, kind, data, table=None, mask=None):
+        self.kind = kind
+        self.data = data
+        self.table = table
+        self.mask = mask
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Create the column with the most compact kind for the values (_MISSING for the missing ones)
+        """
+        present = [v for v in values if v is not _MISSING]
+        mask = None
+        if len(present) < len(values):
+            mask = array.array('B', [v is not _MISSING for v in values])
+        types = set([type(v) for v in present])
+        if present and types.issubset(STRING_TYPES):
+            # the parsed classads have unicode strings, the values are stored as they are
+            table = []
+            table_idx = {}
+            indexes = []
+            for v in values:
+                if v is _MISSING:
+                    indexes.append(-1)
+                    continue
+                # u'a' == 'a', the type is part of the key to return the same value
+                v_key = (type(v), v)
+                idx = table_idx.get(v_key)
+                if idx is None:
+                    idx = table_idx[v_key] = len(table)
+                    table.append(v)
+                indexes.append(idx)
+            return cls('s', intArray(indexes), table, mask)
+        if types == set([int]):
+            return cls('i', intArray([0 if v is _MISSING else v for v in values]), mask=mask)
+        if types == set([float]):
+            return cls('d', array.array('d', [0.0 if v is _MISSING else v for v in values]), mask=mask)
+        if (mask is None) and (types == set([tuple])) and present and \
+                (set([len(v) for v in present]) == set([2])) and \
+                (set([type(e) for v in present for e in v]) == set([int])):
+            return cls('t', (intArray([v[0] for v in values]), intArray([v[1] for v in values])))
+        return cls('o', [None if v is _MISSING else v for v in values], mask=mask)
+
+    def get(self, pos):
+        if (self.mask is not None) and (not self.mask[pos]):
+            return _MISSING
+        if self.kind == 's':
+            return self.table[self.data[pos]]
+        if self.kind == 't':
+            return (self.data[0][pos], self.data[1][pos])
+        return self.data[pos]
+
+    def get_state(self):
+        """
+        Return the column as strings and lists, compact when pickled
+        """
+        if self.kind == 't':
+            data = (arrayState(self.data[0]), arrayState(self.data[1]))
+        elif self.kind == 'o':
+            data = self.data
+        else:
+            data = arrayState(self.data)
+        mask = None
+        if self.mask is not None:
+            mask = arrayState(self.mask)
+        return (self.kind, data, self.table, mask)
+
+    @classmethod
+    def from_state(cls, state):
+        kind, data, table, mask = state
+        if kind == 't':
+            data = (arrayFromState(data[0]), arrayFromState(data[1]))
+        elif kind != 'o':
+            data = arrayFromState(data)
+        if mask is not None:
+            mask = arrayFromState(mask)
+        return cls(kind, data, table, mask)
+
+
+class ColumnarStoredData(object):
+    """
+    Compact replacement for the dictionary of classads of a query (e.g. CondorQ.stored_data),
+    used to keep large query results and pass them between processes.
+    Each attribute is stored in a column (see ColumnarColumn): typed arrays for the ints
+    and floats and one copy of each distinct string.
+    The classad dictionaries are created when accessed, so changes to them are not kept:
+    use set_column to add an attribute to all the classads.
+    A view, returned by select, shares the columns with the original data.
+    When pickled, only the classads in the view are saved, as a compact binary blob.
+    """
+
+    def __init__(self, data=None):
+        """
+        @type data: dict
+        @param data: Dictionary of classad dictionaries, e.g. the result of a query fetch
+        """
+        if data is None:
+            data = {}
+        keys = data.keys()
+        attrs = set()
+        for el in data.itervalues():
+            attrs.update(el.iterkeys())
+        self.keys_column = ColumnarColumn.from_values(keys)
+        self.columns = {}
+        for attr in attrs:
+            self.columns[attr] = ColumnarColumn.from_values([data[key].get(attr, _MISSING) for key in keys])
+        self.index = None           # positions of the classads of a view, None for all
+        self.nr_classads = len(keys)
+        self.extra_columns = {}     # set_column values, aligned with the classads of this object
+        self.positions = None       # key -> position, created when needed
+
+    def select(self, constraint_func=None, positions=None):
+        """
+        Return a view with the classads satisfying constraint_func, or in the positions list
+
+        @rtype: ColumnarStoredData
+        """
+        if positions is None:
+            positions = [pos for pos in xrange(len(self)) if (constraint_func is None) or constraint_func(self.get_classad(pos))]
+        view = ColumnarStoredData.__new__(ColumnarStoredData)
+        view.keys_column = self.keys_column
+        view.columns = self.columns
+        if self.index is None:
+            view.index = array.array('l', positions)
+        else:
+            view.index = array.array('l', [self.index[pos] for pos in positions])
+        view.nr_classads = len(positions)
+        view.extra_columns = {}
+        for attr in self.extra_columns:
+            values = self.extra_columns[attr]
+            view.extra_columns[attr] = [values[pos] for pos in positions]
+        view.positions = None
+        return view
+
+    def column(self, attr, default=None):
+        """
+        Return the list of the values of attr, in the order of the classads (default if missing)
+        """
+        if attr in self.extra_columns:
+            return list(self.extra_columns[attr])
+        col = self.columns.get(attr)
+        out = []
+        for pos in xrange(len(self)):
+            v = _MISSING
+            if col is not None:
+                v = col.get(self.base_pos(pos))
+            if v is _MISSING:
+                v = default
+            out.append(v)
+        return out
+
+    def set_column(self, attr, values):
+        """
+        Set the attribute in all the classads of this object (not in the ones of other views)
+
+        @type values: list
+        @param values: values of attr, in the order of the classads (see column and iterkeys)
+        """
+        if len(values) != len(self):
+            raise ValueError("Got %i values for %i classads" % (len(values), len(self)))
+        self.extra_columns[attr] = list(values)
+
+    def base_pos(self, pos):
+        if self.index is None:
+            return pos
+        return self.index[pos]
+
+    def get_key(self, pos):
+        return self.keys_column.get(self.base_pos(pos))
+
+    def get_classad(self, pos):
+        base_pos = self.base_pos(pos)
+        classad = {}
+        for attr, col in self.columns.iteritems():
+            v = col.get(base_pos)
+            if v is not _MISSING:
+                classad[attr] = v
+        for attr in self.extra_columns:
+            classad[attr] = self.extra_columns[attr][pos]
+        return classad
+
+    def iterclassads(self, attrs):
+        """
+        Iterate over the classads with only the attributes in attrs, cheaper than itervalues
+        """
+        cols = [(attr, self.columns.get(attr), self.extra_columns.get(attr)) for attr in attrs]
+        for pos in xrange(len(self)):
+            base_pos = self.base_pos(pos)
+            classad = {}
+            for attr, col, extra in cols:
+                if extra is not None:
+                    classad[attr] = extra[pos]
+                elif col is not None:
+                    v = col.get(base_pos)
+                    if v is not _MISSING:
+                        classad[attr] = v
+            yield classad
+
+    def get_positions(self):
+        if self.positions is None:
+            self.positions = dict([(self.get_key(pos), pos) for pos in xrange(len(self))])
+        return self.positions
+
+    # dictionary interface
+    def __len__(self):
+        return self.nr_classads
+
+    def __contains__(self, key):
+        return key in self.get_positions()
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        return self.get_classad(self.get_positions()[key])
+
+    def get(self, key, default=None):
+        pos = self.get_positions().get(key)
+        if pos is None:
+            return default
+        return self.get_classad(pos)
+
+    def iterkeys(self):
+        for pos in xrange(len(self)):
+            yield self.get_key(pos)
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for pos in xrange(len(self)):
+            yield self.get_classad(pos)
+
+    def iteritems(self):
+        for pos in xrange(len(self)):
+            yield self.get_key(pos), self.get_classad(pos)
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, ColumnarStoredData)):
+            return dict(self.iteritems()) == dict(other.iteritems())
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    # pickling
+    def to_blob(self):
+        """
+        Return the classads of this object as a binary string (see from_blob)
+        """
+        data = self
+        if (self.index is not None) or self.extra_columns:
+            # only the classads of the view, with the set_column attributes
+            data = ColumnarStoredData(dict(self.iteritems()))
+        columns = [(attr, data.columns[attr].get_state()) for attr in data.columns]
+        return cPickle.dumps((data.nr_classads, data.keys_column.get_state(), columns), cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def from_blob(cls, blob):
+        nr_classads, keys_state, columns = cPickle.loads(blob)
+        data = cls.__new__(cls)
+        data.keys_column = ColumnarColumn.from_state(keys_state)
+        data.columns = {}
+        for attr, col_state in columns:
+            data.columns[attr] = ColumnarColumn.from_state(col_state)
+        data.index = None
+        data.nr_classads = nr_classads
+        data.extra_columns = {}
+        data.positions = None
+        return data
+
+    def __reduce__(self):
+        return (columnarFromBlob, (self.to_blob(),))
+
+
+def columnarFromBlob(blob):
+    """Unpickle a ColumnarStoredData"""
+    return ColumnarStoredData.from_blob(blob)
+
 
 class CondorQEdit:
     """
@@ -313,22 +841,13 @@ class CondorQEdit:
         if not (len(joblist) == len(attributes) == len(values)):
             raise QueryError("Arguments to QEdit.executeAll should have the same length")
         try:
-            htcondor.reload_config()
-            if self.pool_name:
-                collector = htcondor.Collector(str(self.pool_name))
-            else:
-                collector = htcondor.Collector()
-
-            if self.schedd_name:
-                schedd_ad = collector.locate(htcondor.DaemonTypes.Schedd,
-                                             self.schedd_name)
-                schedd = htcondor.Schedd(schedd_ad)
-            else:
-                schedd = htcondor.Schedd()
+            bindings_handle_pool.reload_config()
+            schedd = bindings_handle_pool.get_schedd(self.pool_name, self.schedd_name or None)
             with schedd.transaction() as _:
                 for jobid, attr, val in zip(joblist, attributes, values):
                     schedd.edit([jobid], attr, classad.quote(val))
         except Exception as ex:
+            bindings_handle_pool.invalidate(self.pool_name, self.schedd_name or None)
             s = 'default'
             if self.schedd_name is not None:
                 s = self.schedd_name
@@ -379,6 +898,10 @@ class CondorQuery(StoredQuery):
             self.security_obj = copy.deepcopy(security_obj)
         else:
             self.security_obj = condorSecurity.ProtoRequest()
+        # size of the output of the last fetch (only when using the HTCondor commands)
+        self.fetched_bytes = None
+        # seconds spent preparing the last fetch (only when using the python bindings)
+        self.setup_time = None
 
     def require_integrity(self, requested_integrity):
         """
@@ -472,25 +995,29 @@ class CondorQuery(StoredQuery):
                 format_arr.append('-format "%s" "%s"' % (attr_format, attr_name))
             format_str = string.join(format_arr, " ")
 
+        # the output is parsed as it arrives, the raw text is never kept all in memory
+        parser = XmlClassadParser(self.group_attribute)
+        self.fetched_bytes = 0
         # set environment for security settings
         self.security_obj.save_state()
         try:
             self.security_obj.enforce_requests()
 
             if full_xml:
-                xml_data = condorExe.exe_cmd(self.exe_name, "%s -xml %s %s" %
-                                             (self.resource_str, self.pool_str, constraint_str), env=self.env)
+                xml_stream = condorExe.exe_cmd_stream(self.exe_name, "%s -xml %s %s" %
+                                                      (self.resource_str, self.pool_str, constraint_str), env=self.env)
             else:
                 # format_str is defined because full_xml False means (format_list is not None)
-                xml_data = condorExe.exe_cmd(self.exe_name, "%s %s -xml %s %s" %
-                                             (self.resource_str, format_str, self.pool_str, constraint_str), env=self.env)
+                xml_stream = condorExe.exe_cmd_stream(self.exe_name, "%s %s -xml %s %s" %
+                                                      (self.resource_str, format_str, self.pool_str, constraint_str), env=self.env)
+            for data in xml_stream:
+                self.fetched_bytes += len(data)
+                parser.feed(data)
         finally:
             # restore old security context
             self.security_obj.restore_state()
 
-        list_data = xml2list(xml_data)
-        del xml_data
-        dict_data = list2dict(list_data, self.group_attribute)
+        dict_data = parser.close()
         return dict_data
 
     def fetch_using_bindings(self, constraint=None, format_list=None):
@@ -557,21 +1084,16 @@ class CondorQ(CondorQuery):
         self.security_obj.save_state()
         try:
             self.security_obj.enforce_requests()
-            htcondor.reload_config()
-            if self.pool_name:
-                collector = htcondor.Collector(str(self.pool_name))
-            else:
-                collector = htcondor.Collector()
-
-            if self.schedd_name is None:
-                schedd = htcondor.Schedd()
-            else:
-                schedd_ad = collector.locate(htcondor.DaemonTypes.Schedd,
-                                             self.schedd_name)
-                schedd = htcondor.Schedd(schedd_ad)
+            t_setup = time.time()
+            bindings_handle_pool.reload_config()
+            schedd = bindings_handle_pool.get_schedd(self.pool_name, self.schedd_name)
+            self.setup_time = time.time() - t_setup
             results = schedd.query(constraint, attrs)
             results_dict = list2dict(results, self.group_attribute)
+            bindings_handle_pool.log_query('condor_q of schedd %s in pool %s' % (self.schedd_name, self.pool_name),
+                                           self.setup_time, time.time() - t_setup)
         except Exception as ex:
+            bindings_handle_pool.invalidate(self.pool_name, self.schedd_name)
             s = 'default'
             if self.schedd_name is not None:
                 s = self.schedd_name
@@ -618,15 +1140,16 @@ class CondorStatus(CondorQuery):
         self.security_obj.save_state()
         try:
             self.security_obj.enforce_requests()
-            htcondor.reload_config()
-            if self.pool_name:
-                collector = htcondor.Collector(str(self.pool_name))
-            else:
-                collector = htcondor.Collector()
-
+            t_setup = time.time()
+            bindings_handle_pool.reload_config()
+            collector = bindings_handle_pool.get_collector(self.pool_name)
+            self.setup_time = time.time() - t_setup
             results = collector.query(adtype, constraint, attrs)
             results_dict = list2dict(results, self.group_attribute)
+            bindings_handle_pool.log_query('condor_status of pool %s' % self.pool_name,
+                                           self.setup_time, time.time() - t_setup)
         except Exception as ex:
+            bindings_handle_pool.invalidate(self.pool_name)
             p = 'default'
             if self.pool_name is not None:
                 p = self.pool_name
@@ -800,7 +1323,7 @@ def complete_format_list(in_format_list, req_format_els):
 
 
 #
-# Convert Condor XML to list
+# Convert Condor XML to list or dictionary
 #
 # For Example:
 #
@@ -825,108 +1348,249 @@ def complete_format_list(in_format_list, req_format_els):
 #</classads>
 #
 
-# 3 xml2list XML handler functions
-def xml2list_start_element(name, attrs):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
-    if name == "c":
-        xml2list_inclassad = {}
-    elif name == "a":
-        xml2list_inattr = {"name": attrs["n"], "val": ""}
-        xml2list_intype = "s"
-    elif name == "i":
-        xml2list_intype = "i"
-    elif name == "r":
-        xml2list_intype = "r"
-    elif name == "b":
-        xml2list_intype = "b"
-        if 'v' in attrs:
-            xml2list_inattr["val"] = (attrs["v"] in ('T', 't', '1'))
-        else:
-            # extended syntax... value in text area
-            xml2list_inattr["val"] = None
-    elif name == "un":
-        xml2list_intype = "un"
-        xml2list_inattr["val"] = None
-    elif name in ("s", "e"):
-        pass  # nothing to do
-    elif name == "classads":
-        pass  # top element, nothing to do
-    else:
-        raise TypeError("Unsupported type: %s" % name)
-
-
-def xml2list_end_element(name):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
-    if name == "c":
-        xml2list_data.append(xml2list_inclassad)
-        xml2list_inclassad = None
-    elif name == "a":
-        xml2list_inclassad[xml2list_inattr["name"]] = xml2list_inattr["val"]
-        xml2list_inattr = None
-    elif name in ("i", "b", "un", "r"):
-        xml2list_intype = "s"
-    elif name in ("s", "e"):
-        pass # nothing to do
-    elif name == "classads":
-        pass # top element, nothing to do
-    else:
-        raise TypeError("Unexpected type: %s" % name)
-
-
-def xml2list_char_data(data):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
-    if xml2list_inattr is None:
-        # only process when in attribute
-        return
-
-    if xml2list_intype == "i":
-        xml2list_inattr["val"] = int(data)
-    elif xml2list_intype == "r":
-        xml2list_inattr["val"] = float(data)
-    elif xml2list_intype == "b":
-        if xml2list_inattr["val"] is not None:
-            # nothing to do, value was in attribute
-            pass
-        else:
-            xml2list_inattr["val"] = (data[0] in ('T', 't', '1'))
-    elif xml2list_intype == "un":
-        # nothing to do, value was in attribute
-        pass
-    else:
-        unescaped_data = string.replace(data, '\\"', '"')
-        xml2list_inattr["val"] += unescaped_data
+# Number of output lines passed to the XML parser at once by XmlClassadParser.feed_lines
+XML_PARSE_LINES = 1024
 
 
-def xml2list(xml_data):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
+def find_xml_header(data):
+    """Find the XML header at the beginning of a line
 
-    xml2list_data = []
-    xml2list_inclassad = None
-    xml2list_inattr = None
-    xml2list_intype = None
+    @param data: text to search
+    @return: position of the header in data or -1 if not found
+    """
+    idx = data.find("<?xml")
+    while idx > 0 and data[idx - 1] not in "\r\n":
+        idx = data.find("<?xml", idx + 1)
+    return idx
 
-    p = xml.parsers.expat.ParserCreate()
-    p.StartElementHandler = xml2list_start_element
-    p.EndElementHandler = xml2list_end_element
-    p.CharacterDataHandler = xml2list_char_data
 
-    found_xml = -1
-    for line in range(len(xml_data)):
-        # look for the xml header
-        if xml_data[line][:5] == "<?xml":
-            found_xml = line
-            break
+def is_undefined(value):
+    """
+    Return True if the attribute value is HTCondor Undefined,
+    without converting the strings (str() fails on non-ASCII unicode values)
+    """
+    if isinstance(value, basestring):
+        return value == 'Undefined'
+    try:
+        return str(value) == 'Undefined'
+    except Exception:
+        return False
+
+
+class XmlClassadParser:
+    """Incremental parser of the Condor XML classads output (see the example above)
+
+    The output can be fed as it arrives, in lines (feed_lines) or in arbitrary text chunks (feed).
+    All the parser state is in the object, so multiple parsers can be used at the same time.
+    Anything before the XML header (e.g. warnings) is ignored and the newlines are treated
+    as spaces, like xml2list that joins the lines of the output.
+    Each classad is stored when complete:
+    if attr_name is None, the classads are appended to a list, like in xml2list,
+    otherwise they are inserted in a dictionary using the values of attr_name as key, like in list2dict.
+    """
 
-    if found_xml >= 0:
+    def __init__(self, attr_name=None):
+        """
+        @param attr_name: None, string (1 attribute) or list or tuple (one or more attributes)
+            with the attributes to use as key
+        """
+        self.attr_name = attr_name
+        if attr_name is None:
+            self.attr_list = None
+            self.data = []
+        else:
+            if type(attr_name) in (type([]), type((1, 2))):
+                self.attr_list = attr_name
+            else:
+                self.attr_list = [attr_name]
+            self.data = {}
+        # text seen before the XML header, None once the header is found
+        self.pending = ""
+
+        self.classad = None
+        self.attr = None
+        self.attr_type = None
+        self.attr_val = None
+        self.attr_text = []
+
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.ordered_attributes = True
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.char_data
+
+    def start_element(self, name, attrs):
+        if name == "a":
+            if attrs[0] == "n":
+                self.attr = attrs[1]
+            else:
+                self.attr = dict(zip(attrs[::2], attrs[1::2]))["n"]
+            self.attr_type = "s"
+            self.attr_val = None
+            del self.attr_text[:]
+        elif name == "c":
+            self.classad = {}
+        elif name in ("i", "r"):
+            self.attr_type = name
+        elif name == "b":
+            self.attr_type = "b"
+            if 'v' in attrs[::2]:
+                self.attr_val = (dict(zip(attrs[::2], attrs[1::2]))["v"] in ('T', 't', '1'))
+            # else extended syntax... value in text area
+        elif name == "un":
+            self.attr_type = "un"
+        elif name in ("s", "e"):
+            pass  # nothing to do
+        elif name == "classads":
+            pass  # top element, nothing to do
+        else:
+            raise TypeError("Unsupported type: %s" % name)
+
+    def end_element(self, name):
+        if name == "a":
+            self.classad[self.attr] = self.get_attr_value()
+            self.attr = None
+        elif name == "c":
+            self.add_classad(self.classad)
+            self.classad = None
+        elif name in ("i", "b", "un", "r", "s", "e"):
+            pass  # the value is converted at the end of the attribute
+        elif name == "classads":
+            pass  # top element, nothing to do
+        else:
+            raise TypeError("Unexpected type: %s" % name)
+
+    def char_data(self, data):
+        if self.attr is None:
+            # only process when in attribute
+            return
+        self.attr_text.append(data)
+
+    def get_attr_value(self):
+        """Convert the text of the current attribute according to its type"""
+        attr_type = self.attr_type
+        if attr_type == "un":
+            return None
+        elif attr_type == "b":
+            if self.attr_val is None and self.attr_text:
+                return self.attr_text[0][0] in ('T', 't', '1')
+            return self.attr_val
+        text = "".join(self.attr_text)
+        if not text:
+            return ""
+        elif attr_type == "i":
+            return int(text)
+        elif attr_type == "r":
+            return float(text)
+        return text.replace('\\"', '"')
+
+    def add_classad(self, classad):
+        """Store a complete classad, see list2dict for the quirks of the dictionary keys"""
+        if self.attr_list is None:
+            self.data.append(classad)
+            return
+        if self.attr_list is self.attr_name:
+            key = []
+            for an in self.attr_list:
+                if an in classad:
+                    key.append(classad[an])
+                else:
+                    # Try lower cases
+                    lan = an.lower()
+                    for k in classad:
+                        if lan == k.lower():
+                            key.append(classad[k])
+                            break
+            key = tuple(key)
+        else:
+            key = classad[self.attr_name]
+        # the value has all the elements but those in attr_list
+        for an in self.attr_list:
+            if an in classad:
+                del classad[an]
+        if USE_HTCONDOR_PYTHON_BINDINGS:
+            # same as list2dict
+            for a in [a for a in classad if is_undefined(classad[a])]:
+                del classad[a]
+        self.data[key] = classad
+
+    def parse(self, data, is_final):
         try:
-            p.Parse(string.join(xml_data[found_xml:]), 1)
+            self.parser.Parse(data, is_final)
         except TypeError as e:
             raise RuntimeError("Failed to parse XML data, TypeError: %s" % e)
         except:
             raise RuntimeError("Failed to parse XML data, generic error")
-    # else no xml, so return an empty list
 
-    return xml2list_data
+    def feed(self, data):
+        """Parse a chunk of text, it does not need to end at a line or element boundary
+
+        @param data: text
+        """
+        if self.pending is not None:
+            data = self.pending + data
+            idx = find_xml_header(data)
+            if idx < 0:
+                # keep only the last (possibly incomplete) line
+                self.pending = data[data.rfind("\n") + 1:]
+                return
+            self.pending = None
+            data = data[idx:]
+        self.parse(data.replace("\n", " "), False)
+
+    def feed_lines(self, lines):
+        """Parse lines of text, as returned by condorExe.exe_cmd
+
+        Lines are joined by spaces, a space is added also after the last line
+
+        @param lines: list of strings
+        """
+        start = 0
+        if self.pending is not None:
+            start = len(lines)
+            for i in range(len(lines)):
+                # look for the xml header
+                if lines[i][:5] == "<?xml":
+                    start = i
+                    self.pending = None
+                    break
+        for i in range(start, len(lines), XML_PARSE_LINES):
+            self.parse(string.join(lines[i:i + XML_PARSE_LINES]) + " ", False)
+
+    def close(self):
+        """Complete the parsing
+
+        @return: list or dictionary (see attr_name) with the parsed classads, empty if there was no XML
+        """
+        if self.pending is None:
+            self.parse("", True)
+        # else no xml, so return an empty list or dictionary
+        return self.data
+
+
+def xml2list(xml_data):
+    """Convert the Condor XML output to a list of classads (dictionaries)
+
+    @param xml_data: list of lines
+    @return: list of dictionaries
+    """
+    parser = XmlClassadParser()
+    parser.feed_lines(xml_data)
+    return parser.close()
+
+
+def xml2dict(xml_data, attr_name):
+    """Convert the Condor XML output to a dictionary of classads, same as list2dict(xml2list(xml_data), attr_name)
+    but without building the intermediate list
+
+    @param xml_data: list of lines
+    @param attr_name: string (1 attribute) or list or tuple (one or more attributes) with the attributes to use as key
+    @return: dictionary of dictionaries
+    """
+    parser = XmlClassadParser(attr_name)
+    parser.feed_lines(xml_data)
+    return parser.close()
 
 
 def list2dict(list_data, attr_name):
@@ -1013,6 +1677,9 @@ def applyConstraint(data, constraint_func):
 
     if constraint_func is None:
         return data
+    elif isinstance(data, ColumnarStoredData):
+        # a view sharing the columns
+        return data.select(constraint_func)
     else:
         outdata = {}
         for key, val in data.iteritems():
@@ -15,14 +15,21 @@ from __future__ import absolute_import
 #
 # TODO: This could be rewritten so that the polling lists are registered once and the fd are removed only when
 #       not needed anymore (currently there is an extrnal structure and the poll object is a new one each time)
+#       ForkPoolManager below uses a persistent registration (FdPoller)
 import cPickle
+import cStringIO
+import io
 import os
 import sys
 import time
 import select
+import signal
 import errno
+import struct
+from collections import deque
 from .pidSupport import register_sighandler, unregister_sighandler, termsignal
 from . import logSupport
+from . import servicePerformance
 
 
 class FetchError(RuntimeError):
@@ -54,8 +61,10 @@ def fork_in_bg(function_torun, *args):
         logSupport.disable_rotate = True
         os.close(r)
         try:
+            # spans recorded by the child are returned with the result
+            trace_mark = servicePerformance.getTraceMark()
             out = function_torun(*args)
-            os.write(w, cPickle.dumps(out))
+            os.write(w, cPickle.dumps(servicePerformance.packForkResult(out, trace_mark), cPickle.HIGHEST_PROTOCOL))
         except:
             logSupport.log.warning("Forked process '%s' failed" % str(function_torun))
             logSupport.log.exception("Forked process '%s' failed" % str(function_torun))
@@ -101,7 +110,7 @@ def fetch_fork_result(r, pid):
             rin += s
             s = os.read(r, 1024*1024)
         # pickle can fail w/ EOFError if rin is empty. Any output from pickle is never an empty string, e.g. None is 'N.' 
-        out = cPickle.loads(rin)
+        out = servicePerformance.unpackForkResult(cPickle.loads(rin))
     except (OSError, IOError, EOFError, cPickle.UnpicklingError) as err:
         etype, evalue, etraceback = sys.exc_info()
         # Adding message in case close/waitpid fail and preempt raise
@@ -397,3 +406,336 @@ class ForkManager:
             raise ForkResultError(nr_errors, post_work_info)
 
         return post_work_info
+
+
+################################################
+# Pool of pre-forked workers
+
+# Messages exchanged with the pool workers
+#  task: index of the function in key_list (POOL_EXIT_TASK to terminate the worker)
+#  result: status and length of the pickled result, followed by the pickle
+POOL_TASK = struct.Struct('!i')
+POOL_EXIT_TASK = -1
+POOL_RESULT_HEADER = struct.Struct('!BQ')
+POOL_RESULT_OK = 0
+POOL_RESULT_FAILED = 1
+
+
+def read_into(fd, buf):
+    """
+    Fill buf reading from the file descriptor fd (blocking)
+
+    @type fd: int
+    @param fd: file descriptor to read from
+
+    @type buf: bytearray
+    @param buf: preallocated buffer, filled completely unless EOF is reached
+
+    @rtype: int
+    @return: number of bytes read
+    """
+    view = memoryview(buf)
+    fobj = io.FileIO(fd, 'r', closefd=False)
+    pos = 0
+    while pos < len(buf):
+        try:
+            count = fobj.readinto(view[pos:])
+        except (IOError, OSError) as err:
+            if err.errno == errno.EINTR:
+                continue
+            raise
+        if not count:
+            # EOF
+            break
+        pos += count
+    return pos
+
+
+def write_all(fd, data):
+    """
+    Write all data to the file descriptor fd (os.write can do partial writes on pipes)
+    """
+    pos = 0
+    while pos < len(data):
+        try:
+            pos += os.write(fd, buffer(data, pos))
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+
+
+class FdPoller:
+    """
+    Persistent registration of the file descriptors to wait on
+    Uses epoll, poll or select, depending on what is available, like fetch_ready_fork_result_list
+    but the registration is done only once per fd and the waits are blocking
+    """
+
+    def __init__(self):
+        self.fds = []
+        self.poll_obj = None
+        try:
+            # Level Trigger behavior (default)
+            self.poll_obj = select.epoll()
+            self.poll_type = "epoll"
+            self.mask = select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR
+        except (AttributeError, IOError) as err:
+            logSupport.log.warning("Failed to load select.epoll() '%s'" % str(err))
+            try:
+                self.poll_obj = select.poll()
+                self.poll_type = "poll"
+                self.mask = select.POLLIN | select.POLLHUP | select.POLLERR
+            except (AttributeError, IOError) as err:
+                logSupport.log.warning("Failed to load select.poll() '%s'" % str(err))
+                self.poll_type = "select"
+
+    def register(self, fd):
+        if self.poll_obj is not None:
+            self.poll_obj.register(fd, self.mask)
+        self.fds.append(fd)
+
+    def unregister(self, fd):
+        if self.poll_obj is not None:
+            self.poll_obj.unregister(fd)
+        self.fds.remove(fd)
+
+    def wait(self):
+        """
+        Block until some of the registered fd are readable (or closed)
+
+        @rtype: list
+        @return: list of readable fd
+        """
+        while True:
+            try:
+                if self.poll_type == "epoll":
+                    return [i[0] for i in self.poll_obj.poll(-1)]
+                elif self.poll_type == "poll":
+                    return [i[0] for i in self.poll_obj.poll()]
+                else:
+                    return select.select(self.fds, [], [])[0]
+            except (IOError, select.error) as err:
+                # interrupted by a signal (e.g. SIGCHLD), try again
+                if err.args[0] != errno.EINTR:
+                    raise
+
+    def close(self):
+        if self.poll_type == "epoll":
+            self.poll_obj.close()
+
+
+class PoolWorker:
+    """
+    Pre-forked process executing the functions of a ForkPoolManager, one at a time
+    Tasks are sent as indexes in the list of functions, known to the worker since it is forked after add_fork
+    """
+
+    def __init__(self, functions, close_fds=()):
+        """
+        Fork the worker
+
+        @type functions: list
+        @param functions: list of (function, arg1, ...) tuples, the tasks are indexes in this list
+
+        @type close_fds: list
+        @param close_fds: file descriptors of the parent not needed by the worker (e.g. other workers' pipes)
+        """
+        task_r, self.task_w = os.pipe()
+        self.result_r, result_w = os.pipe()
+        self.task = None
+        self.pid = None
+        unregister_sighandler()
+        try:
+            self.pid = os.fork()
+        finally:
+            if self.pid != 0:
+                # parent, also if the fork failed
+                register_sighandler()
+                if self.pid is None:
+                    for fd in (task_r, self.task_w, self.result_r, result_w):
+                        os.close(fd)
+        if self.pid == 0:
+            logSupport.disable_rotate = True
+            os.close(self.task_w)
+            os.close(self.result_r)
+            for fd in close_fds:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+            try:
+                self.serve(functions, task_r, result_w)
+            finally:
+                # Exit, immediately. Don't want any cleanup, since I was created
+                # just for performing the work
+                os._exit(0)
+        os.close(task_r)
+        os.close(result_w)
+
+    def serve(self, functions, task_r, result_w):
+        """
+        Worker loop: run the requested functions and send back the framed results until told to exit
+        """
+        task_buf = bytearray(POOL_TASK.size)
+        while True:
+            if read_into(task_r, task_buf) < POOL_TASK.size:
+                # parent gone
+                return
+            task = POOL_TASK.unpack_from(buffer(task_buf))[0]
+            if task == POOL_EXIT_TASK:
+                return
+            function_torun = functions[task][0]
+            trace_mark = servicePerformance.getTraceMark()
+            try:
+                out = cPickle.dumps(servicePerformance.packForkResult(function_torun(*functions[task][1:]),
+                                                                      trace_mark),
+                                    cPickle.HIGHEST_PROTOCOL)
+                status = POOL_RESULT_OK
+            except:
+                logSupport.log.warning("Forked process '%s' failed" % str(function_torun))
+                logSupport.log.exception("Forked process '%s' failed" % str(function_torun))
+                out = ""
+                status = POOL_RESULT_FAILED
+            write_all(result_w, POOL_RESULT_HEADER.pack(status, len(out)))
+            write_all(result_w, out)
+
+    def send_task(self, task):
+        self.task = task
+        write_all(self.task_w, POOL_TASK.pack(task))
+
+    def fetch_result(self):
+        """
+        Read the result of the current task, the result is read in a buffer preallocated using the length prefix
+        Can raise FetchError if the worker died or the function failed
+
+        @rtype: Object
+        @return: Unpickled object
+        """
+        header = bytearray(POOL_RESULT_HEADER.size)
+        try:
+            if read_into(self.result_r, header) < POOL_RESULT_HEADER.size:
+                raise FetchError("Worker %s terminated before returning the result" % self.pid)
+            status, length = POOL_RESULT_HEADER.unpack_from(buffer(header))
+            if status != POOL_RESULT_OK:
+                raise FetchError("Function failed in worker %s" % self.pid)
+            data = bytearray(length)
+            if read_into(self.result_r, data) < length:
+                raise FetchError("Worker %s terminated while returning the result" % self.pid)
+            return servicePerformance.unpackForkResult(cPickle.load(cStringIO.StringIO(data)))
+        except (OSError, IOError, EOFError, cPickle.UnpicklingError) as err:
+            etype, evalue, etraceback = sys.exc_info()
+            raise FetchError, 'Exception during read probably due to worker failure, original exception and trace %s: %s' % (etype, evalue), etraceback
+
+    def stop(self):
+        """
+        Tell the worker to exit (if still alive) and wait for it
+        """
+        try:
+            write_all(self.task_w, POOL_TASK.pack(POOL_EXIT_TASK))
+        except OSError:
+            # EPIPE, the worker is already gone
+            pass
+        os.close(self.task_w)
+        os.close(self.result_r)
+        os.waitpid(self.pid, 0)
+
+    def kill(self):
+        """
+        Kill the worker, without waiting for its current task, and reap it
+        """
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            # already gone
+            pass
+        os.close(self.task_w)
+        os.close(self.result_r)
+        os.waitpid(self.pid, 0)
+
+
+class ForkPoolManager(ForkManager):
+    """
+    Same interface of ForkManager, but bounded_fork_and_collect runs the functions in a pool of
+    pre-forked workers instead of forking once per function.
+    Workers are forked when collecting, so the functions and arguments do not have to be picklable (only the results)
+    and the workers see the state of the parent at that time.
+    Each worker runs multiple functions: the side effects of a function are visible to the next ones in the same worker
+    """
+
+    def bounded_fork_and_collect(self, max_forks, log_progress=True, sleep_time=None):
+        """
+        Run all the functions using at most max_forks workers and collect the results
+
+        @type max_forks: int
+        @param max_forks: maximum number of workers
+
+        @type log_progress: bool
+        @param log_progress: log the number of active workers and functions to finish
+
+        @param sleep_time: ignored, kept for compatibility with ForkManager. The waits are blocking
+
+        @rtype: dict
+        @return: Dictionary with the results, the keys are the ones used in add_fork
+        """
+        post_work_info = {}
+        nr_errors = 0
+        failed = []
+        functions = [self.functions_tofork[key] for key in self.key_list]
+        tasks_remaining = deque(range(len(functions)))
+        functions_remaining = len(functions)
+        nr_workers = min(max(max_forks, 1), functions_remaining)
+
+        poller = FdPoller()
+        workers = {}  # result fd -> PoolWorker
+
+        def start_worker():
+            close_fds = [fd for w in workers.values() for fd in (w.task_w, w.result_r)]
+            worker = PoolWorker(functions, close_fds)
+            poller.register(worker.result_r)
+            workers[worker.result_r] = worker
+            worker.send_task(tasks_remaining.popleft())
+
+        try:
+            for i in range(nr_workers):
+                start_worker()
+            if log_progress:
+                logSupport.log.info("Active forks = %i, Forks to finish = %i" % (len(workers), functions_remaining))
+
+            while functions_remaining > 0:
+                for fd in poller.wait():
+                    worker = workers[fd]
+                    key = self.key_list[worker.task]
+                    functions_remaining -= 1
+                    try:
+                        post_work_info[key] = worker.fetch_result()
+                    except FetchError as err:
+                        errmsg = "Failed to extract info from child '%s' %s" % (str(key), err)
+                        logSupport.log.warning(errmsg)
+                        logSupport.log.exception(errmsg)
+                        failed.append(key)
+                        nr_errors += 1
+                        # the worker may be dead or in an inconsistent state, replace it
+                        poller.unregister(fd)
+                        del workers[fd]
+                        worker.kill()
+                        if tasks_remaining:
+                            start_worker()
+                        continue
+                    if tasks_remaining:
+                        worker.send_task(tasks_remaining.popleft())
+                    else:
+                        poller.unregister(fd)
+                        del workers[fd]
+                        worker.stop()
+                if log_progress:
+                    logSupport.log.info("Active forks = %i, Forks to finish = %i" % (len(workers), functions_remaining))
+        finally:
+            # only left if something failed, do not wait for the tasks still running
+            for fd in workers.keys():
+                workers[fd].kill()
+            poller.close()
+
+        if nr_errors > 0:
+            raise ForkResultError(nr_errors, post_work_info, failed=failed)
+
+        return post_work_info
@@ -16,6 +16,7 @@ from __future__ import print_function
 
 import string
 import time
+import threading
 try:
     import rrdtool # pylint: disable=import-error
 except:
@@ -32,6 +33,18 @@ class BaseRRDSupport:
     def isDummy(self):
         return (self.rrd_obj is None)
 
+    #############################################################
+    # Updates are written synchronously, nothing to do
+    # WriteBehindRRDSupport overwrites it
+    def flush(self):
+        """
+        Write the queued updates
+
+        Returns a tuple (nr updates written, nr rrdtool processes or module calls used,
+                         list of (rrdfname, error message) of the failed updates)
+        """
+        return (0, 0, [])
+
     #############################################################
     # The default will do nothing
     # Children should overwrite it, if needed
@@ -137,12 +150,7 @@ class BaseRRDSupport:
             # nothing to do in this case
             return
 
-        lck = self.get_disk_lock(rrdfname)
-        try:
-            self.rrd_obj.update(str(rrdfname), '%li:%s'%(time, val))
-        finally:
-            lck.close()
-
+        self.rrd_update(str(rrdfname), ['%li:%s'%(time, val)])
         return
 
     #############################################################
@@ -160,7 +168,7 @@ class BaseRRDSupport:
         if self.rrd_obj is None:
             return # nothing to do in this case
 
-        args = [str(rrdfname)]
+        args = []
         ds_names = sorted(val_dict.keys())
 
         ds_names_real = []
@@ -176,14 +184,26 @@ class BaseRRDSupport:
         args.append('-t')
         args.append(string.join(ds_names_real, ':'))
         args.append(('%li:' % time) + string.join(ds_vals, ':'))
-    
+
+        self.rrd_update(str(rrdfname), args)
+        return
+
+    #############################################################
+    def rrd_update(self, rrdfname, update_args):
+        """
+        Send one update to an RRD archive, holding its disk lock
+        Children can overwrite it to change how updates are written
+
+        Arguments:
+          rrdfname    - File path name of the RRD archive
+          update_args - rrdtool update arguments following the file name,
+                        the last one being the time:values string
+        """
         lck = self.get_disk_lock(rrdfname)
         try:
-            #print args
-            self.rrd_obj.update(*args)
+            self.rrd_obj.update(rrdfname, *update_args)
         finally:
             lck.close()
-            
         return
 
     #############################################################
@@ -502,6 +522,177 @@ class rrdSupport(BaseRRDSupport):
                 rrd_obj = None
         BaseRRDSupport.__init__(self, rrd_obj)
 
+# This class queues the updates in memory and writes them in batches
+# from a background thread; create, fetch, graph,... are still synchronous
+# Reading back an updated archive flushes the pending updates first
+class WriteBehindRRDSupport(BaseRRDSupport):
+    def __init__(self, rrd_support=None, max_pending=1000):
+        """
+        Arguments:
+          rrd_support - the RRD support object writing the updates
+                        (default rrdSupport())
+          max_pending - start a background flush once these many updates
+                        are queued (None to flush only when asked)
+        """
+        if rrd_support is None:
+            rrd_support = rrdSupport()
+        BaseRRDSupport.__init__(self, rrd_support.rrd_obj)
+        self.rrd_support = rrd_support
+        self.max_pending = max_pending
+
+        self.queue_lock = threading.Lock()
+        self.pending = {}       # rrdfname -> list of update_args, in order
+        self.pending_files = [] # rrdfname, in order of first update
+        self.nr_pending = 0
+
+        self.flush_thread = None
+        self.flush_errors = []
+        self.nr_updates = 0  # updates written since the last wait_flush
+        self.nr_calls = 0    # rrdtool processes or module calls used for them
+
+    def get_disk_lock(self, fname):
+        return self.rrd_support.get_disk_lock(fname)
+
+    def get_graph_lock(self, fname):
+        return self.rrd_support.get_graph_lock(fname)
+
+    #############################################################
+    def rrd_update(self, rrdfname, update_args):
+        """
+        Queue the update, it will be written by the next flush
+        """
+        self.queue_lock.acquire()
+        try:
+            if rrdfname not in self.pending:
+                self.pending[rrdfname] = []
+                self.pending_files.append(rrdfname)
+            self.pending[rrdfname].append(tuple(update_args))
+            self.nr_pending += 1
+            start_flush = (self.max_pending is not None) and (self.nr_pending >= self.max_pending)
+        finally:
+            self.queue_lock.release()
+
+        if start_flush:
+            self.start_flush()
+        return
+
+    def start_flush(self):
+        """
+        Write all the queued updates in a background thread
+        A flush still running is waited for first, so that the updates
+        of each file are written in the order they were queued
+        """
+        self.join_flush_thread()
+
+        self.queue_lock.acquire()
+        try:
+            updates = [(fname, self.pending[fname]) for fname in self.pending_files]
+            self.pending = {}
+            self.pending_files = []
+            self.nr_pending = 0
+        finally:
+            self.queue_lock.release()
+
+        if len(updates) == 0:
+            return # nothing to do
+
+        self.flush_thread = threading.Thread(target=self.write_updates, args=(updates,))
+        self.flush_thread.setDaemon(True)
+        self.flush_thread.start()
+        return
+
+    def join_flush_thread(self):
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+            self.flush_thread = None
+        return
+
+    def wait_flush(self):
+        """
+        Wait for the background flush to complete
+
+        Returns a tuple (nr updates written, nr rrdtool processes or module calls used,
+                         list of (rrdfname, error message) of the failed updates)
+        counting the updates written since the last call
+        """
+        self.join_flush_thread()
+        out = (self.nr_updates, self.nr_calls, self.flush_errors)
+        self.flush_errors = []
+        self.nr_updates = 0
+        self.nr_calls = 0
+        return out
+
+    def flush(self):
+        """
+        Write all the queued updates and wait for them to complete
+
+        Returns the same as wait_flush
+        """
+        self.start_flush()
+        return self.wait_flush()
+
+    def write_updates(self, updates):
+        """
+        Write the updates, in order; it runs in the flush thread
+        and stores the errors in flush_errors
+        Each value is a separate rrdtool update command: rrdtool stops at the
+        first value it rejects (e.g. an old time), so merging the values of
+        a file in one command would lose the following ones
+
+        Arguments:
+          updates - list of (rrdfname, list of update_args)
+        """
+        commands = []
+        for rrdfname, update_list in updates:
+            self.nr_updates += len(update_list)
+            for update_args in update_list:
+                commands.append([rrdfname] + list(update_args))
+
+        if hasattr(self.rrd_obj, 'update_many'):
+            # a single rrdtool process for all the updates
+            self.nr_calls += 1
+            locks = [self.get_disk_lock(fname) for fname, update_list in updates]
+            try:
+                try:
+                    errors = self.rrd_obj.update_many(commands)
+                except Exception as e:
+                    errors = [(args, str(e)) for args in commands]
+            finally:
+                for lck in locks:
+                    lck.close()
+            for args, msg in errors:
+                self.flush_errors.append((args[0], msg))
+        else:
+            self.nr_calls += len(commands)
+            for args in commands:
+                try:
+                    BaseRRDSupport.rrd_update(self, args[0], args[1:])
+                except Exception as e:
+                    self.flush_errors.append((args[0], str(e)))
+        return
+
+    #############################################################
+    def fetch_rrd(self, filename, CF, resolution=None, start=None,
+                  end=None, daemon=None):
+        """
+        Write the queued updates, so that they are visible, then fetch
+        See BaseRRDSupport.fetch_rrd
+        Update errors are not returned here but by the next wait_flush
+        """
+        self.start_flush()
+        self.join_flush_thread()
+        return BaseRRDSupport.fetch_rrd(self, filename, CF, resolution, start, end, daemon)
+
+
+def write_behind(rrd_support):
+    """
+    Return a WriteBehindRRDSupport queueing the updates of rrd_support
+    (rrd_support itself if it is already write-behind)
+    """
+    if isinstance(rrd_support, WriteBehindRRDSupport):
+        return rrd_support
+    return WriteBehindRRDSupport(rrd_support)
+
 
 ##################################################################
 # INTERNAL, do not use directly
@@ -525,6 +716,7 @@ def string_quote_join(arglist):
         l2.append('"%s"' % e)
     return string.join(l2)
 
+#################################
 #################################
 # this class is used in place of the rrdtool
 # python module, if that one is not available
@@ -541,6 +733,36 @@ class rrdtool_exe:
         cmdline = '%s update %s'%(self.rrd_bin, string_quote_join(args))
         outstr = subprocessSupport.iexe_cmd(cmdline)
         return
+
+    def update_many(self, updates):
+        """
+        Run many updates in a single rrdtool process, using the pipe mode
+
+        Input is a list of update argument lists, each starting with the file name.
+        Output is the list of (update arguments, error message) that failed.
+        """
+        if len(updates) == 0:
+            return []
+
+        cmds = []
+        for args in updates:
+            cmds.append('update %s\n' % string_quote_join(args))
+
+        proc = subprocess.Popen([self.rrd_bin, '-'], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        outstr, errstr = proc.communicate(string.join(cmds, ''))
+
+        # rrdtool prints either OK or ERROR for each command, in order
+        results = [line for line in outstr.split('\n')
+                   if line.startswith('OK') or line.startswith('ERROR')]
+        errors = []
+        for i in range(len(updates)):
+            if i >= len(results):
+                errors.append((updates[i], "rrdtool exited with code %s before the update: %s" %
+                               (proc.returncode, errstr.strip())))
+            elif results[i].startswith('ERROR'):
+                errors.append((updates[i], results[i][6:].strip()))
+        return errors
     
     def info(self,*args):
         cmdline = '%s info %s'%(self.rrd_bin, string_quote_join(args))
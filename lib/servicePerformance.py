@@ -13,7 +13,10 @@
 #
 ###############################################################################
 
+import os
 import time
+import json
+import functools
 
 class PerfMetric:
     """
@@ -25,6 +28,9 @@ class PerfMetric:
         # metric is a dict of dict with following structure
         # {event_name: {'start_time': time(), 'end_time': time()}}
         self.metric = {}
+        # counters is a dict of numbers (e.g. queries done, bytes received)
+        # {counter_name: value}
+        self.counters = {}
 
 
     def register_event_time(self, event_name, t_tag, t=None):
@@ -47,6 +53,15 @@ class PerfMetric:
         self.register_event_time(event_name, 'end_time', t=t)
 
 
+    def set_counter(self, counter_name, value):
+        self.counters[counter_name] = value
+
+
+    def get_counters(self):
+        # objects unpickled from older versions have no counters
+        return getattr(self, 'counters', {})
+
+
     def event_lifetime(self, event_name, check_active_event=True):
         lifetime = -1
         if event_name in self.metric:
@@ -92,6 +107,10 @@ def getPerfMetricEventLifetime(name, event_name):
     return getPerfMetric(name).event_lifetime(event_name)
 
 
+def setPerfMetricCounter(name, counter_name, value):
+    getPerfMetric(name).set_counter(counter_name, value)
+
+
 def getPerfMetric(name):
     """
     Given the name of the service, return the PerfMetric object
@@ -103,4 +122,265 @@ def getPerfMetric(name):
     return _perf_metric[name]
 
 
+def resetPerfMetric(name):
+    """
+    Forget all the events of the service, e.g. at the start of a new
+    iteration of a long-lived process
+    """
+
+    global _perf_metric
+    _perf_metric.pop(name, None)
+
+
+################################################################################
+# Span tracing
+################################################################################
+
+# Number of durations per span name used for the rolling percentiles
+SPAN_HISTORY_SIZE = 100
+
+
+class Tracer:
+    """
+    Nested spans (timed sections of the code) of a process and of the
+    children forked by it (see lib/fork.py)
+    Spans are dictionaries: {'id', 'parent', 'name', 'pid', 'start', 'end'}
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # finished spans, in order of completion
+        self.spans = []
+        # stack of the open spans, the last one is the parent of new spans
+        self.open_spans = []
+        self.counter = 0
+
+
+    def start_span(self, name):
+        if not self.enabled:
+            return None
+        self.counter += 1
+        pid = os.getpid()
+        # the pid keeps the ids unique across forked processes
+        span = {'id': '%i.%i' % (pid, self.counter),
+                'parent': None,
+                'name': name,
+                'pid': pid,
+                'start': time.time(),
+                'end': None}
+        if self.open_spans:
+            span['parent'] = self.open_spans[-1]['id']
+        self.open_spans.append(span)
+        return span
+
+
+    def end_span(self, span):
+        if span is None:
+            return
+        span['end'] = time.time()
+        # normally the last one, unless a span was not closed
+        for i in range(len(self.open_spans) - 1, -1, -1):
+            if self.open_spans[i] is span:
+                del self.open_spans[i]
+                break
+        self.spans.append(span)
+
+
+class TraceSpan:
+    """
+    Span usable as context manager or as function decorator:
+        with TraceSpan('query_schedd'):
+            ...
+        @TraceSpan('countMatch')
+        def countMatch(...):
+    Does nothing if tracing is not enabled
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.span = None
+
+
+    def __enter__(self):
+        self.span = _tracer.start_span(self.name)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _tracer.end_span(self.span)
+        # do not swallow exceptions
+        return False
+
+
+    def __call__(self, function):
+        name = self.name
+
+        @functools.wraps(function)
+        def traced_function(*args, **kwargs):
+            with TraceSpan(name):
+                return function(*args, **kwargs)
+        return traced_function
+
+
+class TracedForkResult:
+    """
+    Result of a forked function, with the spans recorded by the child process
+    """
+
+    def __init__(self, result, spans):
+        self.result = result
+        self.spans = spans
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile
+
+    @type values: list
+    @param values: numbers, not empty
+
+    @type pct: int
+    @param pct: percentile, 0-100
+
+    @rtype: number
+    @return: smallest value greater or equal than pct percent of the values
+    """
+    values = sorted(values)
+    rank = int((len(values) * pct + 99) / 100)
+    return values[max(rank, 1) - 1]
+
+
+# Internal global tracer, should not be used directly
+_tracer = Tracer()
 
+
+################################################################################
+# Span tracing user functions
+################################################################################
+
+
+def enableTracing(enabled=True):
+    _tracer.enabled = enabled
+
+
+def isTracingEnabled():
+    return _tracer.enabled
+
+
+def getTraceMark():
+    """
+    Return a marker of the spans finished so far, to retrieve only the following ones
+    """
+    return len(_tracer.spans)
+
+
+def getTraceSpans(mark=0):
+    """
+    Return the finished spans, those after mark (see getTraceMark) if provided
+    """
+    return _tracer.spans[mark:]
+
+
+def mergeTraceSpans(spans):
+    """
+    Add spans recorded in a different process, e.g. a forked child
+    """
+    if _tracer.enabled:
+        _tracer.spans.extend(spans)
+
+
+def resetTrace():
+    """
+    Forget the finished spans, e.g. at the end of an iteration
+    The open ones are kept and will be recorded when they end
+    """
+    _tracer.spans = []
+
+
+def packForkResult(result, mark):
+    """
+    Used in the forked child, add to its result the spans finished after mark
+
+    @param result: return value of the forked function
+    @param mark: trace marker taken when the child started (getTraceMark)
+    @return: result or TracedForkResult
+    """
+    spans = getTraceSpans(mark)
+    if not spans:
+        return result
+    return TracedForkResult(result, spans)
+
+
+def unpackForkResult(result):
+    """
+    Used in the parent, merge the spans of the child and return the original result
+    """
+    if isinstance(result, TracedForkResult):
+        mergeTraceSpans(result.spans)
+        return result.result
+    return result
+
+
+def writeTraceFile(fname, spans=None):
+    """
+    Write the spans as Chrome trace-event JSON (chrome://tracing, Perfetto)
+    The file is written to a temporary file and then renamed
+
+    @type fname: string
+    @param fname: trace file name
+
+    @type spans: list
+    @param spans: spans to write, defaults to all the finished spans
+    """
+    if spans is None:
+        spans = getTraceSpans()
+    events = []
+    for span in spans:
+        events.append({'name': span['name'],
+                       'cat': 'glideinwms',
+                       'ph': 'X',
+                       'ts': int(span['start'] * 1000000),
+                       'dur': int((span['end'] - span['start']) * 1000000),
+                       'pid': span['pid'],
+                       'tid': span['pid'],
+                       'args': {'id': span['id'], 'parent': span['parent']}})
+    tmp_fname = '%s.tmp' % fname
+    with open(tmp_fname, 'w') as fd:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fd)
+    os.rename(tmp_fname, fname)
+
+
+def summarizeTrace(name, durations=None, history_size=SPAN_HISTORY_SIZE):
+    """
+    Add the durations of the finished spans to the rolling history
+    and set the <span name>_p50 and <span name>_p95 counters of the service
+
+    @type name: string
+    @param name: name of the service (PerfMetric)
+
+    @type durations: dict
+    @param durations: rolling history {span name: [durations]}, e.g. saved
+        across iterations in a history file. Updated in place
+
+    @type history_size: int
+    @param history_size: max number of durations kept per span name
+
+    @rtype: dict
+    @return: the updated rolling history
+    """
+    if durations is None:
+        durations = {}
+    for span in getTraceSpans():
+        span_durations = durations.setdefault(span['name'], [])
+        span_durations.append(span['end'] - span['start'])
+    perf_metric = getPerfMetric(name)
+    for span_name in durations:
+        span_durations = durations[span_name][-history_size:]
+        durations[span_name] = span_durations
+        if not span_durations:
+            continue
+        perf_metric.set_counter('%s_p50' % span_name,
+                                float('{0:.3f}'.format(percentile(span_durations, 50))))
+        perf_metric.set_counter('%s_p95' % span_name,
+                                float('{0:.3f}'.format(percentile(span_durations, 95))))
+    return durations
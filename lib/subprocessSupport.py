@@ -1,7 +1,12 @@
 import os
+import errno
+import select
 import subprocess
 import shlex
 
+# Size of the stdout chunks returned by iexe_cmd_stream
+STREAM_CHUNK_SIZE = 65536
+
 # Exception classes used by this module.
 class CalledProcessError(Exception):
     """This exception is raised when a process run by check_call() or
@@ -81,6 +86,106 @@ def iexe_cmd(cmd, useShell=False, stdin_data=None, child_env=None):
         raise CalledProcessError(exitStatus, cmd, output="".join(stderrdata))
     return stdoutdata
 
+def iexe_cmd_stream(cmd, useShell=False, stdin_data=None, child_env=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Fork a process and execute cmd, like iexe_cmd, but return a generator
+    yielding the stdout data as it arrives, in chunks of at most chunk_size bytes.
+    The chunks do not respect line boundaries.
+    stderr is collected and, as in iexe_cmd, CalledProcessError is raised
+    at the end of the iteration if the command exits with a non zero status.
+    If the iteration is interrupted (the generator is closed) the process is killed.
+
+    @type cmd: string
+    @param cmd: String containing the entire command including all arguments
+    @type useShell: bool
+    @param useShell: see iexe_cmd
+    @type stdin_data: string
+    @param stdin_data: Data that will be fed to the command via stdin
+    @type child_env: dict
+    @param child_env: Environment to be set before execution
+    @type chunk_size: int
+    @param chunk_size: maximum size of the chunks read from stdout
+    """
+    stderr_list = []
+    exitStatus = 0
+    process = None
+
+    try:
+        try:
+            # Add in parent process environment, make sure that env ovrrides parent
+            if child_env:
+                for k in os.environ:
+                    if not k in child_env:
+                        child_env[k] = os.environ[k]
+            # otherwise just use the parent environment
+            else:
+                child_env = os.environ
+
+            if useShell:
+                command_list = ['%s' % cmd,]
+            else:
+                command_list = shlex.split(cmd.encode('utf8'))
+            process = subprocess.Popen(command_list, shell=useShell,
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       env=child_env)
+        except OSError as e:
+            err_str = "Error running '%s'\nStdout:%s\nStderr:%s\nException OSError:%s"
+            raise RuntimeError(err_str % (cmd, "", "", e))
+
+        # stdin is written in PIPE_BUF pieces, when select says it is writable, so it never blocks
+        wlist = []
+        input_offset = 0
+        if stdin_data:
+            wlist.append(process.stdin)
+        else:
+            process.stdin.close()
+        rlist = [process.stdout, process.stderr]
+        while rlist or wlist:
+            try:
+                ready_r, ready_w, _ = select.select(rlist, wlist, [])
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if ready_w:
+                try:
+                    input_offset += os.write(process.stdin.fileno(),
+                                             stdin_data[input_offset:input_offset + select.PIPE_BUF])
+                except OSError as e:
+                    if e.errno != errno.EPIPE:
+                        raise
+                    # the process is not reading stdin any more
+                    input_offset = len(stdin_data)
+                if input_offset >= len(stdin_data):
+                    process.stdin.close()
+                    wlist = []
+            for pipe in ready_r:
+                data = os.read(pipe.fileno(), chunk_size)
+                if not data:
+                    pipe.close()
+                    rlist.remove(pipe)
+                elif pipe is process.stdout:
+                    yield data
+                else:
+                    stderr_list.append(data)
+        exitStatus = process.wait()
+    finally:
+        if process is not None and process.returncode is None:
+            # iteration interrupted, do not leave the process behind
+            try:
+                process.kill()
+            except OSError:
+                pass
+            process.wait()
+            for pipe in (process.stdin, process.stdout, process.stderr):
+                pipe.close()
+
+    if exitStatus:
+        raise CalledProcessError(exitStatus, cmd, output="".join(stderr_list))
+
+
 def call(*popenargs, **kwargs):
     """Run command with arguments.  Wait for command to complete, then
     return the returncode attribute.
@@ -26,6 +26,7 @@ import time
 
 # imports and global for flattenDict
 from collections import Mapping
+from collections import OrderedDict
 from operator import add
 
 _FLAG_FIRST = object()
@@ -164,6 +165,44 @@ except AttributeError:
     replace = os.rename
 
 
+class LRUCache:
+    """Cache keeping at most max_size values, the least recently used are dropped first
+    Counts the hits and misses of get, to evaluate the cache effectiveness
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """Return the cached value, default if not in the cache
+        """
+        try:
+            val = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data[key] = val  # now the most recently used
+        self.hits += 1
+        return val
+
+    def put(self, key, val):
+        self.data.pop(key, None)
+        self.data[key] = val
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        """Remove all the values, the hit and miss counts are kept
+        """
+        self.data.clear()
+
+
 class ExpiredFileException(Exception):
     """The file is too old to be used
     """
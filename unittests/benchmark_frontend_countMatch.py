@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Project:
+#   glideinWMS
+#
+# Description:
+#   benchmark the indexed match engine against the eval based countMatch
+#   Uses the same data dumped for profile_frontend.py (see glideinFrontendElement.subprocess_count_dt)
+#
+#   Usage: benchmark_frontend_countMatch.py [dumpdir [repetitions [match_expr]]]
+#
+
+from __future__ import print_function
+
+import sys
+import time
+
+from glideinwms.lib import logSupport
+from glideinwms.frontend.glideinFrontendLib import countMatch
+from glideinwms.unittests.profile_frontend import FakeLogger, load_dump, CMS_MATCH_EXPR
+
+
+def time_countMatch(repetitions, *args, **kwargs):
+    """Run countMatch repetitions times
+
+    @return: tuple (result of the last run, list of the run times in seconds)
+    """
+    times = []
+    out = None
+    for i in range(repetitions):
+        t_begin = time.time()
+        out = countMatch(*args, **kwargs)
+        times.append(time.time() - t_begin)
+    return out, times
+
+
+def main():
+    dumpdir = "/tmp/frontend_dump/main/"
+    repetitions = 3
+    mexpr = CMS_MATCH_EXPR
+    if len(sys.argv) > 1:
+        dumpdir = sys.argv[1]
+    if len(sys.argv) > 2:
+        repetitions = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        mexpr = sys.argv[3]
+    logSupport.log = FakeLogger(open('/dev/null', 'w'))
+
+    glidein_dict, attr_dict, condorq_match_list, condorq_dict = load_dump(dumpdir)
+    nr_jobs = sum([len(el.fetchStored()) for el in condorq_dict.values()])
+    print("Frontend dump loaded: %d entries, %d schedds, %d jobs" % (len(glidein_dict), len(condorq_dict), nr_jobs))
+
+    cexpr = compile(mexpr, "<string>", "eval")
+    args = (cexpr, condorq_dict, glidein_dict, attr_dict, False, condorq_match_list)
+    eval_out, eval_times = time_countMatch(repetitions, *args)
+    engine_out, engine_times = time_countMatch(repetitions, *args, match_expr=mexpr)
+
+    print("eval:   best %.3fs, average %.3fs" % (min(eval_times), sum(eval_times)/len(eval_times)))
+    print("engine: best %.3fs, average %.3fs" % (min(engine_times), sum(engine_times)/len(engine_times)))
+    print("speedup (best): %.1fx" % (min(eval_times)/max(min(engine_times), 1e-6)))
+    if eval_out != engine_out:
+        print("ERROR: the results of the two implementations differ")
+        return 1
+    print("Results are identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Project:
+#   glideinWMS
+#
+# Description:
+#   micro-benchmark of glideinFrontendLib.uniqueSets over synthetic overlap patterns
+#   The previous (quadratic) implementation is kept here as reference to
+#   compare results and times. It takes minutes already with 1000 entries,
+#   so it is run only up to --reference-max entries (default: not run)
+#
+#   Usage: benchmark_frontend_uniqueSets.py [--reference-max N] [nr_entries ...]
+#
+
+from __future__ import print_function
+
+import sys
+import time
+import random
+
+from glideinwms.frontend.glideinFrontendLib import uniqueSets
+
+# Number of job clusters the entries are matched against
+NR_CLUSTERS = 20000
+
+
+def uniqueSets_reference(in_sets):
+    """uniqueSets as implemented before the signature partitioner"""
+    sorted_sets = []
+    for i in in_sets:
+        common_list = []
+        old_unique = set()
+        new = []
+        for k in sorted_sets:
+            old_unique = old_unique | k
+            common = k & i
+            if common:
+                common_list.append(common)
+        for j in common_list:
+            i = i - j
+            old_unique = old_unique - j
+        old_unique_list = [k & old_unique for k in sorted_sets]
+        if i:
+            new.append(i)
+        new += [o for o in old_unique_list if o]
+        new += [c for c in common_list if c]
+        sorted_sets = new
+
+    sum_set = set()
+    for s in sorted_sets:
+        sum_set = sum_set | s
+    sorted_sets.append(sum_set)
+
+    index_list = []
+    for s in sorted_sets:
+        indexes = []
+        temp_sets = in_sets[:]
+        for t in temp_sets:
+            if s & t:
+                indexes.append(temp_sets.index(t))
+                temp_sets[temp_sets.index(t)] = set()
+        index_list.append(indexes)
+
+    outvals = []
+    for i in range(len(index_list) - 1):
+        outvals.append((set(index_list[i]), sorted_sets[i]))
+    return (outvals, sorted_sets[-1])
+
+
+def pattern_disjoint(nr_entries):
+    """Each entry matches its own clusters"""
+    size = max(NR_CLUSTERS // nr_entries, 1)
+    return [set(range(i * size, (i + 1) * size)) for i in range(nr_entries)]
+
+
+def pattern_identical(nr_entries):
+    """All entries match the same clusters"""
+    return [set(range(NR_CLUSTERS // 10)) for i in range(nr_entries)]
+
+
+def pattern_sites(nr_entries):
+    """Entries grouped in sites, clusters whitelisting a few random sites"""
+    nr_sites = max(nr_entries // 10, 1)
+    rnd = random.Random(nr_entries)
+    out = [set() for i in range(nr_entries)]
+    for cluster in range(NR_CLUSTERS):
+        for site in rnd.sample(range(nr_sites), min(5, nr_sites)):
+            for entry in range(site * 10, min(site * 10 + 10, nr_entries)):
+                out[entry].add(cluster)
+    return out
+
+
+def pattern_random(nr_entries):
+    """Each entry matches a random 10% of the clusters"""
+    rnd = random.Random(nr_entries)
+    return [set(rnd.sample(xrange(NR_CLUSTERS), NR_CLUSTERS // 10)) for i in range(nr_entries)]
+
+
+PATTERNS = (('disjoint', pattern_disjoint), ('identical', pattern_identical),
+            ('sites', pattern_sites), ('random', pattern_random))
+
+
+def normalize(result):
+    outvals, jrange = result
+    return sorted([(sorted(el[0]), sorted(el[1])) for el in outvals]), jrange
+
+
+def main():
+    args = sys.argv[1:]
+    reference_max = 0
+    if args and args[0] == '--reference-max':
+        reference_max = int(args[1])
+        args = args[2:]
+    sizes = [int(el) for el in args] or [1000, 5000, 10000]
+
+    for nr_entries in sizes:
+        for name, pattern in PATTERNS:
+            in_sets = pattern(nr_entries)
+            t_begin = time.time()
+            out = uniqueSets(in_sets)
+            t_new = time.time() - t_begin
+            line = "%6d entries %-10s partitions: %6d  uniqueSets: %8.3fs" % (nr_entries, name, len(out[0]), t_new)
+            if nr_entries <= reference_max:
+                t_begin = time.time()
+                ref_out = uniqueSets_reference(in_sets)
+                t_ref = time.time() - t_begin
+                line += "  reference: %8.3fs" % t_ref
+                if normalize(ref_out) != normalize(out):
+                    line += "  ERROR: results differ"
+            print(line)
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
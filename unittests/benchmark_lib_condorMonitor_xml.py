@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# Project:
+#   glideinWMS
+#
+# Description:
+#   benchmark the incremental XML classad parser of condorMonitor (xml2dict)
+#   against the previous xml2list + list2dict, kept here as reference
+#   The condor_q and condor_status fixtures are scaled up to the requested number of classads.
+#   Each measurement runs in a forked process, to report its own peak memory (maxrss)
+#
+#   Usage: benchmark_lib_condorMonitor_xml.py [nr_classads ...]
+#
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import time
+import string
+import resource
+import xml.parsers.expat
+
+from glideinwms.lib import condorMonitor
+from glideinwms.lib.condorMonitor import XmlClassadParser, list2dict
+
+FIXTURES = (('cq.fixture', ('ClusterId', 'ProcId'), 'ClusterId', '<a n="ClusterId"><i>(\d+)</i></a>'),
+            ('cs.fixture', 'Name', 'Name', '<a n="Name"><s>([^<]*)</s></a>'))
+
+
+class ReferenceParser:
+    """xml2list as implemented before XmlClassadParser (global state replaced by attributes)"""
+
+    def __init__(self):
+        self.data = []
+        self.inclassad = None
+        self.inattr = None
+        self.intype = None
+
+    def start_element(self, name, attrs):
+        if name == "c":
+            self.inclassad = {}
+        elif name == "a":
+            self.inattr = {"name": attrs["n"], "val": ""}
+            self.intype = "s"
+        elif name in ("i", "r"):
+            self.intype = name
+        elif name == "b":
+            self.intype = "b"
+            if 'v' in attrs:
+                self.inattr["val"] = (attrs["v"] in ('T', 't', '1'))
+            else:
+                self.inattr["val"] = None
+        elif name == "un":
+            self.intype = "un"
+            self.inattr["val"] = None
+
+    def end_element(self, name):
+        if name == "c":
+            self.data.append(self.inclassad)
+            self.inclassad = None
+        elif name == "a":
+            self.inclassad[self.inattr["name"]] = self.inattr["val"]
+            self.inattr = None
+        elif name in ("i", "b", "un", "r"):
+            self.intype = "s"
+
+    def char_data(self, data):
+        if self.inattr is None:
+            return
+        if self.intype == "i":
+            self.inattr["val"] = int(data)
+        elif self.intype == "r":
+            self.inattr["val"] = float(data)
+        elif self.intype == "b":
+            if self.inattr["val"] is None:
+                self.inattr["val"] = (data[0] in ('T', 't', '1'))
+        elif self.intype != "un":
+            self.inattr["val"] += string.replace(data, '\\"', '"')
+
+
+def reference_xml2dict(xml_data, attr_name):
+    ref = ReferenceParser()
+    p = xml.parsers.expat.ParserCreate()
+    p.StartElementHandler = ref.start_element
+    p.EndElementHandler = ref.end_element
+    p.CharacterDataHandler = ref.char_data
+    for line in range(len(xml_data)):
+        if xml_data[line][:5] == "<?xml":
+            p.Parse(string.join(xml_data[line:]), 1)
+            break
+    return list2dict(ref.data, attr_name)
+
+
+def new_xml2dict(xml_data, attr_name):
+    return condorMonitor.xml2dict(xml_data, attr_name)
+
+
+def new_xml2dict_chunks(xml_data, attr_name):
+    """Feed the parser with 64KB text chunks, as read from a pipe"""
+    parser = XmlClassadParser(attr_name)
+    chunk = []
+    chunk_len = 0
+    for line in xml_data:
+        chunk.append(line)
+        chunk_len += len(line)
+        if chunk_len > 65536:
+            parser.feed("".join(chunk))
+            chunk = []
+            chunk_len = 0
+    parser.feed("".join(chunk))
+    return parser.close()
+
+
+def scale_fixture(fname, unique_attr, unique_re, nr_classads):
+    """Repeat the classads of the fixture changing unique_attr to have nr_classads distinct ones
+
+    @return: list of lines (with newline), like condorExe.exe_cmd
+    """
+    fd = open(fname)
+    text = fd.read()
+    fd.close()
+    start = text.index("<c>")
+    end = text.rindex("</c>") + len("</c>\n")
+    classads = re.findall(r"<c>.*?</c>\n", text[start:end], re.S)
+    unique_pattern = re.compile(unique_re)
+    out = [text[:start]]
+    for i in range(nr_classads):
+        classad = classads[i % len(classads)]
+        if unique_attr == 'ClusterId':
+            replacement = '<a n="ClusterId"><i>%i</i></a>' % (1000000 + i)
+        else:
+            replacement = '<a n="Name"><s>slot%i@host%i.local</s></a>' % (i % 8, i)
+        out.append(unique_pattern.sub(replacement, classad))
+    out.append(text[end:])
+    return "".join(out).splitlines(True)
+
+
+def measure(func, xml_data, attr_name):
+    """Run func(xml_data, attr_name) in a child process
+
+    @return: tuple (elapsed seconds, peak memory increase in KB, number of classads)
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        rss_begin = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t_begin = time.time()
+        out = func(xml_data, attr_name)
+        elapsed = time.time() - t_begin
+        rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(wfd, "%f %i %i" % (elapsed, rss_end - rss_begin, len(out)))
+        os._exit(0)
+    os.close(wfd)
+    result = os.read(rfd, 1024).split()
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    return float(result[0]), int(result[1]), int(result[2])
+
+
+def main():
+    sizes = [int(el) for el in sys.argv[1:]] or [1000, 10000]
+    condorMonitor.USE_HTCONDOR_PYTHON_BINDINGS = False
+    for nr_classads in sizes:
+        for fname, attr_name, unique_attr, unique_re in FIXTURES:
+            xml_data = scale_fixture(fname, unique_attr, unique_re, nr_classads)
+            nr_bytes = sum([len(line) for line in xml_data])
+            print("%s x %d classads (%.1f MB)" % (fname, nr_classads, nr_bytes / 1048576.))
+            for name, func in (('xml2list+list2dict', reference_xml2dict), ('xml2dict', new_xml2dict),
+                               ('XmlClassadParser.feed', new_xml2dict_chunks)):
+                elapsed, rss, nr_out = measure(func, xml_data, attr_name)
+                print("    %-22s %8.3fs  peak memory +%7.1f MB  classads: %d" % (name, elapsed, rss / 1024., nr_out))
+            if reference_xml2dict(xml_data, attr_name) != new_xml2dict(xml_data, attr_name):
+                print("    ERROR: the results of the two implementations differ")
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
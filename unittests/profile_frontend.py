@@ -83,15 +83,16 @@ class mock_condorq_el:
         return self.obj
 
 
-def main():
-    # Need to be global for cProfile to work
-    global cexpr, condorq_dict, glidein_dict, attr_dict, condorq_match_list
-    dumpdir = "/tmp/frontend_dump/main/" # This will profile the main group. Change it to profile another one
-    # The CMS matching expression as of April 17th 2019
-    mexpr = """(((glidein["attrs"].get("GLIDEIN_MaxMemMBs", 0) == 0) or (job.get("RequestMemory", 0)<=glidein["attrs"]["GLIDEIN_MaxMemMBs"])) and ((job.get("REQUIRED_OS", "any")=="any") or (glidein["attrs"].get("GLIDEIN_REQUIRED_OS", "any")=="any") or (job.get("REQUIRED_OS")==glidein["attrs"]["GLIDEIN_REQUIRED_OS"])) and ((job.get("MaxWallTimeMins", 0)*60)>=glidein["attrs"].get("GLIDEIN_Job_Min_Time", 0)) and ((job.get("MaxWallTimeMins", 0)+10)<(glidein["attrs"]["GLIDEIN_Max_Walltime"]-glidein["attrs"]["GLIDEIN_Retire_Time_Spread"])/60))"""
-    logSupport.log = FakeLogger()
+# The CMS matching expression as of April 17th 2019
+CMS_MATCH_EXPR = """(((glidein["attrs"].get("GLIDEIN_MaxMemMBs", 0) == 0) or (job.get("RequestMemory", 0)<=glidein["attrs"]["GLIDEIN_MaxMemMBs"])) and ((job.get("REQUIRED_OS", "any")=="any") or (glidein["attrs"].get("GLIDEIN_REQUIRED_OS", "any")=="any") or (job.get("REQUIRED_OS")==glidein["attrs"]["GLIDEIN_REQUIRED_OS"])) and ((job.get("MaxWallTimeMins", 0)*60)>=glidein["attrs"].get("GLIDEIN_Job_Min_Time", 0)) and ((job.get("MaxWallTimeMins", 0)+10)<(glidein["attrs"]["GLIDEIN_Max_Walltime"]-glidein["attrs"]["GLIDEIN_Retire_Time_Spread"])/60))"""
 
-    # Load the saved dictionaries
+
+def load_dump(dumpdir):
+    """Load the data structures saved by countMatch
+
+    @param dumpdir: directory with the pickle files (e.g. /tmp/frontend_dump/main/)
+    @return: tuple (glidein_dict, attr_dict, condorq_match_list, condorq_dict)
+    """
     with open(os.path.join(dumpdir, 'glidein_dict.pickle')) as fd:
         glidein_dict = pickle.load(fd)
     with open(os.path.join(dumpdir, 'attr_dict.pickle')) as fd:
@@ -99,8 +100,6 @@ def main():
     with open(os.path.join(dumpdir, 'condorq_match_list.pickle')) as fd:
         condorq_match_list = pickle.load(fd)
 
-    cexpr = compile(mexpr, "<string>", "eval")
-
     # The condor_q dictionary names depend on the schedd names, use glob to get them
     cwd = os.getcwd()
     os.chdir(dumpdir)
@@ -112,9 +111,24 @@ def main():
         with open(os.path.join(dumpdir, schedd_name)) as fd:
             condorq_dict[schedd_name] = mock_condorq_el(pickle.load(fd))
 
+    return glidein_dict, attr_dict, condorq_match_list, condorq_dict
+
+
+def main():
+    # Need to be global for cProfile to work
+    global cexpr, condorq_dict, glidein_dict, attr_dict, condorq_match_list
+    dumpdir = "/tmp/frontend_dump/main/" # This will profile the main group. Change it to profile another one
+    mexpr = CMS_MATCH_EXPR
+    logSupport.log = FakeLogger()
+
+    # Load the saved dictionaries
+    glidein_dict, attr_dict, condorq_match_list, condorq_dict = load_dump(dumpdir)
+
+    cexpr = compile(mexpr, "<string>", "eval")
+
     print("Frontend dump loaded")
 
-    cProfile.run('countMatch(cexpr, condorq_dict, glidein_dict, attr_dict, condorq_match_list)')
+    cProfile.run('countMatch(cexpr, condorq_dict, glidein_dict, attr_dict, False, condorq_match_list)')
 
 
 if __name__ == "__main__":
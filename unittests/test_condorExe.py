@@ -22,6 +22,8 @@ from glideinwms.lib import condorExe
 from glideinwms.lib.condorExe import iexe_cmd
 from glideinwms.lib.condorExe import exe_cmd
 from glideinwms.lib.condorExe import exe_cmd_sbin
+from glideinwms.lib.condorExe import iexe_cmd_stream
+from glideinwms.lib.condorExe import exe_cmd_stream
 from glideinwms.lib.condorExe import ExeError
 
 
@@ -106,6 +108,44 @@ class TestCondorExe(unittest.TestCase):
             self.failUnlessRaises(
                 ExeError, exe_cmd_sbin, script, self.dummy_args)
 
+    def test_iexe_cmd_stream(self):
+        """
+        iexe_cmd_stream yields the same output as iexe_cmd, in chunks, and
+        raises the errors at the end of the iteration.
+        """
+        for script in self.normal_exit_scripts:
+            cmd = os.path.join(condorExe.condor_bin_path, script)
+            output = "".join(iexe_cmd_stream(cmd))
+            self.assertEqual(iexe_cmd(cmd), output.splitlines())
+
+        for script in self.abnormal_exit_scripts:
+            cmd = os.path.join(condorExe.condor_bin_path, script)
+            self.failUnlessRaises(ExeError, list, iexe_cmd_stream(cmd))
+
+        # stdin is fed while reading stdout
+        stdin_data = "".join(["line %i\n" % i for i in range(20000)])
+        self.assertEqual(stdin_data, "".join(iexe_cmd_stream("cat", stdin_data=stdin_data)))
+
+    def test_iexe_cmd_stream_close(self):
+        """
+        Closing the generator before the end kills the process
+        """
+        stream = iexe_cmd_stream("yes")
+        self.assertTrue(next(stream))
+        stream.close()
+        self.assertEqual([], list(stream))
+
+    def test_exe_cmd_stream(self):
+        """
+        exe_cmd_stream is a wrapper for iexe_cmd_stream.
+        """
+        for script in self.normal_exit_scripts:
+            output = "".join(exe_cmd_stream(script, self.dummy_args))
+            self.assertEqual(exe_cmd(script, self.dummy_args), output.splitlines())
+
+        for script in self.abnormal_exit_scripts:
+            self.failUnlessRaises(ExeError, list, exe_cmd_stream(script, self.dummy_args))
+
 
 if __name__ == '__main__':
     unittest.main(
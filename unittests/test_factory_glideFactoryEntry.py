@@ -192,11 +192,19 @@ class TestEntry(unittest.TestCase):
         #self.assertEqual(expected, entry.logLogStats(marker))
         assert False  # TODO: implement your test here
 
-    @unittest.skip('for now')
     def test_queryQueuedGlideins(self):
-        #entry = Entry(name, startup_dir, glidein_descript, frontend_descript)
-        #self.assertEqual(expected, entry.queryQueuedGlideins())
-        assert False  # TODO: implement your test here
+        condorq = mock.Mock()
+        with mock.patch('glideinwms.factory.glideFactoryLib.getCondorQData', return_value=condorq) as m_query:
+            self.assertEqual(condorq, self.entry.queryQueuedGlideins())
+            m_query.assert_called_once_with(self.entry_name, None, self.entry.scheddName,
+                                            factoryConfig=self.entry.gflFactoryConfig)
+            # glideins already queried by the entry group
+            prefetched = mock.Mock()
+            self.entry.setPrefetchedCondorQ(prefetched)
+            self.assertEqual(prefetched, self.entry.queryQueuedGlideins())
+            self.assertEqual(1, m_query.call_count)
+            self.entry.setPrefetchedCondorQ(None)
+            self.assertEqual(condorq, self.entry.queryQueuedGlideins())
 
     def test_setDowntime(self):
         self.entry.loadDowntimes()
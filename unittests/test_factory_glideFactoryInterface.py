@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for findGroupWork and the work snapshot in glideinwms/factory/glideFactoryInterface.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import mock
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.unittests.unittest_utils import FakeLogger
+from glideinwms.lib import logSupport
+from glideinwms.lib import condorExe
+from glideinwms.lib import classadSupport
+from glideinwms.factory import glideFactoryInterface as gfi
+
+
+class FakeSymKey:
+    def __init__(self, code):
+        self.code = code
+
+    def decrypt_hex(self, data):
+        if not data.startswith(self.code):
+            raise ValueError("wrong key")
+        return data[len(self.code):]
+
+
+class FakePubKey:
+    def __init__(self, key_id='key1'):
+        self.key_id = key_id
+        self.extract_sym_key = mock.Mock(side_effect=FakeSymKey)
+
+    def get_pub_key_id(self):
+        return self.key_id
+
+
+def request_ad(name, key_code, identity='fe@host', param='proxy', entry='entry1', key_id='key1'):
+    return {'GlideinMyType': 'glideclient', 'ReqGlidein': '%s@glidein@factory' % entry,
+            'ReqName': '%s@glidein@factory' % entry, 'ClientName': name, 'WebSignType': 'sha1',
+            'ReqPubKeyID': key_id, 'ReqEncKeyCode': key_code,
+            'ReqEncIdentity': key_code + identity, 'AuthenticatedIdentity': identity,
+            'ReqIdleGlideins': 3, 'GlideinEncParamProxy': key_code + param}
+
+
+class TestFindGroupWork(unittest.TestCase):
+
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.lock_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(gfi.factoryConfig, 'lock_dir', self.lock_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ads = {}
+        status = mock.Mock()
+        status.fetchStored.side_effect = lambda: self.ads
+        patcher = mock.patch('glideinwms.lib.condorMonitor.CondorStatus', return_value=status)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        gfi.clear_decryption_caches()
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def find_work(self, pub_key_obj):
+        return gfi.findGroupWork('factory', 'glidein', ['entry1'], ['sha1'], pub_key_obj)
+
+    def test_cached_decryption(self):
+        pub_key = FakePubKey()
+        self.ads = {'fe1': request_ad('fe1', 'k1'), 'fe2': request_ad('fe2', 'k2', param='other')}
+        work = self.find_work(pub_key)
+        self.assertEqual('proxy', work['entry1']['fe1']['params_decrypted']['Proxy'])
+        self.assertEqual('other', work['entry1']['fe2']['params_decrypted']['Proxy'])
+        self.assertEqual(2, pub_key.extract_sym_key.call_count)
+        param_misses = gfi.decryptedParamCache.misses
+
+        # same requests in the next cycle, nothing is decrypted again
+        work2 = self.find_work(pub_key)
+        self.assertEqual(work, work2)
+        self.assertEqual(2, pub_key.extract_sym_key.call_count)
+        self.assertEqual(param_misses, gfi.decryptedParamCache.misses)
+
+        # new parameter value with the same key
+        self.ads['fe1'] = request_ad('fe1', 'k1', param='renewed')
+        work = self.find_work(pub_key)
+        self.assertEqual('renewed', work['entry1']['fe1']['params_decrypted']['Proxy'])
+        self.assertEqual(2, pub_key.extract_sym_key.call_count)
+
+        # a different factory key does not use the cached symmetric keys
+        other_key = FakePubKey('key2')
+        self.find_work(other_key)
+        self.assertEqual(2, other_key.extract_sym_key.call_count)
+
+        gfi.clear_decryption_caches()
+        self.find_work(pub_key)
+        self.assertEqual(4, pub_key.extract_sym_key.call_count)
+
+    def test_invalid_not_cached(self):
+        pub_key = FakePubKey()
+        ad = request_ad('fe1', 'k1')
+        ad['GlideinEncParamProxy'] = 'bad'
+        self.ads = {'fe1': ad}
+        self.assertEqual({}, self.find_work(pub_key))
+        self.assertEqual({}, self.find_work(pub_key))
+        self.assertEqual(0, len([k for k in gfi.decryptedParamCache.data if k[-1] == 'bad']))
+
+
+class TestWorkSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.lock_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(gfi.factoryConfig, 'lock_dir', self.lock_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pub_key = FakePubKey()
+        unencrypted = request_ad('fe4', 'k4')
+        for attr in ('ReqPubKeyID', 'ReqEncKeyCode', 'ReqEncIdentity', 'GlideinEncParamProxy'):
+            del unencrypted[attr]
+        md5 = request_ad('fe5', 'k5')
+        md5['WebSignType'] = 'md5'
+        self.ads = {'fe1': request_ad('fe1', 'k1'),
+                    'fe2': request_ad('fe2', 'k2', entry='entry2'),
+                    'fe3': request_ad('fe3', 'k3', key_id='key3'),
+                    'fe4': unencrypted,
+                    'fe5': md5}
+        self.status = mock.Mock()
+        self.status.fetchStored.side_effect = lambda: self.ads
+        patcher = mock.patch('glideinwms.lib.condorMonitor.CondorStatus', return_value=self.status)
+        self.condor_status = patcher.start()
+        self.addCleanup(patcher.stop)
+        gfi.clear_decryption_caches()
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def test_constraint(self):
+        self.assertEqual('(GlideinMyType=?="glideclient") && (stringListMember(ReqGlidein,"e1@g@f,e2@g@f")=?=True)'
+                         ' && stringListMember(WebSignType,"sha1")'
+                         ' && (((ReqPubKeyID=?="key1") && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined))'
+                         ' || (ReqPubKeyID=?=Undefined))',
+                         gfi.getWorkConstraint(gfi.get_req_glideins('f', 'g', ['e1', 'e2']), ['sha1'], ['key1']))
+        self.assertTrue('((ReqPubKeyID=?="key1") || (ReqPubKeyID=?="key2"))' in
+                        gfi.getWorkConstraint(['e1@g@f'], ['sha1'], ['key1', 'key2']))
+
+    def test_snapshot(self):
+        nr_ads = gfi.writeWorkSnapshot('factory', 'glidein', ['entry1', 'entry2'], ['sha1'], [self.pub_key])
+        self.assertEqual(5, nr_ads)
+        self.assertTrue('entry1@glidein@factory,entry2@glidein@factory' in self.status.load.call_args[0][0])
+        self.assertEqual(1, self.condor_status.call_count)
+
+        snapshot = gfi.loadWorkSnapshot(60)
+        work = gfi.findGroupWork('factory', 'glidein', ['entry1'], ['sha1'], self.pub_key,
+                                 work_snapshot=snapshot)
+        # the classads the collector would have returned, without querying it
+        self.assertEqual(['fe1', 'fe4'], sorted(work['entry1'].keys()))
+        self.assertEqual('proxy', work['entry1']['fe1']['params_decrypted']['Proxy'])
+        work = gfi.findGroupWork('factory', 'glidein', ['entry2'], ['sha1'], self.pub_key,
+                                 work_snapshot=snapshot)
+        self.assertEqual({'entry2': ['fe2']}, dict([(k, work[k].keys()) for k in work]))
+        self.assertEqual(1, self.condor_status.call_count)
+
+        # entries or keys not in the snapshot are queried
+        gfi.findGroupWork('factory', 'glidein', ['entry3'], ['sha1'], self.pub_key, work_snapshot=snapshot)
+        self.assertEqual(2, self.condor_status.call_count)
+        gfi.findGroupWork('factory', 'glidein', ['entry1'], ['sha1'], FakePubKey('key3'), work_snapshot=snapshot)
+        self.assertEqual(3, self.condor_status.call_count)
+
+    def test_stale_snapshot(self):
+        self.assertEqual(None, gfi.loadWorkSnapshot(60))
+        gfi.writeWorkSnapshot('factory', 'glidein', ['entry1'], ['sha1'], [self.pub_key])
+        self.assertEqual(None, gfi.loadWorkSnapshot(-1))
+
+
+class TestDeltaAdvertisement(unittest.TestCase):
+
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        patcher = mock.patch.object(gfi, 'advertizeDeltaCache', classadSupport.ClassadDeltaCache(600))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(gfi, 'exe_condor_advertise')
+        self.exe_condor_advertise = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_classads(self, nr_idle):
+        fname = os.path.join(self.work_dir, 'gfi_adm_gf')
+        for entry in ('e1', 'e2'):
+            gf_classad = gfi.EntryClassad('f', 'g', entry, 'grid', 'grid_proxy', ['sha1'],
+                                          glidein_monitors={'TotalStatusIdle': nr_idle.get(entry, 0)})
+            gf_classad.writeToFile(fname)
+        return fname
+
+    def test_advertize(self):
+        gfi.advertizeGlideinFromFile(self.write_classads({}), is_multi=True)
+        self.assertEqual(1, self.exe_condor_advertise.call_count)
+        # unchanged, the file is removed without advertising it
+        fname = self.write_classads({})
+        gfi.advertizeGlideinFromFile(fname, is_multi=True)
+        self.assertEqual(1, self.exe_condor_advertise.call_count)
+        self.assertFalse(os.path.exists(fname))
+        # only the changed classad is advertised
+        fname = self.write_classads({'e2': 1})
+        nr_advertised = []
+        self.exe_condor_advertise.side_effect = lambda fname, *args, **kwargs: nr_advertised.append(
+            open(fname).read().count('GlideinMyType = '))
+        gfi.advertizeGlideinFromFile(fname, is_multi=True)
+        self.assertEqual([1], nr_advertised)
+
+    def test_advertize_failure(self):
+        self.exe_condor_advertise.side_effect = condorExe.ExeError("collector down")
+        gfi.advertizeGlideinFromFile(self.write_classads({}), is_multi=True)
+        self.exe_condor_advertise.side_effect = None
+        # advertised again after the failure
+        gfi.advertizeGlideinFromFile(self.write_classads({}), is_multi=True)
+        self.assertEqual(2, self.exe_condor_advertise.call_count)
+        self.assertEqual(2, len(gfi.advertizeDeltaCache.sent))
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
@@ -22,6 +22,7 @@ from glideinwms.unittests.unittest_utils import FakeLogger
 from glideinwms.factory.glideFactoryLib import FactoryConfig
 from glideinwms.factory.glideFactoryLib import secClass2Name
 from glideinwms.factory.glideFactoryLib import getCondorQData
+from glideinwms.factory.glideFactoryLib import getCondorQDataMulti
 from glideinwms.factory.glideFactoryLib import getCondorQCredentialList
 from glideinwms.factory.glideFactoryLib import getQCredentials
 from glideinwms.factory.glideFactoryLib import getQProxSecClass
@@ -60,8 +61,8 @@ from glideinwms.factory.glideFactoryLib import getCondorStatusData
 # from glideinwms.factory.glideFactoryLib import executeSubmit
 # from glideinwms.factory.glideFactoryLib import pickSubmitFile
 # from glideinwms.factory.glideFactoryLib import submitGlideins
-# from glideinwms.factory.glideFactoryLib import removeGlideins
-# from glideinwms.factory.glideFactoryLib import releaseGlideins
+from glideinwms.factory.glideFactoryLib import removeGlideins
+from glideinwms.factory.glideFactoryLib import releaseGlideins
 # from glideinwms.factory.glideFactoryLib import in_submit_environment
 # from glideinwms.factory.glideFactoryLib import get_submit_environment
 # from glideinwms.factory.glideFactoryLib import isGlideinWithinHeldLimits
@@ -184,6 +185,38 @@ class TestFactoryConfig(unittest.TestCase):
         self.assertEqual(cd.client_name, client_name)
         self.assertEqual(cd.entry_name, entry_name)
 
+    def test_get_condor_q_data_multi(self):
+        glideinwms.factory.glideFactoryLib.logSupport.log = FakeLogger()
+        entry_attr = self.cnf.entry_schedd_attribute
+        jobs = {(1, 0): {entry_attr: 'entry1', 'JobStatus': 1},
+                (1, 1): {entry_attr: 'entry1', 'JobStatus': 2},
+                (2, 0): {entry_attr: 'entry2', 'JobStatus': 1},
+                (3, 0): {entry_attr: 'other', 'JobStatus': 1}}
+        condorq = mock.Mock()
+        condorq.stored_data = jobs
+        with mock.patch.object(glideinwms.factory.glideFactoryLib, 'condorMonitor') as m_monitor:
+            m_monitor.CondorQ.return_value = condorq
+            out = getCondorQDataMulti(['entry1', 'entry2', 'entry3'], 'schedd_name', self.cnf)
+        # a single query with all the entries
+        m_monitor.CondorQ.assert_called_once_with('schedd_name')
+        self.assertEqual(1, condorq.load.call_count)
+        constraint, format_list = condorq.load.call_args[0]
+        for entry_name in ('entry1', 'entry2', 'entry3'):
+            self.assertTrue('(%s =?= "%s")' % (entry_attr, entry_name) in constraint)
+        self.assertTrue((entry_attr, 's') in format_list)
+        self.assertEqual(['entry1', 'entry2', 'entry3'], sorted(out.keys()))
+        self.assertEqual([(1, 0), (1, 1)], sorted(out['entry1'].fetchStored().keys()))
+        self.assertEqual([(2, 0)], out['entry2'].stored_data.keys())
+        self.assertEqual({}, out['entry3'].stored_data)
+        cd = out['entry2']
+        cd.load()
+        self.assertEqual([(2, 0)], cd.stored_data.keys())
+        self.assertEqual('schedd_name', cd.schedd_name)
+        self.assertEqual(self.cnf.factory_name, cd.factory_name)
+        self.assertEqual(self.cnf.glidein_name, cd.glidein_name)
+        self.assertEqual('entry2', cd.entry_name)
+        self.assertEqual(None, cd.client_name)
+
     def test_get_q_credentials(self):
         glideinwms.factory.glideFactoryLib.logSupport.log = FakeLogger()
         glideinwms.factory.glideFactoryLib.condorMonitor = mock.Mock()
@@ -617,33 +650,59 @@ class TestSubmitGlideins(unittest.TestCase):
         assert False
 
 
+def fake_act_many(failing):
+    """condorRemoveMany/condorReleaseMany replacement failing for the jids in failing"""
+    def act_many(jid_list, schedd_name, do_forcex=False):
+        return dict([(jid, (jid not in failing, 'msg')) for jid in jid_list])
+    return act_many
+
+
 class TestRemoveGlideins(unittest.TestCase):
-    @unittest.skip('for now')
-    def test_remove_glideins(self):
-        # self.assertEqual(
-        #     expected,
-        #     removeGlideins(
-        #         schedd_name,
-        #         jid_list,
-        #         force,
-        #         log,
-        #         factoryConfig))
-        # assert False # TODO: implement your test here
-        assert False
+
+    def setUp(self):
+        self.cnf = FactoryConfig()
+        self.cnf.remove_sleep = 0
+        self.log = FakeLogger()
+        self.jids = [(10, i) for i in range(10)]
+
+    @mock.patch('glideinwms.factory.glideFactoryLib.condorManager.condorRemoveMany')
+    def test_remove_glideins(self, m_remove):
+        m_remove.side_effect = fake_act_many([(10, 1)])
+        self.cnf.max_removes = 5
+        self.cnf.max_remove_cluster_size = 100
+        removeGlideins('schedd1', self.jids, log=self.log, factoryConfig=self.cnf)
+        # one command for max_removes jobs, one more to replace the failed one
+        self.assertEqual([mock.call(self.jids[:5], 'schedd1'), mock.call(self.jids[5:6], 'schedd1')],
+                         m_remove.call_args_list)
+
+    @mock.patch('glideinwms.factory.glideFactoryLib.condorManager.condorRemoveMany')
+    def test_remove_glideins_force(self, m_remove):
+        m_remove.side_effect = fake_act_many([(10, 1)])
+        self.cnf.max_removes = 100
+        self.cnf.max_remove_cluster_size = 4
+        removeGlideins('schedd1', self.jids, force=True, log=self.log, factoryConfig=self.cnf)
+        # chunks of max_remove_cluster_size, each followed by -forcex of the removed ones
+        self.assertEqual([mock.call(self.jids[:4], 'schedd1'),
+                          mock.call([self.jids[0]] + self.jids[2:4], 'schedd1', do_forcex=True),
+                          mock.call(self.jids[4:8], 'schedd1'),
+                          mock.call(self.jids[4:8], 'schedd1', do_forcex=True),
+                          mock.call(self.jids[8:], 'schedd1'),
+                          mock.call(self.jids[8:], 'schedd1', do_forcex=True)],
+                         m_remove.call_args_list)
 
 
 class TestReleaseGlideins(unittest.TestCase):
-    @unittest.skip('for now')
-    def test_release_glideins(self):
-        # self.assertEqual(
-        #     expected,
-        #     releaseGlideins(
-        #         schedd_name,
-        #         jid_list,
-        #         log,
-        #         factoryConfig))
-        # # assert False # TODO: implement your test here
-        assert False
+
+    @mock.patch('glideinwms.factory.glideFactoryLib.condorManager.condorReleaseMany')
+    def test_release_glideins(self, m_release):
+        m_release.side_effect = fake_act_many([])
+        cnf = FactoryConfig()
+        cnf.release_sleep = 0
+        cnf.max_releases = 2
+        jids = [(10, i) for i in range(10)]
+        releaseGlideins('schedd1', jids, log=FakeLogger(), factoryConfig=cnf)
+        # as before, up to max_releases+1 jobs are released
+        m_release.assert_called_once_with(jids[:3], 'schedd1')
 
 
 class TestInSubmitEnvironment(unittest.TestCase):
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for EntryDataCache in glideinwms/factory/glideFactoryMonitorAggregator.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.factory.glideFactoryMonitorAggregator import EntryDataCache
+
+
+class TestEntryDataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor_dir = tempfile.mkdtemp()
+        self.entries = ['A', 'B', 'C']
+        for entry in self.entries[:2]:
+            self.write_entry(entry, entry.lower())
+        self.loaded = []
+        self.cache = EntryDataCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.monitor_dir)
+
+    def write_entry(self, entry, content):
+        fname = self.fname(entry)
+        fd = open(fname + '.tmp', 'w')
+        fd.write(content)
+        fd.close()
+        os.rename(fname + '.tmp', fname)
+
+    def fname(self, entry):
+        return os.path.join(self.monitor_dir, 'entry_%s.txt' % entry)
+
+    def fnames(self, entry):
+        return (self.fname(entry),)
+
+    def load_entry(self, entry):
+        self.loaded.append(entry)
+        try:
+            return open(self.fname(entry)).read()
+        except IOError:
+            return None
+
+    def test_load(self):
+        data, nr_loaded = self.cache.load('txt', self.entries, self.fnames, self.load_entry)
+        self.assertEqual({'A': 'a', 'B': 'b'}, data)
+        self.assertEqual(3, nr_loaded)
+        # nothing changed
+        data, nr_loaded = self.cache.load('txt', self.entries, self.fnames, self.load_entry)
+        self.assertEqual({'A': 'a', 'B': 'b'}, data)
+        self.assertEqual(0, nr_loaded)
+        self.assertEqual(['A', 'B', 'C'], self.loaded)
+        # replaced and new files are reloaded
+        self.write_entry('B', 'b')
+        self.write_entry('C', 'c2')
+        data, nr_loaded = self.cache.load('txt', self.entries, self.fnames, self.load_entry)
+        self.assertEqual({'A': 'a', 'B': 'b', 'C': 'c2'}, data)
+        self.assertEqual(['A', 'B', 'C', 'B', 'C'], self.loaded)
+        # removed entries are dropped
+        data, nr_loaded = self.cache.load('txt', ['A'], self.fnames, self.load_entry)
+        self.assertEqual({'A': 'a'}, data)
+        self.assertEqual(['A'], self.cache.data['txt'].keys())
+
+    def test_parallel_load(self):
+        serial_data, nr_loaded = EntryDataCache().load('txt', self.entries, self.fnames, self.load_entry)
+        data, nr_loaded = self.cache.load('txt', self.entries, self.fnames, self.load_entry, parallel_workers=2)
+        self.assertEqual(serial_data, data)
+        self.assertEqual(3, nr_loaded)
+        self.write_entry('A', 'a2')
+        data, nr_loaded = self.cache.load('txt', self.entries, self.fnames, self.load_entry, parallel_workers=2)
+        self.assertEqual({'A': 'a2', 'B': 'b'}, data)
+        self.assertEqual(1, nr_loaded)
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
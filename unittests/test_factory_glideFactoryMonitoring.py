@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for FactoryStatusData in glideinwms/factory/glideFactoryMonitoring.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import mock
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.unittests.unittest_utils import FakeLogger
+from glideinwms.lib import xmlParse
+from glideinwms.factory import glideFactoryMonitoring
+from glideinwms.factory.glideFactoryMonitoring import FactoryStatusData
+from glideinwms.factory.glideFactoryMonitoring import condorQStats
+from glideinwms.factory.glideFactoryMonitoring import RRD_LIST
+
+
+def fetch_rrd(filename, CF, resolution=None, start=None, end=None, daemon=None):
+    # 3 data points with 2 data sets
+    return ((start, end, resolution), ('Idle', 'Running'), [(1, 2), (3, 4), (5, 6), (None, None)])
+
+
+def xml_strings(data):
+    # the XML files have only string values
+    if isinstance(data, dict):
+        return dict([(k, xml_strings(data[k])) for k in data])
+    return '%s' % data
+
+
+class TestFactoryStatusData(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor_dir = tempfile.mkdtemp()
+        self.monitoring_config = glideFactoryMonitoring.MonitoringConfig(log=FakeLogger())
+        self.monitoring_config.monitor_dir = self.monitor_dir
+        self.rrd_support = mock.Mock()
+        self.rrd_support.fetch_rrd.side_effect = fetch_rrd
+        patcher = mock.patch('glideinwms.lib.rrdSupport.rrdSupport', return_value=self.rrd_support)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.status_data = FactoryStatusData(log=FakeLogger(), base_dir=self.monitor_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.monitor_dir)
+
+    def test_getData(self):
+        data = self.status_data.getData('client@fe', monitoringConfig=self.monitoring_config)
+        periods = [el[0] for el in self.status_data.getPeriods(self.monitoring_config)]
+        self.assertEqual(len(self.status_data.resolution), len(periods))
+        for rrd in RRD_LIST:
+            self.assertEqual(sorted(periods), sorted(data[rrd]['frontend_fe/'].keys()))
+            for period in periods:
+                self.assertEqual({'Idle': 3, 'Running': 4}, data[rrd]['frontend_fe/'][period])
+        self.assertEqual(['frontend_fe/'], self.status_data.frontends)
+        self.assertEqual(len(RRD_LIST) * len(periods), self.rrd_support.fetch_rrd.call_count)
+
+    def test_fetch_cache(self):
+        nr_periods = len(self.status_data.getPeriods(self.monitoring_config))
+        self.status_data.getData('client@fe', monitoringConfig=self.monitoring_config)
+        self.status_data.getData('client@fe', monitoringConfig=self.monitoring_config)
+        self.assertEqual(len(RRD_LIST) * nr_periods, self.status_data.nr_fetches)
+        self.assertEqual(len(RRD_LIST) * nr_periods, self.status_data.nr_cached_fetches)
+        self.status_data.logFetchStats()
+        self.assertEqual({}, self.status_data.fetch_cache)
+        self.assertEqual(0, self.status_data.nr_fetches)
+        self.status_data.getData('client@fe', monitoringConfig=self.monitoring_config)
+        self.assertEqual(2 * len(RRD_LIST) * nr_periods, self.rrd_support.fetch_rrd.call_count)
+
+    def test_writeFiles(self):
+        nr_periods = len(self.status_data.getPeriods(self.monitoring_config))
+        self.status_data.getData('client@fe', monitoringConfig=self.monitoring_config)
+        xml_data = self.status_data.getXMLData(RRD_LIST[0])
+        self.assertTrue('<frontend name="frontend_fe">' in xml_data)
+        self.status_data.logFetchStats()
+        self.rrd_support.fetch_rrd.reset_mock()
+        self.monitoring_config.write_file = mock.Mock()
+        self.status_data.writeFiles(monitoringConfig=self.monitoring_config)
+        # each total RRD fetched once per resolution, not once per XML file
+        self.assertEqual(len(RRD_LIST) * nr_periods, self.rrd_support.fetch_rrd.call_count)
+        self.assertEqual(len(RRD_LIST), self.monitoring_config.write_file.call_count)
+        file_name, xml_str = self.monitoring_config.write_file.call_args_list[0][0]
+        self.assertEqual('rrd_Status_Attributes.xml', file_name)
+        self.assertTrue('<total>' in xml_str)
+        self.assertTrue('<frontend name="frontend_fe">' in xml_str)
+
+    def test_writeFiles_sidecar(self):
+        self.status_data.getData('client@fe', monitoringConfig=self.monitoring_config)
+        self.monitoring_config.write_file = mock.Mock()
+        self.monitoring_config.write_sidecar = mock.Mock()
+        self.status_data.writeFiles(monitoringConfig=self.monitoring_config)
+        self.assertEqual(len(RRD_LIST), self.monitoring_config.write_sidecar.call_count)
+        for i in range(len(RRD_LIST)):
+            file_name, xml_str = self.monitoring_config.write_file.call_args_list[i][0]
+            sidecar_name, sidecar_data = self.monitoring_config.write_sidecar.call_args_list[i][0]
+            self.assertEqual(file_name, sidecar_name)
+            xml_data = xmlParse.xmlstring2dict(xml_str, always_singular_list={'timezone': {}})
+            del xml_data['updated']
+            self.assertEqual(xml_data, xml_strings(sidecar_data))
+
+
+class TestSidecar(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor_dir = tempfile.mkdtemp()
+        self.monitoring_config = glideFactoryMonitoring.MonitoringConfig(log=FakeLogger())
+        self.monitoring_config.monitor_dir = self.monitor_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.monitor_dir)
+
+    def test_condorq_sidecar(self):
+        data = {'fe1': {'Status': {'Idle': 3, 'Running': 1},
+                        'Requested': {'Idle': 5, 'MaxGlideins': 10, 'Parameters': {'p1': 'v1', 'n': 3}},
+                        'ClientMonitor': {'InfoAge': 12.5, 'JobsIdle': 4, 'Name': None},
+                        'Downtime': {'status': 'False'}},
+                'fe2': {'Status': {'Idle': 0}, 'Requested': {'Parameters': {}}, 'Downtime': {'status': True}}}
+        xml_data = xmlParse.xmlstring2dict(condorQStats.get_xml_data(data))
+        sidecar_data = condorQStats.get_sidecar_data(data)
+        self.assertEqual(xml_data, xml_strings(sidecar_data))
+        self.assertEqual(3, sidecar_data['fe1']['Status']['Idle'])
+        self.assertEqual('False', sidecar_data['fe1']['Downtime']['status'])
+        self.assertEqual('True', sidecar_data['fe2']['Downtime']['status'])
+
+    def test_load_sidecar(self):
+        xml_fname = os.path.join(self.monitor_dir, 'schedd_status.xml')
+        self.assertEqual(None, glideFactoryMonitoring.load_sidecar(xml_fname))
+        self.monitoring_config.write_file('schedd_status.xml', '<glideFactoryEntryQStats/>')
+        self.assertEqual(None, glideFactoryMonitoring.load_sidecar(xml_fname))
+        self.monitoring_config.write_sidecar('schedd_status.xml', {'total': {'Status': {'Idle': 2}}})
+        self.assertEqual({'total': {'Status': {'Idle': 2}}}, glideFactoryMonitoring.load_sidecar(xml_fname))
+        # XML file written after the sidecar
+        sidecar_mtime = os.path.getmtime(xml_fname + glideFactoryMonitoring.SIDECAR_EXT)
+        os.utime(xml_fname, (sidecar_mtime + 10, sidecar_mtime + 10))
+        self.assertEqual(None, glideFactoryMonitoring.load_sidecar(xml_fname))
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
@@ -15,9 +15,12 @@ Project:
 from __future__ import absolute_import
 from __future__ import print_function
 import dis
+import os
 import re
 import sys
 import StringIO
+import tempfile
+from collections import OrderedDict
 import xmlrunner
 import mock
 import unittest2 as unittest
@@ -26,6 +29,7 @@ from glideinwms.frontend.glideinFrontendLib import getClientCondorStatusPerCredI
 import glideinwms.lib.condorExe
 import glideinwms.lib.condorMonitor as condorMonitor
 import glideinwms.frontend.glideinFrontendLib as glideinFrontendLib
+import glideinwms.frontend.glideinFrontendMatch as glideinFrontendMatch
 from glideinwms.unittests.unittest_utils import FakeLogger
 
 
@@ -67,7 +71,7 @@ class FETestCaseBase(unittest.TestCase):
         glideinwms.frontend.glideinFrontendLib.logSupport.log = FakeLogger()
         # Only condor cliens are mocked, not the python bindings
         condorMonitor.USE_HTCONDOR_PYTHON_BINDINGS = False
-        with mock.patch('glideinwms.lib.condorExe.exe_cmd') as m_exe_cmd:
+        with mock.patch('glideinwms.lib.condorExe.exe_cmd_stream') as m_exe_cmd:
             f = open('cs.fixture')
             m_exe_cmd.return_value = f.readlines()
             self.status_dict = glideinFrontendLib.getCondorStatus(['coll1'])
@@ -102,7 +106,7 @@ class FETestCaseBase(unittest.TestCase):
         with mock.patch('glideinwms.lib.condorMonitor.LocalScheddCache.iGetEnv') as m_iGetEnv:
             cq = condorMonitor.CondorQ(schedd_name='sched1', pool_name='pool1')
 
-        with mock.patch('glideinwms.lib.condorExe.exe_cmd') as m_exe_cmd:
+        with mock.patch('glideinwms.lib.condorExe.exe_cmd_stream') as m_exe_cmd:
             f = open('cq.fixture')
             m_exe_cmd.return_value = f.readlines()
             cq.load()
@@ -185,6 +189,113 @@ class FETestCaseCount(FETestCaseBase):
                          (1, 1, 1, 1))
 
 
+    def test_countMatch_engine(self):
+        # the indexed engine must give the same results as eval
+        self.glidein_dict[self.glidein_dict_k2]['attrs']['GLIDEIN_MaxMemMBs'] = 2000
+        self.glidein_dict[self.glidein_dict_k3]['attrs']['GLIDEIN_Sites_List'] = ['Site_Name1', 'Site_Name3']
+        match_exprs = [
+            'True',
+            'not job.has_key("DESIRED_Sites") or glidein["attrs"].get("GLIDEIN_Site") in job["DESIRED_Sites"]',
+            'job.get("DESIRED_Sites") == glidein["attrs"]["GLIDEIN_Site"]',
+            'glidein["attrs"]["GLIDEIN_Site"] != job.get("DESIRED_Sites")',
+            'job.get("DESIRED_Sites") in glidein["attrs"].get("GLIDEIN_Sites_List", [])',
+            '(glidein["attrs"].get("GLIDEIN_MaxMemMBs", 0) == 0) or (job.get("ProcId", 0) * 500 <= glidein["attrs"]["GLIDEIN_MaxMemMBs"])',
+            'job["ProcId"] > glidein["attrs"]["GLIDEIN_CPUS"]',
+            'job.get("JobStatus") == 1 and not (glidein["attrs"]["GLIDEIN_Site"] < job.get("User", 0))',
+            '(job.get("DESIRED_Sites", "").find(glidein["attrs"]["GLIDEIN_Site"]) >= 0) and job["ProcId"]',
+        ]
+        for match_expr in match_exprs:
+            match_obj = compile(match_expr, "<string>", "eval")
+            expected = glideinFrontendLib.countMatch(
+                match_obj, self.condorq_dict, self.glidein_dict, {}, False)
+            actual = glideinFrontendLib.countMatch(
+                match_obj, self.condorq_dict, self.glidein_dict, {}, False, match_expr=match_expr)
+            self.assertEqual(expected, actual, match_expr)
+
+    def test_countMatch_memo(self):
+        # the memo must give the same results, evaluating only the new pairs
+        match_expr = 'not job.has_key("DESIRED_Sites") or glidein["attrs"].get("GLIDEIN_Site") in job["DESIRED_Sites"]'
+        match_obj = compile(match_expr, "<string>", "eval")
+        version = glideinFrontendMatch.get_match_version(match_expr, [], {})
+        memo = glideinFrontendMatch.MatchMemo(1000, version)
+        expected = glideinFrontendLib.countMatch(
+            match_obj, self.condorq_dict, self.glidein_dict, {}, False)
+        actual = glideinFrontendLib.countMatch(
+            match_obj, self.condorq_dict, self.glidein_dict, {}, False, match_expr=match_expr, match_memo=memo)
+        self.assertEqual(expected, actual)
+        self.assertEqual(0, memo.hits)
+        nr_pairs = memo.misses
+        self.assertEqual(nr_pairs, memo.size)
+
+        # next iteration, in a new process, with an entry changed
+        update = memo.get_update()
+        memo = glideinFrontendMatch.MatchMemo.from_state(memo.get_state(), 1000, version)
+        self.glidein_dict[self.glidein_dict_k3]['attrs']['GLIDEIN_Site'] = 'Site_Name1'
+        self.glidein_dict[self.glidein_dict_k1]['attrs']['LastHeardFrom'] = 12345
+        expected = glideinFrontendLib.countMatch(
+            match_obj, self.condorq_dict, self.glidein_dict, {}, False)
+        actual = glideinFrontendLib.countMatch(
+            match_obj, self.condorq_dict, self.glidein_dict, {}, False, match_expr=match_expr, match_memo=memo)
+        self.assertEqual(expected, actual)
+        self.assertEqual(nr_pairs / 3, memo.misses)
+        self.assertEqual(nr_pairs - nr_pairs / 3, memo.hits)
+
+        # the parent merges the results of the subprocesses
+        parent_memo = glideinFrontendMatch.MatchMemo(1000, version)
+        parent_memo.merge_update(update)
+        parent_memo.merge_update(memo.get_update())
+        self.assertEqual(nr_pairs + nr_pairs / 3, parent_memo.size)
+        parent_memo.prune(set())
+        self.assertEqual(0, parent_memo.size)
+
+        # different configuration
+        self.assertNotEqual(version, glideinFrontendMatch.get_match_version(match_expr, [], {'A': 1}))
+        memo = glideinFrontendMatch.MatchMemo.from_state(memo.get_state(), 1000, 'other')
+        self.assertEqual(0, memo.size)
+
+    def test_memo_ignored_names(self):
+        self.assertEqual([], glideinFrontendMatch.get_memo_ignored_names('glidein["attrs"]["GLIDEIN_Site"] == "A"', []))
+        self.assertEqual(['monitor'], glideinFrontendMatch.get_memo_ignored_names(
+            'glidein["monitor"]["TotalStatusIdle"] < 10', []))
+        fd, policy_fname = tempfile.mkstemp()
+        os.write(fd, 'def match(job, glidein):\n    return glidein["attrs"].get("LastHeardFrom", 0) > 0\n')
+        os.close(fd)
+        self.addCleanup(os.remove, policy_fname)
+        policy = mock.Mock()
+        policy.file = policy_fname
+        self.assertEqual(['LastHeardFrom'], glideinFrontendMatch.get_memo_ignored_names('True', [policy]))
+
+    def test_match_memo_size(self):
+        memo = glideinFrontendMatch.MatchMemo(5, 'v1')
+        memo.add_results('e1', set([1, 2]), set([3]))
+        memo.add_results('e2', set([1]), set([2]))
+        self.assertEqual(5, memo.size)
+        # the least recently used entry is dropped
+        memo.add_results('e3', set([1]), set())
+        self.assertEqual(['e2', 'e3'], memo.entries.keys())
+        self.assertEqual(3, memo.size)
+        # a changed result replaces the old one
+        memo.add_results('e2', set([2]), set())
+        self.assertEqual((set([1, 2]), set()), memo.entries['e2'])
+
+    def test_countMatch_engineErrors(self):
+        match_expr = 'glidein["attrs"]["FOO"] == 3'
+        with mock.patch.object(glideinwms.frontend.glideinFrontendLib.logSupport.log, 'debug') as m_debug:
+            match_obj = compile(match_expr, "<string>", "eval")
+            glideinFrontendLib.countMatch(
+                match_obj, self.condorq_dict, self.glidein_dict, {}, False, match_expr=match_expr)
+            m_debug.assert_called_with(
+                "Failed to evaluate resource match in countMatch. Possibly match_expr has "
+                "errors and trying to reference job or site attribute(s) ''FOO'' in an inappropriate way.")
+        match_expr = 'job.get("ProcId", 1)/0 > glidein["attrs"]["GLIDEIN_CPUS"]'
+        with mock.patch.object(glideinwms.frontend.glideinFrontendLib.logSupport.log, 'debug') as m_debug:
+            match_obj = compile(match_expr, "<string>", "eval")
+            glideinFrontendLib.countMatch(
+                match_obj, self.condorq_dict, self.glidein_dict, {}, False, match_expr=match_expr)
+            log_msg = m_debug.call_args[0]
+            self.assertTrue(
+                'ZeroDivisionError: integer division or modulo by zero' in str(log_msg), log_msg)
+
     def test_countMatchDowntime(self):
         self.glidein_dict[self.glidein_dict_k1]['attrs']['GLIDEIN_In_Downtime'] = True
         # test_countMatch should give the same results unless we call countMatch with ignore_down_entries = False
@@ -273,7 +384,7 @@ class FETestCaseCount(FETestCaseBase):
 class FETestCaseCondorStatus(FETestCaseBase):
 
     def test_getCondorStatus(self):
-        with mock.patch('glideinwms.lib.condorExe.exe_cmd') as m_exe_cmd:
+        with mock.patch('glideinwms.lib.condorExe.exe_cmd_stream') as m_exe_cmd:
             f = open('cs.fixture')
             m_exe_cmd.return_value = f.readlines()
             condorStatus = glideinFrontendLib.getCondorStatus(['coll1'],
@@ -313,6 +424,42 @@ class FETestCaseCondorStatus(FETestCaseBase):
         # need example with GLIDEIN_CredentialIdentifier
         pass
 
+    def reference_client_counts(self, frontend_name, group_name, request_name, cred_id=None):
+        # per request (and credential) scans, as done before countClientCondorStatus
+        req_dict = glideinFrontendLib.getClientCondorStatus(
+            self.status_dict, frontend_name, group_name, request_name)
+        if cred_id is not None:
+            req_dict = glideinFrontendLib.getClientCondorStatusCredIdOnly(req_dict, cred_id)
+        return {
+            'Total': glideinFrontendLib.countCondorStatus(req_dict),
+            'Idle': glideinFrontendLib.countCondorStatus(glideinFrontendLib.getIdleCondorStatus(req_dict)),
+            'Running': glideinFrontendLib.countRunningCondorStatus(glideinFrontendLib.getRunningCondorStatus(req_dict)),
+            'Failed': glideinFrontendLib.countCondorStatus(glideinFrontendLib.getFailedCondorStatus(req_dict)),
+            'TotalCores': glideinFrontendLib.countCoresCondorStatus(
+                glideinFrontendLib.getCondorStatusNonDynamic(req_dict), 'TotalCores'),
+            'IdleCores': glideinFrontendLib.countCoresCondorStatus(
+                glideinFrontendLib.getIdleCoresCondorStatus(req_dict), 'IdleCores'),
+            'RunningCores': glideinFrontendLib.countCoresCondorStatus(
+                glideinFrontendLib.getRunningCoresCondorStatus(req_dict), 'RunningCores'),
+        }
+
+    def test_countClientCondorStatus(self):
+        request_names = [el[0] for el in glideinFrontendLib.getFactoryEntryList(self.status_dict)]
+        for frontend_name, group_name in (('frontend_v3', 'maingroup'), ('CMS-CERN', 'main')):
+            counts = glideinFrontendLib.countClientCondorStatus(self.status_dict, frontend_name, group_name)
+            self.assertTrue(len(counts) > 0)
+            for request_name in request_names:
+                req_counts = counts.get(request_name, {})
+                self.assertEqual(self.reference_client_counts(frontend_name, group_name, request_name),
+                                 glideinFrontendLib.sumClientCondorStatusCounts(req_counts))
+                for cred_id in ('792718', 'other'):
+                    self.assertEqual(
+                        self.reference_client_counts(frontend_name, group_name, request_name, cred_id),
+                        glideinFrontendLib.sumClientCondorStatusCounts(req_counts, [cred_id]))
+        counts = glideinFrontendLib.countClientCondorStatus(self.status_dict, 'frontend_v3', 'maingroup')
+        self.assertEqual(['Site_Name1@v3_0@factory1'], counts.keys())
+        self.assertEqual(1, counts['Site_Name1@v3_0@factory1']['792718']['Total'])
+
     def test_countCondorStatus(self):
         self.assertEqual(
             glideinFrontendLib.countCondorStatus(
@@ -333,7 +480,7 @@ class FETestCaseCondorStatus(FETestCaseBase):
             expected)
 
     def test_getCondorStatusSchedds(self):
-        with mock.patch('glideinwms.lib.condorExe.exe_cmd') as m_exe_cmd:
+        with mock.patch('glideinwms.lib.condorExe.exe_cmd_stream') as m_exe_cmd:
             f = open('cs.schedd.fixture')
             m_exe_cmd.return_value = f.readlines()
             condorStatus = glideinFrontendLib.getCondorStatusSchedds(['coll1'])
@@ -359,6 +506,21 @@ class FETestCaseMisc(FETestCaseBase):
 
         self.assertItemsEqual(expected, glideinFrontendLib.uniqueSets(input))
 
+    def test_uniqueSets_partition(self):
+        input = [set([1, 2, 3]), set(), set([3, 4, 5]), set([1, 2, 3]), set([6]), set([5, 6, 7])]
+        outvals, jrange = glideinFrontendLib.uniqueSets(input)
+        self.assertEqual(set([1, 2, 3, 4, 5, 6, 7]), jrange)
+        # every element is in exactly one subset, together with the indexes of all the sets containing it
+        seen = set()
+        for indexes, subset in outvals:
+            self.assertFalse(seen & subset)
+            seen |= subset
+            for el in subset:
+                self.assertEqual(indexes, set([i for i in range(len(input)) if el in input[i]]))
+        self.assertEqual(jrange, seen)
+        self.assertEqual(6, len(outvals))
+        self.assertEqual(([], set()), glideinFrontendLib.uniqueSets([]))
+
     def test_hashJob(self):
         in1 = {1: 'a', 2: 'b', 3: 'c'}
         in2 = [1, 3]
@@ -380,6 +542,31 @@ class FETestCaseMisc(FETestCaseBase):
              for x in cq_run_dict['sched1'].fetchStored().values()],
             expected)
 
+    def test_appendRealRunning_compact(self):
+        expected = glideinFrontendLib.getRunningCondorQ(self.condorq_dict)
+        glideinFrontendLib.appendRealRunning(expected, self.status_dict)
+        self.condorq_dict['sched1'].compact()
+        cq_run_dict = glideinFrontendLib.getRunningCondorQ(self.condorq_dict)
+        glideinFrontendLib.appendRealRunning(cq_run_dict, self.status_dict)
+        self.assertEqual(expected['sched1'].fetchStored(), cq_run_dict['sched1'].fetchStored())
+
+    def test_getRunningOnIndex(self):
+        index = glideinFrontendLib.getRunningOnIndex(self.status_dict)
+        cq_run_dict = glideinFrontendLib.getRunningCondorQ(self.condorq_dict)
+        glideinFrontendLib.appendRealRunning(cq_run_dict, self.status_dict, index)
+        for job in cq_run_dict['sched1'].fetchStored().values():
+            self.assertEqual(index.get(job.get('RemoteHost'), 'UNKNOWN'), job['RunningOn'])
+        self.assertTrue(set(['Site_Name%s@v3_0@factory1@submit.local' % x for x in (1, 2)]) <= set(index.values()))
+
+        # the first collector with the slot is used
+        slot_name = index.keys()[0]
+        other_slot = dict(self.status_dict['coll1'].fetchStored()[slot_name])
+        other_slot['GLIDEIN_Entry_Name'] = 'Other_Site'
+        other = mock.Mock()
+        other.fetchStored.return_value = {slot_name: other_slot, 'not_a_glidein@host': {}}
+        status_dict = OrderedDict([('coll1', self.status_dict['coll1']), ('coll2', other)])
+        self.assertEqual(index, glideinFrontendLib.getRunningOnIndex(status_dict))
+
     def test_getGlideinCpusNum(self):
         self.assertEqual(glideinFrontendLib.getGlideinCpusNum(
             self.glidein_dict[self.glidein_dict_k1]), 1)
@@ -503,6 +690,48 @@ class FETestCaseCondorQ(FETestCaseBase):
                 'sched1'].fetchStored().keys()
         self.assertEqual(condor_ids, [(12345, 0)])
 
+    def test_classifyCondorQ(self):
+        condorq_dict = {'sched1': self.condorq_dict['sched1'], 'sched2': self.condorq_dict['sched1']}
+        good_condorq_dict = {'sched1': self.condorq_dict['sched1']}
+        idle = glideinFrontendLib.getIdleCondorQ(good_condorq_dict)
+        expected = {'IdleAll': glideinFrontendLib.getIdleCondorQ(condorq_dict),
+                    'Idle': idle,
+                    'OldIdle': glideinFrontendLib.getOldCondorQ(idle, 600),
+                    'Idle_3600': glideinFrontendLib.getOldCondorQ(idle, 3600),
+                    'VomsIdle': glideinFrontendLib.getIdleVomsCondorQ(idle),
+                    'ProxyIdle': glideinFrontendLib.getIdleProxyCondorQ(idle),
+                    'Running': glideinFrontendLib.getRunningCondorQ(condorq_dict)}
+
+        types = glideinFrontendLib.classifyCondorQ(condorq_dict, ['sched2'])
+        self.assertItemsEqual(expected.keys(), types.keys())
+        for dt in expected:
+            self.assertItemsEqual(expected[dt].keys(), types[dt]['dict'].keys())
+            for schedd_name in expected[dt]:
+                self.assertEqual(expected[dt][schedd_name].fetchStored(),
+                                 types[dt]['dict'][schedd_name].fetchStored())
+            self.assertEqual(glideinFrontendLib.countCondorQ(expected[dt]), types[dt]['abs'])
+        self.assertEqual(14, types['IdleAll']['abs'])
+        self.assertEqual(7, types['Idle']['abs'])
+        # the job classads are shared, not copied
+        job = types['Running']['dict']['sched1'].fetchStored()[(12345, 3)]
+        self.assertTrue(job is self.condorq_dict['sched1'].fetchStored()[(12345, 3)])
+
+    def test_classifyCondorQ_compact(self):
+        condorq_dict = {'sched1': self.condorq_dict['sched1']}
+        types = glideinFrontendLib.classifyCondorQ(condorq_dict)
+        self.condorq_dict['sched1'].compact()
+        compact_types = glideinFrontendLib.classifyCondorQ(condorq_dict)
+        for dt in types:
+            self.assertEqual(types[dt]['abs'], compact_types[dt]['abs'])
+            compact_jobs = compact_types[dt]['dict']['sched1'].fetchStored()
+            self.assertTrue(isinstance(compact_jobs, condorMonitor.ColumnarStoredData))
+            self.assertEqual(types[dt]['dict']['sched1'].fetchStored(), compact_jobs)
+        match_expr = 'not job.has_key("DESIRED_Sites") or glidein["attrs"].get("GLIDEIN_Site") in job["DESIRED_Sites"]'
+        match_obj = compile(match_expr, "<string>", "eval")
+        self.assertEqual(
+            glideinFrontendLib.countMatch(match_obj, types['Idle']['dict'], self.glidein_dict, {}, False),
+            glideinFrontendLib.countMatch(match_obj, compact_types['Idle']['dict'], self.glidein_dict, {}, False))
+
     def test_countCondorQ(self):
         count = glideinFrontendLib.countCondorQ(self.condorq_dict)
         self.assertEqual(count, self.total_jobs)
@@ -512,7 +741,7 @@ class FETestCaseCondorQ(FETestCaseBase):
         self.assertItemsEqual(users, ['user1@fnal.gov', 'user2@fnal.gov'])
 
     @mock.patch('glideinwms.lib.condorMonitor.LocalScheddCache.iGetEnv')
-    @mock.patch('glideinwms.lib.condorExe.exe_cmd')
+    @mock.patch('glideinwms.lib.condorExe.exe_cmd_stream')
     def test_getCondorQ(self, m_exe_cmd, m_iGetEnv):
         f = open('cq.fixture')
         m_exe_cmd.return_value = f.readlines()
@@ -22,7 +22,7 @@ import glideinwms.lib.condorExe
 import glideinwms.lib.condorMonitor as condorMonitor
 from glideinwms.unittests.unittest_utils import FakeLogger
 from glideinwms.unittests.unittest_utils import TestImportError
-from glideinwms.lib.fork import ForkManager
+from glideinwms.lib.fork import ForkManager, ForkPoolManager
 from glideinwms.frontend import glideinFrontendMonitoring
 from glideinwms.frontend import glideinFrontendInterface
 from glideinwms.lib.util import safe_boolcomp
@@ -223,7 +223,7 @@ class FEElementTestCase(unittest.TestCase):
 
     def test_get_condor_q(self):
         with mock.patch('glideinwms.lib.condorMonitor.LocalScheddCache.iGetEnv'):
-            with mock.patch('glideinwms.lib.condorExe.exe_cmd') as m_exe_cmd:
+            with mock.patch('glideinwms.lib.condorExe.exe_cmd_stream') as m_exe_cmd:
                 f = open('cq.fixture')
                 m_exe_cmd.return_value = f.readlines()
                 cq = self.gfe.get_condor_q('schedd1')
@@ -274,7 +274,7 @@ class FEElementTestCase(unittest.TestCase):
 
         with mock.patch.object(ForkManager, 'fork_and_collect',
                                return_value=fork_and_collect_side_effect()):
-            with mock.patch.object(ForkManager, 'bounded_fork_and_collect',
+            with mock.patch.object(ForkPoolManager, 'bounded_fork_and_collect',
                                    return_value=bounded_fork_and_collect_side_effect()):
                 # also need to mock advertisers so they don't fork off jobs
                 # it has nothing to do with what is being tested here
@@ -11,15 +11,18 @@ from __future__ import absolute_import
 from __future__ import print_function
 import mock
 import os
+import sys
 import unittest2 as unittest
 import xmlrunner
 
 import glideinwms
 from glideinwms.frontend import glideinFrontendMonitoring
+from glideinwms.frontend import glideinFrontendInterface
 import glideinwms.lib.condorMonitor as condorMonitor
 import glideinwms.lib.condorExe as condorExe
 from glideinwms.frontend.glideinFrontendElement import CounterWrapper
 from glideinwms.frontend.glideinFrontendElement import glideinFrontendElement
+from glideinwms.frontend.glideinFrontendElement import ElementWorker
 from glideinwms.frontend.glideinFrontendElement import write_stats
 from glideinwms.frontend.glideinFrontendElement import log_and_sum_factory_line
 from glideinwms.frontend.glideinFrontendElement import init_factory_stats_arr
@@ -107,6 +110,8 @@ class TestGlideinFrontendElement(unittest.TestCase):
         self.gfe = glideinFrontendElement(
         os.getpid(), work_dir, group_name, action)
         self.gfe.frontend_name = 'Frontend-master-v1_0'
+        # do not write the history file in the fixtures
+        self.gfe.history_obj.save = mock.Mock()
         #self.gfe.configure()
         init_factory_stats_arr()
         self.verbose = os.environ.get('DEBUG_OUTPUT')
@@ -149,6 +154,24 @@ class TestGlideinFrontendElement(unittest.TestCase):
     def test_set_glidein_config_limits(self):
         self.gfe.set_glidein_config_limits()
 
+    def test_get_query_spec(self):
+        spec = self.gfe.get_query_spec()
+        self.assertEqual(list(self.gfe.elementDescript.merged_data['JobSchedds']), spec['schedds'])
+        self.assertTrue(('x509userproxy', 's') in spec['condorq_format_list'])
+        self.assertTrue(('GLIDEIN_CredentialIdentifier', 's') in spec['status_format_list'])
+
+    def test_reset_iteration(self):
+        self.gfe.request_removal_wtype = 'IDLE'
+        self.gfe.request_removal_excess_only = True
+        self.gfe.count_real_jobs = {'a': 1}
+        self.gfe.history_obj['perf_metrics'] = {'a': 1}
+        self.gfe.reset_iteration('run')
+        self.assertEqual('run', self.gfe.action)
+        self.assertEqual(None, self.gfe.request_removal_wtype)
+        self.assertFalse(self.gfe.request_removal_excess_only)
+        self.assertEqual({}, self.gfe.count_real_jobs)
+        self.assertEqual({}, self.gfe.history_obj['perf_metrics'])
+
     def test_init_factory_stats_arr(self):
         arr = init_factory_stats_arr()
         for ind in range(16):
@@ -202,6 +225,55 @@ class TestGlideinFrontendElement(unittest.TestCase):
         self.gfe.configure()
         self.gfe.deadvertiseAllClassads()
 
+    def advertize_delta_key(self):
+        # one request advertised in the previous iteration
+        self.gfe.elementDescript.frontend_data['AdvertiseRefreshInterval'] = '600'
+        delta_cache = self.gfe.load_advertize_delta()
+        key = ('glideclient', 'entry@gfactory@Frontend-master-v1_0.group1')
+        delta_cache.mark_sent({key: 'fp'})
+        self.gfe.history_obj['advertize_delta'] = delta_cache.get_state()
+        self.gfe.history_obj['advertize_delta_parent_pid'] = self.gfe.parent_pid
+        self.assertFalse(self.gfe.load_advertize_delta().is_changed(key, 'fp'))
+        return key
+
+    def test_deadvertise_iterate(self):
+        key = self.advertize_delta_key()
+        self.gfe.configure()
+        self.gfe.action = 'deadvertise'
+        with mock.patch.object(glideinFrontendInterface, 'deadvertizeAllWork') as m_work:
+            with mock.patch.object(glideinFrontendInterface, 'deadvertizeAllGlobals'):
+                with mock.patch.object(glideinFrontendInterface, 'ResourceClassadAdvertiser'):
+                    self.assertEqual(0, self.gfe.iterate())
+        self.assertTrue(m_work.called)
+        self.assertTrue(self.gfe.history_obj.save.called)
+        self.assertFalse('advertize_delta' in self.gfe.history_obj)
+        # the next iteration advertises all the requests
+        self.assertTrue(self.gfe.load_advertize_delta().is_changed(key, 'fp'))
+
+    def test_advertize_delta_after_restart(self):
+        key = self.advertize_delta_key()
+        # saved by the group of a Frontend process that is gone
+        self.gfe.parent_pid += 1
+        self.assertTrue(self.gfe.load_advertize_delta().is_changed(key, 'fp'))
+
+    def test_match_memo(self):
+        self.gfe.elementDescript.frontend_data['MatchMemoSize'] = '100'
+        self.gfe.elementDescript.merged_data['MatchExpr'] = 'glidein["attrs"].get("GLIDEIN_Site") == "A"'
+        memo = self.gfe.load_match_memo()
+        self.assertTrue(memo is not None)
+        memo.add_results('e1', set(['jh1']), set(['jh2']))
+        # nothing matched in this iteration, the results are kept
+        self.gfe.match_memo = memo
+        self.gfe.save_match_memo()
+        self.assertEqual(2, memo.size)
+        memo.seen_clusters = set(['jh2'])
+        self.gfe.save_match_memo()
+        self.assertEqual(1, memo.size)
+        # the monitoring values are not in the entry fingerprint
+        self.gfe.elementDescript.merged_data['MatchExpr'] = 'glidein["monitor"]["TotalStatusIdle"] < 10'
+        self.assertEqual(None, self.gfe.load_match_memo())
+        self.assertFalse('match_memo' in self.gfe.history_obj)
+
     @unittest.skip('hhmmm')
     def test_do_match(self):
         self.gfe.do_match()
@@ -345,6 +417,33 @@ class TestGlideinFrontendElement(unittest.TestCase):
         assert False  # TODO: implement your test here
 
 
+class TestElementWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = ElementWorker(os.getpid(), 'fixtures/frontend', 'group1')
+
+    def test_config_changed(self):
+        self.assertTrue(self.worker.config_changed())
+        self.worker.config_mtimes = self.worker.get_config_mtimes()
+        self.assertFalse(self.worker.config_changed())
+        fname = self.worker.config_files()[0]
+        self.worker.config_mtimes[fname] -= 10
+        self.assertTrue(self.worker.config_changed())
+        self.worker.config_mtimes = self.worker.get_config_mtimes()
+        self.worker.hupsignal(1, None)
+        self.assertTrue(self.worker.config_changed())
+
+    def test_read_action(self):
+        rfd, wfd = os.pipe()
+        os.write(wfd, 'run\nremoveIdle\n')
+        os.close(wfd)
+        with mock.patch.object(sys, 'stdin', os.fdopen(rfd)):
+            self.assertEqual('run', self.worker.read_action())
+            self.assertEqual('removeIdle', self.worker.read_action())
+            # pipe closed by the parent
+            self.assertEqual(None, self.worker.read_action())
+
+
 class TestCheckParent(unittest.TestCase):
     @unittest.skip('grr')
     def test_check_parent(self):
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for glideinwms/frontend/glideinFrontendSnapshot.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import mock
+import unittest2 as unittest
+import xmlrunner
+
+import glideinwms.lib.condorMonitor as condorMonitor
+from glideinwms.lib import logSupport
+from glideinwms.frontend import glideinFrontendConfig
+from glideinwms.frontend import glideinFrontendSnapshot
+from glideinwms.frontend.glideinFrontendSnapshot import GroupSnapshot
+from glideinwms.unittests.unittest_utils import FakeLogger
+
+FRONTEND_NAME = 'fe'
+
+# jobs in the schedd and the JobQueryExpr each one satisfies
+JOBS = {(1, 0): {'ClusterId': 1, 'ProcId': 0, 'JobStatus': 1, 'Owner': 'a'},
+        (2, 0): {'ClusterId': 2, 'ProcId': 0, 'JobStatus': 1, 'Owner': 'b'},
+        (3, 0): {'ClusterId': 3, 'ProcId': 0, 'JobStatus': 2, 'Owner': 'b'}}
+JOB_EXPRS = {'(Owner=?="a")': [(1, 0)], '(Owner=?="b")': [(2, 0), (3, 0)]}
+
+SLOTS = {'s1': {'Name': 's1', 'GLIDECLIENT_Name': 'fe.group1', 'State': 'Claimed', 'Activity': 'Busy'},
+         's2': {'Name': 's2', 'GLIDECLIENT_Name': 'fe.group2', 'State': 'Unclaimed', 'Activity': 'Idle'}}
+
+
+class FakeCondorQ(condorMonitor.StoredQuery):
+    queries = []
+
+    def __init__(self, schedd_name):
+        self.schedd_name = schedd_name
+        self.fetched_bytes = 100
+
+    def load(self, constraint, format_list):
+        FakeCondorQ.queries.append((constraint, format_list))
+        jobs = set()
+        for expr in JOB_EXPRS:
+            if expr in constraint:
+                jobs.update(JOB_EXPRS[expr])
+        self.stored_data = dict([(jid, dict(JOBS[jid])) for jid in jobs])
+
+
+class FakeCondorStatus(condorMonitor.StoredQuery):
+    def __init__(self, subsystem_name=None, pool_name=None):
+        self.subsystem_name = subsystem_name
+        self.fetched_bytes = None
+
+    def load(self, constraint, format_list):
+        if self.subsystem_name == 'schedd':
+            self.stored_data = {}
+        else:
+            self.stored_data = dict([(k, dict(SLOTS[k])) for k in SLOTS])
+
+
+def query_spec(constraint, condorq_format_list=(('Owner', 's'),), status_format_list=(('Cpus', 'i'),)):
+    return {'schedds': ['schedd1'],
+            'condorq_constraint': constraint,
+            'condorq_format_list': list(condorq_format_list),
+            'status_format_list': list(status_format_list)}
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.work_dir = tempfile.mkdtemp()
+        FakeCondorQ.queries = []
+        patchers = [mock.patch.object(condorMonitor, 'CondorQ', FakeCondorQ),
+                    mock.patch.object(condorMonitor, 'CondorStatus', FakeCondorStatus)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        glideinFrontendSnapshot.clean_snapshot(self.work_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_snapshot_schedd(self):
+        exprs = sorted(JOB_EXPRS.keys())
+        nr_queries, nr_ads, nr_bytes = glideinFrontendSnapshot.snapshot_schedd(
+            self.work_dir, 'schedd1', exprs, [('Owner', 's')])
+        # one full query and one id query per expression
+        self.assertEqual(3, nr_queries)
+        self.assertEqual(6, nr_ads)
+        self.assertEqual(300, nr_bytes)
+        for expr in exprs:
+            snapshot = GroupSnapshot(self.work_dir, FRONTEND_NAME, 'group1', query_spec(expr))
+            self.assertTrue(snapshot.has_schedd('schedd1'))
+            self.assertEqual(sorted(JOB_EXPRS[expr]),
+                             sorted(snapshot.condorq_dict['schedd1'].fetchStored().keys()))
+
+    def test_snapshot_schedd_single_expr(self):
+        expr = '(Owner=?="b")'
+        nr_queries, nr_ads, nr_bytes = glideinFrontendSnapshot.snapshot_schedd(
+            self.work_dir, 'schedd1', [expr], [('Owner', 's')])
+        self.assertEqual(1, nr_queries)
+        snapshot = GroupSnapshot(self.work_dir, FRONTEND_NAME, 'group1', query_spec(expr))
+        self.assertEqual(2, len(snapshot.condorq_dict['schedd1'].fetchStored()))
+
+    def test_not_covered(self):
+        glideinFrontendSnapshot.snapshot_schedd(self.work_dir, 'schedd1', ['(Owner=?="a")'], [('Owner', 's')])
+        # different expression
+        snapshot = GroupSnapshot(self.work_dir, FRONTEND_NAME, 'group1', query_spec('(Owner=?="b")'))
+        self.assertFalse(snapshot.has_schedd('schedd1'))
+        # attribute not in the snapshot
+        snapshot = GroupSnapshot(self.work_dir, FRONTEND_NAME, 'group1',
+                                 query_spec('(Owner=?="a")', [('Owner', 's'), ('Other', 'i')]))
+        self.assertFalse(snapshot.has_schedd('schedd1'))
+        # no condor_status snapshot
+        self.assertFalse(snapshot.has_status())
+
+    def test_snapshot_collector(self):
+        nr_queries, nr_ads, nr_bytes = glideinFrontendSnapshot.snapshot_collector(
+            self.work_dir, FRONTEND_NAME, [('Cpus', 'i')])
+        self.assertEqual(4, nr_queries)
+        self.assertEqual(None, nr_bytes)
+        snapshot = GroupSnapshot(self.work_dir, FRONTEND_NAME, 'group1', query_spec('True'))
+        self.assertTrue(snapshot.has_status())
+        group_dict, fe_dict, global_dict, schedd_dict, curb_dict = snapshot.get_status_dicts()
+        self.assertEqual(['s1'], group_dict[None].fetchStored().keys())
+        self.assertEqual(2, len(fe_dict[None].fetchStored()))
+        self.assertEqual({}, schedd_dict)
+        snapshot = GroupSnapshot(self.work_dir, 'other_fe', 'group1', query_spec('True'))
+        self.assertFalse(snapshot.has_status())
+
+    def test_make_snapshot(self):
+        counters = glideinFrontendSnapshot.make_snapshot(self.work_dir, FRONTEND_NAME, ['group1', 'group2'])
+        # no group ran yet
+        self.assertEqual({}, counters)
+        for group_name, expr in (('group1', '(Owner=?="a")'), ('group2', '(Owner=?="b")')):
+            os.mkdir(glideinFrontendConfig.get_group_dir(self.work_dir, group_name))
+            history_obj = glideinFrontendConfig.HistoryFile(self.work_dir, group_name, False, dict)
+            history_obj['query_spec'] = query_spec(expr)
+            history_obj.save()
+        counters = glideinFrontendSnapshot.make_snapshot(self.work_dir, FRONTEND_NAME, ['group1', 'group2'])
+        self.assertEqual(3, counters['snapshot_condor_q_queries'])
+        self.assertEqual(300, counters['snapshot_condor_q_bytes'])
+        self.assertEqual(4, counters['snapshot_condor_status_queries'])
+        self.assertFalse('snapshot_condor_status_bytes' in counters)
+        snapshot = GroupSnapshot(self.work_dir, FRONTEND_NAME, 'group2', query_spec('(Owner=?="b")'))
+        self.assertEqual(2, len(snapshot.condorq_dict['schedd1'].fetchStored()))
+        self.assertTrue(snapshot.has_status())
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
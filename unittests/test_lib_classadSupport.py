@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for the delta advertisement in glideinwms/lib/classadSupport.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import tempfile
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.unittests.unittest_utils import FakeLogger
+from glideinwms.lib import logSupport
+from glideinwms.lib.classadSupport import ClassadDeltaCache
+
+ADS = ['MyType = "glidefactory"\nName = "e1@g@f"\nGlideinMonitorTotalStatusIdle = 3\nUpdateSequenceNumber = %i\n',
+       'MyType = "glidefactory"\nName = "e2@g@f"\nGlideinMonitorTotalStatusIdle = %i\nUpdateSequenceNumber = 1\n']
+
+
+class TestClassadDeltaCache(unittest.TestCase):
+
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.delta_cache = ClassadDeltaCache(600)
+
+    def test_filter_classads(self):
+        ads_str = '%s\n%s\n' % (ADS[0] % 1, ADS[1] % 3)
+        changed_str, fingerprints = self.delta_cache.filter_classads(ads_str, now=1000)
+        self.assertEqual(ads_str, changed_str + '\n')
+        self.assertEqual([('glidefactory', 'e1@g@f'), ('glidefactory', 'e2@g@f')], sorted(fingerprints.keys()))
+        # not advertised yet
+        changed_str, fingerprints = self.delta_cache.filter_classads(ads_str, now=1010)
+        self.assertEqual(2, len(fingerprints))
+        self.delta_cache.mark_sent(fingerprints, now=1010)
+        # only the volatile attributes and the monitor of e2 changed
+        changed_str, fingerprints = self.delta_cache.filter_classads('%s\n%s\n' % (ADS[0] % 2, ADS[1] % 4), now=1020)
+        self.assertEqual(ADS[1] % 4, changed_str)
+        self.assertEqual([('glidefactory', 'e2@g@f')], fingerprints.keys())
+        self.assertEqual((5, 1), (self.delta_cache.nr_sent, self.delta_cache.nr_suppressed))
+        # refresh
+        changed_str, fingerprints = self.delta_cache.filter_classads(ads_str, now=1610)
+        self.assertEqual(2, len(fingerprints))
+        self.delta_cache.log_stats('glidefactory')
+        self.assertEqual((0, 0), (self.delta_cache.nr_sent, self.delta_cache.nr_suppressed))
+
+    def test_disabled(self):
+        delta_cache = ClassadDeltaCache()
+        key, fingerprint = delta_cache.classad_fingerprint(ADS[0] % 1)
+        delta_cache.mark_sent({key: fingerprint})
+        self.assertTrue(delta_cache.is_changed(key, fingerprint))
+        self.assertEqual({}, delta_cache.get_state())
+
+    def test_fingerprint(self):
+        self.assertEqual(self.delta_cache.fingerprint('a', {'x': 1, 'y': 2}),
+                         self.delta_cache.fingerprint('a', {'y': 2, 'x': 1}))
+        self.assertNotEqual(self.delta_cache.fingerprint('a', {'x': 1}),
+                            self.delta_cache.fingerprint('a', {'x': 2}))
+
+    def test_state(self):
+        key, fingerprint = self.delta_cache.classad_fingerprint(ADS[0] % 1)
+        self.delta_cache.mark_sent({key: fingerprint})
+        self.delta_cache.mark_sent({('glidefactory', 'old'): 'fp'}, now=0)
+        state = self.delta_cache.get_state()
+        self.assertEqual([key], state.keys())
+        delta_cache = ClassadDeltaCache.from_state(state, 600)
+        self.assertFalse(delta_cache.is_changed(key, fingerprint))
+        self.assertTrue(ClassadDeltaCache.from_state(state, 0).is_changed(key, fingerprint))
+        self.assertEqual({}, ClassadDeltaCache.from_state(None, 600).sent)
+
+    def test_filter_file(self):
+        fd, fname = tempfile.mkstemp()
+        os.write(fd, '%s\n%s\n' % (ADS[0] % 1, ADS[1] % 3))
+        os.close(fd)
+        self.addCleanup(os.remove, fname)
+        self.delta_cache.mark_sent(self.delta_cache.filter_file(fname))
+        self.assertEqual({}, self.delta_cache.filter_file(fname))
+        fd = open(fname, 'w')
+        fd.write('%s\n%s\n' % (ADS[0] % 2, ADS[1] % 5))
+        fd.close()
+        self.assertEqual(1, len(self.delta_cache.filter_file(fname)))
+        self.assertEqual(ADS[1] % 5, open(fname).read())
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
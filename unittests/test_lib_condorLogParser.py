@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for the incremental parsing in glideinwms/lib/condorLogParser.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.lib import condorLogParser
+
+
+def event(status, job, event_time="09/28 01:38:53"):
+    return "%s (%s.000) %s Something happened\n    details\n...\n" % (status, job, event_time)
+
+
+EVENTS1 = [event('000', '123.000'), event('000', '123.001'), event('001', '123.000', "09/28 02:00:00")]
+EVENTS2 = [event('005', '123.000', "09/28 03:00:00"), event('020', '123.001'),
+           event('000', '124.000', "09/28 04:00:00")]
+
+
+class TestIncrementalParsing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.logname = os.path.join(self.tmp_dir, "condor_activity_x.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_log(self, events, mode="a"):
+        fd = open(self.logname, mode)
+        fd.write("".join(events))
+        fd.close()
+        # make sure the log is newer than the cache
+        cache_time = os.path.getmtime(self.logname) + 10
+        for fname in os.listdir(self.tmp_dir):
+            if fname.endswith("pk"):
+                os.utime(os.path.join(self.tmp_dir, fname), (cache_time - 20, cache_time - 20))
+
+    def load(self, log_class):
+        obj = log_class(self.logname, self.tmp_dir)
+        obj.load()
+        return obj
+
+    def test_parse_from(self):
+        self.write_log(EVENTS1 + EVENTS2)
+        full = condorLogParser.parseSubmitLogFastRaw(self.logname)
+        jobs, offset = condorLogParser.parseSubmitLogFastRawFrom(self.logname, {}, 0)
+        self.assertEqual(full, jobs)
+        self.assertEqual(os.path.getsize(self.logname), offset)
+        # partial events are not parsed
+        self.write_log(["001 (124.000.000) 09/28 05:00:00 Job exec"])
+        jobs, new_offset = condorLogParser.parseSubmitLogFastRawFrom(self.logname, jobs, offset)
+        self.assertEqual(offset, new_offset)
+        self.assertEqual('000', jobs['124.000'])
+
+    def test_parse_timings_from(self):
+        self.write_log(EVENTS1)
+        raw_state, offset = condorLogParser.parseSubmitLogFastRawTimingsFrom(self.logname, ({}, None, None), 0)
+        self.write_log(EVENTS2)
+        raw_state, offset = condorLogParser.parseSubmitLogFastRawTimingsFrom(self.logname, raw_state, offset)
+        self.assertEqual(condorLogParser.parseSubmitLogFastRawTimings(self.logname), raw_state)
+
+    def test_incremental_load(self):
+        for log_class in (condorLogParser.logSummary, condorLogParser.logCompleted,
+                          condorLogParser.logCounts, condorLogParser.logSummaryTimings):
+            if os.path.exists(self.logname):
+                os.unlink(self.logname)
+            self.write_log(EVENTS1)
+            self.load(log_class)
+            self.write_log(EVENTS2)
+            obj = self.load(log_class)
+            self.assertEqual(os.path.getsize(self.logname), obj.log_state.offset)
+            # same result as a full parse
+            log_class.incremental = False
+            try:
+                full = self.load(log_class)
+            finally:
+                log_class.incremental = True
+            self.assertEqual(full.data, obj.data)
+
+    def test_rewritten_log(self):
+        self.write_log(EVENTS1 + EVENTS2)
+        self.assertEqual(['123.000'], self.load(condorLogParser.logSummary).data['Completed'])
+        # truncated
+        self.write_log(EVENTS1[:1], "w")
+        self.assertEqual({'Wait': ['123.000']}, self.load(condorLogParser.logSummary).data)
+        # rewritten with different content, same inode
+        self.write_log([event('000', '125.000')] + EVENTS2, "w")
+        data = self.load(condorLogParser.logSummary).data
+        self.assertEqual(['123.000'], data['Completed'])
+        self.assertEqual(['124.000', '125.000'], sorted(data['Wait']))
+
+    def test_old_cache(self):
+        # cache written without the parsing state
+        self.write_log(EVENTS1)
+        obj = condorLogParser.logCounts(self.logname, self.tmp_dir)
+        condorLogParser.saveCache(obj.cachename, {'Wait': 100})
+        self.write_log(EVENTS2)
+        self.assertEqual({'Wait': 2, 'Completed': 1}, self.load(condorLogParser.logCounts).data)
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for glideinwms/lib/condorManager.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import mock
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.unittests.unittest_utils import FakeLogger
+from glideinwms.lib import condorExe
+from glideinwms.lib import logSupport
+from glideinwms.lib import condorMonitor
+from glideinwms.lib import condorManager
+
+RM_OUT = ["Job 10.0 marked for removal",
+          "Job 10.2 marked for removal"]
+RM_ERR = "Command 'condor_rm' returned non-zero exit status 1: Job 10.1 not found\nCouldn't find/remove all jobs in cluster 10\n"
+
+
+class TestCondorActMany(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(condorMonitor, 'USE_HTCONDOR_PYTHON_BINDINGS', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse_job_outcomes(self):
+        jids = [(10, 0), (10, 1), (10, 2), (10, 3)]
+        out = condorManager.parse_job_outcomes(jids, RM_OUT, condorExe.ExeError(RM_ERR), ("marked for",))
+        self.assertEqual((True, "marked for removal"), out[(10, 0)])
+        self.assertEqual((False, "not found"), out[(10, 1)])
+        self.assertTrue(out[(10, 2)][0])
+        # not in the output of a failed command
+        self.assertFalse(out[(10, 3)][0])
+        # not in the output of a successful command
+        out = condorManager.parse_job_outcomes(jids, [], None, ("marked for",))
+        self.assertEqual(4, len([jid for jid in out if out[jid][0]]))
+
+    @mock.patch('glideinwms.lib.condorExe.exe_cmd_stream')
+    def test_condorRemoveMany(self, m_stream):
+        def stream(cmd, opts, env):
+            yield "\n".join(RM_OUT[:1]) + "\n"
+            raise condorExe.ExeError(RM_ERR)
+        m_stream.side_effect = stream
+        out = condorManager.condorRemoveMany([(10, 0), (10, 1)], 'schedd1', do_forcex=True,
+                                             schedd_lookup_cache=None)
+        m_stream.assert_called_once_with("condor_rm", "-name schedd1 -forcex 10.0 10.1", env={})
+        self.assertEqual({(10, 0): (True, "marked for removal"), (10, 1): (False, "not found")}, out)
+
+    @mock.patch('glideinwms.lib.condorExe.exe_cmd_stream')
+    def test_condorReleaseMany(self, m_stream):
+        m_stream.return_value = ["Job 10.0 released\nJob 10.1 not held to be released\n"]
+        out = condorManager.condorReleaseMany([(10, 0), (10, 1)], schedd_lookup_cache=None)
+        m_stream.assert_called_once_with("condor_release", "10.0 10.1", env={})
+        self.assertEqual({(10, 0): (True, "released"), (10, 1): (False, "not held to be released")}, out)
+        self.assertEqual({}, condorManager.condorReleaseMany([]))
+
+
+class FakeScheddCache(condorMonitor.NoneScheddCache):
+
+    def __init__(self, envs):
+        self.envs = envs
+
+    def getScheddId(self, schedd_name, pool_name):
+        if schedd_name not in self.envs:
+            raise RuntimeError("Schedd '%s' not found" % schedd_name)
+        return ("", self.envs[schedd_name])
+
+
+class TestPbActMany(unittest.TestCase):
+
+    def setUp(self):
+        self.htcondor = mock.Mock()
+        self.htcondor.JobAction.Remove = 'Remove'
+        self.act_env = []
+        def act(action, jobs):
+            self.act_env.append(os.environ.get('_CONDOR_SPOOL'))
+            return dict([("job_%s" % job.replace('.', '_'), condorManager.AR_SUCCESS) for job in jobs])
+        self.htcondor.Schedd.return_value.act.side_effect = act
+        self.pool = condorMonitor.BindingsHandlePool()
+        for name, value in (('htcondor', self.htcondor), ('bindings_handle_pool', self.pool),
+                            ('USE_HTCONDOR_PYTHON_BINDINGS', True)):
+            patcher = mock.patch.object(condorMonitor, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(os.environ, {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop('_CONDOR_SPOOL', None)
+        self.lookup_cache = FakeScheddCache({'local@host': {'_CONDOR_SPOOL': '/var/lib/condor/spool'},
+                                             'remote@host': {}})
+
+    def remove(self, schedd_name, jids):
+        return condorManager.condorRemoveMany(jids, schedd_name, schedd_lookup_cache=self.lookup_cache)
+
+    def test_handle_pool(self):
+        for i in range(3):
+            out = self.remove('remote@host', [(10, i), (11, i)])
+            self.assertEqual({(10, i): (True, "success"), (11, i): (True, "success")}, out)
+        # one configuration reload and one Schedd for all the chunks
+        self.assertEqual(1, self.htcondor.reload_config.call_count)
+        self.assertEqual(1, self.htcondor.Schedd.call_count)
+        self.assertEqual(1, self.htcondor.Collector.return_value.locate.call_count)
+        self.assertEqual([None, None, None], self.act_env)
+
+    def test_local_schedd_env(self):
+        self.remove('local@host', [(10, 0)])
+        self.remove('local@host', [(10, 1)])
+        # the local schedd is found through the environment of the lookup, as condor_rm does
+        self.assertEqual(['/var/lib/condor/spool', '/var/lib/condor/spool'], self.act_env)
+        self.assertFalse('_CONDOR_SPOOL' in os.environ)
+        self.assertEqual(0, self.htcondor.Collector.return_value.locate.call_count)
+        self.assertEqual(mock.call(), self.htcondor.Schedd.call_args)
+        self.assertEqual(1, self.htcondor.reload_config.call_count)
+        self.assertEqual(1, self.htcondor.Schedd.call_count)
+        # the environment is part of the configuration key
+        self.remove('remote@host', [(10, 2)])
+        self.assertEqual(2, self.htcondor.reload_config.call_count)
+        self.assertEqual(2, self.htcondor.Schedd.call_count)
+        self.assertEqual(None, self.act_env[-1])
+
+    def test_lookup_error(self):
+        out = self.remove('unknown@host', [(10, 0)])
+        self.assertFalse(out[(10, 0)][0])
+        self.assertTrue("not found" in out[(10, 0)][1])
+        self.assertEqual(0, self.htcondor.Schedd.call_count)
+
+
+ADS_STR = 'MyType = "glideresource"\nName = "a"\n\nMyType = "glideresource"\nName = "b"\n\nMyType = "glideresource"\nName = "c"\n'
+
+
+class TestCondorAdvertise(unittest.TestCase):
+
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.collector = mock.Mock()
+        htcondor = mock.Mock()
+        htcondor.Collector.return_value = self.collector
+        classad = mock.Mock(spec=['parseOldAds'])
+        classad.parseOldAds.side_effect = lambda ads_str: [ad for ad in ads_str.split('\n\n') if ad]
+        for attr, value in (('htcondor', htcondor), ('classad', classad),
+                            ('USE_HTCONDOR_PYTHON_BINDINGS', True),
+                            ('bindings_handle_pool', condorMonitor.BindingsHandlePool())):
+            patcher = mock.patch.object(condorMonitor, attr, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @mock.patch('glideinwms.lib.condorExe.exe_cmd_sbin')
+    def test_batches(self, m_exe):
+        self.assertEqual([], condorManager.condorAdvertiseString(ADS_STR, 'UPDATE_AD_GENERIC', True, True,
+                                                                 'pool1', batch_size=2))
+        self.assertEqual([mock.call(['MyType = "glideresource"\nName = "a"',
+                                     'MyType = "glideresource"\nName = "b"'], 'UPDATE_AD_GENERIC', True),
+                          mock.call(['MyType = "glideresource"\nName = "c"\n'], 'UPDATE_AD_GENERIC', True)],
+                         self.collector.advertise.call_args_list)
+        # all the classads in one update
+        self.collector.advertise.reset_mock()
+        condorManager.condorAdvertiseString(ADS_STR, 'UPDATE_AD_GENERIC', pool_name='pool1')
+        self.assertEqual(1, self.collector.advertise.call_count)
+        self.assertEqual(3, len(self.collector.advertise.call_args[0][0]))
+        self.assertFalse(m_exe.called)
+
+    @mock.patch('glideinwms.lib.condorExe.exe_cmd_sbin')
+    def test_fallback(self, m_exe):
+        self.collector.advertise.side_effect = RuntimeError("cannot connect")
+        fnames = []
+        m_exe.side_effect = lambda cmd, opts: fnames.append(opts.split()[-1]) or ['ok']
+        self.assertEqual(['ok'], condorManager.condorAdvertiseString(ADS_STR, 'UPDATE_AD_GENERIC', True, True,
+                                                                     'pool1'))
+        self.assertEqual('condor_advertise', m_exe.call_args[0][0])
+        self.assertTrue(m_exe.call_args[0][1].startswith('-pool pool1 -tcp -multiple UPDATE_AD_GENERIC '))
+        # the temporary file is removed
+        self.assertFalse(os.path.exists(fnames[0]))
+        # the collector handle is dropped after the failure
+        self.assertEqual({}, condorMonitor.bindings_handle_pool.handles)
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
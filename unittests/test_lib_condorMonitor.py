@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for the XML parsing in glideinwms/lib/condorMonitor.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import cPickle
+import mock
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.lib import condorMonitor
+from glideinwms.lib import logSupport
+from glideinwms.lib.condorMonitor import XmlClassadParser
+from glideinwms.lib.condorMonitor import xml2list
+from glideinwms.lib.condorMonitor import xml2dict
+from glideinwms.lib.condorMonitor import list2dict
+from glideinwms.lib.condorMonitor import BindingsHandlePool
+from glideinwms.lib.condorMonitor import ColumnarStoredData
+
+XML_LINES = ['Warning: something to ignore',
+             '<?xml version="1.0"?>',
+             '<!DOCTYPE classads SYSTEM "classads.dtd">',
+             '<classads>',
+             '<c>',
+             '    <a n="ClusterId"><i>12</i></a>',
+             '    <a n="ProcId"><i>0</i></a>',
+             '    <a n="Owner"><s>say \\"hi\\" &amp; bye</s></a>',
+             '    <a n="Rank"><r>1.5</r></a>',
+             '    <a n="ExitBySignal"><b v="f"/></a>',
+             '    <a n="OnExitRemove"><b>true</b></a>',
+             '    <a n="TransferOutputRemaps"><un/></a>',
+             '    <a n="Requirements"><e>(Arch == "X86_64")</e></a>',
+             '    <a n="Empty"><s></s></a>',
+             '</c>',
+             '<c>',
+             '    <a n="ClusterId"><i>12</i></a>',
+             '    <a n="ProcId"><i>1</i></a>',
+             '    <a n="Multi"><s>first',
+             'second</s></a>',
+             '</c>',
+             '</classads>']
+
+CLASSAD1 = {'ClusterId': 12, 'ProcId': 0, 'Owner': 'say "hi" & bye', 'Rank': 1.5,
+            'ExitBySignal': False, 'OnExitRemove': True, 'TransferOutputRemaps': None,
+            'Requirements': '(Arch == "X86_64")', 'Empty': ''}
+CLASSAD2 = {'ClusterId': 12, 'ProcId': 1, 'Multi': 'first second'}
+
+
+def fixture_lines(fname):
+    fd = open(fname)
+    try:
+        return fd.readlines()
+    finally:
+        fd.close()
+
+
+class TestXmlClassadParser(unittest.TestCase):
+
+    def setUp(self):
+        condorMonitor.USE_HTCONDOR_PYTHON_BINDINGS = False
+
+    def test_xml2list(self):
+        self.assertEqual([CLASSAD1, CLASSAD2], xml2list(XML_LINES))
+
+    def test_xml2dict(self):
+        out = xml2dict(XML_LINES, ('ClusterId', 'procid'))
+        classad1 = dict(CLASSAD1)
+        del classad1['ClusterId']
+        # like in list2dict, only the exact attribute names are removed from the values
+        self.assertEqual(classad1, out[(12, 0)])
+        self.assertEqual(2, len(out))
+        out = xml2dict(XML_LINES, 'ProcId')
+        self.assertEqual(['ClusterId', 'Multi'], sorted(out[1].keys()))
+
+    def test_unicode_values(self):
+        lines = XML_LINES[:4] + ['<c>',
+                                 '    <a n="ProcId"><i>0</i></a>',
+                                 '    <a n="Owner"><s>J\xc3\xbcrgen</s></a>',
+                                 '    <a n="Remaps"><s>Undefined</s></a>',
+                                 '</c>', '</classads>']
+        with mock.patch.object(condorMonitor, 'USE_HTCONDOR_PYTHON_BINDINGS', True):
+            out = xml2dict(lines, 'ProcId')
+        self.assertEqual({0: {'Owner': u'J\xfcrgen'}}, out)
+
+    def test_no_xml(self):
+        self.assertEqual([], xml2list(['Error: no xml here']))
+        self.assertEqual({}, xml2dict([], 'Name'))
+        parser = XmlClassadParser('Name')
+        parser.feed('no xml <?xml in the middle of a line\n')
+        self.assertEqual({}, parser.close())
+
+    def test_parse_error(self):
+        self.assertRaises(RuntimeError, xml2list, XML_LINES[:5] + ['<x/>'] + XML_LINES[5:])
+        self.assertRaises(RuntimeError, xml2list, XML_LINES[:-3])
+
+    def test_feed_chunks(self):
+        text = "\n".join(XML_LINES) + "\n"
+        for chunk_size in (1, 2, 7, 64, len(text)):
+            parser = XmlClassadParser()
+            for i in range(0, len(text), chunk_size):
+                parser.feed(text[i:i + chunk_size])
+            self.assertEqual([CLASSAD1, CLASSAD2], parser.close())
+
+    def test_fixtures(self):
+        for fname, attr_name in (('cq.fixture', ('ClusterId', 'ProcId')), ('cs.fixture', 'Name')):
+            lines = fixture_lines(fname)
+            expected = list2dict(xml2list(lines), attr_name)
+            self.assertEqual(expected, xml2dict(lines, attr_name))
+            parser = XmlClassadParser(attr_name)
+            text = "".join(lines)
+            for i in range(0, len(text), 1000):
+                parser.feed(text[i:i + 1000])
+            self.assertEqual(expected, parser.close())
+        # the fixture has 7 classads, 2 with the same Name
+        self.assertEqual(6, len(expected))
+        self.assertEqual('FI_HIP_T2', expected['glidein_1@cmswn001.local']['GLIDEIN_ResourceName'])
+
+    def test_reentrant(self):
+        parser1 = XmlClassadParser()
+        parser2 = XmlClassadParser('ProcId')
+        for line in XML_LINES:
+            parser1.feed_lines([line])
+            parser2.feed(line + "\n")
+        self.assertEqual([CLASSAD1, CLASSAD2], parser1.close())
+        self.assertEqual([0, 1], sorted(parser2.close().keys()))
+
+
+class TestBindingsHandlePool(unittest.TestCase):
+
+    def setUp(self):
+        self.htcondor = mock.Mock()
+        self.htcondor.Schedd.return_value.query.return_value = [{'ClusterId': 1, 'ProcId': 0, 'Owner': 'u1'}]
+        self.htcondor.Collector.return_value.query.return_value = [{'Name': 'slot1@wn', 'State': 'Idle'}]
+        self.pool = BindingsHandlePool(ttl=300)
+        for name, value in (('htcondor', self.htcondor), ('bindings_handle_pool', self.pool),
+                            ('USE_HTCONDOR_PYTHON_BINDINGS', True)):
+            patcher = mock.patch.object(condorMonitor, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(os.environ, {'_CONDOR_SEC_CLIENT_INTEGRITY': 'REQUIRED'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def condor_q(self):
+        return condorMonitor.CondorQ('schedd1@host', 'pool.host', schedd_lookup_cache=None)
+
+    def test_warm_cache(self):
+        for i in range(3):
+            cq = self.condor_q()
+            self.assertEqual({(1, 0): {'Owner': 'u1'}}, cq.fetch())
+            self.assertTrue(cq.setup_time is not None)
+        cs = condorMonitor.CondorStatus(pool_name='pool.host')
+        self.assertEqual(['slot1@wn'], cs.fetch().keys())
+        self.assertEqual(1, self.htcondor.reload_config.call_count)
+        self.assertEqual(1, self.htcondor.Collector.call_count)
+        self.assertEqual(1, self.htcondor.Collector.return_value.locate.call_count)
+        self.assertEqual(1, self.htcondor.Schedd.call_count)
+        self.assertEqual(3, self.htcondor.Schedd.return_value.query.call_count)
+        self.assertEqual(3, self.pool.nr_hits)
+
+    def test_config_change(self):
+        self.condor_q().fetch()
+        os.environ['_CONDOR_SEC_CLIENT_INTEGRITY'] = 'OPTIONAL'
+        self.condor_q().fetch()
+        self.assertEqual(2, self.htcondor.reload_config.call_count)
+        self.assertEqual(2, self.htcondor.Schedd.call_count)
+        # the security settings of the query are applied before the reload
+        cq = self.condor_q()
+        cq.require_integrity(True)
+        cq.fetch()
+        self.assertEqual(3, self.htcondor.reload_config.call_count)
+        self.assertEqual('OPTIONAL', os.environ['_CONDOR_SEC_CLIENT_INTEGRITY'])
+
+    def test_invalidate_on_error(self):
+        self.condor_q().fetch()
+        self.htcondor.Schedd.return_value.query.side_effect = IOError("schedd restarted")
+        self.assertRaises(condorMonitor.QueryError, self.condor_q().fetch)
+        self.assertEqual({}, dict([(k, v) for k, v in self.pool.handles.items() if k[0] == 'schedd']))
+        self.htcondor.Schedd.return_value.query.side_effect = None
+        self.condor_q().fetch()
+        self.assertEqual(2, self.htcondor.Schedd.call_count)
+        self.assertEqual(1, self.htcondor.Collector.call_count)
+
+    def test_ttl(self):
+        self.pool.ttl = 0
+        self.condor_q().fetch()
+        self.condor_q().fetch()
+        self.assertEqual(2, self.htcondor.Schedd.call_count)
+        self.assertEqual(1, self.htcondor.reload_config.call_count)
+        self.pool.disable()
+        self.condor_q().fetch()
+        self.assertEqual(2, self.htcondor.reload_config.call_count)
+
+    def write_file(self, fname, content):
+        fd = open(fname, 'w')
+        fd.write(content)
+        fd.close()
+
+    def test_config_files(self):
+        config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir)
+        condor_config = os.path.join(config_dir, 'condor_config')
+        self.write_file(condor_config, 'A = 1\n')
+        os.mkdir(os.path.join(config_dir, 'config.d'))
+        config_d_file = os.path.join(config_dir, 'config.d', '00_test.conf')
+        self.write_file(config_d_file, 'B = 1\n')
+        local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local_dir)
+        local_file = os.path.join(local_dir, '10_local.conf')
+        self.write_file(local_file, 'C = 1\n')
+        self.htcondor.param = {'LOCAL_CONFIG_DIR': local_dir, 'LOCAL_CONFIG_FILE': '/usr/bin/script |'}
+        with mock.patch.dict(os.environ, {'CONDOR_CONFIG': condor_config}):
+            self.condor_q().fetch()
+            self.condor_q().fetch()
+            self.assertEqual(1, self.htcondor.reload_config.call_count)
+            # edit of an existing file in config.d
+            self.write_file(config_d_file, 'B = 12\n')
+            self.condor_q().fetch()
+            self.assertEqual(2, self.htcondor.reload_config.call_count)
+            # edit in LOCAL_CONFIG_DIR, outside the CONDOR_CONFIG directory
+            self.write_file(local_file, 'C = 12\n')
+            self.condor_q().fetch()
+            self.assertEqual(3, self.htcondor.reload_config.call_count)
+        # without CONDOR_CONFIG the default configuration file is watched
+        default_config = os.path.join(local_dir, 'condor_config')
+        with mock.patch.object(condorMonitor, 'DEFAULT_CONDOR_CONFIG', default_config):
+            with mock.patch.dict(os.environ, {}):
+                os.environ.pop('CONDOR_CONFIG', None)
+                self.condor_q().fetch()
+                self.assertEqual(4, self.htcondor.reload_config.call_count)
+                self.condor_q().fetch()
+                self.assertEqual(4, self.htcondor.reload_config.call_count)
+                self.write_file(default_config, 'A = 2\n')
+                self.condor_q().fetch()
+                self.assertEqual(5, self.htcondor.reload_config.call_count)
+
+    def test_reload_interval(self):
+        self.pool.reload_interval = 0
+        self.condor_q().fetch()
+        self.condor_q().fetch()
+        self.assertEqual(2, self.htcondor.reload_config.call_count)
+        # same configuration, the handles are kept
+        self.assertEqual(1, self.htcondor.Schedd.call_count)
+
+    def test_log_query(self):
+        with mock.patch.object(logSupport, 'log') as m_log:
+            self.condor_q().fetch()
+            self.condor_q().fetch()
+        msg = m_log.debug.call_args[0][0]
+        self.assertTrue(msg.startswith('condor_q of schedd schedd1@host in pool pool.host done in'), msg)
+        self.assertTrue('1 hits, 2 misses, 1 config reloads' in msg, msg)
+
+
+class TestColumnarStoredData(unittest.TestCase):
+
+    def setUp(self):
+        self.data = xml2dict(fixture_lines('cq.fixture'), ('ClusterId', 'ProcId'))
+        self.columnar = ColumnarStoredData(self.data)
+
+    def test_dict_interface(self):
+        self.assertEqual(self.data, self.columnar)
+        self.assertEqual(len(self.data), len(self.columnar))
+        self.assertItemsEqual(self.data.keys(), self.columnar.keys())
+        for key in self.data:
+            self.assertTrue(key in self.columnar)
+            self.assertEqual(self.data[key], self.columnar[key])
+        self.assertEqual(None, self.columnar.get((0, 0)))
+        self.assertFalse(self.columnar.has_key((0, 0)))
+        self.assertEqual(dict(self.data.items()), dict(self.columnar.items()))
+        self.assertEqual({}, ColumnarStoredData())
+
+    def test_columns(self):
+        data = {'a': {'Name': 'a', 'Cpus': 1, 'Rank': 1.5, 'Owner': 'u1', 'Flag': True},
+                'b': {'Name': 'b', 'Cpus': 2, 'Owner': 'u1'},
+                'c': {'Name': 'c', 'Cpus': 4, 'Rank': 0.0, 'Owner': 'u2', 'Flag': 'x'}}
+        columnar = ColumnarStoredData(data)
+        self.assertEqual(data, columnar)
+        self.assertEqual('i', columnar.columns['Cpus'].kind)
+        self.assertEqual('d', columnar.columns['Rank'].kind)
+        self.assertEqual('o', columnar.columns['Flag'].kind)
+        # each distinct string is stored once
+        self.assertEqual('s', columnar.columns['Owner'].kind)
+        self.assertItemsEqual(['u1', 'u2'], columnar.columns['Owner'].table)
+        self.assertFalse('Rank' in columnar['b'])
+        self.assertEqual([1.5, -1, 0.0], [columnar.column('Rank', -1)[columnar.keys().index(k)] for k in 'abc'])
+        self.assertEqual('t', self.columnar.keys_column.kind)
+
+    def test_parsed_strings(self):
+        # the parser returns unicode strings, they must be interned as well
+        for fname, attr_name in (('cq.fixture', ('ClusterId', 'ProcId')), ('cs.fixture', 'Name')):
+            data = xml2dict(fixture_lines(fname), attr_name)
+            columnar = ColumnarStoredData(data)
+            self.assertEqual(data, columnar)
+            nr_strings = 0
+            for name, column in columnar.columns.iteritems():
+                values = [el[name] for el in data.itervalues() if name in el]
+                if values and all([isinstance(v, basestring) for v in values]):
+                    nr_strings += 1
+                    self.assertEqual('s', column.kind, name)
+            self.assertTrue(nr_strings > 0)
+        self.assertEqual('s', self.columnar.columns['User'].kind)
+        self.assertTrue(isinstance(self.columnar.values()[0]['User'], unicode))
+        # str and unicode values are kept as they are
+        columnar = ColumnarStoredData({1: {'Owner': 'u1'}, 2: {'Owner': u'u1'}, 3: {'Owner': u'u\xe8'}})
+        self.assertEqual('s', columnar.columns['Owner'].kind)
+        self.assertEqual([str, unicode, unicode], [type(columnar[k]['Owner']) for k in (1, 2, 3)])
+        self.assertEqual(u'u\xe8', cPickle.loads(cPickle.dumps(columnar, cPickle.HIGHEST_PROTOCOL))[3]['Owner'])
+
+    def test_select(self):
+        view = self.columnar.select(lambda el: el.get('JobStatus') == 2)
+        expected = dict([(k, v) for k, v in self.data.iteritems() if v.get('JobStatus') == 2])
+        self.assertEqual(expected, view)
+        self.assertTrue(view.columns is self.columnar.columns)
+        # view of a view
+        key = view.keys()[0]
+        sub_view = view.select(positions=[0])
+        self.assertEqual({key: self.data[key]}, sub_view)
+        self.assertEqual(expected, condorMonitor.applyConstraint(self.columnar, lambda el: el.get('JobStatus') == 2))
+
+    def test_set_column(self):
+        view = self.columnar.select(positions=[1, 2])
+        view.set_column('RunningOn', ['e1', 'e2'])
+        self.assertEqual(['e1', 'e2'], view.column('RunningOn'))
+        self.assertEqual('e2', view[view.keys()[1]]['RunningOn'])
+        self.assertEqual(['e2'], [el['RunningOn'] for el in view.select(positions=[1]).itervalues()])
+        self.assertEqual(None, self.columnar.column('RunningOn')[1])
+        self.assertEqual([{'RunningOn': 'e1'}, {'RunningOn': 'e2'}], list(view.iterclassads(['RunningOn', 'NotThere'])))
+        self.assertRaises(ValueError, view.set_column, 'RunningOn', ['e1'])
+        self.assertEqual(view, cPickle.loads(cPickle.dumps(view, cPickle.HIGHEST_PROTOCOL)))
+
+    def test_pickle(self):
+        self.assertEqual(self.data, cPickle.loads(cPickle.dumps(self.columnar, cPickle.HIGHEST_PROTOCOL)))
+        # many similar classads, as returned by condor_q
+        data = {}
+        for i in range(500):
+            data[(100 + i / 10, i % 10)] = {'ClusterId': 100 + i / 10, 'ProcId': i % 10, 'JobStatus': 1 + i % 2,
+                                            'Owner': 'user%i' % (i % 3), 'QDate': 1500000000 + i,
+                                            'x509UserProxyFirstFQAN': '/cms/Role=NULL/Capability=NULL'}
+        columnar = ColumnarStoredData(data)
+        blob = cPickle.dumps(columnar, cPickle.HIGHEST_PROTOCOL)
+        self.assertEqual(data, cPickle.loads(blob))
+        self.assertTrue(len(blob) * 2 < len(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)))
+
+    def test_compact(self):
+        query = condorMonitor.StoredQuery()
+        query.stored_data = dict(self.data)
+        query.compact()
+        self.assertTrue(isinstance(query.stored_data, ColumnarStoredData))
+        self.assertEqual(self.data, query.fetchStored())
+        self.assertEqual(len([el for el in self.data.values() if el.get('JobStatus') == 1]),
+                         len(query.fetchStored(lambda el: el.get('JobStatus') == 1)))
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
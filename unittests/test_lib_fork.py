@@ -13,11 +13,14 @@ Project:
 
 from __future__ import absolute_import
 from __future__ import print_function
+import errno
 import select
+import signal
 import time
 import os
 import xmlrunner
 import platform
+import mock
 import unittest2 as unittest
 
 from glideinwms.unittests.unittest_utils import FakeLogger
@@ -29,9 +32,16 @@ from glideinwms.lib.fork import fetch_fork_result_list
 from glideinwms.lib.fork import fetch_ready_fork_result_list
 from glideinwms.lib.fork import wait_for_pids
 from glideinwms.lib.fork import ForkManager
+from glideinwms.lib.fork import ForkPoolManager
+from glideinwms.lib.fork import FdPoller
+from glideinwms.lib import pidSupport
+from glideinwms.lib import servicePerformance
 import glideinwms.lib.logSupport
 
 LOG_FILE = create_temp_file()
+# TestForkManager removes epoll and poll from select
+SELECT_EPOLL = getattr(select, 'epoll', None)
+SELECT_POLL = getattr(select, 'poll', None)
 
 
 def global_log_setup():
@@ -233,6 +243,146 @@ class TestForkManager(unittest.TestCase):
             "'module' object has no attribute 'poll'" in log_contents)
 
 
+def pid_fn(key, size=0):
+    if key == 'raise':
+        raise ValueError("failing on purpose")
+    if key == 'exit':
+        os._exit(1)
+    return key, os.getpid(), 'x' * size
+
+
+def traced_fn(key):
+    with servicePerformance.TraceSpan('child_%s' % key):
+        return key
+
+
+class TestForkTracing(unittest.TestCase):
+
+    def setUp(self):
+        global_log_setup()
+        servicePerformance.enableTracing()
+
+    def tearDown(self):
+        servicePerformance.enableTracing(False)
+        servicePerformance.resetTrace()
+        global_log_cleanup()
+
+    def check_spans(self, fork_manager):
+        for key in ('a', 'b', 'c'):
+            fork_manager.add_fork(key, traced_fn, key)
+        with servicePerformance.TraceSpan('parent') as parent:
+            results = fork_manager.bounded_fork_and_collect(max_forks=2)
+        self.assertEqual({'a': 'a', 'b': 'b', 'c': 'c'}, results)
+        spans = servicePerformance.getTraceSpans()
+        self.assertEqual(['child_a', 'child_b', 'child_c', 'parent'], sorted([s['name'] for s in spans]))
+        for span in spans:
+            if span['name'] != 'parent':
+                # recorded in the children, nested in the span open in the parent
+                self.assertEqual(parent.span['id'], span['parent'])
+                self.assertNotEqual(os.getpid(), span['pid'])
+
+    def test_fork_manager(self):
+        self.check_spans(ForkManager())
+
+    def test_fork_pool_manager(self):
+        self.check_spans(ForkPoolManager())
+
+
+class TestForkPoolManager(unittest.TestCase):
+
+    def setUp(self):
+        global_log_setup()
+        self.fork_manager = ForkPoolManager()
+        for name, value in (('epoll', SELECT_EPOLL), ('poll', SELECT_POLL)):
+            if value is not None:
+                patcher = mock.patch.object(select, name, value, create=True)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        global_log_cleanup()
+
+    def test_bounded_fork_and_collect(self):
+        for i in range(50):
+            self.fork_manager.add_fork(i, pid_fn, i)
+        results = self.fork_manager.bounded_fork_and_collect(max_forks=4)
+        self.assertEqual(range(50), sorted(results.keys()))
+        self.assertEqual(range(50), sorted([el[0] for el in results.values()]))
+        # the functions are run by at most 4 workers
+        self.assertTrue(len(set([el[1] for el in results.values()])) <= 4)
+        self.assertFalse(os.getpid() in [el[1] for el in results.values()])
+        log_contents = open(LOG_FILE, 'r').read()
+        self.assertTrue("Active forks = 4, Forks to finish = 50" in log_contents)
+        self.assertTrue("Active forks = 0, Forks to finish = 0" in log_contents)
+
+    def test_large_results(self):
+        # larger than the pipe buffer
+        sizes = [0, 1, 65536, 5 * 1024 * 1024]
+        for size in sizes:
+            self.fork_manager.add_fork(size, pid_fn, size, size)
+        results = self.fork_manager.bounded_fork_and_collect(max_forks=2)
+        for size in sizes:
+            self.assertEqual('x' * size, results[size][2])
+
+    def test_failures(self):
+        for key in ('a', 'raise', 'b', 'exit', 'c', 'd'):
+            self.fork_manager.add_fork(key, pid_fn, key)
+        try:
+            self.fork_manager.bounded_fork_and_collect(max_forks=2)
+            self.fail("ForkResultError not raised")
+        except ForkResultError as err:
+            self.assertEqual(2, err.nr_errors)
+            self.assertEqual(['exit', 'raise'], sorted(err.failed))
+            self.assertEqual(['a', 'b', 'c', 'd'], sorted(err.good_results.keys()))
+        log_contents = open(LOG_FILE, 'r').read()
+        self.assertTrue("Forked process" in log_contents)
+        self.assertTrue("terminated before returning the result" in log_contents)
+
+    def test_fewer_functions_than_workers(self):
+        self.assertEqual({}, self.fork_manager.bounded_fork_and_collect(max_forks=10))
+        self.fork_manager.add_fork('a', sleep_fn, '0.1')
+        self.assertEqual({'a': '0.1'}, self.fork_manager.bounded_fork_and_collect(max_forks=10))
+
+    def test_fork_error(self):
+        for name in ('SIGTERM', 'SIGQUIT'):
+            self.addCleanup(signal.signal, getattr(signal, name), signal.getsignal(getattr(signal, name)))
+        real_fork = os.fork
+        forks = []
+        def fork():
+            if forks:
+                raise OSError(errno.EAGAIN, "Resource temporarily unavailable")
+            forks.append(real_fork())
+            return forks[-1]
+        self.fork_manager.add_fork('long', sleep_fn, '30')
+        self.fork_manager.add_fork('short', sleep_fn, '0.1')
+        start_time = time.time()
+        with mock.patch('os.fork', side_effect=fork):
+            self.assertRaises(OSError, self.fork_manager.bounded_fork_and_collect, max_forks=2)
+        # the signal handlers are back and the running worker was killed, not waited for
+        self.assertEqual(pidSupport.termsignal, signal.getsignal(signal.SIGTERM))
+        self.assertEqual(pidSupport.termsignal, signal.getsignal(signal.SIGQUIT))
+        self.assertTrue(time.time() - start_time < 10)
+        self.assertRaises(OSError, os.kill, forks[0], 0)
+
+    def test_poller_fallback(self):
+        if platform.system() != 'Linux':
+            return
+        self.assertEqual('epoll', FdPoller().poll_type)
+        expected = {}
+        for i in range(10):
+            self.fork_manager.add_fork(i, sleep_fn, '0.1')
+            expected[i] = '0.1'
+        # select.epoll and select.poll are restored by the patchers in setUp
+        del select.epoll
+        self.assertEqual('poll', FdPoller().poll_type)
+        self.assertEqual(expected, self.fork_manager.bounded_fork_and_collect(max_forks=3))
+        del select.poll
+        self.assertEqual('select', FdPoller().poll_type)
+        self.assertEqual(expected, self.fork_manager.bounded_fork_and_collect(max_forks=3))
+        select.epoll = SELECT_EPOLL
+        select.poll = SELECT_POLL
+
+
 if __name__ == '__main__':
     unittest.main(
         testRunner=xmlrunner.XMLTestRunner(
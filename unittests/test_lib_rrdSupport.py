@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Project:
+    glideinWMS
+Purpose:
+    unit test for the RRD updates in glideinwms/lib/rrdSupport.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import mock
+import unittest2 as unittest
+import xmlrunner
+
+from glideinwms.lib import rrdSupport
+from glideinwms.lib.rrdSupport import BaseRRDSupport
+from glideinwms.lib.rrdSupport import WriteBehindRRDSupport
+
+
+class FakeRRD:
+    """rrdtool module replacement recording the updates"""
+
+    def __init__(self, failing=()):
+        self.updates = []
+        self.failing = failing
+        self.last_times = {}
+
+    def update(self, *args):
+        if args[0] in self.failing:
+            raise RuntimeError("cannot update %s" % args[0])
+        # like rrdtool, stop at the first value older than the last update
+        values = list(args[1:])
+        if values[0] == '-t':
+            values = values[2:]
+        for val_str in values:
+            update_time = int(val_str.split(':', 1)[0])
+            last_time = self.last_times.get(args[0], 0)
+            if update_time <= last_time:
+                raise RuntimeError("illegal attempt to update using time %i when last update time is %i" %
+                                   (update_time, last_time))
+            self.last_times[args[0]] = update_time
+        self.updates.append(args)
+
+    def fetch(self, *args):
+        return (args, list(self.updates))
+
+
+class FakeRRDExe(FakeRRD):
+    """rrdtool_exe replacement with the batch update"""
+
+    def __init__(self, failing=()):
+        FakeRRD.__init__(self, failing)
+        self.batches = []
+
+    def update_many(self, updates):
+        self.batches.append(updates)
+        errors = []
+        for args in updates:
+            try:
+                self.update(*args)
+            except RuntimeError as e:
+                errors.append((args, str(e)))
+        return errors
+
+
+class TestRRDUpdates(unittest.TestCase):
+
+    def test_sync_update(self):
+        rrd_obj = FakeRRD()
+        rrd = BaseRRDSupport(rrd_obj)
+        rrd.update_rrd_multi('a.rrd', 300, {'Running': 2, 'Idle': 1, 'Held': None})
+        rrd.update_rrd('b.rrd', 300, 5)
+        self.assertEqual([('a.rrd', '-t', 'Idle:Running', '300:1:2'),
+                          ('b.rrd', '300:5')], rrd_obj.updates)
+
+    def test_write_behind(self):
+        rrd_obj = FakeRRD()
+        rrd = WriteBehindRRDSupport(BaseRRDSupport(rrd_obj), max_pending=None)
+        rrd.update_rrd_multi('a.rrd', 300, {'Idle': 1})
+        rrd.update_rrd_multi('b.rrd', 300, {'Idle': 2})
+        rrd.update_rrd_multi('a.rrd', 600, {'Idle': 3})
+        self.assertEqual([], rrd_obj.updates)
+        self.assertEqual((3, 3, []), rrd.flush())
+        # a.rrd updates are kept in order
+        self.assertEqual([('a.rrd', '-t', 'Idle', '300:1'), ('a.rrd', '-t', 'Idle', '600:3'),
+                          ('b.rrd', '-t', 'Idle', '300:2')], rrd_obj.updates)
+        self.assertEqual((0, 0, []), rrd.flush())
+        self.assertEqual(3, len(rrd_obj.updates))
+
+    def test_write_behind_out_of_order(self):
+        for rrd_obj in (FakeRRD(), FakeRRDExe()):
+            rrd = WriteBehindRRDSupport(BaseRRDSupport(rrd_obj), max_pending=None)
+            for update_time, value in ((300, 1), (600, 2), (450, 3), (900, 4), (1200, 5)):
+                rrd.update_rrd_multi('a.rrd', update_time, {'Idle': value})
+            nr_updates, nr_calls, errors = rrd.flush()
+            # only the old value fails, the following ones are written
+            self.assertEqual(5, nr_updates)
+            self.assertEqual(1, len(errors))
+            self.assertEqual('a.rrd', errors[0][0])
+            self.assertTrue('illegal attempt to update using time 450' in errors[0][1])
+            self.assertEqual(['300:1', '600:2', '900:4', '1200:5'], [args[-1] for args in rrd_obj.updates])
+
+    def test_write_behind_errors(self):
+        rrd_obj = FakeRRD(failing=('a.rrd',))
+        rrd = WriteBehindRRDSupport(BaseRRDSupport(rrd_obj), max_pending=None)
+        rrd.update_rrd('a.rrd', 300, 1)
+        rrd.update_rrd('b.rrd', 300, 2)
+        nr_updates, nr_calls, errors = rrd.flush()
+        self.assertEqual((2, 2), (nr_updates, nr_calls))
+        self.assertEqual(1, len(errors))
+        self.assertEqual('a.rrd', errors[0][0])
+        self.assertEqual([('b.rrd', '300:2')], rrd_obj.updates)
+        # errors are reported once
+        self.assertEqual((0, 0, []), rrd.flush())
+
+    def test_write_behind_update_many(self):
+        rrd_obj = FakeRRDExe(failing=('b.rrd',))
+        rrd = WriteBehindRRDSupport(BaseRRDSupport(rrd_obj), max_pending=2)
+        rrd.update_rrd('a.rrd', 300, 1)
+        rrd.update_rrd('b.rrd', 300, 2)  # starts the background flush
+        rrd.update_rrd('a.rrd', 600, 3)
+        rrd.join_flush_thread()
+        self.assertEqual(1, len(rrd_obj.batches))
+        nr_updates, nr_calls, errors = rrd.flush()
+        # the counts include the background flush, one rrdtool process each
+        self.assertEqual((3, 2), (nr_updates, nr_calls))
+        self.assertEqual(['b.rrd'], [fname for fname, msg in errors])
+        self.assertEqual(2, len(rrd_obj.batches))
+        self.assertEqual([('a.rrd', '300:1'), ('a.rrd', '600:3')], rrd_obj.updates)
+
+    def test_sync_flush(self):
+        rrd = BaseRRDSupport(FakeRRD())
+        self.assertEqual((0, 0, []), rrd.flush())
+        write_behind_rrd = rrdSupport.write_behind(rrd)
+        self.assertTrue(isinstance(write_behind_rrd, WriteBehindRRDSupport))
+        self.assertTrue(write_behind_rrd is rrdSupport.write_behind(write_behind_rrd))
+
+    def test_fetch_flushes(self):
+        rrd_obj = FakeRRD()
+        rrd = WriteBehindRRDSupport(BaseRRDSupport(rrd_obj), max_pending=None)
+        rrd.update_rrd('a.rrd', 300, 1)
+        args, updates = rrd.fetch_rrd('a.rrd', 'AVERAGE')
+        self.assertEqual([('a.rrd', '300:1')], updates)
+
+    def test_update_many_exe(self):
+        with mock.patch.object(rrdSupport.subprocessSupport, 'iexe_cmd', return_value='/usr/bin/rrdtool\n'):
+            rrd_exe = rrdSupport.rrdtool_exe()
+        proc = mock.Mock()
+        proc.returncode = 0
+        proc.communicate.return_value = ("OK u:0.00 s:0.00 r:0.00\nERROR: illegal attempt to update\n", "")
+        with mock.patch('subprocess.Popen', return_value=proc) as popen:
+            errors = rrd_exe.update_many([['a.rrd', '300:1'], ['b.rrd', '300:2'], ['c.rrd', '300:3']])
+        self.assertEqual(['/usr/bin/rrdtool', '-'], popen.call_args[0][0])
+        self.assertEqual('update "a.rrd" "300:1"\nupdate "b.rrd" "300:2"\nupdate "c.rrd" "300:3"\n',
+                         proc.communicate.call_args[0][0])
+        self.assertEqual(['b.rrd', 'c.rrd'], [args[0] for args, msg in errors])
+        self.assertEqual('illegal attempt to update', errors[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='unittests-reports'))
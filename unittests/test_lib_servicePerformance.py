@@ -13,6 +13,10 @@ Project:
 
 from __future__ import absolute_import
 from __future__ import print_function
+import os
+import json
+import shutil
+import tempfile
 import unittest2 as unittest
 import xmlrunner
 
@@ -21,6 +25,10 @@ from glideinwms.lib.servicePerformance import startPerfMetricEvent
 from glideinwms.lib.servicePerformance import endPerfMetricEvent
 from glideinwms.lib.servicePerformance import getPerfMetricEventLifetime
 from glideinwms.lib.servicePerformance import getPerfMetric
+from glideinwms.lib.servicePerformance import resetPerfMetric
+from glideinwms.lib.servicePerformance import setPerfMetricCounter
+from glideinwms.lib import servicePerformance
+from glideinwms.lib.servicePerformance import TraceSpan
 
 # define these globally for convenience
 name = "timing_test"
@@ -95,6 +103,120 @@ class TestGetPerfMetric(unittest.TestCase):
         self.assertEqual(event_end_repr, getPerfMetric(name).__repr__())
 
 
+class TestSetPerfMetricCounter(unittest.TestCase):
+
+    def test_set_perf_metric_counter(self):
+        setPerfMetricCounter(name, 'queries', 3)
+        setPerfMetricCounter(name, 'queries', 4)
+        self.assertEqual({'queries': 4}, getPerfMetric(name).get_counters())
+        # counters are not events
+        self.assertFalse('queries' in getPerfMetric(name).metric)
+        resetPerfMetric(name)
+
+
+class TestResetPerfMetric(unittest.TestCase):
+
+    def test_reset_perf_metric(self):
+        startPerfMetricEvent(name, event_name, event_begin)
+        resetPerfMetric(name)
+        self.assertEqual(expected_repr, getPerfMetric(name).__repr__())
+        # resetting an unknown service is not an error
+        resetPerfMetric('not_there')
+
+
+@TraceSpan('decorated')
+def decorated_fn(value):
+    return value
+
+
+class TestTraceSpan(unittest.TestCase):
+
+    def setUp(self):
+        servicePerformance.enableTracing()
+
+    def tearDown(self):
+        servicePerformance.enableTracing(False)
+        servicePerformance.resetTrace()
+        resetPerfMetric(name)
+
+    def test_nested_spans(self):
+        with TraceSpan('outer') as outer:
+            with TraceSpan('inner') as inner:
+                pass
+            self.assertEqual(3, decorated_fn(3))
+        spans = servicePerformance.getTraceSpans()
+        self.assertEqual(['inner', 'decorated', 'outer'], [s['name'] for s in spans])
+        self.assertEqual(outer.span['id'], inner.span['parent'])
+        self.assertEqual(outer.span['id'], spans[1]['parent'])
+        self.assertEqual(None, outer.span['parent'])
+        self.assertEqual(os.getpid(), outer.span['pid'])
+        self.assertTrue(outer.span['start'] <= inner.span['start'] <= inner.span['end'] <= outer.span['end'])
+
+    def test_exception(self):
+        try:
+            with TraceSpan('failing'):
+                raise ValueError("failing on purpose")
+        except ValueError:
+            pass
+        with TraceSpan('next'):
+            pass
+        spans = servicePerformance.getTraceSpans()
+        self.assertEqual(['failing', 'next'], [s['name'] for s in spans])
+        self.assertEqual(None, spans[1]['parent'])
+
+    def test_disabled(self):
+        servicePerformance.enableTracing(False)
+        with TraceSpan('outer'):
+            self.assertEqual(3, decorated_fn(3))
+        self.assertEqual([], servicePerformance.getTraceSpans())
+
+    def test_fork_result(self):
+        self.assertEqual('out', servicePerformance.packForkResult('out', servicePerformance.getTraceMark()))
+        with TraceSpan('before'):
+            pass
+        mark = servicePerformance.getTraceMark()
+        with TraceSpan('child'):
+            pass
+        packed = servicePerformance.packForkResult('out', mark)
+        self.assertEqual(['child'], [s['name'] for s in packed.spans])
+        servicePerformance.resetTrace()
+        self.assertEqual('out', servicePerformance.unpackForkResult(packed))
+        self.assertEqual(['child'], [s['name'] for s in servicePerformance.getTraceSpans()])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(50, servicePerformance.percentile(values, 50))
+        self.assertEqual(95, servicePerformance.percentile(values, 95))
+        self.assertEqual(7, servicePerformance.percentile([7], 95))
+        self.assertEqual(1, servicePerformance.percentile([3, 1, 2], 0))
+
+    def test_summarize_trace(self):
+        durations = {'query': [0.5, 1.5, 2.5]}
+        with TraceSpan('query'):
+            pass
+        durations = servicePerformance.summarizeTrace(name, durations, history_size=3)
+        self.assertEqual(3, len(durations['query']))
+        self.assertEqual(1.5, durations['query'][0])
+        counters = getPerfMetric(name).get_counters()
+        self.assertEqual(1.5, counters['query_p50'])
+        self.assertEqual(2.5, counters['query_p95'])
+
+    def test_write_trace_file(self):
+        trace_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, trace_dir)
+        with TraceSpan('outer'):
+            with TraceSpan('inner'):
+                pass
+        fname = os.path.join(trace_dir, 'trace.json')
+        servicePerformance.writeTraceFile(fname)
+        events = json.load(open(fname))['traceEvents']
+        self.assertEqual(['inner', 'outer'], [e['name'] for e in events])
+        self.assertEqual('X', events[0]['ph'])
+        self.assertEqual(events[1]['args']['id'], events[0]['args']['parent'])
+        self.assertTrue(events[1]['ts'] <= events[0]['ts'])
+        self.assertEqual(['trace.json'], os.listdir(trace_dir))
+
+
 if __name__ == '__main__':
     unittest.main(
         testRunner=xmlrunner.XMLTestRunner(
@@ -16,6 +16,7 @@ import xmlrunner
 import unittest2 as unittest
 
 from glideinwms.lib.util import safe_boolcomp
+from glideinwms.lib.util import LRUCache
 
 class TestUtils(unittest.TestCase):
     def test_safe_boolcomp(self):
@@ -30,6 +31,21 @@ class TestUtils(unittest.TestCase):
         self.assertFalse(safe_boolcomp("foo", True))
         self.assertFalse(safe_boolcomp("foo", False))
 
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)  # drops b, the least recently used
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(2, len(cache))
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual('x', cache.get('a', 'x'))
+
 if __name__ == '__main__':
     unittest.main(
         testRunner=xmlrunner.XMLTestRunner(